@@ -13,8 +13,11 @@ git pull origin develop
 echo "3. Aplicar migraciones..."
 docker exec -it inventario_dev python manage.py migrate
 
-echo "4. Reiniciar contenedor..."
-docker-compose restart web
+echo "4. Reiniciar contenedores (web y worker de trabajos en segundo plano)..."
+# up crea el worker si no existe y recrea los que cambiaron de imagen o configuración;
+# restart recarga el código montado en los que no se recrearon.
+docker-compose up -d --build web worker
+docker-compose restart web worker
 
 echo "5. Verificar estado..."
 docker exec -it inventario_dev python manage.py check
@@ -36,6 +36,13 @@ print("✗ No se pudo conectar a la base de datos", flush=True)
 sys.exit(1)
 PY
 
+# Modo worker: contenedor dedicado al procesador de trabajos (servicio "worker" de
+# docker-compose, que lo reinicia con restart: always). Las migraciones las corre "web".
+if [ "$1" = "worker" ]; then
+    echo -e "${GREEN}🚀 Iniciando procesador de trabajos (${TRABAJOS_WORKERS:-2} procesos)${NC}"
+    exec python manage.py procesar_trabajos --workers "${TRABAJOS_WORKERS:-2}"
+fi
+
 # Ejecutar migraciones
 echo -e "${YELLOW}🔄 Ejecutando migraciones...${NC}"
 if ! python manage.py migrate --noinput; then
@@ -62,12 +69,30 @@ else
     echo -e "${GREEN}✓ API móvil disponible en /api/v1 (montada en WSGI)${NC}"
 fi
 
+# Trabajos en segundo plano (cargas y exportaciones largas). Con docker-compose corren en
+# el servicio "worker" y aquí se desactivan; sin él, proceso aparte en este contenedor,
+# supervisado: si termina (error, OOM) se reinicia tras una pausa.
+if [ "${TRABAJOS_WORKER_EN_CONTENEDOR:-true}" = "false" ] || [ "${TRABAJOS_WORKER_EN_CONTENEDOR}" = "False" ]; then
+    echo -e "${YELLOW}⏭ Procesador de trabajos fuera de este contenedor (TRABAJOS_WORKER_EN_CONTENEDOR=false)${NC}"
+else
+    (
+        while true; do
+            codigo=0
+            python manage.py procesar_trabajos --workers "${TRABAJOS_WORKERS:-2}" || codigo=$?
+            echo -e "${RED}⚠ procesar_trabajos terminó (código ${codigo}); reinicio en 5 s${NC}" >&2
+            sleep 5
+        done
+    ) &
+    echo -e "${GREEN}✓ Procesador de trabajos en segundo plano iniciado (${TRABAJOS_WORKERS:-2} procesos, supervisado)${NC}"
+fi
+
 # Iniciar la aplicación web (proceso principal del contenedor)
 if [ "$DEBUG" = "False" ] || [ "$DEBUG" = "false" ]; then
     echo -e "${BLUE}════════════════════════════════════════════════════${NC}"
     echo -e "${GREEN}🚀 Iniciando en modo PRODUCCIÓN con Gunicorn${NC}"
     echo -e "${BLUE}════════════════════════════════════════════════════${NC}"
     exec gunicorn inventario_hospitalario.wsgi:application \
+        --config gunicorn.conf.py \
         --bind 0.0.0.0:8000 \
         --workers 5 \
         --timeout 300 \
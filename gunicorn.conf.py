@@ -0,0 +1,13 @@
+"""Hooks de gunicorn (entrypoint.sh lo carga con ``--config gunicorn.conf.py``)."""
+
+import sys
+
+
+def worker_exit(server, worker):
+    """
+    La API móvil va montada con a2wsgi, que no emite eventos lifespan: el pool de hilos de
+    BD se cierra aquí, en el proceso del worker y antes de que termine el intérprete.
+    """
+    db = sys.modules.get('mobile_api.db')
+    if db is not None:
+        db.shutdown()
@@ -0,0 +1,233 @@
+"""
+Conteos de actividad por usuario para el reporte de usuarios (views_reporte_usuarios).
+
+El reporte hacía un ``GROUP BY`` por cada par (modelo, FK a usuario) de ``ACTIVIDADES``
+sobre todo el historial, incluidas las tablas más grandes (MovimientoInventario,
+LoteAsignado, LogSistema). ``ActividadUsuarioDia`` guarda esos conteos por
+(usuario, actividad, día) para los días ya cerrados (hasta
+``ControlActividadUsuarios.fecha_cierre``); el reporte suma esas filas y solo cuenta en
+vivo los días posteriores al cierre.
+
+Cada actividad se fecha con el momento de la acción (validación, surtimiento,
+anulación, ...) y, si está vacío, con la fecha de creación del registro. Como algunas
+acciones pueden quedar fechadas en días ya cerrados, cada ejecución vuelve a consolidar
+los últimos ``DIAS_RELECTURA`` días.
+
+Como en el reporte original, una actividad cuya consulta falla (modelo o campo que no
+existe, error de BD) se omite y queda en el log; las demás se cuentan igual.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import ActividadUsuarioDia, ControlActividadUsuarios
+from .saldos_cierre_utils import fin_dia, inicio_dia
+
+logger = logging.getLogger(__name__)
+
+DIAS_POR_BLOQUE = 31
+DIAS_RELECTURA = 3
+TAMANO_LOTE_INSERCION = 1000
+
+# (modelo, campo FK a User, campos de fecha en orden de preferencia, etiqueta para la tabla)
+ACTIVIDADES = [
+    ('SolicitudPedido', 'usuario_solicitante', ('fecha_solicitud',), 'Pedidos solicitados'),
+    ('SolicitudPedido', 'usuario_validacion', ('fecha_validacion', 'fecha_solicitud'), 'Pedidos validados'),
+    ('PropuestaPedido', 'usuario_generacion', ('fecha_generacion',), 'Propuestas generadas'),
+    ('PropuestaPedido', 'usuario_revision', ('fecha_revision', 'fecha_generacion'), 'Propuestas revisadas'),
+    ('PropuestaPedido', 'usuario_surtimiento', ('fecha_surtimiento', 'fecha_generacion'), 'Propuestas surtidas'),
+    ('LoteAsignado', 'usuario_surtido', ('fecha_surtimiento', 'fecha_asignacion'), 'Ítems picking (recogidos)'),
+    ('CitaProveedor', 'usuario_creacion', ('fecha_creacion',), 'Citas creadas'),
+    ('CitaProveedor', 'usuario_autorizacion', ('fecha_autorizacion', 'fecha_creacion'), 'Citas autorizadas'),
+    ('CitaProveedor', 'usuario_cancelacion', ('fecha_cancelacion', 'fecha_creacion'), 'Citas canceladas'),
+    ('ConteoFisico', 'usuario_creacion', ('fecha_creacion',), 'Conteos creados'),
+    ('OrdenTraslado', 'usuario_creacion', ('fecha_creacion',), 'Traslados creados'),
+    ('LlegadaProveedor', 'creado_por', ('fecha_creacion',), 'Llegadas creadas'),
+    ('LlegadaProveedor', 'usuario_calidad', ('fecha_validacion_calidad', 'fecha_creacion'), 'Llegadas (calidad)'),
+    ('LlegadaProveedor', 'usuario_facturacion', ('fecha_facturacion', 'fecha_creacion'), 'Llegadas (facturación)'),
+    ('LlegadaProveedor', 'usuario_supervision', ('fecha_supervision', 'fecha_creacion'), 'Llegadas (supervisión)'),
+    ('LlegadaProveedor', 'usuario_ubicacion', ('fecha_ubicacion', 'fecha_creacion'), 'Llegadas (ubicación)'),
+    ('DevolucionProveedor', 'usuario_creacion', ('fecha_creacion',), 'Devoluciones creadas'),
+    ('DevolucionProveedor', 'usuario_autorizo', ('fecha_autorizacion', 'fecha_creacion'), 'Devoluciones autorizadas'),
+    ('ItemDevolucion', 'usuario_inspeccion', ('fecha_inspeccion', 'fecha_creacion'), 'Items devolución inspeccionados'),
+    ('SalidaExistencias', 'usuario_autoriza', ('fecha_salida',), 'Salidas autorizadas'),
+    ('DistribucionArea', 'usuario_creacion', ('fecha_creacion',), 'Distribuciones creadas'),
+    ('ListaRevision', 'usuario_creacion', ('fecha_creacion',), 'Listas revisión creadas'),
+    ('ListaRevision', 'usuario_validacion', ('fecha_validacion', 'fecha_creacion'), 'Listas revisión validadas'),
+    ('RegistroConteoFisico', 'usuario_creacion', ('fecha_creacion',), 'Registros conteo creados'),
+    ('MovimientoInventario', 'usuario', ('fecha_movimiento',), 'Movimientos inventario'),
+    ('MovimientoInventario', 'usuario_anulacion', ('fecha_anulacion', 'fecha_movimiento'), 'Movimientos anulados'),
+    ('LogSistema', 'usuario', ('fecha_creacion',), 'Logs sistema'),
+    ('LogPropuesta', 'usuario', ('timestamp',), 'Acciones en propuestas'),
+    ('LogErrorPedido', 'usuario', ('fecha_error',), 'Errores pedido'),
+]
+
+
+def clave_actividad(modelo, user_attr):
+    return f'{modelo.lower()}.{user_attr}'
+
+
+def _actividad_con_momento(modelo, user_attr, campos_fecha, inicio, fin):
+    """
+    Registros de la actividad en [inicio, fin) anotados con ``momento`` (fecha de la
+    acción) y filtrados a usuario no nulo.
+    """
+    model = apps.get_model('inventario', modelo)
+    momento = F(campos_fecha[0]) if len(campos_fecha) == 1 else Coalesce(*campos_fecha)
+    qs = model.objects.filter(**{f'{user_attr}__isnull': False}).annotate(momento=momento)
+    if inicio is not None:
+        qs = qs.filter(momento__gte=inicio)
+    if fin is not None:
+        qs = qs.filter(momento__lt=fin)
+    return qs.order_by()
+
+
+def _por_actividad(inicio, fin, consulta):
+    """
+    (clave, filas) por actividad, con ``filas = list(consulta(qs, user_attr))`` sobre los
+    registros en [inicio, fin). Cada actividad corre en su propio savepoint: si falla se
+    registra y se omite sin invalidar la transacción ni las demás actividades.
+    """
+    for modelo, user_attr, campos_fecha, _ in ACTIVIDADES:
+        clave = clave_actividad(modelo, user_attr)
+        try:
+            with transaction.atomic():
+                qs = _actividad_con_momento(modelo, user_attr, campos_fecha, inicio, fin)
+                filas = list(consulta(qs, user_attr))
+        except Exception:
+            logger.exception('Actividad de usuarios omitida: %s', clave)
+            continue
+        yield clave, filas
+
+
+def consolidar_actividad(desde, hasta):
+    """
+    Recalcula ActividadUsuarioDia de los días ``desde``..``hasta`` (inclusive).
+
+    Returns:
+        int: filas escritas
+    """
+    escritas = 0
+    dia = desde
+    while dia <= hasta:
+        fin_bloque = min(dia + timedelta(days=DIAS_POR_BLOQUE - 1), hasta)
+        filas = []
+        consolidadas = []
+        for clave, conteos in _por_actividad(
+            inicio_dia(dia), fin_dia(fin_bloque),
+            lambda qs, user_attr: (
+                qs.annotate(dia=TruncDate('momento'))
+                .values(user_attr, 'dia')
+                .annotate(total=Count('pk'))
+                .values_list(user_attr, 'dia', 'total')
+            ),
+        ):
+            consolidadas.append(clave)
+            filas.extend(
+                ActividadUsuarioDia(usuario_id=usuario_id, actividad=clave, fecha=fecha, total=total)
+                for usuario_id, fecha, total in conteos
+            )
+
+        # Una actividad omitida conserva lo que ya tenía consolidado en el bloque.
+        ActividadUsuarioDia.objects.filter(
+            fecha__gte=dia, fecha__lte=fin_bloque, actividad__in=consolidadas
+        ).delete()
+        ActividadUsuarioDia.objects.bulk_create(filas, batch_size=TAMANO_LOTE_INSERCION)
+        escritas += len(filas)
+        dia = fin_bloque + timedelta(days=1)
+    return escritas
+
+
+def _primer_dia_con_actividad():
+    primeros = []
+    for _, (primero,) in _por_actividad(None, None, lambda qs, _: [qs.aggregate(m=Min('momento'))['m']]):
+        if primero:
+            primeros.append(timezone.localtime(primero).date())
+    return min(primeros) if primeros else None
+
+
+def obtener_fecha_cierre():
+    """Último día consolidado en ActividadUsuarioDia, o None si nunca se ha ejecutado."""
+    return ControlActividadUsuarios.objects.filter(pk=1).values_list('fecha_cierre', flat=True).first()
+
+
+def actualizar_actividad_usuarios(hasta=None, reconstruir=False):
+    """
+    Avanza el cierre hasta ``hasta`` (por defecto ayer) de forma incremental: consolida los
+    días posteriores a ``fecha_cierre`` más los últimos ``DIAS_RELECTURA`` días cerrados
+    (la primera vez, desde el primer registro con actividad).
+
+    Returns:
+        dict: {'desde', 'hasta', 'filas'}
+    """
+    hasta = hasta or (timezone.localdate() - timedelta(days=1))
+    resumen = {'desde': None, 'hasta': hasta, 'filas': 0}
+
+    with transaction.atomic():
+        control, _ = ControlActividadUsuarios.objects.select_for_update().get_or_create(pk=1)
+        if reconstruir:
+            ActividadUsuarioDia.objects.all().delete()
+            control.fecha_cierre = None
+
+        if control.fecha_cierre:
+            desde = min(control.fecha_cierre - timedelta(days=DIAS_RELECTURA - 1), hasta)
+        else:
+            desde = _primer_dia_con_actividad() or hasta + timedelta(days=1)
+
+        if desde <= hasta:
+            resumen['desde'] = desde
+            resumen['filas'] = consolidar_actividad(desde, hasta)
+
+        if control.fecha_cierre is None or hasta > control.fecha_cierre:
+            control.fecha_cierre = hasta
+        control.ultima_ejecucion = timezone.now()
+        control.save()
+    return resumen
+
+
+def conteos_por_usuario(desde=None, hasta=None):
+    """
+    {user_id: {clave_actividad: total}} para los días ``desde``..``hasta`` (None = sin límite).
+
+    Los días hasta el cierre se leen de ActividadUsuarioDia con una consulta agrupada; solo
+    los posteriores al cierre (normalmente hoy) se cuentan en las tablas de origen.
+    Sin cierre (nunca se ejecutó el comando) cuenta todo en vivo.
+    """
+    fecha_cierre = obtener_fecha_cierre()
+    conteos = {}
+
+    def sumar(usuario_id, clave, total):
+        por_actividad = conteos.setdefault(usuario_id, {})
+        por_actividad[clave] = por_actividad.get(clave, 0) + total
+
+    if fecha_cierre is not None and (desde is None or desde <= fecha_cierre):
+        cerrados = ActividadUsuarioDia.objects.filter(fecha__lte=min(hasta or fecha_cierre, fecha_cierre))
+        if desde is not None:
+            cerrados = cerrados.filter(fecha__gte=desde)
+        for usuario_id, clave, total in (
+            cerrados.order_by()
+            .values('usuario_id', 'actividad')
+            .annotate(t=Sum('total'))
+            .values_list('usuario_id', 'actividad', 't')
+        ):
+            sumar(usuario_id, clave, total)
+
+    if fecha_cierre is None or hasta is None or hasta > fecha_cierre:
+        inicio_vivo = desde
+        if fecha_cierre is not None and (inicio_vivo is None or inicio_vivo <= fecha_cierre):
+            inicio_vivo = fecha_cierre + timedelta(days=1)
+        inicio = inicio_dia(inicio_vivo) if inicio_vivo else None
+        fin = fin_dia(hasta) if hasta else None
+        for clave, totales in _por_actividad(
+            inicio, fin,
+            lambda qs, user_attr: qs.values(user_attr).annotate(t=Count('pk')).values_list(user_attr, 't'),
+        ):
+            for usuario_id, total in totales:
+                sumar(usuario_id, clave, total)
+    return conteos
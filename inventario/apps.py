@@ -4,3 +4,51 @@ from django.apps import AppConfig
 class InventarioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventario'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Group
+        from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+
+        from . import dashboard_utils, menu_roles_utils, principal_movil_utils, reservas_utils
+        from .models import CategoriaProducto, Institucion, Lote, MenuItemRol, MovimientoInventario, Producto
+        from .pedidos_models import LoteAsignado
+
+        # Libro de reservas activas por LoteUbicacion
+        pre_save.connect(reservas_utils.lote_asignado_pre_save, sender=LoteAsignado,
+                         dispatch_uid='reserva_activa_pre_save')
+        post_save.connect(reservas_utils.lote_asignado_post_save, sender=LoteAsignado,
+                          dispatch_uid='reserva_activa_post_save')
+        pre_delete.connect(reservas_utils.lote_asignado_pre_delete, sender=LoteAsignado,
+                           dispatch_uid='reserva_activa_pre_delete')
+        post_delete.connect(reservas_utils.lote_asignado_post_delete, sender=LoteAsignado,
+                            dispatch_uid='reserva_activa_post_delete')
+
+        # Catálogo de menús por rol en caché de proceso
+        for senal, modelo, uid in (
+            (post_save, MenuItemRol, 'menu_roles_menuitem_save'),
+            (post_delete, MenuItemRol, 'menu_roles_menuitem_delete'),
+            (m2m_changed, MenuItemRol.roles_permitidos.through, 'menu_roles_permitidos'),
+            (post_delete, Group, 'menu_roles_group_delete'),
+        ):
+            senal.connect(menu_roles_utils.invalidar_catalogo_menu, sender=modelo, dispatch_uid=uid)
+
+        # Métricas del dashboard en caché
+        for modelo in (Lote, MovimientoInventario, Producto, Institucion, CategoriaProducto):
+            post_save.connect(dashboard_utils.invalidar_dashboard, sender=modelo,
+                              dispatch_uid=f'dashboard_save_{modelo.__name__}')
+            post_delete.connect(dashboard_utils.invalidar_dashboard, sender=modelo,
+                                dispatch_uid=f'dashboard_delete_{modelo.__name__}')
+
+        # Principal de la API móvil en caché de proceso
+        User = get_user_model()
+        for senal, modelo, receptor, uid in (
+            (post_save, User, principal_movil_utils.invalidar_principal_usuario, 'mobile_api_principal_user_save'),
+            (post_delete, User, principal_movil_utils.invalidar_principal_usuario, 'mobile_api_principal_user_delete'),
+            (m2m_changed, User.groups.through, principal_movil_utils.invalidar_principal_grupos_usuario,
+             'mobile_api_principal_grupos'),
+            # Renombrar o borrar un grupo puede cambiar quién tiene rol de conteo.
+            (post_save, Group, principal_movil_utils.invalidar_principales, 'mobile_api_principal_group_save'),
+            (post_delete, Group, principal_movil_utils.invalidar_principales, 'mobile_api_principal_group_delete'),
+        ):
+            senal.connect(receptor, sender=modelo, dispatch_uid=uid)
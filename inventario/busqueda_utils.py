@@ -0,0 +1,143 @@
+"""
+Búsqueda de productos, lotes, ubicaciones y solicitudes (autocompletes y filtros de texto).
+
+``icontains`` se traduce a ``UPPER(col) LIKE '%term%'``, que PostgreSQL no puede resolver
+con índices btree: cada tecla de un autocomplete recorría Lote/Producto completos. Aquí
+todas las búsquedas comparan ``inventario_sin_acentos(lower(col)) LIKE '%term%'``, la
+misma expresión de los índices GIN ``gin_trgm_ops`` creados en la migración 0118
+(extensiones ``pg_trgm`` y ``unaccent``), así que:
+
+- la búsqueda usa el índice trigram en lugar de un recorrido secuencial;
+- no distingue acentos ni mayúsculas ("jeringa" encuentra "JERINGA", "acido" a "ÁCIDO");
+- cada palabra del término debe aparecer en alguno de los campos (en cualquier orden);
+- ``buscar`` ordena por relevancia: primero lo que empieza con el término en el campo
+  principal (la clave), luego por similitud trigram (``similarity``).
+
+En otras bases (SQLite de pruebas) se usa ``lower(col) LIKE`` sin similitud.
+
+API::
+
+    buscar('producto', 'acido fol', limite=20)            # queryset ordenado por relevancia
+    buscar('lote', q, queryset=Lote.objects.filter(...))  # sobre un queryset ya filtrado
+    filtrar(lotes, q)                                     # solo filtra (conserva el orden)
+    filtrar(lotes, q, campos=('numero_lote',))            # campos específicos
+"""
+
+import unicodedata
+from dataclasses import dataclass
+
+from django.apps import apps
+from django.db.models import Case, F, FloatField, Func, IntegerField, Q, TextField, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.lookups import Contains, StartsWith
+
+LIMITE_DEFAULT = 20
+
+
+@dataclass(frozen=True)
+class EntidadBusqueda:
+    modelo: str
+    campos: tuple
+    orden: tuple
+
+
+ENTIDADES = {
+    'producto': EntidadBusqueda('inventario.Producto', ('clave_cnis', 'descripcion'), ('clave_cnis',)),
+    'lote': EntidadBusqueda(
+        'inventario.Lote',
+        ('numero_lote', 'producto__clave_cnis', 'producto__descripcion'),
+        ('numero_lote', 'id'),
+    ),
+    'ubicacion': EntidadBusqueda('inventario.UbicacionAlmacen', ('codigo', 'descripcion'), ('codigo',)),
+    'solicitud': EntidadBusqueda(
+        'inventario.SolicitudPedido',
+        ('folio', 'observaciones_solicitud', 'institucion_solicitante__nombre'),
+        ('-fecha_solicitud',),
+    ),
+}
+
+
+class SinAcentos(Func):
+    """``inventario_sin_acentos(lower(expr))`` en PostgreSQL; ``lower(expr)`` en otras bases."""
+    function = 'LOWER'
+    output_field = TextField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='inventario_sin_acentos(LOWER(%(expressions)s))', **extra_context
+        )
+
+
+class Similitud(Func):
+    """``similarity(a, b)`` de pg_trgm; constante 0 fuera de PostgreSQL."""
+    function = 'similarity'
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return '0', []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return Func.as_sql(self, compiler, connection, **extra_context)
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, igual que ``inventario_sin_acentos(lower(...))``."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower().strip()
+
+
+def _entidad(nombre):
+    try:
+        return ENTIDADES[nombre]
+    except KeyError:
+        raise ValueError(f'Entidad de búsqueda desconocida: {nombre}') from None
+
+
+def _campos_de(queryset):
+    etiqueta = queryset.model._meta.label
+    for entidad in ENTIDADES.values():
+        if entidad.modelo == etiqueta:
+            return entidad.campos
+    raise ValueError(f'No hay campos de búsqueda definidos para {etiqueta}')
+
+
+def filtrar(queryset, termino, campos=None):
+    """Filtra ``queryset`` con el término (cada palabra en alguno de ``campos``); sin reordenar."""
+    palabras = normalizar(termino).split()
+    if not palabras:
+        return queryset
+    campos = campos or _campos_de(queryset)
+    condicion = Q()
+    for palabra in palabras:
+        alguna = Q()
+        for campo in campos:
+            alguna |= Q(Contains(SinAcentos(F(campo)), palabra))
+        condicion &= alguna
+    return queryset.filter(condicion)
+
+
+def buscar(entidad, termino, queryset=None, limite=LIMITE_DEFAULT, campos=None):
+    """
+    Resultados de ``entidad`` que coinciden con ``termino``, ordenados por relevancia.
+
+    Devuelve un queryset (ya recortado a ``limite`` si se indica) con la anotación
+    ``relevancia``; con término vacío devuelve el queryset vacío.
+    """
+    definicion = _entidad(entidad)
+    if queryset is None:
+        queryset = apps.get_model(definicion.modelo).objects.all()
+    campos = campos or definicion.campos
+    normalizado = normalizar(termino)
+    if not normalizado:
+        return queryset.none()
+
+    similitudes = [Similitud(SinAcentos(F(campo)), Value(normalizado)) for campo in campos]
+    resultado = filtrar(queryset, termino, campos).annotate(
+        prefijo=Case(
+            When(StartsWith(SinAcentos(F(campos[0])), normalizado), then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        relevancia=Greatest(*similitudes) if len(similitudes) > 1 else similitudes[0],
+    ).order_by('-prefijo', '-relevancia', *definicion.orden)
+    return resultado[:limite] if limite else resultado
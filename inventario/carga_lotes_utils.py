@@ -0,0 +1,552 @@
+"""
+Carga masiva de lotes desde Excel por bloques.
+
+Columnas: almcen, CLAVE, DESCRIPCION, LOTE, CADUCIDAD, UBICACIÓN, INVENTARIO.
+
+En lugar de ``pd.read_excel`` + ``iterrows`` con ``get_or_create`` por fila (~5 consultas
+por renglón), el archivo se lee en streaming (openpyxl ``read_only``) en bloques de
+``CARGA_MASIVA_TAMANO_BLOQUE`` filas y cada bloque se resuelve con unas cuantas consultas:
+
+1. Almacenes, productos y ubicaciones referenciados: un ``IN`` por tabla; los faltantes se
+   crean con ``bulk_create``. Los ids se guardan en diccionarios para los bloques siguientes.
+2. Lotes del bloque: un ``IN``; nuevos con ``bulk_create``, existentes con ``bulk_update``.
+3. LoteUbicacion: ``bulk_create(update_conflicts=True)`` sobre (lote, ubicacion).
+4. ``cantidad_disponible`` de los lotes: una suma agrupada por bloque.
+
+Cada bloque corre en un savepoint; si falla en BD se reprocesa fila por fila para
+reportar el error en la fila que lo causa. Toda la carga es una transacción: en modo
+previsualización (dry-run) se revierte al final y las estadísticas reflejan lo que se
+habría hecho.
+
+El avance se reporta con el callable ``progreso(procesadas, total)`` tras cada bloque; la
+vista lo conecta al TrabajoSegundoPlano que ejecuta la carga (ver trabajos_tareas).
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import pandas as pd
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .dashboard_utils import invalidar_dashboard
+from .models import (
+    Almacen,
+    CategoriaProducto,
+    Lote,
+    LoteUbicacion,
+    MovimientoInventario,
+    Producto,
+    UbicacionAlmacen,
+)
+from .saldos_cierre_utils import inicio_dia
+
+logger = logging.getLogger(__name__)
+
+TAMANO_BLOQUE = getattr(settings, 'CARGA_MASIVA_TAMANO_BLOQUE', 500)
+MAX_ERRORES_DETALLE = 1000
+
+# Ubicaciones asignadas antes de esta fecha que no vienen en el archivo se dan de baja
+# (ajuste previo a conteo), salvo claves 060.
+FECHA_LIMITE_UBICACIONES_PREVIAS = date(2025, 12, 30)
+
+
+# ---------------------------------------------------------------------------
+# Lectura
+# ---------------------------------------------------------------------------
+
+class LectorExcelPorBloques:
+    """
+    Itera la primera hoja en bloques de ``[(fila_excel, {columna: valor}), ...]``.
+
+    ``total_estimado`` sale de las dimensiones de la hoja (puede incluir filas vacías).
+    Los .xls (no soportados por openpyxl) se leen con pandas completos.
+    """
+
+    def __init__(self, archivo_path, tamano_bloque=TAMANO_BLOQUE):
+        self.archivo_path = archivo_path
+        self.tamano_bloque = tamano_bloque
+        self._libro = None
+        self._df = None
+        try:
+            from openpyxl import load_workbook
+
+            self._libro = load_workbook(archivo_path, read_only=True, data_only=True)
+            hoja = self._libro.active
+            self.total_estimado = max((hoja.max_row or 1) - 1, 0)
+        except Exception:
+            self._df = pd.read_excel(archivo_path)
+            self.total_estimado = len(self._df)
+
+    def _filas(self):
+        if self._df is not None:
+            columnas = [str(c).strip() for c in self._df.columns]
+            for idx, valores in enumerate(self._df.itertuples(index=False, name=None)):
+                yield idx + 2, dict(zip(columnas, valores))
+            return
+        filas = self._libro.active.iter_rows(values_only=True)
+        encabezado = next(filas, None) or ()
+        columnas = [str(c).strip() if c is not None else '' for c in encabezado]
+        for numero, valores in enumerate(filas, start=2):
+            if all(_vacio(v) for v in valores):
+                continue
+            yield numero, dict(zip(columnas, valores))
+
+    def __iter__(self):
+        bloque = []
+        try:
+            for fila in self._filas():
+                bloque.append(fila)
+                if len(bloque) >= self.tamano_bloque:
+                    yield bloque
+                    bloque = []
+            if bloque:
+                yield bloque
+        finally:
+            if self._libro is not None:
+                self._libro.close()
+
+
+def _vacio(valor):
+    return valor is None or (isinstance(valor, float) and pd.isna(valor)) or (isinstance(valor, str) and not valor.strip())
+
+
+def _texto(valor):
+    """Texto de una celda: '' si está vacía; los números enteros sin '.0'."""
+    if _vacio(valor):
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _fecha_caducidad(valor):
+    if _vacio(valor) or valor == 'S/C':
+        return None
+    try:
+        if isinstance(valor, str):
+            return pd.to_datetime(valor).date()
+        if isinstance(valor, datetime):
+            return valor.date()
+        if isinstance(valor, date):
+            return valor
+        return pd.to_datetime(valor).date()
+    except Exception:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Carga
+# ---------------------------------------------------------------------------
+
+@dataclass
+class RegistroLote:
+    fila: int
+    clave: str
+    almacen_id: int
+    descripcion: str
+    numero_lote: str
+    fecha_caducidad: object
+    ubicacion_codigo: str
+    cantidad: int
+    producto_id: int = None
+    ubicacion_id: int = None
+    lote: object = None
+
+
+class CargaMasivaLotes:
+    """
+    Procesa el Excel de lotes por bloques.
+
+    Args:
+        institucion_id: institución de los lotes
+        usuario: usuario que realiza la carga
+        dry_run: procesa todo y revierte al final
+        actualizar_cantidad: si es False, en lotes/ubicaciones existentes solo se
+            actualizan los demás campos (fechas, almacén)
+        limpiar_ubicaciones_previas: da de baja (con AJUSTE_NEGATIVO) las ubicaciones
+            asignadas antes de FECHA_LIMITE_UBICACIONES_PREVIAS que no vienen en el archivo
+        progreso: callable(procesadas, total) invocado tras cada bloque
+    """
+
+    def __init__(self, institucion_id, usuario, dry_run=False, actualizar_cantidad=True,
+                 limpiar_ubicaciones_previas=True, progreso=None):
+        self.institucion_id = institucion_id
+        self.usuario = usuario
+        self.dry_run = dry_run
+        self.actualizar_cantidad = actualizar_cantidad
+        self.limpiar_ubicaciones_previas = limpiar_ubicaciones_previas
+        self.progreso = progreso
+        self.stats = {
+            'total_registros': 0,
+            'procesados': 0,
+            'omitidos': 0,
+            'productos_creados': 0,
+            'ubicaciones_creadas': 0,
+            'lotes_creados': 0,
+            'lotes_actualizados': 0,
+            'ubicaciones_eliminadas': 0,
+            'ajustes_previos': 0,
+            'errores': 0,
+            'errores_detalle': [],
+            'dry_run': dry_run,
+        }
+        # Diccionarios de ids resueltos, compartidos entre bloques
+        self._almacenes = {}
+        self._productos = {}
+        self._ubicaciones = {}
+        self._ubicaciones_por_lote = {}
+        self._categoria_id = None
+
+    def procesar_archivo(self, archivo_path):
+        try:
+            lector = LectorExcelPorBloques(archivo_path)
+        except Exception as e:
+            raise Exception(f'Error al leer archivo: {str(e)}')
+        return self.procesar(lector, lector.total_estimado)
+
+    def procesar(self, bloques, total_estimado=None):
+        """Procesa un iterable de bloques ``[(fila, {columna: valor}), ...]``."""
+        with transaction.atomic():
+            for bloque in bloques:
+                self.stats['total_registros'] += len(bloque)
+                registros = [r for r in (self._leer_registro(fila, datos) for fila, datos in bloque) if r]
+                if registros:
+                    self._procesar_con_respaldo(registros)
+                if self.progreso:
+                    self.progreso(self.stats['total_registros'], max(total_estimado or 0, self.stats['total_registros']))
+            # bulk_create/bulk_update no emiten señales
+            invalidar_dashboard()
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+        omitidos = self.stats['errores'] - len(self.stats['errores_detalle'])
+        if omitidos > 0:
+            self.stats['errores_detalle'].append(f'... y {omitidos} errores más')
+        return self.stats
+
+    # -- Validación de filas -------------------------------------------------
+
+    def _error(self, fila, mensaje):
+        self.stats['errores'] += 1
+        if len(self.stats['errores_detalle']) < MAX_ERRORES_DETALLE:
+            self.stats['errores_detalle'].append(f'Fila {fila}: {mensaje}')
+
+    def _leer_registro(self, fila, datos):
+        clave = _texto(datos.get('CLAVE'))
+        if not clave or clave == 'S/CLAVE':
+            self.stats['omitidos'] += 1
+            return None
+        try:
+            almacen_id = int(datos.get('almcen', 1))
+            cantidad = int(datos.get('INVENTARIO', 0))
+        except (TypeError, ValueError) as e:
+            self._error(fila, str(e))
+            return None
+        registro = RegistroLote(
+            fila=fila,
+            clave=clave,
+            almacen_id=almacen_id,
+            descripcion=_texto(datos.get('DESCRIPCION')),
+            numero_lote=_texto(datos.get('LOTE')),
+            fecha_caducidad=_fecha_caducidad(datos.get('CADUCIDAD')),
+            ubicacion_codigo=_texto(datos.get('UBICACIÓN')),
+            cantidad=cantidad,
+        )
+        if not registro.numero_lote or not registro.ubicacion_codigo:
+            self._error(fila, 'Datos incompletos')
+            return None
+        if cantidad < 0:
+            self._error(fila, f'Cantidad negativa ({cantidad})')
+            return None
+        if len(clave) > 150 or len(registro.numero_lote) > 50 or len(registro.ubicacion_codigo) > 50:
+            self._error(fila, 'CLAVE, LOTE o UBICACIÓN exceden la longitud permitida')
+            return None
+        return registro
+
+    # -- Bloques -------------------------------------------------------------
+
+    def _procesar_con_respaldo(self, registros):
+        try:
+            with transaction.atomic():
+                conteos = self._procesar_bloque(registros)
+        except DatabaseError as exc:
+            logger.warning('Bloque de carga masiva falló (%s); se reprocesa fila por fila', exc)
+            # Los ids creados dentro del savepoint revertido ya no existen.
+            self._productos.clear()
+            self._ubicaciones.clear()
+            for registro in registros:
+                try:
+                    with transaction.atomic():
+                        conteos = self._procesar_bloque([registro])
+                except DatabaseError as exc_fila:
+                    self._productos.clear()
+                    self._ubicaciones.clear()
+                    self._error(registro.fila, str(exc_fila))
+                else:
+                    self._sumar(conteos)
+        else:
+            self._sumar(conteos)
+
+    def _sumar(self, conteos):
+        for clave, valor in conteos.items():
+            self.stats[clave] += valor
+
+    def _procesar_bloque(self, registros):
+        conteos = dict.fromkeys(
+            ('procesados', 'productos_creados', 'ubicaciones_creadas', 'lotes_creados',
+             'lotes_actualizados', 'ubicaciones_eliminadas', 'ajustes_previos'),
+            0,
+        )
+        registros = self._filtrar_almacenes(registros)
+        if not registros:
+            return conteos
+        conteos['productos_creados'] = self._resolver_productos(registros)
+        conteos['ubicaciones_creadas'] = self._resolver_ubicaciones(registros)
+        lotes, creados, actualizados = self._resolver_lotes(registros)
+        conteos['lotes_creados'] = creados
+        conteos['lotes_actualizados'] = actualizados
+        if self.limpiar_ubicaciones_previas:
+            conteos['ubicaciones_eliminadas'], conteos['ajustes_previos'] = self._limpiar_ubicaciones(registros)
+        self._guardar_ubicaciones_lote(registros)
+        self._guardar_lotes(lotes)
+        conteos['procesados'] = len(registros)
+        return conteos
+
+    def _filtrar_almacenes(self, registros):
+        faltan = {r.almacen_id for r in registros} - self._almacenes.keys()
+        if faltan:
+            existentes = set(Almacen.objects.filter(id__in=faltan).values_list('id', flat=True))
+            self._almacenes.update({pk: pk in existentes for pk in faltan})
+        validos = []
+        for r in registros:
+            if self._almacenes[r.almacen_id]:
+                validos.append(r)
+            else:
+                self._error(r.fila, f'Almacén {r.almacen_id} no existe')
+        return validos
+
+    def _categoria(self):
+        if self._categoria_id is None:
+            categoria, _ = CategoriaProducto.objects.get_or_create(
+                nombre='Sin Categoría',
+                defaults={'descripcion': 'Categoría por defecto para carga masiva'},
+            )
+            self._categoria_id = categoria.id
+        return self._categoria_id
+
+    def _resolver_productos(self, registros):
+        faltan = {r.clave for r in registros} - self._productos.keys()
+        if not faltan:
+            return 0
+        self._productos.update(Producto.objects.filter(clave_cnis__in=faltan).values_list('clave_cnis', 'id'))
+        nuevos = {}
+        for r in registros:
+            if r.clave not in self._productos:
+                nuevos.setdefault(r.clave, r.descripcion)
+        if nuevos:
+            categoria_id = self._categoria()
+            Producto.objects.bulk_create(
+                [
+                    Producto(
+                        clave_cnis=clave,
+                        descripcion=descripcion or f'Producto {clave}',
+                        categoria_id=categoria_id,
+                        unidad_medida='PIEZA',
+                        es_insumo_cpm=False,
+                    )
+                    for clave, descripcion in nuevos.items()
+                ],
+                batch_size=TAMANO_BLOQUE,
+            )
+            self._productos.update(Producto.objects.filter(clave_cnis__in=nuevos).values_list('clave_cnis', 'id'))
+        return len(nuevos)
+
+    def _resolver_ubicaciones(self, registros):
+        faltan = {(r.almacen_id, r.ubicacion_codigo) for r in registros} - self._ubicaciones.keys()
+        creadas = 0
+        if faltan:
+            def consultar(pares):
+                for almacen_id, codigo, pk in UbicacionAlmacen.objects.filter(
+                    almacen_id__in={a for a, _ in pares},
+                    codigo__in={c for _, c in pares},
+                ).values_list('almacen_id', 'codigo', 'id'):
+                    if (almacen_id, codigo) in pares:
+                        self._ubicaciones[(almacen_id, codigo)] = pk
+
+            consultar(faltan)
+            nuevas = faltan - self._ubicaciones.keys()
+            if nuevas:
+                UbicacionAlmacen.objects.bulk_create(
+                    [
+                        UbicacionAlmacen(almacen_id=almacen_id, codigo=codigo, descripcion=codigo, activo=True)
+                        for almacen_id, codigo in nuevas
+                    ],
+                    batch_size=TAMANO_BLOQUE,
+                )
+                consultar(nuevas)
+                creadas = len(nuevas)
+        for r in registros:
+            r.ubicacion_id = self._ubicaciones[(r.almacen_id, r.ubicacion_codigo)]
+        return creadas
+
+    def _resolver_lotes(self, registros):
+        for r in registros:
+            r.producto_id = self._productos[r.clave]
+        pares = {(r.producto_id, r.numero_lote) for r in registros}
+        lotes = {
+            (l.producto_id, l.numero_lote): l
+            for l in Lote.objects.filter(
+                institucion_id=self.institucion_id,
+                producto_id__in={p for p, _ in pares},
+                numero_lote__in={n for _, n in pares},
+            ).only(
+                'id', 'producto', 'numero_lote', 'fecha_caducidad', 'almacen',
+                'cantidad_inicial', 'cantidad_disponible', 'precio_unitario', 'valor_total',
+            )
+            if (l.producto_id, l.numero_lote) in pares
+        }
+
+        nuevos = []
+        actualizados = 0
+        hoy = timezone.now().date()
+        for r in registros:
+            clave = (r.producto_id, r.numero_lote)
+            lote = lotes.get(clave)
+            if lote is None:
+                lote = Lote(
+                    numero_lote=r.numero_lote,
+                    producto_id=r.producto_id,
+                    institucion_id=self.institucion_id,
+                    cantidad_inicial=r.cantidad,
+                    cantidad_disponible=r.cantidad,
+                    precio_unitario=0,
+                    valor_total=0,
+                    fecha_recepcion=hoy,
+                    fecha_caducidad=r.fecha_caducidad,
+                    almacen_id=r.almacen_id,
+                    creado_por=self.usuario,
+                )
+                lotes[clave] = lote
+                nuevos.append(lote)
+            else:
+                if r.fecha_caducidad and lote.fecha_caducidad != r.fecha_caducidad:
+                    lote.fecha_caducidad = r.fecha_caducidad
+                lote.almacen_id = r.almacen_id
+                if self.actualizar_cantidad:
+                    lote.cantidad_inicial = r.cantidad
+                    lote.cantidad_disponible = r.cantidad
+                actualizados += 1
+            r.lote = lote
+
+        if nuevos:
+            Lote.objects.bulk_create(nuevos, batch_size=TAMANO_BLOQUE)
+            if any(l.pk is None for l in nuevos):
+                ids = dict(
+                    ((p, n), pk)
+                    for p, n, pk in Lote.objects.filter(
+                        institucion_id=self.institucion_id,
+                        producto_id__in={l.producto_id for l in nuevos},
+                        numero_lote__in={l.numero_lote for l in nuevos},
+                    ).values_list('producto_id', 'numero_lote', 'id')
+                )
+                for lote in nuevos:
+                    lote.pk = ids[(lote.producto_id, lote.numero_lote)]
+        return list(lotes.values()), len(nuevos), actualizados
+
+    def _limpiar_ubicaciones(self, registros):
+        lote_ids = set()
+        for r in registros:
+            self._ubicaciones_por_lote.setdefault(r.lote.pk, set()).add(r.ubicacion_id)
+            if not r.clave.startswith('060'):
+                lote_ids.add(r.lote.pk)
+        if not lote_ids:
+            return 0, 0
+
+        previas = [
+            (pk, lote_id, cantidad, codigo)
+            for pk, lote_id, ubicacion_id, cantidad, codigo in LoteUbicacion.objects.filter(
+                lote_id__in=lote_ids,
+                fecha_asignacion__lt=inicio_dia(FECHA_LIMITE_UBICACIONES_PREVIAS),
+            ).values_list('id', 'lote_id', 'ubicacion_id', 'cantidad', 'ubicacion__codigo')
+            if ubicacion_id not in self._ubicaciones_por_lote[lote_id]
+        ]
+        if not previas:
+            return 0, 0
+
+        folio = f"AJUSTE-PREVIO-{timezone.now().strftime('%Y%m%d%H%M%S')}"
+        ajustes = [
+            MovimientoInventario(
+                lote_id=lote_id,
+                tipo_movimiento='AJUSTE_NEGATIVO',
+                cantidad=cantidad,
+                cantidad_anterior=cantidad,
+                cantidad_nueva=0,
+                motivo=f"Ajuste previo a conteo - Eliminación de ubicación previa ({codigo})",
+                usuario=self.usuario,
+                folio=folio,
+            )
+            for _, lote_id, cantidad, codigo in previas
+            if cantidad > 0
+        ]
+        MovimientoInventario.objects.bulk_create(ajustes, batch_size=TAMANO_BLOQUE)
+        LoteUbicacion.objects.filter(id__in=[pk for pk, *_ in previas]).delete()
+        return len(previas), len(ajustes)
+
+    def _guardar_ubicaciones_lote(self, registros):
+        existentes = {
+            (lote_id, ubicacion_id): cantidad
+            for lote_id, ubicacion_id, cantidad in LoteUbicacion.objects.filter(
+                lote_id__in={r.lote.pk for r in registros}
+            ).values_list('lote_id', 'ubicacion_id', 'cantidad')
+        }
+        # Misma pareja repetida en el archivo: gana la última fila si se actualizan
+        # cantidades; si no, la cantidad con la que se creó (la primera).
+        cantidades = {}
+        for r in registros:
+            clave = (r.lote.pk, r.ubicacion_id)
+            if self.actualizar_cantidad:
+                cantidades[clave] = r.cantidad
+            else:
+                cantidades.setdefault(clave, r.cantidad)
+
+        cambios = [
+            LoteUbicacion(lote_id=lote_id, ubicacion_id=ubicacion_id, cantidad=cantidad, usuario_asignacion=self.usuario)
+            for (lote_id, ubicacion_id), cantidad in cantidades.items()
+            if (lote_id, ubicacion_id) not in existentes
+            or (self.actualizar_cantidad and existentes[(lote_id, ubicacion_id)] != cantidad)
+        ]
+        if cambios:
+            LoteUbicacion.objects.bulk_create(
+                cambios,
+                batch_size=TAMANO_BLOQUE,
+                update_conflicts=True,
+                unique_fields=['lote', 'ubicacion'],
+                update_fields=['cantidad', 'usuario_asignacion', 'fecha_actualizacion'],
+            )
+
+    def _guardar_lotes(self, lotes):
+        if self.actualizar_cantidad:
+            totales = dict(
+                LoteUbicacion.objects.filter(lote_id__in=[l.pk for l in lotes])
+                .order_by()
+                .values('lote_id')
+                .annotate(total=Sum('cantidad'))
+                .values_list('lote_id', 'total')
+            )
+            for lote in lotes:
+                lote.cantidad_disponible = totales.get(lote.pk) or 0
+        ahora = timezone.now()
+        for lote in lotes:
+            # Igual que Lote.save()
+            if lote.cantidad_inicial and lote.precio_unitario:
+                lote.valor_total = lote.cantidad_inicial * lote.precio_unitario
+            lote.fecha_actualizacion = ahora
+        Lote.objects.bulk_update(
+            lotes,
+            ['fecha_caducidad', 'almacen', 'cantidad_inicial', 'cantidad_disponible', 'valor_total', 'fecha_actualizacion'],
+            batch_size=TAMANO_BLOQUE,
+        )
@@ -2,7 +2,8 @@
 Utilidades para comparar inventario entre dos fechas (corte al cierre del día).
 
 Existencia histórica por lote: último ``MovimientoInventario`` no anulado con
-``fecha_movimiento`` <= fecha; si no hay movimiento, ``cantidad_inicial`` si el lote
+``fecha_movimiento`` <= fecha (vía snapshots ``SaldoCierreLote`` + cola reciente, ver
+``saldos_cierre_utils``); si no hay movimiento, ``cantidad_inicial`` si el lote
 ya existía (``fecha_recepcion`` <= fecha).
 
 Inventario disponible neto (fecha B = hoy): ``cantidad_disponible`` − reservas activas,
@@ -16,7 +17,6 @@ from django.db.models import (
     Case,
     F,
     IntegerField,
-    OuterRef,
     Q,
     Subquery,
     Sum,
@@ -27,7 +27,8 @@ from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from .models import Lote, MovimientoInventario
-from .pedidos_models import LoteAsignado
+from .reservas_utils import subquery_reserva_activa_lote
+from .saldos_cierre_utils import existencia_en_fecha, fin_dia, obtener_fecha_cierre
 
 TIPOS_INCREMENTAN = frozenset(
     {'ENTRADA', 'AJUSTE_POSITIVO', 'TRANSFERENCIA_ENTRADA'}
@@ -52,30 +53,9 @@ AGRUPACIONES = {
 }
 
 
-def _subquery_existencia_fisica_en_fecha(fecha):
-    return (
-        MovimientoInventario.objects.filter(
-            lote_id=OuterRef('pk'),
-            anulado=False,
-            fecha_movimiento__date__lte=fecha,
-        )
-        .exclude(tipo_movimiento='AJUSTE_DATOS_LOTE')
-        .order_by('-fecha_movimiento', '-id')
-        .values('cantidad_nueva')[:1]
-    )
-
-
 def _subquery_reserva_activa():
-    return (
-        LoteAsignado.objects.filter(
-            lote_ubicacion__lote_id=OuterRef('pk'),
-            surtido=False,
-        )
-        .order_by()
-        .values('lote_ubicacion__lote_id')
-        .annotate(t=Sum('cantidad_asignada'))
-        .values('t')[:1]
-    )
+    """Reserva activa del lote desde el libro LoteUbicacion.reserva_activa."""
+    return subquery_reserva_activa_lote()
 
 
 def annotar_existencias_comparativo(lotes_qs, fecha_a, fecha_b):
@@ -83,8 +63,7 @@ def annotar_existencias_comparativo(lotes_qs, fecha_a, fecha_b):
     Anota por lote: existencia física en A y B (historial), disponible neto actual
   y delta físico.
     """
-    subq_a = _subquery_existencia_fisica_en_fecha(fecha_a)
-    subq_b = _subquery_existencia_fisica_en_fecha(fecha_b)
+    fecha_cierre = obtener_fecha_cierre()
     reserva = _subquery_reserva_activa()
 
     existencia_si_recepcion = lambda f: Case(
@@ -95,15 +74,11 @@ def annotar_existencias_comparativo(lotes_qs, fecha_a, fecha_b):
 
     qs = lotes_qs.annotate(
         _reserva=Coalesce(Subquery(reserva, output_field=IntegerField()), Value(0)),
-        exist_a=Coalesce(
-            Subquery(subq_a, output_field=IntegerField()),
-            existencia_si_recepcion(fecha_a),
-            output_field=IntegerField(),
+        exist_a=existencia_en_fecha(
+            fecha_a, existencia_si_recepcion(fecha_a), fecha_cierre=fecha_cierre
         ),
-        exist_b_fisica=Coalesce(
-            Subquery(subq_b, output_field=IntegerField()),
-            existencia_si_recepcion(fecha_b),
-            output_field=IntegerField(),
+        exist_b_fisica=existencia_en_fecha(
+            fecha_b, existencia_si_recepcion(fecha_b), fecha_cierre=fecha_cierre
         ),
     ).annotate(
         exist_b_neto=Case(
@@ -217,8 +192,8 @@ def movimientos_en_periodo(lotes_qs, fecha_a, fecha_b, clave_cnis=None, limite=5
         MovimientoInventario.objects.filter(
             lote_id__in=lote_ids,
             anulado=False,
-            fecha_movimiento__date__gt=fecha_a,
-            fecha_movimiento__date__lte=fecha_b,
+            fecha_movimiento__gte=fin_dia(fecha_a),
+            fecha_movimiento__lt=fin_dia(fecha_b),
         )
         .exclude(tipo_movimiento='AJUSTE_DATOS_LOTE')
         .select_related(
@@ -275,8 +250,8 @@ def resumen_movimientos_por_clave(lotes_qs, fecha_a, fecha_b, claves=None):
         MovimientoInventario.objects.filter(
             lote_id__in=lote_ids,
             anulado=False,
-            fecha_movimiento__date__gt=fecha_a,
-            fecha_movimiento__date__lte=fecha_b,
+            fecha_movimiento__gte=fin_dia(fecha_a),
+            fecha_movimiento__lt=fin_dia(fecha_b),
         )
         .exclude(tipo_movimiento='AJUSTE_DATOS_LOTE')
         .values('lote__producto__clave_cnis', 'tipo_movimiento')
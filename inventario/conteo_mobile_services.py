@@ -6,6 +6,7 @@ En móvil v1: un solo valor de conteo se replica en primer/segundo/tercer conteo
 
 from __future__ import annotations
 
+import uuid
 from dataclasses import dataclass
 from datetime import date
 from typing import Optional
@@ -171,6 +172,282 @@ def _ajustar_caducidad_lote(lote, fecha_caducidad: date, usuario, origen: str =
     return mov.id
 
 
+@dataclass
+class ConteoSincronizado:
+    """Conteo capturado sin conexión en la app móvil, con su clave de idempotencia."""
+    clave_idempotencia: str
+    lote_ubicacion_id: int
+    cantidad_fisica: int
+    fecha_caducidad: Optional[date] = None
+    observaciones: str = ''
+
+
+def _resultado_a_dict(resultado: ResultadoConteo) -> dict:
+    return {
+        'lote_ubicacion_id': resultado.lote_ubicacion_id,
+        'movimiento_id': resultado.movimiento_id,
+        'cantidad_anterior': resultado.cantidad_anterior,
+        'cantidad_nueva': resultado.cantidad_nueva,
+        'diferencia': resultado.diferencia,
+        'tipo_movimiento': resultado.tipo_movimiento,
+        'completado': resultado.completado,
+    }
+
+
+@transaction.atomic
+def sincronizar_conteos(
+    usuario,
+    conteos: list[ConteoSincronizado],
+    *,
+    origen: str = 'App móvil — sincronización',
+) -> list[dict]:
+    """
+    Aplica en una sola transacción un lote de conteos capturados sin conexión.
+
+    Misma regla que ``registrar_conteo_ubicacion`` (el conteo se replica en los 3 conteos,
+    ajusta existencia y genera movimiento), pero con lecturas agrupadas y escrituras
+    ``bulk_create`` / ``bulk_update``. Cada conteo trae una clave de idempotencia: si ya se
+    aplicó en una sincronización anterior se devuelve el resultado guardado.
+    Si un mismo LoteUbicacion aparece varias veces se aplican en el orden recibido.
+
+    Returns:
+        list[dict]: un resultado por conteo, en el mismo orden, con ``estado``
+        'aplicado', 'duplicado' o 'error' (más ``detalle`` en caso de error).
+    """
+    from django.db.models import Sum
+
+    from inventario.dashboard_utils import invalidar_dashboard
+    from inventario.models import (
+        Lote,
+        LoteUbicacion,
+        MovimientoInventario,
+        RegistroConteoFisico,
+        SincronizacionConteoMovil,
+    )
+
+    ahora = timezone.now()
+    folio = f'CONTEO-{ahora.strftime("%Y%m%d%H%M%S")}'
+    resultados: list[Optional[dict]] = [None] * len(conteos)
+
+    # 1) Idempotencia: claves ya sincronizadas por este usuario (o repetidas dentro del mismo lote).
+    claves = {c.clave_idempotencia for c in conteos}
+    sincronizadas = SincronizacionConteoMovil.objects.filter(usuario=usuario, clave_idempotencia__in=claves)
+    previas = dict(sincronizadas.values_list('clave_idempotencia', 'resultado'))
+    pendientes = []
+    primera_aparicion = {}
+    repetidas = []
+    for i, conteo in enumerate(conteos):
+        clave = conteo.clave_idempotencia
+        if clave in previas:
+            resultados[i] = {**previas[clave], 'clave_idempotencia': clave, 'estado': 'duplicado'}
+        elif clave in primera_aparicion:
+            repetidas.append((i, primera_aparicion[clave]))
+        elif conteo.cantidad_fisica < 0:
+            resultados[i] = {
+                'clave_idempotencia': clave,
+                'estado': 'error',
+                'detalle': 'La cantidad física no puede ser negativa.',
+            }
+        else:
+            pendientes.append(i)
+        primera_aparicion.setdefault(clave, i)
+
+    # Reclamar las claves nuevas antes de tocar existencias. Una sincronización concurrente con
+    # la misma clave espera en el índice único (ON CONFLICT DO NOTHING) y, al confirmarse la
+    # otra, la encuentra con su resultado: se responde 'duplicado' en lugar de chocar al final.
+    reclamo = uuid.uuid4().hex
+    SincronizacionConteoMovil.objects.bulk_create(
+        [
+            SincronizacionConteoMovil(
+                clave_idempotencia=conteos[i].clave_idempotencia, usuario=usuario, resultado={'reclamo': reclamo}
+            )
+            for i in pendientes
+        ],
+        ignore_conflicts=True,
+    )
+    propias = {}
+    for sync in sincronizadas.filter(clave_idempotencia__in=[conteos[i].clave_idempotencia for i in pendientes]):
+        if sync.resultado.get('reclamo') == reclamo:
+            propias[sync.clave_idempotencia] = sync
+        else:
+            previas[sync.clave_idempotencia] = sync.resultado
+    reclamadas = []
+    for i in pendientes:
+        clave = conteos[i].clave_idempotencia
+        if clave in propias:
+            reclamadas.append(i)
+        else:
+            resultados[i] = {**previas[clave], 'clave_idempotencia': clave, 'estado': 'duplicado'}
+    pendientes = reclamadas
+
+    # 2) Lecturas agrupadas, bloqueando las ubicaciones en orden de id.
+    lu_ids = {conteos[i].lote_ubicacion_id for i in pendientes}
+    ubicaciones = {}
+    lotes = {}
+    for lu in (
+        LoteUbicacion.objects.select_for_update(of=('self',))
+        .select_related('lote')
+        .filter(id__in=lu_ids)
+        .order_by('id')
+    ):
+        # Una sola instancia por lote para acumular cambios de varias ubicaciones
+        lu.lote = lotes.setdefault(lu.lote_id, lu.lote)
+        ubicaciones[lu.id] = lu
+    registros = {
+        r.lote_ubicacion_id: r
+        for r in RegistroConteoFisico.objects.filter(lote_ubicacion_id__in=lu_ids)
+    }
+
+    registros_nuevos = {}
+    movimientos = []
+    lotes_caducidad = {}
+    sincronizaciones = []
+    for i in pendientes:
+        conteo = conteos[i]
+        lote_ubicacion = ubicaciones.get(conteo.lote_ubicacion_id)
+        if lote_ubicacion is None:
+            resultados[i] = {
+                'clave_idempotencia': conteo.clave_idempotencia,
+                'estado': 'error',
+                'detalle': 'Lote en ubicación no encontrado',
+            }
+            continue
+        lote = lote_ubicacion.lote
+
+        registro = registros.get(lote_ubicacion.id)
+        if registro is None:
+            registro = RegistroConteoFisico(lote_ubicacion=lote_ubicacion, usuario_creacion=usuario)
+            registros[lote_ubicacion.id] = registros_nuevos[lote_ubicacion.id] = registro
+
+        cantidad_anterior = lote_ubicacion.cantidad
+        cantidad_nueva = int(conteo.cantidad_fisica)
+        diferencia = cantidad_nueva - cantidad_anterior
+
+        registro.primer_conteo = registro.segundo_conteo = registro.tercer_conteo = cantidad_nueva
+        if conteo.observaciones:
+            registro.observaciones = conteo.observaciones
+        registro.usuario_ultima_actualizacion = usuario
+        registro.completado = True
+        registro.fecha_actualizacion = ahora
+
+        lote_ubicacion.cantidad = cantidad_nueva
+        lote_ubicacion.usuario_asignacion = usuario
+        lote_ubicacion.fecha_actualizacion = ahora
+
+        if conteo.fecha_caducidad and lote.fecha_caducidad != conteo.fecha_caducidad:
+            movimientos.append(
+                MovimientoInventario(
+                    lote=lote,
+                    tipo_movimiento='AJUSTE_DATOS_LOTE',
+                    cantidad=max(lote.cantidad_disponible or 0, 1),
+                    cantidad_anterior=lote.cantidad_disponible or 0,
+                    cantidad_nueva=lote.cantidad_disponible or 0,
+                    motivo=(
+                        f'Ajuste caducidad ({origen}): '
+                        f'{lote.fecha_caducidad.strftime("%d/%m/%Y") if lote.fecha_caducidad else "—"} → '
+                        f'{conteo.fecha_caducidad.strftime("%d/%m/%Y")}'
+                    ),
+                    usuario=usuario,
+                    folio=f'CONTEO-CAD-{ahora.strftime("%Y%m%d%H%M%S")}',
+                )
+            )
+            lote.fecha_caducidad = conteo.fecha_caducidad
+            lotes_caducidad[lote.id] = lote
+
+        tipo_mov = _tipo_movimiento_por_diferencia(diferencia)
+        movimiento = MovimientoInventario(
+            lote=lote,
+            tipo_movimiento=tipo_mov,
+            cantidad=abs(diferencia),
+            cantidad_anterior=cantidad_anterior,
+            cantidad_nueva=cantidad_nueva,
+            motivo=_motivo_conteo(registro, cantidad_nueva, diferencia, conteo.observaciones, origen),
+            usuario=usuario,
+            folio=folio,
+        )
+        movimientos.append(movimiento)
+        resultados[i] = ResultadoConteo(
+            lote_ubicacion_id=lote_ubicacion.id,
+            movimiento_id=None,
+            cantidad_anterior=cantidad_anterior,
+            cantidad_nueva=cantidad_nueva,
+            diferencia=diferencia,
+            tipo_movimiento=tipo_mov,
+            completado=True,
+            progreso='3/3',
+        )
+        sincronizaciones.append((i, movimiento))
+
+    # 3) Escrituras en bloque.
+    if sincronizaciones:
+        tocadas = list({resultados[i].lote_ubicacion_id for i, _ in sincronizaciones})
+        LoteUbicacion.objects.bulk_update(
+            [ubicaciones[pk] for pk in tocadas],
+            ['cantidad', 'usuario_asignacion', 'fecha_actualizacion'],
+        )
+        RegistroConteoFisico.objects.bulk_create(list(registros_nuevos.values()))
+        RegistroConteoFisico.objects.bulk_update(
+            [r for pk, r in registros.items() if pk in tocadas and pk not in registros_nuevos],
+            [
+                'primer_conteo',
+                'segundo_conteo',
+                'tercer_conteo',
+                'observaciones',
+                'usuario_ultima_actualizacion',
+                'completado',
+                'fecha_actualizacion',
+            ],
+        )
+        if lotes_caducidad:
+            Lote.objects.bulk_update(list(lotes_caducidad.values()), ['fecha_caducidad'])
+        MovimientoInventario.objects.bulk_create(movimientos)
+
+        # Equivalente a Lote.sincronizar_cantidad_disponible para todos los lotes tocados.
+        lotes = {ubicaciones[pk].lote_id: ubicaciones[pk].lote for pk in tocadas}
+        totales = dict(
+            LoteUbicacion.objects.filter(lote_id__in=list(lotes))
+            .order_by()
+            .values('lote_id')
+            .annotate(total=Sum('cantidad'))
+            .values_list('lote_id', 'total')
+        )
+        desfasados = []
+        for lote_id, lote in lotes.items():
+            total = totales.get(lote_id) or 0
+            if lote.cantidad_disponible != total:
+                lote.cantidad_disponible = total
+                desfasados.append(lote)
+        Lote.objects.bulk_update(desfasados, ['cantidad_disponible'])
+        invalidar_dashboard()
+
+    registros_sync = []
+    for i, movimiento in sincronizaciones:
+        resultado = resultados[i]
+        resultado.movimiento_id = movimiento.id
+        resultados[i] = {
+            **_resultado_a_dict(resultado),
+            'clave_idempotencia': conteos[i].clave_idempotencia,
+            'estado': 'aplicado',
+        }
+        sync = propias[conteos[i].clave_idempotencia]
+        sync.lote_ubicacion_id = resultado.lote_ubicacion_id
+        sync.resultado = _resultado_a_dict(resultado)
+        registros_sync.append(sync)
+    SincronizacionConteoMovil.objects.bulk_update(registros_sync, ['lote_ubicacion', 'resultado'])
+    # Claves reclamadas cuyo conteo dio error: se liberan para que el dispositivo pueda reintentar.
+    aplicadas = {sync.pk for sync in registros_sync}
+    SincronizacionConteoMovil.objects.filter(
+        pk__in=[sync.pk for sync in propias.values() if sync.pk not in aplicadas]
+    ).delete()
+
+    for i, original in repetidas:
+        if resultados[original]['estado'] == 'error':
+            resultados[i] = resultados[original]
+        else:
+            resultados[i] = {**resultados[original], 'estado': 'duplicado'}
+    return resultados
+
+
 @transaction.atomic
 def crear_lote_en_ubicacion(
     ubicacion_id: int,
@@ -18,6 +18,9 @@ Uso en settings.py:
     ]
 """
 
+from .menu_roles_utils import acceso_menu_usuario
+
+
 def permisos_usuario(request):
     """
     Context processor que agrega los permisos del usuario al contexto
@@ -26,7 +29,7 @@ def permisos_usuario(request):
         - {{ permisos.puede_crear_entrada }}
         - {{ permisos.puede_crear_salida }}
         - {{ permisos.es_administrador }}
-        - {{ user.groups.all }} (para obtener todos los grupos)
+        - {{ permisos.roles }} (nombres de los grupos del usuario)
     """
     
     permisos = {
@@ -49,11 +52,15 @@ def permisos_usuario(request):
         'es_almacenero': False,
         'es_responsable_proveeduria': False,
         'es_administrador': False,
+
+        # Nombres de los grupos del usuario
+        'roles': [],
     }
     
     if request.user.is_authenticated:
-        # Obtener grupos del usuario
-        grupos = request.user.groups.values_list('name', flat=True)
+        # Grupos del usuario (resueltos una vez por request, compartidos con middleware y menú)
+        grupos = acceso_menu_usuario(request.user).roles
+        permisos['roles'] = grupos
         
         # Verificar permisos específicos
         permisos['puede_crear_entrada'] = request.user.has_perm('inventario.add_lote')
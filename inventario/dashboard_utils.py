@@ -0,0 +1,189 @@
+"""
+Métricas del dashboard principal (``views.dashboard`` y ``api_estadisticas_dashboard``).
+
+Antes cada carga de la página de inicio hacía ~8 conteos/sumas sobre Lote, Producto e
+Institución, y la API de gráficas 12 consultas más (conteo y suma por mes) y un agregado
+por categoría que unía todos los lotes. Aquí:
+
+- Los indicadores de lotes salen de un solo agregado con ``filter=`` por indicador; los
+  meses, de una consulta agrupada por ``TruncMonth``; el top de instituciones y las
+  categorías, de una agrupación sobre Lote.
+- El resultado se guarda en la caché de Django (``DASHBOARD_CACHE_TTL`` segundos, 60 por
+  defecto) con la fecha del día y la versión de ``ControlDashboard`` en la clave.
+- Invalidar es incrementar esa versión al confirmar la transacción: la fila vive en la BD,
+  así que el cambio lo ven todos los workers de gunicorn y ``procesar_trabajos`` aunque la
+  caché sea local a cada proceso (LocMem). Cuesta una lectura por pk en cada carga.
+- Las escrituras de Lote, MovimientoInventario, Producto, Institución y CategoriaProducto
+  invalidan por señal (registradas en ``InventarioConfig.ready``). Los caminos masivos
+  (``update``/``bulk_create``/``bulk_update``) no emiten señales y llaman a
+  ``invalidar_dashboard()`` explícitamente tras escribir.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+DASHBOARD_CACHE_TTL = getattr(settings, 'DASHBOARD_CACHE_TTL', 60)
+MESES_ESTADISTICAS = 6
+
+_CLAVE_RESUMEN = 'dashboard:resumen:{}:v{}'
+_CLAVE_ESTADISTICAS = 'dashboard:estadisticas:{}:v{}'
+
+
+def version_dashboard():
+    """Versión vigente de las métricas (0 si nunca se ha invalidado)."""
+    from .models import ControlDashboard
+
+    return ControlDashboard.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def _calcular_resumen(hoy):
+    from .models import Institucion, Lote, Producto
+
+    activos = Q(estado=1)
+    lotes = Lote.objects.order_by().aggregate(
+        total_lotes=Count('id', filter=activos),
+        valor_total_inventario=Sum('valor_total', filter=activos),
+        alertas_30_dias=Count('id', filter=activos & Q(
+            fecha_caducidad__lte=hoy + timedelta(days=30), fecha_caducidad__gt=hoy
+        )),
+        productos_caducados=Count('id', filter=Q(fecha_caducidad__lt=hoy)),
+        productos_bajo_stock=Count('id', filter=activos & Q(cantidad_disponible__lt=10)),
+    )
+
+    top = list(
+        Lote.objects.filter(institucion__activo=True)
+        .order_by()
+        .values('institucion_id')
+        .annotate(total_lotes=Count('id'), valor_inventario=Sum('valor_total'))
+        .order_by(F('valor_inventario').desc(nulls_last=True), 'institucion_id')[:5]
+    )
+    nombres = dict(
+        Institucion.objects.filter(pk__in=[fila['institucion_id'] for fila in top])
+        .values_list('pk', 'denominacion')
+    )
+    instituciones_top = [
+        {
+            'id': fila['institucion_id'],
+            'denominacion': nombres.get(fila['institucion_id'], ''),
+            'total_lotes': fila['total_lotes'],
+            'valor_inventario': fila['valor_inventario'],
+        }
+        for fila in top
+    ]
+
+    return {
+        'total_instituciones': Institucion.objects.filter(activo=True).count(),
+        'total_productos': Producto.objects.filter(activo=True).count(),
+        'total_lotes': lotes['total_lotes'],
+        'valor_total_inventario': lotes['valor_total_inventario'] or 0,
+        'alertas_30_dias': lotes['alertas_30_dias'],
+        'productos_caducados': lotes['productos_caducados'],
+        'productos_bajo_stock': lotes['productos_bajo_stock'],
+        'instituciones_top': instituciones_top,
+    }
+
+
+def _inicio_meses(hoy, meses):
+    """Primer día de cada uno de los últimos ``meses`` meses, del más antiguo al actual."""
+    anio, mes = hoy.year, hoy.month
+    inicios = []
+    for _ in range(meses):
+        inicios.append(date(anio, mes, 1))
+        anio, mes = (anio, mes - 1) if mes > 1 else (anio - 1, 12)
+    return list(reversed(inicios))
+
+
+def _calcular_estadisticas(hoy):
+    from .models import CategoriaProducto, Lote
+
+    inicios = _inicio_meses(hoy, MESES_ESTADISTICAS)
+    por_mes = {
+        fila['mes'].strftime('%Y-%m'): fila
+        for fila in Lote.objects.filter(fecha_recepcion__gte=inicios[0])
+        .order_by()
+        .annotate(mes=TruncMonth('fecha_recepcion'))
+        .values('mes')
+        .annotate(lotes=Count('id'), valor=Sum('valor_total'))
+    }
+    estadisticas_mensuales = []
+    for inicio in inicios:
+        fila = por_mes.get(inicio.strftime('%Y-%m'), {})
+        estadisticas_mensuales.append({
+            'mes': inicio.strftime('%Y-%m'),
+            'lotes': fila.get('lotes', 0),
+            'valor': float(fila.get('valor') or 0),
+        })
+
+    por_categoria = {
+        fila['producto__categoria_id']: fila
+        for fila in Lote.objects.order_by()
+        .values('producto__categoria_id')
+        .annotate(total_lotes=Count('id'), valor_total=Sum('valor_total'))
+    }
+    categorias = []
+    for categoria_id, nombre in CategoriaProducto.objects.values_list('id', 'nombre'):
+        fila = por_categoria.get(categoria_id, {})
+        categorias.append({
+            'nombre': nombre,
+            'total_lotes': fila.get('total_lotes', 0),
+            'valor_total': fila.get('valor_total'),
+        })
+
+    return {'estadisticas_mensuales': estadisticas_mensuales, 'categorias': categorias}
+
+
+def resumen_dashboard(hoy=None):
+    """Indicadores de las tarjetas e instituciones con mayor valor (en caché)."""
+    hoy = hoy or date.today()
+    return cache.get_or_set(_CLAVE_RESUMEN.format(hoy.isoformat(), version_dashboard()),
+                            lambda: _calcular_resumen(hoy), DASHBOARD_CACHE_TTL)
+
+
+def estadisticas_dashboard(hoy=None):
+    """Lotes y valor recibidos por mes (últimos 6) y totales por categoría (en caché)."""
+    hoy = hoy or date.today()
+    return cache.get_or_set(_CLAVE_ESTADISTICAS.format(hoy.isoformat(), version_dashboard()),
+                            lambda: _calcular_estadisticas(hoy), DASHBOARD_CACHE_TTL)
+
+
+def _avanzar_version(using=None):
+    from .models import ControlDashboard
+
+    controles = ControlDashboard.objects.using(using)
+    if not controles.filter(pk=1).update(version=F('version') + 1):
+        _, creado = controles.get_or_create(pk=1, defaults={'version': 1})
+        if not creado:
+            # Otro proceso creó la fila entre el UPDATE y el INSERT
+            controles.filter(pk=1).update(version=F('version') + 1)
+
+
+class _AvanceVersion:
+    """Callback de ``on_commit``; ``pendiente`` permite registrar uno solo por transacción."""
+
+    def __init__(self, using):
+        self.using = using
+        self.pendiente = True
+
+    def __call__(self):
+        self.pendiente = False
+        _avanzar_version(self.using)
+
+
+def invalidar_dashboard(*args, using=None, **kwargs):
+    """
+    Incrementa la versión del dashboard al confirmar la transacción. Sirve como receptor
+    de señales y se llama directo tras escrituras masivas; dentro de una misma transacción
+    se registra una sola vez.
+    """
+    conexion = transaction.get_connection(using)
+    if conexion.in_atomic_block and any(
+        isinstance(callback, _AvanceVersion) and callback.pendiente
+        for _, callback, *_ in conexion.run_on_commit
+    ):
+        return
+    transaction.on_commit(_AvanceVersion(using), using=using)
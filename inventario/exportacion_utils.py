@@ -0,0 +1,254 @@
+"""
+Exportación de reportes tabulares a Excel (streaming) o CSV.
+
+Las vistas de exportación arman un ``Workbook()`` normal: cada celda es un objeto con su
+estilo y todo el libro vive en memoria hasta ``wb.save(response)``; exportar el histórico de
+movimientos o las existencias completas subía cientos de MB el RSS del worker. Aquí:
+
+- Las filas llegan de un iterable (típicamente un generador sobre ``.iterator(chunk_size=...)``
+  o ``values_list``) y se escriben en una hoja ``write_only``, que openpyxl vuelca a disco
+  conforme se agregan.
+- Los estilos (encabezado, bordes, alineación, totales) se registran una vez como
+  ``NamedStyle`` por hoja; cada celda copia el arreglo de estilo ya calculado.
+- El .xlsx se guarda en un archivo temporal (en memoria si es chico) y se envía con
+  ``FileResponse`` por bloques.
+- ``?formato=csv`` devuelve un ``StreamingHttpResponse`` que va escribiendo las filas
+  conforme se leen de la BD (UTF-8 con BOM para que Excel respete los acentos).
+
+Uso::
+
+    def filas():
+        for lote in lotes.iterator(chunk_size=2000):
+            yield [lote.producto.clave_cnis, lote.numero_lote, lote.cantidad_disponible]
+
+    return respuesta_exportacion(
+        request, filas(), ['Clave', 'Lote', 'Cantidad'], 'reporte_lotes',
+        titulo_hoja='Lotes', anchos=[15, 15, 12],
+    )
+"""
+
+import csv
+import tempfile
+from copy import copy
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+TIPO_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+TIPO_CSV = 'text/csv; charset=utf-8'
+TAMANO_LOTE_ITERATOR = 2000
+# El .xlsx se arma en memoria hasta este tamaño; arriba de eso se pasa a disco.
+MAX_SPOOL_MEMORIA = 16 * 1024 * 1024
+
+
+@dataclass
+class EstiloExportacion:
+    """
+    Formato de la hoja: colores del encabezado (None = sin relleno / color por defecto),
+    bordes, columnas alineadas a la derecha y ``formatos`` numéricos por columna (base 1).
+
+    ``resaltar(fila)`` puede devolver una clave de ``resaltados`` ({clave: color}) para
+    rellenar toda la fila (p. ej. semáforo por nivel de reserva).
+    """
+    fondo_encabezado: str = '1F4E78'
+    color_encabezado: str = 'FFFFFF'
+    tamano_fuente: int = 11
+    bordes: bool = False
+    columnas_derecha: tuple = ()
+    fondo_totales: str = 'D9E1F2'
+    fijar_encabezado: bool = True
+    formatos: dict = field(default_factory=dict)
+    resaltados: dict = field(default_factory=dict)
+    resaltar: object = None
+
+
+def en_lotes(iterable, tamano=TAMANO_LOTE_ITERATOR):
+    """Agrupa un iterable en listas de ``tamano`` (para enriquecer objetos por bloque)."""
+    iterador = iter(iterable)
+    while True:
+        bloque = list(islice(iterador, tamano))
+        if not bloque:
+            return
+        yield bloque
+
+
+def nombre_con_fecha(base, extension):
+    return f"{base}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+def formato_solicitado(request):
+    formato = (request.GET.get('formato') or request.POST.get('formato') or '').lower()
+    return 'csv' if formato == 'csv' else 'xlsx'
+
+
+def respuesta_exportacion(request, filas, encabezados, nombre_base, titulo_hoja='Reporte',
+                          anchos=None, estilo=None, totales=None, con_fecha=True):
+    """
+    Respuesta de descarga en el formato pedido (``formato=csv`` o .xlsx por defecto).
+
+    Args:
+        filas: iterable de listas/tuplas, consumido una sola vez
+        encabezados: títulos de columna
+        nombre_base: nombre del archivo sin extensión
+        anchos: anchos de columna (solo .xlsx)
+        estilo: EstiloExportacion (solo .xlsx)
+        totales: fila final, o callable sin argumentos que la devuelve una vez leídas
+            todas las filas (para sumas acumuladas en el generador)
+        con_fecha: agrega la fecha y hora al nombre del archivo
+    """
+    if formato_solicitado(request) == 'csv':
+        nombre = nombre_con_fecha(nombre_base, 'csv') if con_fecha else f'{nombre_base}.csv'
+        return respuesta_csv(filas, encabezados, nombre, totales=totales)
+    nombre = nombre_con_fecha(nombre_base, 'xlsx') if con_fecha else f'{nombre_base}.xlsx'
+    return respuesta_excel(filas, encabezados, nombre, titulo_hoja=titulo_hoja, anchos=anchos,
+                           estilo=estilo, totales=totales)
+
+
+class _Eco:
+    """Destino de csv.writer que devuelve la línea escrita en lugar de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _celda_csv(valor):
+    return '' if valor is None else valor
+
+
+def respuesta_csv(filas, encabezados, nombre_archivo, totales=None):
+    escritor = csv.writer(_Eco())
+
+    def contenido():
+        yield '﻿' + escritor.writerow(encabezados)
+        for fila in filas:
+            yield escritor.writerow([_celda_csv(v) for v in fila])
+        fila_totales = totales() if callable(totales) else totales
+        if fila_totales:
+            yield escritor.writerow([_celda_csv(v) for v in fila_totales])
+
+    respuesta = StreamingHttpResponse(contenido(), content_type=TIPO_CSV)
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return respuesta
+
+
+class HojaStreaming:
+    """Hoja ``write_only`` con estilos registrados una sola vez en el libro."""
+
+    def __init__(self, libro, titulo, encabezados, anchos=None, estilo=None):
+        self.estilo = estilo or EstiloExportacion()
+        self.hoja = libro.create_sheet(title=titulo[:31])
+        # Los nombres de estilo llevan el número de hoja: cada hoja del libro puede tener su formato.
+        self._prefijo = f'exp{len(libro.worksheets)}_'
+        self.columnas = len(encabezados)
+        self._registrar_estilos(libro)
+
+        for indice, ancho in enumerate(anchos or [], start=1):
+            self.hoja.column_dimensions[get_column_letter(indice)].width = ancho
+        if self.estilo.fijar_encabezado:
+            self.hoja.freeze_panes = 'A2'
+
+        self.hoja.append([self._celda(valor, self._prefijo + 'encabezado') for valor in encabezados])
+
+        # Nombre de estilo por columna, calculado una vez (None = celda sin estilo).
+        self._estilo_columna = []
+        for indice in range(1, self.columnas + 1):
+            if indice in self.estilo.formatos:
+                nombre = f'{self._prefijo}formato_{indice}'
+            elif indice in self.estilo.columnas_derecha:
+                nombre = self._prefijo + 'derecha'
+            elif self.estilo.bordes:
+                nombre = self._prefijo + 'dato'
+            else:
+                nombre = None
+            self._estilo_columna.append(nombre)
+        self._sin_estilos = not any(self._estilo_columna)
+
+    def _registrar_estilos(self, libro):
+        e = self.estilo
+        borde = Border(*(Side(style='thin'),) * 4) if e.bordes else Border()
+        estilos = [
+            NamedStyle(
+                name=self._prefijo + 'encabezado',
+                font=Font(bold=True, color=e.color_encabezado, size=e.tamano_fuente),
+                fill=(PatternFill(start_color=e.fondo_encabezado, end_color=e.fondo_encabezado, fill_type='solid')
+                      if e.fondo_encabezado else PatternFill()),
+                alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+                border=borde,
+            ),
+            NamedStyle(name=self._prefijo + 'dato', border=borde),
+            NamedStyle(name=self._prefijo + 'derecha', border=borde, alignment=Alignment(horizontal='right')),
+            NamedStyle(
+                name=self._prefijo + 'totales',
+                font=Font(bold=True, size=e.tamano_fuente),
+                fill=PatternFill(start_color=e.fondo_totales, end_color=e.fondo_totales, fill_type='solid'),
+                border=borde,
+            ),
+        ]
+        for clave, color in e.resaltados.items():
+            estilos.append(NamedStyle(
+                name=f'{self._prefijo}resaltado_{clave}',
+                fill=PatternFill(start_color=color, end_color=color, fill_type='solid'),
+                border=borde,
+                alignment=Alignment(horizontal='center', vertical='center'),
+            ))
+        for indice, formato in e.formatos.items():
+            alineacion = Alignment(horizontal='right') if indice in e.columnas_derecha else Alignment()
+            estilos.append(NamedStyle(name=f'{self._prefijo}formato_{indice}', number_format=formato, border=borde,
+                                      alignment=alineacion))
+        existentes = set(libro.named_styles)
+        self._estilos = {}
+        for estilo in estilos:
+            if estilo.name not in existentes:
+                libro.add_named_style(estilo)
+            plantilla = WriteOnlyCell(self.hoja)
+            plantilla.style = estilo.name
+            self._estilos[estilo.name] = plantilla._style
+
+    def _celda(self, valor, nombre_estilo):
+        celda = WriteOnlyCell(self.hoja, value=valor)
+        celda._style = copy(self._estilos[nombre_estilo])
+        return celda
+
+    def agregar(self, fila):
+        clave = self.estilo.resaltar(fila) if self.estilo.resaltar else None
+        if clave is not None:
+            nombre = f'{self._prefijo}resaltado_{clave}'
+            self.hoja.append([self._celda(valor, nombre) for valor in fila])
+            return
+        if self._sin_estilos:
+            self.hoja.append(fila)
+            return
+        self.hoja.append([
+            self._celda(valor, nombre) if nombre else valor
+            for valor, nombre in zip(fila, self._estilo_columna)
+        ])
+
+    def agregar_totales(self, fila):
+        fila = list(fila) + [None] * (self.columnas - len(fila))
+        self.hoja.append([self._celda(valor, self._prefijo + 'totales') for valor in fila])
+
+
+def respuesta_excel(filas, encabezados, nombre_archivo, titulo_hoja='Reporte', anchos=None,
+                    estilo=None, totales=None):
+    libro = Workbook(write_only=True)
+    hoja = HojaStreaming(libro, titulo_hoja, encabezados, anchos=anchos, estilo=estilo)
+    for fila in filas:
+        hoja.agregar(fila)
+    fila_totales = totales() if callable(totales) else totales
+    if fila_totales:
+        hoja.agregar_totales(fila_totales)
+    return respuesta_libro(libro, nombre_archivo)
+
+
+def respuesta_libro(libro, nombre_archivo):
+    """Guarda un libro (p. ej. con varias HojaStreaming) y lo envía por bloques."""
+    destino = tempfile.SpooledTemporaryFile(max_size=MAX_SPOOL_MEMORIA)
+    libro.save(destino)
+    destino.seek(0)
+    return FileResponse(destino, as_attachment=True, filename=nombre_archivo, content_type=TIPO_XLSX)
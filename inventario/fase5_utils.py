@@ -6,12 +6,14 @@ cuando se marca una propuesta como surtida.
 
 from collections import defaultdict
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import date
 import logging
+from .dashboard_utils import invalidar_dashboard
 from .models import MovimientoInventario, Lote, LoteUbicacion
-from .pedidos_models import PropuestaPedido
+from .pedidos_models import LoteAsignado, PropuestaPedido
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +58,44 @@ def _mensaje_cantidad_insuficiente(lote, lote_ubicacion, cantidad_anterior_ubica
     return msg
 
 
+def bloquear_lote_ubicaciones(lote_ubicacion_ids):
+    """
+    LoteUbicacion (con lote y ubicación) bloqueadas con un solo
+    ``SELECT ... FOR UPDATE WHERE id IN (...) ORDER BY id``.
+
+    El orden fijo por id evita interbloqueos entre surtidos concurrentes que
+    comparten ubicaciones.
+    """
+    return list(
+        LoteUbicacion.objects.select_for_update()
+        .select_related('lote', 'ubicacion')
+        .filter(pk__in=list(lote_ubicacion_ids))
+        .order_by('pk')
+    )
+
+
+def sincronizar_totales_lotes(lote_ids):
+    """
+    Recalcula ``cantidad_disponible`` y ``cantidad_reservada`` de los lotes como la suma de
+    sus ubicaciones, en un solo UPDATE (equivale a ``sincronizar_cantidad_disponible`` por lote).
+    """
+    if not lote_ids:
+        return 0
+
+    def suma(campo):
+        return Coalesce(Subquery(
+            LoteUbicacion.objects.filter(lote_id=OuterRef('pk'))
+            .order_by()
+            .values('lote_id')
+            .annotate(t=Sum(campo))
+            .values('t')
+        ), 0)
+
+    return Lote.objects.filter(pk__in=list(lote_ids)).update(
+        cantidad_disponible=suma('cantidad'), cantidad_reservada=suma('cantidad_reservada')
+    )
+
+
 def generar_movimientos_suministro(propuesta_id, usuario):
     """
     Genera movimientos de inventario cuando una propuesta se va a marcar como SURTIDA.
@@ -65,6 +105,10 @@ def generar_movimientos_suministro(propuesta_id, usuario):
     Agrupa por (item, lote_ubicacion) para deducir una sola vez por ubicación y evitar
     doble descuento si hubiera LoteAsignado duplicados.
 
+    Todo en bloque: bloquea las ubicaciones afectadas en una consulta ordenada, calcula las
+    cantidades nuevas en memoria y escribe con bulk_update / bulk_create; los totales de los
+    lotes se recalculan en un solo UPDATE (~10 sentencias sin importar el número de líneas).
+
     Args:
         propuesta_id: UUID de la propuesta
         usuario: Usuario que realizó el surtimiento
@@ -77,7 +121,6 @@ def generar_movimientos_suministro(propuesta_id, usuario):
         propuesta = PropuestaPedido.objects.select_related(
             'solicitud__institucion_solicitante',
         ).get(id=propuesta_id)
-        movimientos_creados = 0
         sol = propuesta.solicitud
         folio_pedido = _folio_pedido_desde_solicitud(sol) or (sol.folio or '')
         destino_txt = _texto_destino_solicitud(sol)
@@ -86,38 +129,47 @@ def generar_movimientos_suministro(propuesta_id, usuario):
         )
 
         with transaction.atomic():
+            asignaciones = list(
+                LoteAsignado.objects.filter(item_propuesta__propuesta=propuesta)
+                .order_by()
+                .values_list('item_propuesta_id', 'lote_ubicacion_id', 'cantidad_asignada',
+                             'item_propuesta__producto__clave_cnis')
+            )
+
             # Detectar asignaciones duplicadas (mismo item + misma lote_ubicacion): provocan doble descuento
-            for item in propuesta.items.all():
-                seen = set()
-                for la in item.lotes_asignados.select_related('lote_ubicacion').all():
-                    key = (item.id, la.lote_ubicacion_id)
-                    if key in seen:
-                        return {
-                            'exito': False,
-                            'mensaje': (
-                                f"La propuesta tiene asignaciones duplicadas del mismo lote/ubicación "
-                                f"(producto {item.producto.clave_cnis}). Edite la propuesta, elimine la fila duplicada "
-                                f"del lote en «Lotes Asignados» y guarde de nuevo antes de surtir."
-                            )
-                        }
-                    seen.add(key)
-
-            # Total a descontar por lote_ubicacion (toda la propuesta), orden fijo para select_for_update
-            por_lu_id = defaultdict(int)
-            for item in propuesta.items.all():
-                for la in item.lotes_asignados.all():
-                    if la.cantidad_asignada and la.cantidad_asignada > 0:
-                        por_lu_id[la.lote_ubicacion_id] += la.cantidad_asignada
+            seen = set()
+            for item_id, lu_id, _, clave_cnis in asignaciones:
+                key = (item_id, lu_id)
+                if key in seen:
+                    return {
+                        'exito': False,
+                        'mensaje': (
+                            f"La propuesta tiene asignaciones duplicadas del mismo lote/ubicación "
+                            f"(producto {clave_cnis}). Edite la propuesta, elimine la fila duplicada "
+                            f"del lote en «Lotes Asignados» y guarde de nuevo antes de surtir."
+                        )
+                    }
+                seen.add(key)
 
-            for lu_id in sorted(por_lu_id.keys()):
-                cantidad_surtida = por_lu_id[lu_id]
-                if cantidad_surtida <= 0:
-                    continue
-                lote_ubicacion = (
-                    LoteUbicacion.objects.select_for_update()
-                    .select_related('lote', 'ubicacion')
-                    .get(pk=lu_id)
-                )
+            # Total a descontar por lote_ubicacion (toda la propuesta)
+            por_lu_id = defaultdict(int)
+            for _, lu_id, cantidad, _ in asignaciones:
+                if cantidad and cantidad > 0:
+                    por_lu_id[lu_id] += cantidad
+
+            ubicaciones = bloquear_lote_ubicaciones(por_lu_id)
+            # Existencia de cada lote (suma de sus ubicaciones) antes del surtido, en una consulta
+            existencia_lote = dict(
+                LoteUbicacion.objects.filter(lote_id__in={lu.lote_id for lu in ubicaciones})
+                .order_by()
+                .values('lote_id')
+                .annotate(t=Sum('cantidad'))
+                .values_list('lote_id', 't')
+            )
+
+            movimientos = []
+            for lote_ubicacion in ubicaciones:
+                cantidad_surtida = por_lu_id[lote_ubicacion.pk]
                 lote = lote_ubicacion.lote
                 cantidad_anterior_ubicacion = lote_ubicacion.cantidad
                 cantidad_nueva_ubicacion = cantidad_anterior_ubicacion - cantidad_surtida
@@ -130,9 +182,7 @@ def generar_movimientos_suministro(propuesta_id, usuario):
                         )
                     )
 
-                cantidad_anterior_lote = (
-                    LoteUbicacion.objects.filter(lote=lote).aggregate(t=Sum('cantidad'))['t'] or 0
-                )
+                cantidad_anterior_lote = existencia_lote.get(lote.pk) or 0
                 cantidad_nueva_lote = cantidad_anterior_lote - cantidad_surtida
 
                 if cantidad_nueva_lote < 0:
@@ -140,12 +190,13 @@ def generar_movimientos_suministro(propuesta_id, usuario):
                         f"Cantidad insuficiente en lote {lote.numero_lote} (total en ubicaciones). "
                         f"Disponible: {cantidad_anterior_lote}, Solicitado: {cantidad_surtida}"
                     )
+                existencia_lote[lote.pk] = cantidad_nueva_lote
 
                 logger.info(
                     f"Movimiento surtido lote {lote.numero_lote} ubic {lote_ubicacion.ubicacion.codigo}: "
                     f"{cantidad_surtida} u (exist. ubic antes {cantidad_anterior_ubicacion})"
                 )
-                MovimientoInventario.objects.create(
+                movimientos.append(MovimientoInventario(
                     lote=lote,
                     tipo_movimiento='SALIDA',
                     cantidad=cantidad_surtida,
@@ -157,25 +208,18 @@ def generar_movimientos_suministro(propuesta_id, usuario):
                     folio=folio_pedido[:255],
                     institucion_destino=sol.institucion_solicitante,
                     usuario=usuario,
-                )
+                ))
 
                 lote_ubicacion.cantidad = cantidad_nueva_ubicacion
                 lote_ubicacion.cantidad_reservada = max(
                     0, lote_ubicacion.cantidad_reservada - cantidad_surtida
                 )
-                lote_ubicacion.save(update_fields=['cantidad', 'cantidad_reservada'])
 
-                tot_cant = (
-                    LoteUbicacion.objects.filter(lote=lote).aggregate(t=Sum('cantidad'))['t'] or 0
-                )
-                tot_res = (
-                    LoteUbicacion.objects.filter(lote=lote).aggregate(t=Sum('cantidad_reservada'))['t']
-                    or 0
-                )
-                Lote.objects.filter(pk=lote.pk).update(
-                    cantidad_disponible=tot_cant, cantidad_reservada=tot_res
-                )
-                movimientos_creados += 1
+            LoteUbicacion.objects.bulk_update(ubicaciones, ['cantidad', 'cantidad_reservada'], batch_size=500)
+            MovimientoInventario.objects.bulk_create(movimientos, batch_size=500)
+            sincronizar_totales_lotes({lu.lote_id for lu in ubicaciones})
+            invalidar_dashboard()
+            movimientos_creados = len(movimientos)
 
         return {
             'exito': True,
@@ -209,7 +253,6 @@ def revertir_movimientos_suministro(propuesta_id, usuario):
     Después de esto se pueden aplicar cambios en la propuesta y volver a llamar
     a generar_movimientos_suministro para que el inventario quede alineado.
     """
-    from .pedidos_models import LoteAsignado
     try:
         logger.info(f"Revirtiendo movimientos de suministro para propuesta {propuesta_id}")
         propuesta = PropuestaPedido.objects.select_related(
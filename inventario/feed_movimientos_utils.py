@@ -0,0 +1,198 @@
+"""
+Feed de actividad diaria (dashboard de movimientos) como ``UNION ALL`` en la BD.
+
+``dashboard_movimientos`` traía del día todos los MovimientoInventario, asignaciones de
+LoteUbicacion, órdenes de suministro y citas, armaba un dict por fila y ordenaba, paginaba
+y contaba en Python; en días de conteos masivos o surtidos grandes eran decenas de miles
+de objetos por carga. Aquí cada fuente es una proyección normalizada con las mismas
+columnas (``COLUMNAS``) y el feed es su ``UNION ALL``: el orden y el LIMIT/OFFSET de la
+página, el total y los conteos agrupados se resuelven en SQL.
+
+Las columnas se anotan con prefijo ``feed_`` (algunas chocan con campos de los modelos)
+y en el mismo orden en cada rama, que es lo que exige el UNION.
+"""
+
+from django.db.models import Case, CharField, Count, F, IntegerField, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, NullIf, Substr, Trim
+
+from .models import CitaProveedor, LoteUbicacion, MovimientoInventario, OrdenSuministro
+
+COLUMNAS = (
+    'tipo', 'subtipo', 'tipo_movimiento', 'fecha', 'producto', 'descripcion_producto', 'lote',
+    'cantidad', 'institucion', 'usuario', 'motivo', 'folio', 'id',
+)
+TIPO_MOVIMIENTO = 'Movimiento de Inventario'
+TIPO_ASIGNACION = 'Asignación de Ubicación'
+TIPO_ORDEN = 'Orden de Suministro'
+TIPO_CITA = 'Cita con Proveedor'
+SIN_DATO = '-'
+
+
+def _texto(valor):
+    return Value(valor, output_field=CharField())
+
+
+def _display(campo, choices):
+    """Equivalente en SQL de ``get_<campo>_display()``."""
+    return Case(
+        *[When(**{campo: valor}, then=_texto(str(etiqueta))) for valor, etiqueta in choices],
+        default=Cast(campo, CharField()),
+        output_field=CharField(),
+    )
+
+
+def _nombre_usuario(prefijo):
+    """``get_full_name() or username`` del usuario en ``prefijo`` ('-' si no hay usuario)."""
+    completo = Trim(Concat(f'{prefijo}__first_name', _texto(' '), f'{prefijo}__last_name', output_field=CharField()))
+    return Coalesce(NullIf(completo, _texto('')), f'{prefijo}__username', _texto(SIN_DATO), output_field=CharField())
+
+
+def _clave(prefijo):
+    return Concat(_texto(prefijo), Cast('pk', CharField()), output_field=CharField())
+
+
+def _proyeccion(queryset, **columnas):
+    """Rama del feed: anota todas las COLUMNAS (en orden) y selecciona solo esas."""
+    faltantes = set(COLUMNAS) - set(columnas)
+    if faltantes:
+        raise ValueError(f'Faltan columnas en la proyección: {sorted(faltantes)}')
+    return queryset.order_by().annotate(
+        **{f'feed_{nombre}': columnas[nombre] for nombre in COLUMNAS}
+    ).values(*[f'feed_{nombre}' for nombre in COLUMNAS])
+
+
+def ramas_feed(inicio, fin, usuario_id=None, institucion_id=None):
+    """
+    Proyecciones de cada fuente para [inicio, fin). Los filtros de usuario e institución
+    aplican, como antes, a movimientos y asignaciones (órdenes y citas no los tienen).
+    """
+    movimientos = MovimientoInventario.objects.filter(
+        fecha_movimiento__gte=inicio, fecha_movimiento__lt=fin, anulado=False,
+    )
+    asignaciones = LoteUbicacion.objects.filter(fecha_asignacion__gte=inicio, fecha_asignacion__lt=fin)
+    if usuario_id:
+        movimientos = movimientos.filter(usuario_id=usuario_id)
+        asignaciones = asignaciones.filter(usuario_asignacion_id=usuario_id)
+    if institucion_id:
+        movimientos = movimientos.filter(lote__institucion_id=institucion_id)
+        asignaciones = asignaciones.filter(lote__institucion_id=institucion_id)
+
+    sin_cantidad = Value(None, output_field=IntegerField())
+    return [
+        _proyeccion(
+            movimientos,
+            tipo=_texto(TIPO_MOVIMIENTO),
+            subtipo=_display('tipo_movimiento', MovimientoInventario._meta.get_field('tipo_movimiento').choices),
+            tipo_movimiento=Cast('tipo_movimiento', CharField()),
+            fecha=F('fecha_movimiento'),
+            producto=Coalesce('lote__producto__clave_cnis', _texto(SIN_DATO)),
+            descripcion_producto=Coalesce(Substr('lote__producto__descripcion', 1, 50), _texto(SIN_DATO)),
+            lote=Cast('lote__numero_lote', CharField()),
+            cantidad=Cast('cantidad', IntegerField()),
+            institucion=Coalesce('lote__institucion__denominacion', _texto(SIN_DATO)),
+            usuario=_nombre_usuario('usuario'),
+            motivo=Substr('motivo', 1, 100),
+            folio=Coalesce(NullIf('folio', _texto('')), _texto(SIN_DATO)),
+            id=_clave('mov_'),
+        ),
+        _proyeccion(
+            asignaciones,
+            tipo=_texto(TIPO_ASIGNACION),
+            subtipo=_texto('Asignación'),
+            tipo_movimiento=_texto(''),
+            fecha=F('fecha_asignacion'),
+            producto=Coalesce('lote__producto__clave_cnis', _texto(SIN_DATO)),
+            descripcion_producto=Coalesce(Substr('lote__producto__descripcion', 1, 50), _texto(SIN_DATO)),
+            lote=Cast('lote__numero_lote', CharField()),
+            cantidad=Cast('cantidad', IntegerField()),
+            institucion=Coalesce('lote__institucion__denominacion', _texto(SIN_DATO)),
+            usuario=_nombre_usuario('usuario_asignacion'),
+            motivo=Concat(_texto('Ubicación: '), 'ubicacion__codigo', output_field=CharField()),
+            folio=Cast('lote__numero_lote', CharField()),
+            id=_clave('asig_'),
+        ),
+        _proyeccion(
+            OrdenSuministro.objects.filter(fecha_creacion__gte=inicio, fecha_creacion__lt=fin),
+            tipo=_texto(TIPO_ORDEN),
+            subtipo=_texto('Creación'),
+            tipo_movimiento=_texto(''),
+            fecha=F('fecha_creacion'),
+            producto=_texto(SIN_DATO),
+            descripcion_producto=Concat(
+                _texto('Proveedor: '), Coalesce('proveedor__razon_social', _texto(SIN_DATO)),
+                output_field=CharField(),
+            ),
+            lote=_texto(SIN_DATO),
+            cantidad=sin_cantidad,
+            institucion=_texto(SIN_DATO),
+            usuario=_texto(SIN_DATO),
+            motivo=Concat(_texto('Orden: '), 'numero_orden', output_field=CharField()),
+            folio=Cast('numero_orden', CharField()),
+            id=_clave('orden_'),
+        ),
+        _proyeccion(
+            CitaProveedor.objects.filter(fecha_creacion__gte=inicio, fecha_creacion__lt=fin),
+            tipo=_texto(TIPO_CITA),
+            subtipo=_display('estado', CitaProveedor._meta.get_field('estado').choices),
+            tipo_movimiento=_texto(''),
+            fecha=F('fecha_creacion'),
+            producto=_texto(SIN_DATO),
+            descripcion_producto=Concat(
+                _texto('Proveedor: '), Coalesce('proveedor__razon_social', _texto(SIN_DATO)),
+                output_field=CharField(),
+            ),
+            lote=_texto(SIN_DATO),
+            cantidad=sin_cantidad,
+            institucion=_texto(SIN_DATO),
+            usuario=_nombre_usuario('usuario_creacion'),
+            motivo=Concat(_texto('Almacén: '), 'almacen__nombre', output_field=CharField()),
+            folio=Concat(_texto('Cita '), Cast('pk', CharField()), output_field=CharField()),
+            id=_clave('cita_'),
+        ),
+    ]
+
+
+class FeedMovimientos:
+    """
+    Feed paginable: ``count()`` y el slicing de Paginator se traducen a
+    ``SELECT COUNT(*) FROM (... UNION ALL ...)`` y ``ORDER BY fecha DESC LIMIT/OFFSET``.
+    Cada fila se entrega como dict con las claves de COLUMNAS.
+    """
+
+    def __init__(self, inicio, fin, usuario_id=None, institucion_id=None):
+        self.ramas = ramas_feed(inicio, fin, usuario_id=usuario_id, institucion_id=institucion_id)
+        primera, *resto = self.ramas
+        self.union = primera.union(*resto, all=True).order_by('-feed_fecha', '-feed_id')
+
+    def count(self):
+        return self.union.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, indice):
+        filas = self.union[indice]
+        if isinstance(indice, slice):
+            return [self._fila(f) for f in filas]
+        return self._fila(filas)
+
+    @staticmethod
+    def _fila(fila):
+        return {nombre: fila[f'feed_{nombre}'] for nombre in COLUMNAS}
+
+    def conteos(self, *columnas):
+        """
+        [(valores de ``columnas``..., n)] agrupando cada rama en la BD (un solo UNION ALL de
+        los GROUP BY); los grupos repetidos entre ramas se suman aquí. Una rama agrupada solo
+        por constantes queda sin GROUP BY y devuelve una fila con 0 aunque esté vacía: se omite.
+        """
+        campos = [f'feed_{c}' for c in columnas]
+        agrupadas = [rama.values(*campos).annotate(feed_n=Count('*')).values(*campos, 'feed_n') for rama in self.ramas]
+        primera, *resto = agrupadas
+        totales = {}
+        for fila in primera.union(*resto, all=True):
+            if not fila['feed_n']:
+                continue
+            clave = tuple(fila[c] for c in campos)
+            totales[clave] = totales.get(clave, 0) + fila['feed_n']
+        return [(*clave, n) for clave, n in totales.items()]
@@ -5,10 +5,13 @@ Presenta movimientos en orden cronológico con saldo inicial, entradas, salidas
 y saldo acumulado (usa ``cantidad_nueva`` del sistema como saldo autoritativo).
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from django.db.models import IntegerField, Value
 
 from .comparativo_inventario_utils import signo_movimiento
 from .models import Lote, MovimientoInventario
+from .saldos_cierre_utils import existencia_en_fecha, fin_dia, inicio_dia
 
 
 def _parse_fecha(s):
@@ -30,18 +33,20 @@ def saldo_inicial_lote(lote, fecha_desde):
     if not fecha_desde:
         return 0
 
-    ultimo = (
-        MovimientoInventario.objects.filter(
-            lote_id=lote.id,
-            anulado=False,
-            fecha_movimiento__date__lt=fecha_desde,
+    # Saldo al cierre del día anterior: snapshot diario + cola de movimientos recientes.
+    saldo = (
+        Lote.objects.filter(pk=lote.pk)
+        .annotate(
+            saldo_previo=existencia_en_fecha(
+                fecha_desde - timedelta(days=1),
+                Value(None, output_field=IntegerField()),
+            )
         )
-        .exclude(tipo_movimiento='AJUSTE_DATOS_LOTE')
-        .order_by('-fecha_movimiento', '-id')
+        .values_list('saldo_previo', flat=True)
         .first()
     )
-    if ultimo is not None:
-        return int(ultimo.cantidad_nueva)
+    if saldo is not None:
+        return int(saldo)
 
     if lote.fecha_recepcion and lote.fecha_recepcion < fecha_desde:
         return int(lote.cantidad_inicial or 0)
@@ -89,9 +94,9 @@ def construir_kardex_lote(lote, fecha_desde=None, fecha_hasta=None, incluir_anul
     movs = movs.exclude(tipo_movimiento='AJUSTE_DATOS_LOTE')
 
     if fecha_desde:
-        movs = movs.filter(fecha_movimiento__date__gte=fecha_desde)
+        movs = movs.filter(fecha_movimiento__gte=inicio_dia(fecha_desde))
     if fecha_hasta:
-        movs = movs.filter(fecha_movimiento__date__lte=fecha_hasta)
+        movs = movs.filter(fecha_movimiento__lt=fin_dia(fecha_hasta))
 
     movs = list(movs.order_by('fecha_movimiento', 'id'))
 
@@ -0,0 +1,343 @@
+"""
+Servicio de conversión a PDF con instancias de LibreOffice residentes.
+
+``excel_to_pdf.convertir_excel_a_pdf`` lanzaba un ``libreoffice --headless --convert-to pdf``
+en frío por cada solicitud: varios segundos de arranque, archivos temporales de entrada y
+salida, y dos conversiones simultáneas chocaban en el mismo perfil de usuario. Aquí cada
+proceso mantiene un pool pequeño de ``soffice`` headless ya iniciados:
+
+- Cada instancia escucha en su propio socket UNO (puerto libre en 127.0.0.1) y usa su propio
+  perfil (``-env:UserInstallation``), así que pueden convertir en paralelo.
+- Las instancias se crean bajo demanda hasta ``LIBREOFFICE_POOL_TAMANO``. Si todas están
+  ocupadas, la conversión espera (Condition) hasta ``LIBREOFFICE_ESPERA_INSTANCIA`` segundos
+  a que se devuelva una o se libere cupo.
+- Chequeo de salud al tomar y al devolver una instancia (proceso vivo y el escritorio UNO
+  responde); una instancia caída o con error se descarta y se arranca otra.
+- Reciclaje tras ``LIBREOFFICE_POOL_MAX_TRABAJOS`` conversiones (LibreOffice acumula memoria).
+- Sin archivos temporales: el documento entra y sale por streams UNO (``private:stream``).
+- ``LIBREOFFICE_TIMEOUT``: si una conversión se cuelga, un temporizador mata la instancia.
+
+Requiere el módulo ``uno`` (python3-uno / el Python de LibreOffice). Sin él, o con
+``LIBREOFFICE_POOL_TAMANO = 0``, se usa la conversión por línea de comandos de siempre,
+con un perfil temporal propio para no chocar con otras conversiones.
+"""
+
+import atexit
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import uno
+    import unohelper
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.io import XOutputStream
+except ImportError:  # LibreOffice sin binding de Python: solo conversión en frío
+    uno = None
+
+logger = logging.getLogger(__name__)
+
+BINARIO = getattr(settings, 'LIBREOFFICE_BINARIO', 'libreoffice')
+TAMANO_POOL = getattr(settings, 'LIBREOFFICE_POOL_TAMANO', 2)
+MAX_TRABAJOS = getattr(settings, 'LIBREOFFICE_POOL_MAX_TRABAJOS', 200)
+TIMEOUT = getattr(settings, 'LIBREOFFICE_TIMEOUT', 30)
+TIMEOUT_ARRANQUE = getattr(settings, 'LIBREOFFICE_TIMEOUT_ARRANQUE', 20)
+ESPERA_INSTANCIA = getattr(settings, 'LIBREOFFICE_ESPERA_INSTANCIA', 30)
+
+FILTRO_PDF_CALC = 'calc_pdf_Export'
+
+
+class ErrorConversionPDF(Exception):
+    """La conversión a PDF falló (LibreOffice no disponible, error o tiempo agotado)."""
+
+
+def _puerto_libre():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _propiedades(**valores):
+    return tuple(PropertyValue(Name=nombre, Value=valor) for nombre, valor in valores.items())
+
+
+if uno is not None:
+    class _SalidaEnMemoria(unohelper.Base, XOutputStream):
+        """XOutputStream que acumula en memoria lo que escribe ``storeToURL``."""
+
+        def __init__(self):
+            self.buffer = BytesIO()
+
+        def writeBytes(self, datos):
+            self.buffer.write(datos.value)
+
+        def flush(self):
+            pass
+
+        def closeOutput(self):
+            pass
+
+
+class InstanciaSoffice:
+    """Un ``soffice`` headless con su socket UNO y su perfil."""
+
+    def __init__(self):
+        self.puerto = _puerto_libre()
+        self.perfil = tempfile.mkdtemp(prefix='soffice-perfil-')
+        self.trabajos = 0
+        self.timeout = TIMEOUT
+        self.proceso = subprocess.Popen(
+            [
+                BINARIO,
+                '--headless', '--invisible', '--nologo', '--nodefault', '--norestore', '--nolockcheck',
+                f'-env:UserInstallation={Path(self.perfil).as_uri()}',
+                f'--accept=socket,host=127.0.0.1,port={self.puerto};urp;StarOffice.ComponentContext',
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.contexto, self.escritorio = self._conectar()
+        except Exception:
+            self.detener()
+            raise
+
+    def _conectar(self):
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        url = f'uno:socket,host=127.0.0.1,port={self.puerto};urp;StarOffice.ComponentContext'
+        limite = time.monotonic() + TIMEOUT_ARRANQUE
+        while True:
+            if self.proceso.poll() is not None:
+                raise ErrorConversionPDF(f'soffice terminó al iniciar (código {self.proceso.returncode})')
+            try:
+                contexto = resolver.resolve(url)
+                break
+            except Exception:
+                if time.monotonic() > limite:
+                    raise ErrorConversionPDF('soffice no respondió en el socket UNO a tiempo')
+                time.sleep(0.25)
+        escritorio = contexto.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', contexto)
+        return contexto, escritorio
+
+    def sana(self):
+        """Proceso vivo y el escritorio responde por UNO."""
+        if self.proceso.poll() is not None:
+            return False
+        try:
+            self.escritorio.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def convertir(self, datos, filtro=FILTRO_PDF_CALC):
+        """Convierte ``datos`` (bytes del documento) a PDF por streams UNO; devuelve bytes."""
+        entrada = self.contexto.ServiceManager.createInstanceWithContext(
+            'com.sun.star.io.SequenceInputStream', self.contexto
+        )
+        entrada.initialize((uno.ByteSequence(datos),))
+        salida = _SalidaEnMemoria()
+
+        # Una conversión colgada bloquea la llamada UNO: matar el proceso la libera con error.
+        vigilante = threading.Timer(self.timeout, self.proceso.kill)
+        vigilante.start()
+        documento = None
+        try:
+            documento = self.escritorio.loadComponentFromURL(
+                'private:stream', '_blank', 0, _propiedades(InputStream=entrada, Hidden=True, ReadOnly=True)
+            )
+            if documento is None:
+                raise ErrorConversionPDF('LibreOffice no pudo abrir el documento')
+            documento.storeToURL('private:stream', _propiedades(FilterName=filtro, OutputStream=salida))
+        except ErrorConversionPDF:
+            raise
+        except Exception as e:
+            if self.proceso.poll() is not None:
+                raise ErrorConversionPDF(f'La conversión a PDF excedió {self.timeout} s') from e
+            raise ErrorConversionPDF(f'Error en LibreOffice: {e}') from e
+        finally:
+            vigilante.cancel()
+            if documento is not None:
+                try:
+                    documento.close(True)
+                except Exception:
+                    pass
+        self.trabajos += 1
+        return salida.buffer.getvalue()
+
+    def detener(self):
+        try:
+            if self.proceso.poll() is None:
+                try:
+                    self.escritorio.terminate()
+                except Exception:
+                    pass
+                try:
+                    self.proceso.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.proceso.kill()
+                    self.proceso.wait()
+        except Exception:
+            logger.exception('Error al detener soffice (puerto %s)', self.puerto)
+        finally:
+            shutil.rmtree(self.perfil, ignore_errors=True)
+
+
+class PoolLibreOffice:
+    """
+    Pool por proceso de InstanciaSoffice. Las instancias libres y el cupo (``creadas``) se
+    guardan bajo una Condition: devolver o descartar una instancia despierta a quien espera,
+    que toma la libre o arranca una nueva en el cupo liberado.
+    """
+
+    def __init__(self, tamano=TAMANO_POOL, max_trabajos=MAX_TRABAJOS, espera=ESPERA_INSTANCIA,
+                 fabrica=InstanciaSoffice):
+        self.tamano = tamano
+        self.max_trabajos = max_trabajos
+        self.espera = espera
+        self.fabrica = fabrica
+        self._condicion = threading.Condition()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._pid = os.getpid()
+        self._libres = []
+        self._creadas = 0
+
+    def _asegurar_proceso(self):
+        # Tras un fork (workers de gunicorn) las instancias del padre no son de este proceso.
+        if self._pid != os.getpid():
+            with self._condicion:
+                if self._pid != os.getpid():
+                    self._reiniciar()
+
+    def _liberar_cupo(self):
+        with self._condicion:
+            self._creadas -= 1
+            self._condicion.notify()
+
+    def _descartar(self, instancia):
+        instancia.detener()
+        self._liberar_cupo()
+
+    def _reservar(self, limite):
+        """Instancia libre, o None si hay cupo para arrancar una (ya contado en ``creadas``)."""
+        with self._condicion:
+            while True:
+                if self._libres:
+                    return self._libres.pop()
+                if self._creadas < self.tamano:
+                    self._creadas += 1
+                    return None
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise ErrorConversionPDF('No hay instancias de LibreOffice libres')
+                self._condicion.wait(restante)
+
+    def _tomar(self):
+        limite = time.monotonic() + self.espera
+        while True:
+            instancia = self._reservar(limite)
+            if instancia is None:
+                try:
+                    return self.fabrica()
+                except Exception:
+                    self._liberar_cupo()
+                    raise
+            if instancia.sana():
+                return instancia
+            logger.warning('soffice (puerto %s) no responde; se reemplaza', instancia.puerto)
+            self._descartar(instancia)
+
+    def _devolver(self, instancia):
+        if instancia.trabajos >= self.max_trabajos or not instancia.sana():
+            self._descartar(instancia)
+            return
+        with self._condicion:
+            self._libres.append(instancia)
+            self._condicion.notify()
+
+    def convertir(self, datos, filtro=FILTRO_PDF_CALC):
+        self._asegurar_proceso()
+        instancia = self._tomar()
+        try:
+            pdf = instancia.convertir(datos, filtro)
+        except Exception:
+            self._descartar(instancia)
+            raise
+        self._devolver(instancia)
+        return pdf
+
+    def estado(self):
+        """Instancias creadas y libres en este proceso (para monitoreo)."""
+        with self._condicion:
+            return {'pid': self._pid, 'creadas': self._creadas, 'libres': len(self._libres), 'tamano': self.tamano}
+
+    def cerrar(self):
+        if self._pid != os.getpid():
+            return
+        with self._condicion:
+            libres, self._libres = self._libres, []
+        for instancia in libres:
+            self._descartar(instancia)
+
+
+pool = PoolLibreOffice()
+atexit.register(pool.cerrar)
+
+
+def _convertir_en_frio(datos, extension='.xlsx'):
+    """``--convert-to pdf`` de línea de comandos, con perfil y directorio temporales propios."""
+    directorio = tempfile.mkdtemp(prefix='soffice-conversion-')
+    try:
+        origen = os.path.join(directorio, f'documento{extension}')
+        with open(origen, 'wb') as f:
+            f.write(datos)
+        perfil = Path(directorio, 'perfil').as_uri()
+        try:
+            subprocess.run(
+                [
+                    BINARIO, '--headless', f'-env:UserInstallation={perfil}',
+                    '--convert-to', 'pdf', '--outdir', directorio, origen,
+                ],
+                check=True,
+                capture_output=True,
+                timeout=TIMEOUT,
+            )
+        except subprocess.TimeoutExpired:
+            raise ErrorConversionPDF('La conversión a PDF tardó demasiado tiempo') from None
+        except subprocess.CalledProcessError as e:
+            raise ErrorConversionPDF(f'Error en LibreOffice: {e.stderr.decode(errors="replace")}') from None
+        except FileNotFoundError:
+            raise ErrorConversionPDF(f'LibreOffice no está instalado ({BINARIO})') from None
+        with open(os.path.join(directorio, 'documento.pdf'), 'rb') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def pool_disponible():
+    """Hay binding UNO, binario de LibreOffice y ``LIBREOFFICE_POOL_TAMANO`` > 0."""
+    return uno is not None and pool.tamano > 0 and shutil.which(BINARIO) is not None
+
+
+def convertir_a_pdf(datos, filtro=FILTRO_PDF_CALC, extension='.xlsx'):
+    """
+    Convierte los bytes de un documento (por defecto una hoja de cálculo) a PDF.
+    Usa el pool si ``pool_disponible()``; si no, la línea de comandos en frío.
+
+    Raises:
+        ErrorConversionPDF
+    """
+    if pool_disponible():
+        return pool.convertir(datos, filtro)
+    return _convertir_en_frio(datos, extension)
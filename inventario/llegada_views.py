@@ -19,6 +19,7 @@ from io import BytesIO
 import os
 from django.conf import settings
 from .access_control import requiere_rol, usuario_tiene_rol
+from .trabajos_utils import en_segundo_plano
 
 from .llegada_models import LlegadaProveedor, ItemLlegada, DocumentoLlegada
 
@@ -389,6 +390,7 @@ def _totales_piezas_emitidas_recibidas_reporte(llegada):
     return total_emitidas, total_recibidas
 
 
+@en_segundo_plano('Exportación de llegadas a Excel')
 def exportar_llegadas_excel(request):
     """Exporta la lista de llegadas a Excel con campos de cita y llegada"""
     
@@ -1449,11 +1451,19 @@ class SubirDocumentoView(LoginRequiredMixin, View):
 # API para obtener productos en formato JSON
 @require_GET
 def api_productos(request):
-    """API que devuelve los productos disponibles en formato JSON"""
+    """
+    API que devuelve los productos disponibles en formato JSON.
+    Parámetro GET opcional: q (búsqueda por clave o descripción, máx. 50 por relevancia).
+    """
     from django.apps import apps
+    from .busqueda_utils import buscar
     Producto = apps.get_model('inventario', 'Producto')
     
-    productos = Producto.objects.all().order_by('descripcion')
+    termino = request.GET.get('q', '').strip()
+    if termino:
+        productos = buscar('producto', termino, limite=50)
+    else:
+        productos = Producto.objects.all().order_by('descripcion')
     data = []
     for producto in productos:
         data.append({
@@ -0,0 +1,255 @@
+"""
+Escritura diferida (write-behind) de LogSistema.
+
+``LogSistema.crear_log`` ya no inserta dentro del request: encola la entrada y un hilo de
+fondo la guarda con ``bulk_create`` cuando se juntan ``LOG_SISTEMA_LOTE`` entradas o pasan
+``LOG_SISTEMA_INTERVALO`` segundos. Así la latencia del request no depende de la BD de logs,
+y una tormenta de errores (p. ej. la BD caída) no suma escrituras sobre la misma BD:
+
+- Contrapresión: la cola es acotada (``LOG_SISTEMA_MAX_COLA``); si se llena, las entradas
+  nuevas se descartan y se cuentan, nunca se bloquea al request.
+- Deduplicación: un ERROR o CRITICAL idéntico (nivel, tipo, título, mensaje, usuario, url)
+  dentro de ``LOG_SISTEMA_VENTANA_DEDUP`` segundos se guarda una vez; al cerrar la ventana
+  se agrega una entrada resumen con el número de repeticiones. Los demás niveles no se
+  deduplican.
+- Respaldo: si el ``bulk_create`` falla, el lote se escribe como JSON por línea en
+  ``LOG_SISTEMA_ARCHIVO_RESPALDO``; ``manage.py reimportar_logs_respaldo`` lo sube después.
+
+Con ``LOG_SISTEMA_ASINCRONO = False`` (pruebas) cada entrada se guarda al momento, junto con
+los resúmenes de las ventanas que ya cerraron.
+``fecha_creacion`` es la del guardado; la hora del evento va en ``detalles['registrado_en']``.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+LOTE = getattr(settings, 'LOG_SISTEMA_LOTE', 200)
+INTERVALO = getattr(settings, 'LOG_SISTEMA_INTERVALO', 2.0)
+MAX_COLA = getattr(settings, 'LOG_SISTEMA_MAX_COLA', 5000)
+VENTANA_DEDUP = getattr(settings, 'LOG_SISTEMA_VENTANA_DEDUP', 60)
+ASINCRONO = getattr(settings, 'LOG_SISTEMA_ASINCRONO', True)
+NIVELES_DEDUP = ('ERROR', 'CRITICAL')
+ARCHIVO_RESPALDO = Path(
+    getattr(settings, 'LOG_SISTEMA_ARCHIVO_RESPALDO', settings.BASE_DIR / 'logs' / 'log_sistema_respaldo.jsonl')
+)
+
+CAMPOS = ('nivel', 'tipo', 'titulo', 'mensaje', 'usuario_id', 'url', 'ip_cliente', 'user_agent', 'detalles')
+
+
+class BufferLogSistema:
+    """Cola acotada de entradas de LogSistema con un hilo que las guarda por lotes."""
+
+    def __init__(self):
+        self._cola = queue.Queue(maxsize=MAX_COLA)
+        self._vistos = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+        self.descartados = 0
+
+    # -- Entrada -----------------------------------------------------------
+
+    def registrar(self, entrada):
+        """Encola una entrada (dict con CAMPOS). Nunca bloquea ni lanza excepción."""
+        if not ASINCRONO:
+            # Sin hilo de fondo: las ventanas vencidas se cierran aquí, antes de comparar la
+            # entrada, para no perder su resumen ni dejar crecer _vistos.
+            pendientes = self._resumenes_vencidos()
+            if not self._repetida(entrada):
+                pendientes.append(entrada)
+            if pendientes:
+                self._guardar(pendientes)
+            return
+        if self._repetida(entrada):
+            return
+        self._asegurar_hilo()
+        self._poner(entrada)
+
+    def _repetida(self, entrada):
+        """True si es un error ya visto dentro de su ventana; solo se cuenta la repetición."""
+        if entrada['nivel'] not in NIVELES_DEDUP:
+            return False
+        clave = (
+            entrada['nivel'], entrada['tipo'], entrada['titulo'], (entrada['mensaje'] or '')[:500],
+            entrada['usuario_id'], entrada['url'],
+        )
+        ahora = time.monotonic()
+        with self._lock:
+            visto = self._vistos.get(clave)
+            if visto and visto['expira'] > ahora:
+                visto['repeticiones'] += 1
+                return True
+            self._vistos[clave] = {'expira': ahora + VENTANA_DEDUP, 'repeticiones': 0, 'entrada': entrada}
+        return False
+
+    def _poner(self, entrada):
+        try:
+            self._cola.put_nowait(entrada)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+                descartados = self.descartados
+            if descartados == 1 or descartados % 1000 == 0:
+                logger.warning('Cola de LogSistema llena: %s entradas descartadas', descartados)
+
+    # -- Hilo de fondo -----------------------------------------------------
+
+    def _asegurar_hilo(self):
+        # Tras un fork (workers de gunicorn) el hilo del padre no existe en el hijo.
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._ciclo, name='log-sistema-sink', daemon=True)
+            self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            lote = self._tomar_lote(INTERVALO)
+            lote.extend(self._resumenes_vencidos())
+            if lote:
+                self._guardar(lote, hilo_fondo=True)
+
+    def _tomar_lote(self, espera):
+        lote = []
+        limite = time.monotonic() + espera
+        while len(lote) < LOTE:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _resumenes_vencidos(self, todos=False):
+        """Cierra ventanas de deduplicación y devuelve una entrada resumen por cada error repetido."""
+        ahora = time.monotonic()
+        resumenes = []
+        with self._lock:
+            for clave, visto in list(self._vistos.items()):
+                if not todos and visto['expira'] > ahora:
+                    continue
+                del self._vistos[clave]
+                if visto['repeticiones']:
+                    entrada = visto['entrada']
+                    resumenes.append({
+                        **entrada,
+                        'mensaje': f"{entrada['mensaje']} (repetido {visto['repeticiones']} veces más en {VENTANA_DEDUP} s)",
+                        'detalles': {
+                            **(entrada['detalles'] or {}),
+                            'repeticiones': visto['repeticiones'],
+                            'ventana_segundos': VENTANA_DEDUP,
+                            'registrado_en': timezone.now().isoformat(),
+                        },
+                    })
+        return resumenes
+
+    # -- Salida ------------------------------------------------------------
+
+    def _guardar(self, entradas, hilo_fondo=False):
+        from .models import LogSistema
+
+        # La conexión del hilo de fondo no pasa por request_started/finished: se recicla aquí.
+        # En el hilo de un request (modo síncrono, flush) se usa un savepoint para que un
+        # fallo al guardar el log no rompa la transacción en curso.
+        if hilo_fondo:
+            close_old_connections()
+        try:
+            with transaction.atomic():
+                LogSistema.objects.bulk_create(
+                    [LogSistema(**{campo: e.get(campo) for campo in CAMPOS}) for e in entradas],
+                    batch_size=LOTE,
+                )
+        except Exception as exc:
+            logger.error('No se pudo guardar LogSistema en BD (%s); se usa archivo de respaldo', exc)
+            self._respaldar(entradas)
+        finally:
+            if hilo_fondo:
+                close_old_connections()
+
+    def _respaldar(self, entradas):
+        try:
+            ARCHIVO_RESPALDO.parent.mkdir(parents=True, exist_ok=True)
+            with open(ARCHIVO_RESPALDO, 'a', encoding='utf-8') as archivo:
+                for entrada in entradas:
+                    archivo.write(json.dumps(entrada, ensure_ascii=False, default=str) + '\n')
+        except OSError as exc:
+            logger.error('No se pudo escribir el respaldo de LogSistema: %s', exc)
+
+    def flush(self):
+        """Guarda en el hilo actual todo lo pendiente, incluidos los resúmenes de repetidos."""
+        pendientes = []
+        while True:
+            try:
+                pendientes.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        pendientes.extend(self._resumenes_vencidos(todos=True))
+        for inicio in range(0, len(pendientes), LOTE):
+            self._guardar(pendientes[inicio:inicio + LOTE])
+
+
+sink = BufferLogSistema()
+atexit.register(sink.flush)
+
+
+def registrar_log(nivel, tipo, titulo, mensaje, usuario=None, url=None,
+                  ip_cliente=None, user_agent=None, detalles=None):
+    """Encola un LogSistema (misma firma que ``LogSistema.crear_log``)."""
+    entrada = {
+        'nivel': nivel,
+        'tipo': tipo,
+        'titulo': (titulo or '')[:255],
+        'mensaje': mensaje,
+        'usuario_id': getattr(usuario, 'pk', None),
+        'url': url[:500] if url else None,
+        'ip_cliente': ip_cliente,
+        'user_agent': user_agent or '',
+        'detalles': {**(detalles or {}), 'registrado_en': timezone.now().isoformat()},
+    }
+    sink.registrar(entrada)
+    return entrada
+
+
+def reimportar_respaldo(archivo=None):
+    """
+    Sube a BD las entradas del archivo de respaldo y lo vacía.
+
+    Returns:
+        int: entradas importadas
+    """
+    from .models import LogSistema
+
+    archivo = Path(archivo or ARCHIVO_RESPALDO)
+    procesando = archivo.with_suffix(archivo.suffix + '.procesando')
+    # Un .procesando que quedó de una ejecución fallida se importa antes que el archivo nuevo.
+    if not procesando.exists():
+        if not archivo.exists():
+            return 0
+        archivo.replace(procesando)
+    objetos = []
+    with open(procesando, encoding='utf-8') as f:
+        for linea in f:
+            linea = linea.strip()
+            if linea:
+                entrada = json.loads(linea)
+                objetos.append(LogSistema(**{campo: entrada.get(campo) for campo in CAMPOS}))
+    LogSistema.objects.bulk_create(objetos, batch_size=LOTE)
+    procesando.unlink()
+    return len(objetos)
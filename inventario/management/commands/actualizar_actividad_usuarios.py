@@ -0,0 +1,54 @@
+"""
+Consolida los conteos diarios de actividad por usuario (ActividadUsuarioDia) de forma incremental.
+
+Procesa los días completos posteriores al último cierre (y relee los últimos días ya
+cerrados). El reporte de usuarios suma estas filas y solo cuenta en vivo el día en curso.
+
+Programar diario después de medianoche, por ejemplo:
+  45 0 * * * docker exec inventario_dev sh -c 'cd /app && python manage.py actualizar_actividad_usuarios' >>/var/log/actividad_usuarios.log 2>&1
+
+Uso:
+  python manage.py actualizar_actividad_usuarios                  # hasta ayer
+  python manage.py actualizar_actividad_usuarios --hasta 2025-12-31
+  python manage.py actualizar_actividad_usuarios --reconstruir    # regenerar desde cero
+"""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventario.actividad_usuarios_utils import actualizar_actividad_usuarios
+
+
+class Command(BaseCommand):
+    help = 'Consolida conteos diarios de actividad por usuario para el reporte de usuarios.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasta',
+            help='Último día a cerrar (YYYY-MM-DD, default: ayer). No puede ser hoy ni futuro.',
+        )
+        parser.add_argument(
+            '--reconstruir',
+            action='store_true',
+            help='Borrar todos los conteos y regenerarlos desde el primer registro.',
+        )
+
+    def handle(self, *args, **options):
+        hasta = None
+        if options['hasta']:
+            try:
+                hasta = datetime.strptime(options['hasta'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--hasta debe tener formato YYYY-MM-DD')
+            if hasta >= timezone.localdate():
+                raise CommandError('--hasta debe ser un día ya cerrado (anterior a hoy)')
+
+        resumen = actualizar_actividad_usuarios(hasta=hasta, reconstruir=options['reconstruir'])
+
+        if resumen['desde']:
+            self.stdout.write(f"Días consolidados: {resumen['desde']} → {resumen['hasta']}")
+        else:
+            self.stdout.write(f"Sin días por consolidar (cierre en {resumen['hasta']})")
+        self.stdout.write(self.style.SUCCESS(f"Filas escritas: {resumen['filas']}"))
@@ -18,6 +18,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils import timezone
 
+from inventario.dashboard_utils import invalidar_dashboard
 from inventario.models import Lote
 
 ESTADO_DISPONIBLE = 1
@@ -110,6 +111,7 @@ class Command(BaseCommand):
                     'fecha_actualizacion',
                 ],
             )
+            invalidar_dashboard()
 
         self.stdout.write(self.style.SUCCESS(f'Actualizados {len(actualizados)} lotes.'))
 
@@ -0,0 +1,56 @@
+"""
+Consolida los saldos de cierre diario por lote (SaldoCierreLote) de forma incremental.
+
+Procesa los días completos posteriores al último cierre y reprocesa los lotes con
+movimientos anulados desde la última ejecución. El kardex y el comparativo de
+inventario leen estos snapshots y solo consultan la cola de movimientos recientes.
+
+Programar diario después de medianoche, por ejemplo:
+  30 0 * * * docker exec inventario_dev sh -c 'cd /app && python manage.py actualizar_saldos_cierre' >>/var/log/saldos_cierre.log 2>&1
+
+Uso:
+  python manage.py actualizar_saldos_cierre                  # hasta ayer
+  python manage.py actualizar_saldos_cierre --hasta 2025-12-31
+  python manage.py actualizar_saldos_cierre --reconstruir    # regenerar desde cero
+"""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventario.saldos_cierre_utils import actualizar_saldos_cierre
+
+
+class Command(BaseCommand):
+    help = 'Consolida saldos de cierre diario por lote a partir de MovimientoInventario.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasta',
+            help='Último día a cerrar (YYYY-MM-DD, default: ayer). No puede ser hoy ni futuro.',
+        )
+        parser.add_argument(
+            '--reconstruir',
+            action='store_true',
+            help='Borrar todos los snapshots y regenerarlos desde el primer movimiento.',
+        )
+
+    def handle(self, *args, **options):
+        hasta = None
+        if options['hasta']:
+            try:
+                hasta = datetime.strptime(options['hasta'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--hasta debe tener formato YYYY-MM-DD')
+            if hasta >= timezone.localdate():
+                raise CommandError('--hasta debe ser un día ya cerrado (anterior a hoy)')
+
+        resumen = actualizar_saldos_cierre(hasta=hasta, reconstruir=options['reconstruir'])
+
+        if resumen['desde']:
+            self.stdout.write(f"Días consolidados: {resumen['desde']} → {resumen['hasta']}")
+        else:
+            self.stdout.write(f"Sin días nuevos por consolidar (cierre en {resumen['hasta']})")
+        self.stdout.write(f"Lotes reprocesados por anulaciones: {resumen['lotes_reprocesados']}")
+        self.stdout.write(self.style.SUCCESS(f"Snapshots escritos: {resumen['saldos']}"))
@@ -0,0 +1,95 @@
+"""
+Compara la ruta de picking planificada contra el orden por código en almacenes sintéticos.
+
+Uso:
+  python manage.py benchmark_ruta_picking
+  python manage.py benchmark_ruta_picking --ubicaciones 5000 --lineas 25,100,400,1500 --repeticiones 5
+  python manage.py benchmark_ruta_picking --ola 4          # además, 4 propuestas en una sola ola
+
+No usa la BD: genera códigos RACK.POSICION.NIVEL (como cargar_ubicaciones) y mide la
+distancia recorrida (en posiciones de rack) y el tiempo de cálculo.
+"""
+
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventario.ruta_picking_utils import Distribucion, clave_natural, ordenar_lineas, ordenar_ola
+
+NIVELES = 5
+
+
+def almacen_sintetico(total_ubicaciones, posiciones_por_rack=20):
+    """Códigos tipo J6A.01.02: zonas con letra, racks de ``posiciones_por_rack`` x NIVELES."""
+    por_rack = posiciones_por_rack * NIVELES
+    racks = max(1, -(-total_ubicaciones // por_rack))
+    codigos = []
+    for r in range(racks):
+        nombre = f'{string.ascii_uppercase[r // 10 % 26]}{r % 10 + 1}'
+        for posicion in range(1, posiciones_por_rack + 1):
+            for nivel in range(1, NIVELES + 1):
+                codigos.append(f'{nombre}.{posicion:02d}.{nivel:02d}')
+    return codigos[:total_ubicaciones]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de la ruta de picking (vecino más cercano + 2-opt) contra el orden por código.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ubicaciones', type=int, default=5000, help='Ubicaciones del almacén sintético.')
+        parser.add_argument('--lineas', default='25,100,400,1500', help='Tamaños de propuesta (líneas), separados por coma.')
+        parser.add_argument('--repeticiones', type=int, default=3, help='Propuestas aleatorias por tamaño.')
+        parser.add_argument('--ola', type=int, default=0, help='Propuestas por ola (0 = no medir olas).')
+        parser.add_argument('--semilla', type=int, default=20240601)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semilla'])
+        codigos = almacen_sintetico(options['ubicaciones'])
+        distribucion = Distribucion((codigo, None, None, None) for codigo in codigos)
+        distribuciones = {1: distribucion}
+        self.stdout.write(
+            f'Almacén sintético: {len(codigos)} ubicaciones en {len(distribucion.largo)} racks'
+        )
+
+        def distancia(lineas):
+            puntos = []
+            for linea in lineas:
+                punto = distribucion.punto(linea['ubicacion'])
+                if not puntos or puntos[-1] != punto:
+                    puntos.append(punto)
+            return distribucion.longitud(puntos)
+
+        def propuesta(tamano):
+            return [
+                {'almacen_id': 1, 'ubicacion': codigo, 'producto': f'P{i}'}
+                for i, codigo in enumerate(aleatorio.sample(codigos, min(tamano, len(codigos))))
+            ]
+
+        self.stdout.write(f"{'líneas':>7} {'por código':>11} {'ruta':>9} {'ahorro':>7} {'ms':>8}")
+        for tamano in [int(t) for t in options['lineas'].split(',') if t.strip()]:
+            base = ruta = ms = 0.0
+            for _ in range(options['repeticiones']):
+                lineas = propuesta(tamano)
+                base += distancia(sorted(lineas, key=lambda x: clave_natural(x['ubicacion'])))
+                inicio = time.perf_counter()
+                ordenadas = ordenar_lineas(lineas, distribuciones)
+                ms += (time.perf_counter() - inicio) * 1000
+                ruta += distancia(ordenadas)
+            n = options['repeticiones']
+            self.stdout.write(
+                f'{tamano:>7} {base / n:>11.0f} {ruta / n:>9.0f} {1 - ruta / base:>7.1%} {ms / n:>8.1f}'
+            )
+
+        if options['ola']:
+            tamano = 25
+            propuestas = {f'P{i}': propuesta(tamano) for i in range(options['ola'])}
+            separadas = sum(distancia(ordenar_lineas(l, distribuciones)) for l in propuestas.values())
+            inicio = time.perf_counter()
+            ola = ordenar_ola(propuestas, distribuciones)
+            ms = (time.perf_counter() - inicio) * 1000
+            self.stdout.write(
+                f'Ola de {options["ola"]} propuestas x {tamano} líneas: {separadas:.0f} por separado, '
+                f'{distancia(ola):.0f} en una ola ({ms:.1f} ms)'
+            )
@@ -1,10 +1,9 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-from django.utils import timezone
-from datetime import datetime
-import pandas as pd
-from inventario.models import Producto, Almacen, UbicacionAlmacen, Lote, LoteUbicacion, CategoriaProducto
-from django.contrib.auth.models import User
+from django.contrib.auth import get_user_model
+
+from inventario.carga_lotes_utils import CargaMasivaLotes
+
+User = get_user_model()
 
 
 class Command(BaseCommand):
@@ -48,156 +47,26 @@ class Command(BaseCommand):
                 raise CommandError('No se encontró usuario admin')
 
         self.stdout.write(f'📁 Leyendo archivo: {archivo}')
-        
+
+        def progreso(procesadas, total):
+            self.stdout.write(f'  ... {procesadas} de {total} registros')
+
+        carga = CargaMasivaLotes(
+            institucion_id,
+            usuario,
+            dry_run=dry_run,
+            # Como antes del procesamiento por bloques: en lotes existentes no se tocan
+            # cantidad_inicial ni valor_total.
+            actualizar_cantidad=False,
+            limpiar_ubicaciones_previas=False,
+            progreso=progreso,
+        )
         try:
-            df = pd.read_excel(archivo)
+            stats = carga.procesar_archivo(archivo)
         except Exception as e:
-            raise CommandError(f'Error al leer archivo: {str(e)}')
-
-        self.stdout.write(f'📊 Total de registros: {len(df)}')
-
-        # Estadísticas
-        stats = {
-            'procesados': 0,
-            'omitidos': 0,
-            'productos_creados': 0,
-            'ubicaciones_creadas': 0,
-            'lotes_creados': 0,
-            'lotes_actualizados': 0,
-            'errores': 0,
-            'errores_detalle': []
-        }
-
-        with transaction.atomic():
-            for idx, row in df.iterrows():
-                try:
-                    # 1. VALIDAR: Omitir si CLAVE es 'S/CLAVE'
-                    clave = str(row.get('CLAVE', '')).strip()
-                    if clave == 'S/CLAVE' or clave == 'nan':
-                        stats['omitidos'] += 1
-                        continue
-
-                    # Obtener datos
-                    almacen_id = int(row.get('almcen', 1))
-                    descripcion = str(row.get('DESCRIPCION', '')).strip()
-                    lote_numero = str(row.get('LOTE', '')).strip()
-                    caducidad_str = row.get('CADUCIDAD', '')
-                    ubicacion_codigo = str(row.get('UBICACIÓN', '')).strip()
-                    cantidad = int(row.get('INVENTARIO', 0))
-
-                    # Validar datos mínimos
-                    if not clave or not lote_numero or not ubicacion_codigo:
-                        stats['errores'] += 1
-                        stats['errores_detalle'].append(
-                            f"Fila {idx+2}: Datos incompletos (CLAVE, LOTE o UBICACIÓN vacíos)"
-                        )
-                        continue
-
-                    # 2. CREAR O OBTENER PRODUCTO
-                    # Obtener o crear categoría por defecto
-                    categoria, _ = CategoriaProducto.objects.get_or_create(
-                        nombre='Sin Categoría',
-                        defaults={'descripcion': 'Categoría por defecto para carga masiva'}
-                    )
-                    
-                    producto, producto_creado = Producto.objects.get_or_create(
-                        clave_cnis=clave,
-                        defaults={
-                            'descripcion': descripcion or f'Producto {clave}',
-                            'categoria': categoria,
-                            'unidad_medida': 'PIEZA',
-                            'es_insumo_cpm': False,
-                        }
-                    )
-                    if producto_creado:
-                        stats['productos_creados'] += 1
-
-                    # 3. OBTENER ALMACÉN
-                    try:
-                        almacen = Almacen.objects.get(id=almacen_id)
-                    except Almacen.DoesNotExist:
-                        stats['errores'] += 1
-                        stats['errores_detalle'].append(
-                            f"Fila {idx+2}: Almacén {almacen_id} no existe"
-                        )
-                        continue
-
-                    # 4. CREAR O OBTENER UBICACIÓN
-                    ubicacion, ubicacion_creada = UbicacionAlmacen.objects.get_or_create(
-                        codigo=ubicacion_codigo,
-                        almacen=almacen,
-                        defaults={
-                            'descripcion': ubicacion_codigo,
-                            'activo': True,
-                        }
-                    )
-                    if ubicacion_creada:
-                        stats['ubicaciones_creadas'] += 1
-
-                    # 5. PROCESAR FECHA DE CADUCIDAD
-                    fecha_caducidad = None
-                    if pd.notna(caducidad_str) and caducidad_str != 'S/C':
-                        try:
-                            if isinstance(caducidad_str, str):
-                                fecha_caducidad = pd.to_datetime(caducidad_str).date()
-                            else:
-                                fecha_caducidad = caducidad_str.date() if hasattr(caducidad_str, 'date') else caducidad_str
-                        except:
-                            pass
-
-                    # 6. CREAR O ACTUALIZAR LOTE
-                    lote, lote_creado = Lote.objects.get_or_create(
-                        numero_lote=lote_numero,
-                        producto=producto,
-                        institucion_id=institucion_id,
-                        defaults={
-                            'cantidad_inicial': cantidad,
-                            'cantidad_disponible': cantidad,
-                            'precio_unitario': 0,
-                            'valor_total': 0,
-                            'fecha_recepcion': timezone.now().date(),
-                            'fecha_caducidad': fecha_caducidad,
-                            'almacen': almacen,
-                            'creado_por': usuario,
-                        }
-                    )
-
-                    if lote_creado:
-                        stats['lotes_creados'] += 1
-                    else:
-                        # Actualizar fecha de caducidad y cantidad si es necesario
-                        if fecha_caducidad and lote.fecha_caducidad != fecha_caducidad:
-                            lote.fecha_caducidad = fecha_caducidad
-                        stats['lotes_actualizados'] += 1
-
-                    # 7. CREAR O ACTUALIZAR LOTE_UBICACION
-                    lote_ubicacion, _ = LoteUbicacion.objects.get_or_create(
-                        lote=lote,
-                        ubicacion=ubicacion,
-                        defaults={
-                            'cantidad': cantidad,
-                            'usuario_asignacion': usuario,
-                        }
-                    )
-
-                    # Actualizar cantidad si cambió
-                    if lote_ubicacion.cantidad != cantidad:
-                        lote_ubicacion.cantidad = cantidad
-                        lote_ubicacion.usuario_asignacion = usuario
-                        lote_ubicacion.save()
-
-                    # Guardar lote con cambios
-                    if not lote_creado:
-                        lote.save()
-
-                    # Sincronizar cantidad total del lote
-                    lote.sincronizar_cantidad_disponible()
-
-                    stats['procesados'] += 1
+            raise CommandError(str(e))
 
-                except Exception as e:
-                    stats['errores'] += 1
-                    stats['errores_detalle'].append(f"Fila {idx+2}: {str(e)}")
+        self.stdout.write(f"📊 Total de registros: {stats['total_registros']}")
 
         # Mostrar resultados
         self.stdout.write('\n' + '=' * 80)
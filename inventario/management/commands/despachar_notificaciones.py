@@ -0,0 +1,47 @@
+"""
+Envía las notificaciones encoladas en LogNotificaciones (Email y Telegram).
+
+Uso:
+  python manage.py despachar_notificaciones              # una pasada y termina (cron)
+  python manage.py despachar_notificaciones --continuo   # proceso dedicado
+  python manage.py despachar_notificaciones --continuo --intervalo 10
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from inventario.notificaciones_outbox_utils import INTERVALO, despachar_todo
+
+
+class Command(BaseCommand):
+    help = 'Despacha la bandeja de salida de notificaciones con reintentos y límite por chat.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='No terminar: revisar la cola cada --intervalo segundos.',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=INTERVALO,
+            help=f'Segundos entre pasadas en modo continuo (default: {INTERVALO}).',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            resumen = despachar_todo()
+            if any(resumen.values()) or not options['continuo']:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Enviadas: {resumen['enviadas']} | Reintentos: {resumen['reintentos']} | "
+                        f"Fallidas: {resumen['fallidas']}"
+                    )
+                )
+            if not options['continuo']:
+                return
+            time.sleep(options['intervalo'])
@@ -0,0 +1,137 @@
+"""
+Ejecuta los trabajos en segundo plano (TrabajoSegundoPlano): cargas y exportaciones largas.
+
+Uso:
+  python manage.py procesar_trabajos                  # proceso dedicado, TRABAJOS_WORKERS procesos
+  python manage.py procesar_trabajos --workers 4
+  python manage.py procesar_trabajos --una-vez        # vacía la cola y termina (cron / pruebas)
+
+Cada trabajo corre en un proceso del pool (arrancado con 'spawn', con su propia conexión
+a BD); si un proceso muere, sus trabajos vuelven a la cola y el pool se recrea.
+SIGTERM/SIGINT: deja de tomar trabajos y espera a que terminen los que están en curso.
+"""
+
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+# Trabajos por proceso antes de reemplazarlo (libera la memoria de openpyxl/pandas).
+TRABAJOS_POR_PROCESO = 20
+# Cada cuánto (s) se buscan trabajos abandonados y se purgan los antiguos.
+INTERVALO_MANTENIMIENTO = 300
+
+
+def _inicializar_proceso():
+    import django
+
+    django.setup()
+
+
+def _ejecutar(trabajo_id, trabajador):
+    from inventario.trabajos_utils import ejecutar_trabajo
+
+    ejecutar_trabajo(trabajo_id, trabajador)
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta los trabajos en segundo plano pendientes en un pool de procesos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'TRABAJOS_WORKERS', 2),
+            help='Trabajos simultáneos (procesos del pool).',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos entre revisiones de la cola cuando está vacía (default: 2).',
+        )
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Procesar lo pendiente y terminar.',
+        )
+
+    def handle(self, *args, **options):
+        from inventario.trabajos_utils import (
+            nombre_trabajador, purgar_trabajos_antiguos, reclamar_trabajo, recuperar_abandonados, reencolar,
+        )
+
+        workers = max(1, options['workers'])
+        trabajador = nombre_trabajador()
+        self._detener = False
+        signal.signal(signal.SIGTERM, self._senal)
+        signal.signal(signal.SIGINT, self._senal)
+
+        pool = self._crear_pool(workers)
+        en_curso = {}
+        proximo_mantenimiento = 0.0
+        self.stdout.write(self.style.SUCCESS(f'Procesando trabajos con {workers} procesos ({trabajador})'))
+
+        try:
+            while True:
+                if time.monotonic() >= proximo_mantenimiento:
+                    close_old_connections()
+                    reencolados, fallidos = recuperar_abandonados()
+                    if reencolados or fallidos:
+                        self.stdout.write(self.style.WARNING(
+                            f'Trabajos abandonados: {reencolados} reencolados, {fallidos} con error'
+                        ))
+                    purgar_trabajos_antiguos()
+                    proximo_mantenimiento = time.monotonic() + INTERVALO_MANTENIMIENTO
+
+                while not self._detener and len(en_curso) < workers:
+                    close_old_connections()
+                    trabajo_id = reclamar_trabajo(trabajador)
+                    if trabajo_id is None:
+                        break
+                    en_curso[pool.submit(_ejecutar, trabajo_id, trabajador)] = trabajo_id
+                    self.stdout.write(f'Trabajo {trabajo_id} iniciado')
+
+                if not en_curso:
+                    if self._detener or options['una_vez']:
+                        return
+                    time.sleep(options['intervalo'])
+                    continue
+
+                terminados, _ = wait(en_curso, timeout=options['intervalo'], return_when=FIRST_COMPLETED)
+                roto = False
+                for futuro in terminados:
+                    trabajo_id = en_curso.pop(futuro)
+                    try:
+                        futuro.result()
+                        self.stdout.write(f'Trabajo {trabajo_id} terminado')
+                    except BrokenProcessPool:
+                        roto = True
+                        reencolar([trabajo_id])
+                        self.stderr.write(f'Trabajo {trabajo_id}: el proceso terminó inesperadamente')
+                    except Exception as exc:
+                        self.stderr.write(f'Trabajo {trabajo_id}: {exc}')
+                if roto:
+                    reencolar(list(en_curso.values()))
+                    en_curso.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._crear_pool(workers)
+        finally:
+            pool.shutdown(wait=True)
+
+    def _crear_pool(self, workers):
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_inicializar_proceso,
+            max_tasks_per_child=TRABAJOS_POR_PROCESO,
+        )
+
+    def _senal(self, signum, frame):
+        self._detener = True
+        self.stdout.write('Deteniendo: se esperan los trabajos en curso...')
@@ -0,0 +1,27 @@
+"""
+Sube a LogSistema las entradas que quedaron en el archivo de respaldo
+(LOG_SISTEMA_ARCHIVO_RESPALDO) cuando la BD no estaba disponible.
+
+Uso:
+  python manage.py reimportar_logs_respaldo
+  python manage.py reimportar_logs_respaldo --archivo /ruta/log_sistema_respaldo.jsonl
+"""
+
+from django.core.management.base import BaseCommand
+
+from inventario.logs_utils import ARCHIVO_RESPALDO, reimportar_respaldo
+
+
+class Command(BaseCommand):
+    help = 'Importa a LogSistema el archivo de respaldo del registro diferido de logs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archivo',
+            default=str(ARCHIVO_RESPALDO),
+            help=f'Archivo JSON por línea (default: {ARCHIVO_RESPALDO}).',
+        )
+
+    def handle(self, *args, **options):
+        importados = reimportar_respaldo(options['archivo'])
+        self.stdout.write(self.style.SUCCESS(f'Logs importados: {importados}'))
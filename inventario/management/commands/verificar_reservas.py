@@ -0,0 +1,106 @@
+"""
+Verifica (y opcionalmente repara) el libro de reservas activas LoteUbicacion.reserva_activa.
+
+El libro debe coincidir con la suma de LoteAsignado.cantidad_asignada (surtido=False) por
+ubicación. Con --reparar también realinea los campos heredados cantidad_reservada de
+LoteUbicacion y Lote con el libro.
+
+Uso:
+  python manage.py verificar_reservas              # solo reportar diferencias
+  python manage.py verificar_reservas --reparar    # corregir libro y campos heredados
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from inventario.models import Lote, LoteUbicacion
+from inventario.reservas_utils import TAMANO_LOTE_ACTUALIZACION, recalcular_reserva_activa
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara LoteUbicacion.reserva_activa contra LoteAsignado (surtido=False) '
+        'y, con --reparar, corrige el libro y los campos cantidad_reservada.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reparar',
+            action='store_true',
+            help='Aplicar las correcciones (por defecto solo se reportan).',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=50,
+            help='Máximo de diferencias a listar en pantalla (default: 50).',
+        )
+
+    def handle(self, *args, **options):
+        reparar = options['reparar']
+        limite = options['limite']
+        if not reparar:
+            self.stdout.write(self.style.WARNING('Modo verificación: no se modificará nada.\n'))
+
+        with transaction.atomic():
+            diferencias = recalcular_reserva_activa(aplicar=reparar)
+            for lote_ubicacion_id, registrada, correcta in diferencias[:limite]:
+                self.stdout.write(
+                    f'LoteUbicacion {lote_ubicacion_id}: reserva_activa {registrada} → {correcta}'
+                )
+            if len(diferencias) > limite:
+                self.stdout.write(f'... y {len(diferencias) - limite} más')
+
+            legado_lu, legado_lote = self._campos_heredados_desfasados(diferencias)
+            if reparar:
+                self._realinear_campos_heredados(legado_lote)
+
+        self.stdout.write('\n' + '=' * 60)
+        estilo = self.style.SUCCESS if not diferencias else self.style.WARNING
+        self.stdout.write(estilo(f'Ubicaciones con libro desfasado: {len(diferencias)}'))
+        self.stdout.write(f'LoteUbicacion.cantidad_reservada desfasada: {legado_lu}')
+        self.stdout.write(f'Lote.cantidad_reservada desfasada: {len(legado_lote)}')
+        if reparar:
+            self.stdout.write(self.style.SUCCESS('Correcciones aplicadas.'))
+
+    def _campos_heredados_desfasados(self, diferencias):
+        """
+        Cuenta LoteUbicacion con cantidad_reservada distinta del libro y devuelve los
+        lotes cuyo cantidad_reservada no coincide con la suma del libro.
+        En modo verificación se compara contra el valor correcto, no el registrado.
+        """
+        correccion = {pk: correcta for pk, _registrada, correcta in diferencias}
+
+        legado_lu = sum(
+            1
+            for pk, cantidad_reservada, reserva_activa in LoteUbicacion.objects.filter(
+                ~Q(cantidad_reservada=F('reserva_activa')) | Q(id__in=list(correccion))
+            ).values_list('id', 'cantidad_reservada', 'reserva_activa').iterator(chunk_size=2000)
+            if cantidad_reservada != correccion.get(pk, reserva_activa)
+        )
+
+        totales = {}
+        for lote_id, lote_ubicacion_id, reserva_activa in LoteUbicacion.objects.filter(
+            Q(reserva_activa__gt=0) | Q(id__in=list(correccion))
+        ).values_list('lote_id', 'id', 'reserva_activa').iterator(chunk_size=2000):
+            totales[lote_id] = totales.get(lote_id, 0) + correccion.get(lote_ubicacion_id, reserva_activa)
+
+        legado_lote = {}
+        for lote_id, cantidad_reservada in Lote.objects.filter(
+            Q(cantidad_reservada__gt=0) | Q(id__in=list(totales))
+        ).values_list('id', 'cantidad_reservada').iterator(chunk_size=2000):
+            correcta = totales.get(lote_id, 0)
+            if cantidad_reservada != correcta:
+                legado_lote[lote_id] = correcta
+        return legado_lu, legado_lote
+
+    def _realinear_campos_heredados(self, legado_lote):
+        LoteUbicacion.objects.exclude(cantidad_reservada=F('reserva_activa')).update(
+            cantidad_reservada=F('reserva_activa')
+        )
+        Lote.objects.bulk_update(
+            [Lote(id=pk, cantidad_reservada=total) for pk, total in legado_lote.items()],
+            ['cantidad_reservada'],
+            batch_size=TAMANO_LOTE_ACTUALIZACION,
+        )
@@ -0,0 +1,113 @@
+"""
+Resolución única de menú y acceso por rol (MenuItemRol).
+
+El catálogo de menús activos con sus ``roles_permitidos`` se carga en dos consultas y se
+guarda a nivel de proceso; se invalida con las señales de MenuItemRol / Group registradas
+en ``InventarioConfig.ready`` y, como respaldo para los demás workers de gunicorn, expira
+a los ``MENU_ROLES_CACHE_TTL`` segundos.
+
+Por petición, ``acceso_menu_usuario(user)`` calcula una sola vez los grupos del usuario y
+su árbol visible, y lo deja memorizado en el propio objeto ``user`` (el mismo
+``request.user`` que ven el middleware de control de acceso, el context processor y los
+template tags de menú).
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+MENU_ROLES_CACHE_TTL = getattr(settings, 'MENU_ROLES_CACHE_TTL', 60)
+
+_catalogo = None
+_catalogo_expira = 0.0
+_lock = threading.Lock()
+
+
+class CatalogoMenu:
+    """Menús activos con sus roles permitidos, indexados para consultas en memoria."""
+
+    def __init__(self, items, roles_por_item):
+        self.items = items
+        self.roles_por_item = roles_por_item
+        self.raices = [i for i in items if i.menu_padre_id is None]
+        self.hijos = {}
+        self.por_url = {}
+        for item in items:
+            if item.menu_padre_id is not None:
+                self.hijos.setdefault(item.menu_padre_id, []).append(item)
+            # Igual que .filter(url_name=...).first(): el primero según el ordering del modelo
+            self.por_url.setdefault(item.url_name, item)
+
+    def visible_para(self, item, grupo_ids, es_superusuario):
+        return es_superusuario or bool(self.roles_por_item.get(item.id, frozenset()) & grupo_ids)
+
+
+def _cargar_catalogo():
+    from .models import MenuItemRol
+
+    items = list(MenuItemRol.objects.filter(activo=True).order_by('orden', 'nombre_mostrado', 'id'))
+    roles_por_item = {}
+    for item_id, grupo_id in MenuItemRol.roles_permitidos.through.objects.filter(
+        menuitemrol__activo=True
+    ).values_list('menuitemrol_id', 'group_id'):
+        roles_por_item.setdefault(item_id, set()).add(grupo_id)
+    return CatalogoMenu(items, {pk: frozenset(ids) for pk, ids in roles_por_item.items()})
+
+
+def obtener_catalogo_menu():
+    global _catalogo, _catalogo_expira
+    ahora = time.monotonic()
+    catalogo = _catalogo
+    if catalogo is not None and ahora < _catalogo_expira:
+        return catalogo
+    with _lock:
+        if _catalogo is None or time.monotonic() >= _catalogo_expira:
+            _catalogo = _cargar_catalogo()
+            _catalogo_expira = time.monotonic() + MENU_ROLES_CACHE_TTL
+        return _catalogo
+
+
+def invalidar_catalogo_menu(*args, **kwargs):
+    """Receptor de señales: fuerza recargar el catálogo en la siguiente consulta."""
+    global _catalogo
+    _catalogo = None
+
+
+class AccesoMenu:
+    """Grupos del usuario y árbol de menú visible, calculados una vez por petición."""
+
+    def __init__(self, user, catalogo):
+        self.catalogo = catalogo
+        self.es_superusuario = bool(user.is_superuser)
+        grupos = list(user.groups.values_list('id', 'name'))
+        self.grupo_ids = frozenset(pk for pk, _ in grupos)
+        self.roles = [nombre for _, nombre in grupos]
+        self.es_admin = self.es_superusuario or 'Administrador' in self.roles
+
+        visible = lambda item: catalogo.visible_para(item, self.grupo_ids, self.es_superusuario)
+        self.raices = [i for i in catalogo.raices if visible(i)]
+        self.hijos = {
+            padre_id: [i for i in hijos if visible(i)]
+            for padre_id, hijos in catalogo.hijos.items()
+        }
+
+    def submenus(self, menu_padre):
+        return self.hijos.get(getattr(menu_padre, 'pk', menu_padre), [])
+
+    def menu_de_url(self, url_name):
+        return self.catalogo.por_url.get(url_name)
+
+    def puede_ver(self, item):
+        return self.catalogo.visible_para(item, self.grupo_ids, self.es_superusuario)
+
+
+def acceso_menu_usuario(user):
+    """AccesoMenu del usuario autenticado, memorizado en el objeto ``user``; None si anónimo."""
+    if not user or not user.is_authenticated:
+        return None
+    acceso = getattr(user, '_acceso_menu', None)
+    if acceso is None:
+        acceso = AccesoMenu(user, obtener_catalogo_menu())
+        user._acceso_menu = acceso
+    return acceso
@@ -7,7 +7,7 @@ from django.shortcuts import redirect
 from django.contrib import messages
 from django.urls import resolve
 from django.http import HttpResponseForbidden
-from inventario.models import MenuItemRol
+from inventario.menu_roles_utils import acceso_menu_usuario
 
 
 class ControlAccesoRolesMiddleware:
@@ -37,10 +37,11 @@ class ControlAccesoRolesMiddleware:
         
         # Si está autenticado y la URL no está excluida, verificar acceso
         if request.user.is_authenticated and url_name and url_name not in self.urls_excluidas:
-            # Verificar si existe una configuración de menú para esta URL (first() evita MultipleObjectsReturned si hay duplicados)
-            menu_item = MenuItemRol.objects.filter(url_name=url_name, activo=True).first()
+            # Configuración de menú para esta URL (catálogo en caché; sin consulta por request)
+            acceso = acceso_menu_usuario(request.user)
+            menu_item = acceso.menu_de_url(url_name)
             if menu_item and not request.user.is_superuser:
-                if not menu_item.puede_ver_usuario(request.user):
+                if not acceso.puede_ver(menu_item):
                     mensaje = (
                         f"No tienes permiso para acceder a '{menu_item.nombre_mostrado}'. "
                         f"Contacta con el administrador si crees que es un error."
@@ -63,8 +64,9 @@ class AgregarContextoAccesoMiddleware:
     def __call__(self, request):
         # Agregar información de acceso al request
         if request.user.is_authenticated:
-            request.roles_usuario = list(request.user.groups.values_list('name', flat=True))
-            request.es_admin = request.user.is_superuser or request.user.groups.filter(name='Administrador').exists()
+            acceso = acceso_menu_usuario(request.user)
+            request.roles_usuario = list(acceso.roles)
+            request.es_admin = acceso.es_admin
         else:
             request.roles_usuario = []
             request.es_admin = False
@@ -128,11 +130,12 @@ class LoggingMiddleware:
         
         except Exception as e:
             # Registrar el error en logs
+            detalle_traceback = traceback.format_exc()
             logger.error(f"❌ Error en {request.method} {request.path}")
             logger.error(f"Error: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.error(detalle_traceback)
             
-            # Intentar registrar en la base de datos
+            # Encolar en LogSistema (escritura diferida por lotes, no toca la BD aquí)
             try:
                 LogSistema.crear_log(
                     nivel='ERROR',
@@ -146,11 +149,11 @@ class LoggingMiddleware:
                     detalles={
                         'metodo': request.method,
                         'path': request.path,
-                        'traceback': traceback.format_exc()
+                        'traceback': detalle_traceback
                     }
                 )
-            except Exception as db_error:
-                logger.error(f"No se pudo registrar el error en BD: {db_error}")
+            except Exception as log_error:
+                logger.error(f"No se pudo encolar el error en LogSistema: {log_error}")
             
             # Re-lanzar la excepción para que Django la maneje
             raise
@@ -0,0 +1,40 @@
+# Libro de reservas activas por LoteUbicacion (suma de LoteAsignado con surtido=False)
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def poblar_reserva_activa(apps, schema_editor):
+    """Carga inicial del libro desde LoteAsignado (una consulta agrupada)."""
+    LoteAsignado = apps.get_model('inventario', 'LoteAsignado')
+    LoteUbicacion = apps.get_model('inventario', 'LoteUbicacion')
+
+    totales = (
+        LoteAsignado.objects.filter(surtido=False)
+        .order_by()
+        .values('lote_ubicacion_id')
+        .annotate(total=Sum('cantidad_asignada'))
+    )
+    por_actualizar = []
+    for fila in totales:
+        if fila['total']:
+            por_actualizar.append(
+                LoteUbicacion(id=fila['lote_ubicacion_id'], reserva_activa=fila['total'])
+            )
+    LoteUbicacion.objects.bulk_update(por_actualizar, ['reserva_activa'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0111_itemtransferencia_precios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loteubicacion',
+            name='reserva_activa',
+            field=models.PositiveIntegerField(default=0, verbose_name='Reserva activa (LoteAsignado sin surtir)'),
+        ),
+        migrations.RunPython(poblar_reserva_activa, migrations.RunPython.noop),
+    ]
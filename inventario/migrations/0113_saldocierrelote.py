@@ -0,0 +1,41 @@
+# Generated manually: snapshots diarios de saldo por lote (kardex incremental)
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0112_loteubicacion_reserva_activa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoCierreLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('saldo', models.PositiveIntegerField()),
+                ('ultimo_movimiento_id', models.BigIntegerField()),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_cierre', to='inventario.lote')),
+            ],
+            options={
+                'verbose_name': 'Saldo de cierre de lote',
+                'verbose_name_plural': 'Saldos de cierre de lote',
+                'unique_together': {('lote', 'fecha')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ControlSaldosCierre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_cierre', models.DateField(blank=True, null=True)),
+                ('ultima_ejecucion', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Control de saldos de cierre',
+                'verbose_name_plural': 'Control de saldos de cierre',
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated manually: índices compuestos y parciales para reportes y asignación
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0113_saldocierrelote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(
+                condition=models.Q(anulado=False),
+                fields=['lote', 'fecha_movimiento', 'id'],
+                name='mov_lote_fecha_vigente',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(
+                condition=models.Q(anulado=False),
+                fields=['fecha_movimiento'],
+                name='mov_fecha_vigente',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['tipo_movimiento', 'fecha_movimiento'], name='mov_tipo_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(
+                condition=models.Q(anulado=True),
+                fields=['fecha_anulacion'],
+                name='mov_fecha_anulacion',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(
+                condition=models.Q(estado=1),
+                fields=['producto', 'fecha_caducidad'],
+                name='lote_prod_cad_disponible',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(fields=['producto', 'estado', 'fecha_caducidad'], name='lote_prod_estado_cad'),
+        ),
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(fields=['almacen', 'estado'], name='lote_almacen_estado'),
+        ),
+        migrations.AddIndex(
+            model_name='loteubicacion',
+            index=models.Index(
+                condition=models.Q(cantidad__gt=0),
+                fields=['lote'],
+                include=['ubicacion', 'cantidad', 'reserva_activa'],
+                name='loteubic_lote_con_exist',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='loteubicacion',
+            index=models.Index(
+                condition=models.Q(cantidad__gt=0),
+                fields=['ubicacion'],
+                include=['lote', 'cantidad'],
+                name='loteubic_ubic_con_exist',
+            ),
+        ),
+    ]
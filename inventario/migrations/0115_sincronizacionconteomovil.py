@@ -0,0 +1,32 @@
+# Generated manually: idempotencia de la sincronización en lote de conteos móviles
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventario', '0114_indices_movimientos_lotes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SincronizacionConteoMovil',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave_idempotencia', models.CharField(max_length=64, unique=True)),
+                ('resultado', models.JSONField(default=dict)),
+                ('fecha_sincronizacion', models.DateTimeField(auto_now_add=True)),
+                ('lote_ubicacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sincronizaciones_conteo', to='inventario.loteubicacion')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sincronizaciones_conteo', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Sincronización de conteo móvil',
+                'verbose_name_plural': 'Sincronizaciones de conteo móvil',
+                'ordering': ['-fecha_sincronizacion'],
+            },
+        ),
+    ]
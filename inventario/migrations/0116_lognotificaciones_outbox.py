@@ -0,0 +1,31 @@
+# Generated manually: bandeja de salida (outbox) de LogNotificaciones
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0115_sincronizacionconteomovil'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lognotificaciones',
+            name='intentos',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Intentos de Envío'),
+        ),
+        migrations.AddField(
+            model_name='lognotificaciones',
+            name='proximo_intento',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Próximo Intento'),
+        ),
+        migrations.AddIndex(
+            model_name='lognotificaciones',
+            index=models.Index(
+                condition=models.Q(('estado__in', ['pendiente', 'error'])),
+                fields=['proximo_intento', 'id'],
+                name='notif_outbox_por_enviar',
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated manually: cola de trabajos en segundo plano (cargas y exportaciones)
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventario', '0116_lognotificaciones_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoSegundoPlano',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=100, verbose_name='Tipo de trabajo')),
+                ('descripcion', models.CharField(blank=True, default='', max_length=255, verbose_name='Descripción')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('archivo_entrada', models.FileField(blank=True, upload_to='trabajos/entrada/%Y/%m/')),
+                ('archivo_resultado', models.FileField(blank=True, upload_to='trabajos/resultado/%Y/%m/')),
+                ('nombre_resultado', models.CharField(blank=True, default='', max_length=255)),
+                ('tipo_contenido', models.CharField(blank=True, default='', max_length=100)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('mensaje_error', models.TextField(blank=True, default='')),
+                ('progreso_actual', models.PositiveIntegerField(default=0)),
+                ('progreso_total', models.PositiveIntegerField(default=0)),
+                ('progreso_mensaje', models.CharField(blank=True, default='', max_length=255)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('trabajador', models.CharField(blank=True, default='', max_length=100)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('latido', models.DateTimeField(blank=True, help_text='Última señal de vida del proceso que lo ejecuta', null=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trabajos_segundo_plano', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo en segundo plano',
+                'verbose_name_plural': 'Trabajos en segundo plano',
+                'ordering': ['-fecha_creacion'],
+                'indexes': [
+                    models.Index(condition=models.Q(('estado', 'pendiente')), fields=['fecha_creacion', 'id'], name='trabajo_pendiente_fifo'),
+                    models.Index(fields=['usuario', '-fecha_creacion'], name='trabajo_usuario_fecha'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated manually: índices trigram sin acentos para búsquedas (inventario/busqueda_utils.py)
+
+from django.db import migrations
+
+# (tabla, columna): cada índice es GIN sobre inventario_sin_acentos(lower(columna)).
+COLUMNAS_BUSQUEDA = [
+    ('inventario_producto', 'clave_cnis'),
+    ('inventario_producto', 'descripcion'),
+    ('inventario_lote', 'numero_lote'),
+    ('inventario_ubicacionalmacen', 'codigo'),
+    ('inventario_ubicacionalmacen', 'descripcion'),
+    ('inventario_solicitudpedido', 'folio'),
+    ('inventario_solicitudpedido', 'observaciones_solicitud'),
+    ('inventario_institucion', 'nombre'),
+]
+
+
+def _nombre_indice(tabla, columna):
+    return f"{tabla.replace('inventario_', 'inv_')}_{columna}_trgm"[:63]
+
+
+def crear_indices(apps, schema_editor):
+    """Solo PostgreSQL: extensiones, función inmutable e índices GIN trigram."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    # unaccent() no es IMMUTABLE (depende del search_path); la envoltura fija el diccionario
+    # para poder usarla en índices de expresión.
+    schema_editor.execute(
+        "CREATE OR REPLACE FUNCTION inventario_sin_acentos(text) RETURNS text "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS "
+        "$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$"
+    )
+    for tabla, columna in COLUMNAS_BUSQUEDA:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {_nombre_indice(tabla, columna)} ON {tabla} '
+            f'USING gin (inventario_sin_acentos(lower({columna})) gin_trgm_ops)'
+        )
+
+
+def eliminar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for tabla, columna in COLUMNAS_BUSQUEDA:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {_nombre_indice(tabla, columna)}')
+    schema_editor.execute('DROP FUNCTION IF EXISTS inventario_sin_acentos(text)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0117_trabajosegundoplano'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
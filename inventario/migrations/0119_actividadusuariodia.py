@@ -0,0 +1,44 @@
+# Generated manually: conteo diario de actividades por usuario (reporte incremental)
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventario', '0118_busqueda_trigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActividadUsuarioDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actividad', models.CharField(max_length=80)),
+                ('fecha', models.DateField()),
+                ('total', models.PositiveIntegerField()),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actividad_diaria', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Actividad diaria de usuario',
+                'verbose_name_plural': 'Actividad diaria de usuarios',
+                'unique_together': {('usuario', 'actividad', 'fecha')},
+                'indexes': [models.Index(fields=['fecha'], name='actividad_usuario_fecha')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ControlActividadUsuarios',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_cierre', models.DateField(blank=True, null=True)),
+                ('ultima_ejecucion', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Control de actividad de usuarios',
+                'verbose_name_plural': 'Control de actividad de usuarios',
+            },
+        ),
+    ]
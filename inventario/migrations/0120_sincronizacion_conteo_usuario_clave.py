@@ -0,0 +1,22 @@
+# Generated manually: clave de idempotencia de conteos móviles única por usuario
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0119_actividadusuariodia'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sincronizacionconteomovil',
+            name='clave_idempotencia',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='sincronizacionconteomovil',
+            constraint=models.UniqueConstraint(fields=('usuario', 'clave_idempotencia'), name='sync_conteo_usuario_clave'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated manually: versión de las métricas en caché del dashboard
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0120_sincronizacion_conteo_usuario_clave'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControlDashboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Control del dashboard',
+                'verbose_name_plural': 'Control del dashboard',
+            },
+        ),
+    ]
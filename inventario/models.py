@@ -470,6 +470,16 @@ class Lote(models.Model):
         verbose_name_plural = "Lotes"
         ordering = ['-fecha_recepcion', 'fecha_caducidad']
         unique_together = ['numero_lote', 'producto', 'institucion']
+        indexes = [
+            # Asignación de propuestas / disponibilidad: lotes disponibles por clave y caducidad
+            models.Index(
+                fields=['producto', 'fecha_caducidad'],
+                condition=models.Q(estado=1),
+                name='lote_prod_cad_disponible',
+            ),
+            models.Index(fields=['producto', 'estado', 'fecha_caducidad'], name='lote_prod_estado_cad'),
+            models.Index(fields=['almacen', 'estado'], name='lote_almacen_estado'),
+        ]
 
     #def __str__(self):
         #return f"Lote {self.numero_lote} - {self.producto.clave_cnis}"
@@ -588,6 +598,25 @@ class MovimientoInventario(models.Model):
         verbose_name = "Movimiento de Inventario"
         verbose_name_plural = "Movimientos de Inventario"
         ordering = ['-fecha_movimiento']
+        indexes = [
+            # Kardex, saldos de cierre y existencia histórica: solo movimientos vigentes
+            models.Index(
+                fields=['lote', 'fecha_movimiento', 'id'],
+                condition=models.Q(anulado=False),
+                name='mov_lote_fecha_vigente',
+            ),
+            models.Index(
+                fields=['fecha_movimiento'],
+                condition=models.Q(anulado=False),
+                name='mov_fecha_vigente',
+            ),
+            models.Index(fields=['tipo_movimiento', 'fecha_movimiento'], name='mov_tipo_fecha'),
+            models.Index(
+                fields=['fecha_anulacion'],
+                condition=models.Q(anulado=True),
+                name='mov_fecha_anulacion',
+            ),
+        ]
 
     # ✅ Validación antes de guardar
     def save(self, *args, **kwargs):
@@ -644,6 +673,102 @@ class MovimientoInventario(models.Model):
         return self.es_salida_surtimiento_pedido and self.institucion_destino_id is not None
 
 
+class SaldoCierreLote(models.Model):
+    """
+    Saldo del lote al cierre de un día (snapshot del kardex).
+
+    Solo hay fila para los días en que el lote tuvo movimientos vigentes: el saldo es
+    ``cantidad_nueva`` del último movimiento no anulado (sin AJUSTE_DATOS_LOTE) del día.
+    Se llena de forma incremental con ``manage.py actualizar_saldos_cierre``.
+    """
+    lote = models.ForeignKey(Lote, on_delete=models.CASCADE, related_name='saldos_cierre')
+    fecha = models.DateField()
+    saldo = models.PositiveIntegerField()
+    ultimo_movimiento_id = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = "Saldo de cierre de lote"
+        verbose_name_plural = "Saldos de cierre de lote"
+        unique_together = ['lote', 'fecha']
+
+    def __str__(self):
+        return f"{self.lote} - {self.fecha}: {self.saldo}"
+
+
+class ControlSaldosCierre(models.Model):
+    """
+    Marca de avance de SaldoCierreLote (una sola fila, pk=1).
+    ``fecha_cierre``: último día completo consolidado; ``ultima_ejecucion`` sirve para
+    detectar anulaciones posteriores que afectan días ya cerrados.
+    """
+    fecha_cierre = models.DateField(blank=True, null=True)
+    ultima_ejecucion = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Control de saldos de cierre"
+        verbose_name_plural = "Control de saldos de cierre"
+
+    def __str__(self):
+        return f"Saldos cerrados hasta {self.fecha_cierre or '-'}"
+
+
+class ActividadUsuarioDia(models.Model):
+    """
+    Conteo diario de una actividad por usuario (p. ej. pedidos validados, movimientos).
+
+    Lo llena de forma incremental ``manage.py actualizar_actividad_usuarios`` para que el
+    reporte de usuarios sume estas filas en lugar de agrupar las tablas completas.
+    ``actividad`` es la clave de ``actividad_usuarios_utils.ACTIVIDADES``.
+    """
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='actividad_diaria')
+    actividad = models.CharField(max_length=80)
+    fecha = models.DateField()
+    total = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Actividad diaria de usuario"
+        verbose_name_plural = "Actividad diaria de usuarios"
+        unique_together = ['usuario', 'actividad', 'fecha']
+        indexes = [
+            models.Index(fields=['fecha'], name='actividad_usuario_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario_id} - {self.actividad} - {self.fecha}: {self.total}"
+
+
+class ControlActividadUsuarios(models.Model):
+    """
+    Marca de avance de ActividadUsuarioDia (una sola fila, pk=1).
+    ``fecha_cierre``: último día completo consolidado.
+    """
+    fecha_cierre = models.DateField(blank=True, null=True)
+    ultima_ejecucion = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Control de actividad de usuarios"
+        verbose_name_plural = "Control de actividad de usuarios"
+
+    def __str__(self):
+        return f"Actividad consolidada hasta {self.fecha_cierre or '-'}"
+
+
+class ControlDashboard(models.Model):
+    """
+    Versión de las métricas del dashboard (una sola fila, pk=1). Cada escritura que las
+    afecta la incrementa al confirmar; la versión va en la clave de caché, así que todos
+    los procesos (workers de gunicorn, procesar_trabajos) dejan de leer la entrada vieja.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Control del dashboard"
+        verbose_name_plural = "Control del dashboard"
+
+    def __str__(self):
+        return f"Dashboard v{self.version}"
+
+
 class AlertaCaducidad(models.Model):
     """Alertas de productos próximos a caducar"""
     TIPOS_ALERTA = [
@@ -1506,6 +1631,19 @@ class LogNotificaciones(models.Model):
         verbose_name="Usuario Relacionado"
     )
     
+    # Bandeja de salida: el despachador toma las pendientes/con error cuyo
+    # proximo_intento ya pasó (ver notificaciones_outbox_utils).
+    intentos = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Intentos de Envío"
+    )
+    
+    proximo_intento = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Próximo Intento"
+    )
+    
     class Meta:
         verbose_name = "Log de Notificaciones"
         verbose_name_plural = "Logs de Notificaciones"
@@ -1513,6 +1651,11 @@ class LogNotificaciones(models.Model):
         indexes = [
             models.Index(fields=['evento', '-fecha_envio']),
             models.Index(fields=['estado', '-fecha_envio']),
+            models.Index(
+                fields=['proximo_intento', 'id'],
+                name='notif_outbox_por_enviar',
+                condition=models.Q(estado__in=['pendiente', 'error']),
+            ),
         ]
     
     def __str__(self):
@@ -2043,6 +2186,11 @@ class LoteUbicacion(models.Model):
         default=0,
         verbose_name='Cantidad Reservada en Propuestas'
     )
+    # Libro de reservas: suma de LoteAsignado (surtido=False) mantenida por reservas_utils
+    reserva_activa = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Reserva activa (LoteAsignado sin surtir)'
+    )
     fecha_asignacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     usuario_asignacion = models.ForeignKey(
@@ -2058,6 +2206,21 @@ class LoteUbicacion(models.Model):
         verbose_name_plural = "Ubicaciones de Lotes"
         unique_together = ('lote', 'ubicacion')
         ordering = ['lote', 'ubicacion']
+        indexes = [
+            # Ubicaciones con existencia; INCLUDE solo aplica en PostgreSQL (index-only scans)
+            models.Index(
+                fields=['lote'],
+                condition=models.Q(cantidad__gt=0),
+                include=['ubicacion', 'cantidad', 'reserva_activa'],
+                name='loteubic_lote_con_exist',
+            ),
+            models.Index(
+                fields=['ubicacion'],
+                condition=models.Q(cantidad__gt=0),
+                include=['lote', 'cantidad'],
+                name='loteubic_ubic_con_exist',
+            ),
+        ]
 
     def __str__(self):
         return f"Lote {self.lote.numero_lote} - {self.ubicacion.codigo} ({self.cantidad} unidades)"
@@ -2149,8 +2312,14 @@ class LogSistema(models.Model):
     @classmethod
     def crear_log(cls, nivel, tipo, titulo, mensaje, usuario=None, url=None, 
                   ip_cliente=None, user_agent=None, detalles=None):
-        """Método helper para crear logs fácilmente"""
-        return cls.objects.create(
+        """
+        Método helper para crear logs fácilmente.
+        La escritura es diferida (ver inventario.logs_utils): devuelve la entrada encolada,
+        no una instancia guardada.
+        """
+        from .logs_utils import registrar_log
+
+        return registrar_log(
             nivel=nivel,
             tipo=tipo,
             titulo=titulo,
@@ -2159,7 +2328,7 @@ class LogSistema(models.Model):
             url=url,
             ip_cliente=ip_cliente,
             user_agent=user_agent,
-            detalles=detalles or {}
+            detalles=detalles,
         )
     
     @classmethod
@@ -2288,6 +2457,102 @@ class RegistroConteoFisico(models.Model):
         return f"{conteos_capturados}/3"
 
 
+class SincronizacionConteoMovil(models.Model):
+    """
+    Conteo recibido por ``POST /conteos/sync`` de la app móvil, identificado por la clave
+    de idempotencia que genera el dispositivo. Si el lote se reenvía (p. ej. tras un corte
+    de red) se devuelve el resultado guardado en lugar de aplicar el conteo otra vez.
+    La clave se reclama (fila con ``resultado`` provisional) antes de tocar existencias.
+    """
+    clave_idempotencia = models.CharField(max_length=64)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sincronizaciones_conteo')
+    lote_ubicacion = models.ForeignKey(
+        LoteUbicacion,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sincronizaciones_conteo',
+    )
+    resultado = models.JSONField(default=dict)
+    fecha_sincronizacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Sincronización de conteo móvil"
+        verbose_name_plural = "Sincronizaciones de conteo móvil"
+        ordering = ['-fecha_sincronizacion']
+        # La clave la genera el dispositivo: solo es única para el usuario que sincroniza.
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'clave_idempotencia'], name='sync_conteo_usuario_clave'),
+        ]
+
+    def __str__(self):
+        return f"{self.clave_idempotencia} - {self.usuario}"
+
+
+class TrabajoSegundoPlano(models.Model):
+    """
+    Trabajo largo (carga o exportación de Excel) que se ejecuta fuera del request.
+
+    La vista lo encola y redirige a una página que consulta su estado; el comando
+    ``procesar_trabajos`` lo toma y lo ejecuta en un pool de procesos. Ver trabajos_utils.
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+
+    tipo = models.CharField(max_length=100, verbose_name="Tipo de trabajo")
+    descripcion = models.CharField(max_length=255, blank=True, default='', verbose_name="Descripción")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente', verbose_name="Estado")
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trabajos_segundo_plano')
+    parametros = models.JSONField(default=dict, blank=True)
+    archivo_entrada = models.FileField(upload_to='trabajos/entrada/%Y/%m/', blank=True)
+    archivo_resultado = models.FileField(upload_to='trabajos/resultado/%Y/%m/', blank=True)
+    nombre_resultado = models.CharField(max_length=255, blank=True, default='')
+    tipo_contenido = models.CharField(max_length=100, blank=True, default='')
+    resultado = models.JSONField(null=True, blank=True)
+    mensaje_error = models.TextField(blank=True, default='')
+
+    progreso_actual = models.PositiveIntegerField(default=0)
+    progreso_total = models.PositiveIntegerField(default=0)
+    progreso_mensaje = models.CharField(max_length=255, blank=True, default='')
+
+    intentos = models.PositiveSmallIntegerField(default=0)
+    trabajador = models.CharField(max_length=100, blank=True, default='')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    latido = models.DateTimeField(null=True, blank=True, help_text="Última señal de vida del proceso que lo ejecuta")
+
+    class Meta:
+        verbose_name = "Trabajo en segundo plano"
+        verbose_name_plural = "Trabajos en segundo plano"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(
+                fields=['fecha_creacion', 'id'],
+                condition=models.Q(estado='pendiente'),
+                name='trabajo_pendiente_fifo',
+            ),
+            models.Index(fields=['usuario', '-fecha_creacion'], name='trabajo_usuario_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.estado})"
+
+    @property
+    def terminado(self):
+        return self.estado in ('completado', 'error')
+
+    @property
+    def porcentaje(self):
+        if not self.progreso_total:
+            return 100 if self.estado == 'completado' else 0
+        return min(100, round(self.progreso_actual * 100 / self.progreso_total))
+
+
 class ListaRevision(models.Model):
     """
     Lista de Revisión para validar entrada de citas.
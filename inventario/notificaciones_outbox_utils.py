@@ -0,0 +1,358 @@
+"""
+Bandeja de salida (outbox) de notificaciones.
+
+``ServicioNotificaciones.enviar_email`` / ``enviar_telegram`` ya no llaman a SMTP ni a la
+API de Telegram: solo crean el ``LogNotificaciones`` en estado ``pendiente`` dentro de la
+transacción de quien llama. Si esa transacción se revierte, la notificación desaparece con
+ella; si se confirma, el despachador la envía después, fuera del request y sin locks.
+
+Despacho (``despachar_pendientes``):
+
+- Reclama un lote de filas con ``SELECT ... FOR UPDATE SKIP LOCKED`` y las "arrienda"
+  moviendo ``proximo_intento`` ``NOTIFICACIONES_ARRENDAMIENTO`` segundos; varios
+  despachadores (workers, comando) no se pisan y una fila de un proceso caído se retoma.
+- Email: una sola conexión SMTP por lote.
+- Telegram: ``requests.Session`` con pool de conexiones; los mensajes del mismo chat se
+  agrupan en uno (hasta el límite de 4096 caracteres) y se respeta un intervalo mínimo
+  por chat (``NOTIFICACIONES_TELEGRAM_INTERVALO_CHAT``) y el ``retry_after`` de un 429.
+- Fallos: reintento con backoff exponencial (estado ``error``) hasta
+  ``NOTIFICACIONES_MAX_INTENTOS``; después, o ante un error permanente, ``fallida``.
+
+Quién despacha:
+
+- ``manage.py despachar_notificaciones --continuo``: proceso dedicado (recomendado en
+  producción, con ``NOTIFICACIONES_DESPACHO_EN_PROCESO = False``).
+- Con ``NOTIFICACIONES_DESPACHO_EN_PROCESO = True`` (default), un hilo de fondo por worker
+  se despierta con ``transaction.on_commit`` al encolar y revisa la cola cada
+  ``NOTIFICACIONES_INTERVALO`` segundos.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LOTE = getattr(settings, 'NOTIFICACIONES_LOTE', 50)
+MAX_INTENTOS = getattr(settings, 'NOTIFICACIONES_MAX_INTENTOS', 6)
+BACKOFF_BASE = getattr(settings, 'NOTIFICACIONES_BACKOFF_BASE', 30)
+BACKOFF_MAX = getattr(settings, 'NOTIFICACIONES_BACKOFF_MAX', 3600)
+ARRENDAMIENTO = getattr(settings, 'NOTIFICACIONES_ARRENDAMIENTO', 300)
+INTERVALO = getattr(settings, 'NOTIFICACIONES_INTERVALO', 30)
+TELEGRAM_INTERVALO_CHAT = getattr(settings, 'NOTIFICACIONES_TELEGRAM_INTERVALO_CHAT', 3.0)
+TELEGRAM_TIMEOUT = getattr(settings, 'NOTIFICACIONES_TELEGRAM_TIMEOUT', 10)
+DESPACHO_EN_PROCESO = getattr(settings, 'NOTIFICACIONES_DESPACHO_EN_PROCESO', True)
+
+TELEGRAM_MAX_CARACTERES = 4096
+SEPARADOR_TELEGRAM = '\n\n— — —\n\n'
+ESTADOS_POR_ENVIAR = ('pendiente', 'error')
+
+
+class EnvioFallido(Exception):
+    """Error de envío; ``permanente`` indica que reintentar no sirve."""
+
+    def __init__(self, mensaje, permanente=False, reintentar_en=None):
+        super().__init__(mensaje)
+        self.permanente = permanente
+        self.reintentar_en = reintentar_en
+
+
+# ---------------------------------------------------------------------------
+# Encolado
+# ---------------------------------------------------------------------------
+
+def encolar(**campos):
+    """Crea el LogNotificaciones pendiente en la transacción actual y agenda el despacho."""
+    from .models import LogNotificaciones
+
+    log = LogNotificaciones.objects.create(
+        estado='pendiente',
+        proximo_intento=timezone.now(),
+        **campos,
+    )
+    if DESPACHO_EN_PROCESO:
+        transaction.on_commit(despachador.despertar)
+    return log
+
+
+# ---------------------------------------------------------------------------
+# Transportes
+# ---------------------------------------------------------------------------
+
+_sesion = None
+_sesion_lock = threading.Lock()
+
+
+def sesion_http():
+    """Session compartida del proceso (keep-alive y pool de conexiones a la API de Telegram)."""
+    global _sesion
+    if _sesion is None:
+        with _sesion_lock:
+            if _sesion is None:
+                sesion = requests.Session()
+                sesion.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+                _sesion = sesion
+    return _sesion
+
+
+class LimitadorPorChat:
+    """Intervalo mínimo entre mensajes a un mismo chat (Telegram limita ~20/min por grupo)."""
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._siguiente = {}
+
+    def esperar(self, chat_id):
+        espera = self._siguiente.get(chat_id, 0) - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self._siguiente[chat_id] = time.monotonic() + self.intervalo
+
+    def bloquear(self, chat_id, segundos):
+        self._siguiente[chat_id] = time.monotonic() + segundos
+
+
+limitador_telegram = LimitadorPorChat(TELEGRAM_INTERVALO_CHAT)
+
+
+def _post_telegram(token, chat_id, texto):
+    try:
+        respuesta = sesion_http().post(
+            f'https://api.telegram.org/bot{token}/sendMessage',
+            json={'chat_id': chat_id, 'text': texto, 'parse_mode': 'Markdown'},
+            timeout=TELEGRAM_TIMEOUT,
+        )
+    except requests.RequestException as exc:
+        raise EnvioFallido(str(exc)) from exc
+    if respuesta.status_code == 200:
+        return
+    detalle = f'Error {respuesta.status_code}: {respuesta.text[:500]}'
+    if respuesta.status_code == 429:
+        try:
+            reintentar_en = int(respuesta.json()['parameters']['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            reintentar_en = BACKOFF_BASE
+        raise EnvioFallido(detalle, reintentar_en=reintentar_en)
+    # 4xx (chat inexistente, bot expulsado, Markdown inválido) no se arregla reintentando.
+    raise EnvioFallido(detalle, permanente=400 <= respuesta.status_code < 500)
+
+
+def _agrupar_mensajes(logs):
+    """Parte los logs de un chat en grupos cuyo texto unido cabe en un mensaje."""
+    grupos, actual, largo = [], [], 0
+    for log in logs:
+        extra = len(log.mensaje) + (len(SEPARADOR_TELEGRAM) if actual else 0)
+        if actual and largo + extra > TELEGRAM_MAX_CARACTERES:
+            grupos.append(actual)
+            actual, largo, extra = [], 0, len(log.mensaje)
+        actual.append(log)
+        largo += extra
+    if actual:
+        grupos.append(actual)
+    return grupos
+
+
+def _enviar_telegram(logs, config, resultados):
+    if not config or not config.telegram_token:
+        for log in logs:
+            resultados[log.id] = EnvioFallido('Telegram sin token configurado', permanente=True)
+        return
+
+    por_chat = {}
+    for log in logs:
+        por_chat.setdefault(log.destinatarios, []).append(log)
+
+    for chat_id, logs_chat in por_chat.items():
+        bloqueado = None
+        for grupo in _agrupar_mensajes(logs_chat):
+            if bloqueado:
+                for log in grupo:
+                    resultados[log.id] = bloqueado
+                continue
+            limitador_telegram.esperar(chat_id)
+            try:
+                _post_telegram(config.telegram_token, chat_id, SEPARADOR_TELEGRAM.join(l.mensaje for l in grupo))
+            except EnvioFallido as exc:
+                if exc.reintentar_en:
+                    # 429: el resto del chat espera lo que pide Telegram.
+                    limitador_telegram.bloquear(chat_id, exc.reintentar_en)
+                    bloqueado = exc
+                elif exc.permanente and len(grupo) > 1:
+                    # Un Markdown inválido rompe todo el grupo: se aíslan uno por uno.
+                    for log in grupo:
+                        limitador_telegram.esperar(chat_id)
+                        try:
+                            _post_telegram(config.telegram_token, chat_id, log.mensaje)
+                            resultados[log.id] = None
+                        except EnvioFallido as exc_individual:
+                            resultados[log.id] = exc_individual
+                    continue
+                for log in grupo:
+                    resultados[log.id] = exc
+                continue
+            for log in grupo:
+                resultados[log.id] = None
+
+
+def _enviar_emails(logs, config, resultados):
+    if not config or not config.email_remitente:
+        for log in logs:
+            resultados[log.id] = EnvioFallido('Email sin remitente configurado', permanente=True)
+        return
+    try:
+        conexion = get_connection(fail_silently=False)
+        conexion.open()
+    except Exception as exc:
+        for log in logs:
+            resultados[log.id] = EnvioFallido(str(exc))
+        return
+    try:
+        for log in logs:
+            correo = EmailMultiAlternatives(
+                subject=log.asunto,
+                body=log.mensaje,
+                from_email=config.email_remitente,
+                to=[d.strip() for d in log.destinatarios.split(',') if d.strip()],
+                connection=conexion,
+            )
+            correo.attach_alternative(log.mensaje, 'text/html')
+            try:
+                correo.send()
+                resultados[log.id] = None
+            except Exception as exc:
+                resultados[log.id] = EnvioFallido(str(exc))
+    finally:
+        conexion.close()
+
+
+# ---------------------------------------------------------------------------
+# Despacho
+# ---------------------------------------------------------------------------
+
+def calcular_backoff(intentos):
+    """Segundos de espera tras ``intentos`` fallidos: base · 2^(n-1), con tope."""
+    return min(BACKOFF_BASE * (2 ** max(intentos - 1, 0)), BACKOFF_MAX)
+
+
+def _reclamar(limite):
+    from .models import LogNotificaciones
+
+    ahora = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            LogNotificaciones.objects.select_for_update(skip_locked=True)
+            .filter(estado__in=ESTADOS_POR_ENVIAR, proximo_intento__lte=ahora)
+            .order_by('proximo_intento', 'id')
+            .values_list('id', flat=True)[:limite]
+        )
+        if ids:
+            LogNotificaciones.objects.filter(id__in=ids).update(
+                intentos=F('intentos') + 1,
+                proximo_intento=ahora + timedelta(seconds=ARRENDAMIENTO),
+            )
+    return list(LogNotificaciones.objects.filter(id__in=ids).order_by('id'))
+
+
+def despachar_pendientes(limite=None):
+    """
+    Envía un lote de notificaciones pendientes.
+
+    Returns:
+        dict: {'enviadas', 'reintentos', 'fallidas'}
+    """
+    from .models import ConfiguracionNotificaciones, LogNotificaciones
+
+    resumen = {'enviadas': 0, 'reintentos': 0, 'fallidas': 0}
+    logs = _reclamar(limite or LOTE)
+    if not logs:
+        return resumen
+
+    config = ConfiguracionNotificaciones.objects.first()
+    resultados = {}
+    _enviar_emails([l for l in logs if l.tipo == 'email'], config, resultados)
+    _enviar_telegram([l for l in logs if l.tipo == 'telegram'], config, resultados)
+
+    ahora = timezone.now()
+    for log in logs:
+        error = resultados.get(log.id, EnvioFallido(f'Tipo de notificación no soportado: {log.tipo}', permanente=True))
+        if error is None:
+            log.estado = 'enviada'
+            log.fecha_entrega = ahora
+            log.proximo_intento = None
+            log.respuesta = 'Enviada exitosamente'
+            resumen['enviadas'] += 1
+        elif error.permanente or log.intentos >= MAX_INTENTOS:
+            log.estado = 'fallida'
+            log.proximo_intento = None
+            log.respuesta = str(error)
+            resumen['fallidas'] += 1
+            logger.error('Notificación %s (%s) fallida tras %s intentos: %s', log.id, log.evento, log.intentos, error)
+        else:
+            log.estado = 'error'
+            log.proximo_intento = ahora + timedelta(seconds=error.reintentar_en or calcular_backoff(log.intentos))
+            log.respuesta = str(error)
+            resumen['reintentos'] += 1
+            logger.warning('Notificación %s (%s) se reintentará: %s', log.id, log.evento, error)
+    LogNotificaciones.objects.bulk_update(logs, ['estado', 'fecha_entrega', 'proximo_intento', 'respuesta'])
+    return resumen
+
+
+def despachar_todo():
+    """Despacha lotes hasta vaciar la cola de lo que ya toca enviar."""
+    total = {'enviadas': 0, 'reintentos': 0, 'fallidas': 0}
+    while True:
+        resumen = despachar_pendientes()
+        for clave, valor in resumen.items():
+            total[clave] += valor
+        if sum(resumen.values()) < LOTE:
+            return total
+
+
+class DespachadorEnProceso:
+    """Hilo de fondo por proceso que despacha la cola al encolar y cada INTERVALO segundos."""
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+
+    def despertar(self):
+        self._asegurar_hilo()
+        self._evento.set()
+
+    def _asegurar_hilo(self):
+        # Tras un fork (workers de gunicorn) el hilo del padre no existe en el hijo.
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._ciclo, name='notificaciones-outbox', daemon=True)
+            self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            self._evento.wait(INTERVALO)
+            self._evento.clear()
+            close_old_connections()
+            try:
+                despachar_todo()
+            except Exception:
+                logger.exception('Error al despachar notificaciones')
+            finally:
+                close_old_connections()
+
+
+despachador = DespachadorEnProceso()
@@ -0,0 +1,148 @@
+"""
+Ocupación de ubicaciones de almacén (reporte de ubicaciones vacías, decisiones de acomodo).
+
+El reporte de ubicaciones vacías cargaba todas las UbicacionAlmacen y hacía un
+``LoteUbicacion...exists()`` por cada una, luego filtraba y paginaba una lista en Python
+(y las exportaciones repetían lo mismo). Aquí todo va en SQL:
+
+- ``ubicaciones_vacias``: anti-join ``NOT EXISTS`` contra LoteUbicacion, con los filtros
+  en el WHERE; la vista pagina el queryset (COUNT + LIMIT).
+- ``ubicaciones_con_ocupacion``: cada ubicación anotada con sus lotes, unidades y reserva
+  activa (subconsultas correlacionadas) y su ``ocupacion``: ``vacia`` (sin lotes),
+  ``ocupada`` o ``reservada`` (parte de sus unidades comprometidas en propuestas).
+- ``resumen_ocupacion``: por almacén y rack, posiciones, vacías, ocupadas, con reserva,
+  unidades y porcentaje de posiciones ocupadas, en una consulta agrupada.
+
+Vacía = sin ningún registro en LoteUbicacion (mismo criterio que el reporte original).
+"""
+
+from django.db.models import (
+    Case, CharField, Count, Exists, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
+
+from .busqueda_utils import filtrar
+from .models import LoteUbicacion, UbicacionAlmacen
+from .ruta_picking_utils import clave_natural
+
+OCUPACION_VACIA = 'vacia'
+OCUPACION_OCUPADA = 'ocupada'
+OCUPACION_RESERVADA = 'reservada'
+ESTADOS_OCUPACION = [
+    (OCUPACION_VACIA, 'Vacía'),
+    (OCUPACION_OCUPADA, 'Ocupada'),
+    (OCUPACION_RESERVADA, 'Parcialmente reservada'),
+]
+SIN_RACK = 'Sin rack'
+
+
+def _codigo_estado(estado):
+    """Acepta el valor (``disponible``) o la etiqueta (``Disponible``) del estado de la ubicación."""
+    for valor, etiqueta in UbicacionAlmacen.ESTADOS_UBICACION:
+        if estado in (valor, etiqueta):
+            return valor
+    return estado
+
+
+def filtrar_ubicaciones(ubicaciones, almacen_id=None, institucion_id=None, codigo='', estado=''):
+    """Filtros del reporte (código, almacén, institución, estado) aplicados en la consulta."""
+    if almacen_id:
+        ubicaciones = ubicaciones.filter(almacen_id=almacen_id)
+    if institucion_id:
+        ubicaciones = ubicaciones.filter(almacen__institucion_id=institucion_id)
+    if estado:
+        ubicaciones = ubicaciones.filter(estado=_codigo_estado(estado))
+    if codigo:
+        ubicaciones = filtrar(ubicaciones, codigo, campos=('codigo',))
+    return ubicaciones
+
+
+def _tiene_lotes():
+    return Exists(LoteUbicacion.objects.filter(ubicacion_id=OuterRef('pk')))
+
+
+def _suma_lotes(campo):
+    return Coalesce(Subquery(
+        LoteUbicacion.objects.filter(ubicacion_id=OuterRef('pk'))
+        .order_by()
+        .values('ubicacion_id')
+        .annotate(t=Sum(campo))
+        .values('t'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def ubicaciones_vacias(**filtros):
+    """Ubicaciones sin ningún LoteUbicacion (``NOT EXISTS``), con almacén e institución."""
+    ubicaciones = UbicacionAlmacen.objects.select_related('almacen__institucion').filter(~_tiene_lotes())
+    return filtrar_ubicaciones(ubicaciones, **filtros)
+
+
+def ubicaciones_con_ocupacion(ocupacion=None, **filtros):
+    """
+    Ubicaciones anotadas con ``tiene_lotes``, ``unidades``, ``reservadas`` (reserva activa) y
+    ``ocupacion``; ``ocupacion`` filtra por una de ESTADOS_OCUPACION.
+    """
+    ubicaciones = filtrar_ubicaciones(UbicacionAlmacen.objects.all(), **filtros).annotate(
+        tiene_lotes=_tiene_lotes(),
+        unidades=_suma_lotes('cantidad'),
+        reservadas=_suma_lotes('reserva_activa'),
+    ).annotate(
+        ocupacion=Case(
+            When(tiene_lotes=False, then=Value(OCUPACION_VACIA)),
+            When(reservadas__gt=0, then=Value(OCUPACION_RESERVADA)),
+            default=Value(OCUPACION_OCUPADA),
+            output_field=CharField(),
+        ),
+    )
+    if ocupacion:
+        ubicaciones = ubicaciones.filter(ocupacion=ocupacion)
+    return ubicaciones
+
+
+def resumen_ocupacion(**filtros):
+    """
+    Ocupación por (almacén, rack): lista de dicts con ``almacen_id``, ``almacen``, ``rack``,
+    ``posiciones``, ``vacias``, ``ocupadas``, ``reservadas``, ``unidades``,
+    ``unidades_reservadas`` y ``porcentaje_ocupado`` (posiciones con lotes / posiciones).
+    """
+    filas = (
+        ubicaciones_con_ocupacion(**filtros)
+        .order_by()
+        .values('almacen_id', 'almacen__nombre', 'rack')
+        .annotate(
+            posiciones=Count('pk'),
+            vacias=Count('pk', filter=Q(ocupacion=OCUPACION_VACIA)),
+            ocupadas=Count('pk', filter=Q(ocupacion=OCUPACION_OCUPADA)),
+            con_reserva=Count('pk', filter=Q(ocupacion=OCUPACION_RESERVADA)),
+            total_unidades=Sum('unidades'),
+            total_reservadas=Sum('reservadas'),
+        )
+    )
+    resumen = {}
+    for fila in filas:
+        # rack vacío y NULL caen en el mismo grupo
+        rack = (fila['rack'] or '').strip() or SIN_RACK
+        grupo = resumen.setdefault((fila['almacen_id'], rack), {
+            'almacen_id': fila['almacen_id'],
+            'almacen': fila['almacen__nombre'],
+            'rack': rack,
+            'posiciones': 0,
+            'vacias': 0,
+            'ocupadas': 0,
+            'reservadas': 0,
+            'unidades': 0,
+            'unidades_reservadas': 0,
+        })
+        grupo['posiciones'] += fila['posiciones']
+        grupo['vacias'] += fila['vacias']
+        grupo['ocupadas'] += fila['ocupadas']
+        grupo['reservadas'] += fila['con_reserva']
+        grupo['unidades'] += fila['total_unidades'] or 0
+        grupo['unidades_reservadas'] += fila['total_reservadas'] or 0
+
+    salida = sorted(resumen.values(), key=lambda g: (g['almacen'], g['almacen_id'], clave_natural(g['rack'])))
+    for grupo in salida:
+        usadas = grupo['posiciones'] - grupo['vacias']
+        grupo['porcentaje_ocupado'] = round(usadas * 100 / grupo['posiciones'], 1) if grupo['posiciones'] else 0
+    return salida
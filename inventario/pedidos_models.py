@@ -5,7 +5,7 @@ Estos modelos se han separado para facilitar el mantenimiento y la claridad.
 '''
 
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.utils import timezone
@@ -311,6 +311,12 @@ class LoteAsignado(models.Model):
     def __str__(self):
         return f"{self.lote_ubicacion.lote.numero_lote} - {self.cantidad_asignada} Unidades"
 
+    def save(self, *args, **kwargs):
+        # pre_save bloquea la fila y post_save aplica el delta de reserva_activa
+        # (reservas_utils): ambos deben quedar en la misma transacción que el UPDATE.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class ProductoNoDisponibleAlmacen(models.Model):
     """
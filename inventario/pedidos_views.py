@@ -31,7 +31,7 @@ from .propuesta_generator import PropuestaGenerator
 from .propuesta_utils import (
     cancelar_propuesta,
     eliminar_propuesta,
-    validar_disponibilidad_para_propuesta,
+    disponibilidad_neta_por_producto,
     validar_disponibilidad_solicitud,
     cantidad_surtida_registrada_item,
     sincronizar_cantidades_surtidas_items_propuesta,
@@ -66,18 +66,10 @@ def _disponible_neta_lote_ubicacion(lu):
     cantidad física de la ubicación − suma de LoteAsignado activos (surtido=False).
 
     Nota: no usar `cantidad_reservada` persistida, porque puede desfasarse
-    respecto al estado real de las asignaciones.
+    respecto al estado real de las asignaciones; se usa el libro `reserva_activa`.
     """
     try:
-        from .pedidos_models import LoteAsignado
-
-        reservada_activa = (
-            LoteAsignado.objects.filter(lote_ubicacion=lu, surtido=False)
-            .aggregate(total=Sum('cantidad_asignada'))
-            .get('total')
-            or 0
-        )
-        return max(0, int(lu.cantidad) - int(reservada_activa))
+        return max(0, int(lu.cantidad) - int(lu.reserva_activa or 0))
     except (TypeError, ValueError):
         return 0
 
@@ -577,13 +569,17 @@ def validar_solicitud(request, solicitud_id):
                 items_sin_disponibilidad = []
                 items_con_disponibilidad = []
                 
+                # Disponibilidad de todas las claves en una sola consulta agrupada
+                netos = disponibilidad_neta_por_producto(
+                    item.producto_id for item in solicitud.items.all() if item.cantidad_aprobada > 0
+                )
                 for item in solicitud.items.all():
                     if item.cantidad_aprobada > 0:
-                        resultado = validar_disponibilidad_para_propuesta(
-                            item.producto.id,
-                            item.cantidad_aprobada,
-                            solicitud.institucion_solicitante.id
-                        )
+                        cantidad_disponible = netos.get(item.producto_id, 0)
+                        resultado = {
+                            'disponible': cantidad_disponible >= item.cantidad_aprobada,
+                            'cantidad_disponible': cantidad_disponible,
+                        }
                         
                         # Solo excluir si NO hay disponibilidad en absoluto (cantidad_disponible == 0)
                         # Si hay disponibilidad parcial, mantener cantidad_aprobada para que el algoritmo
@@ -2014,17 +2010,14 @@ def editar_solicitud(request, solicitud_id):
             
             # Si es VALIDADA, validar disponibilidad y generar propuesta
             errores_disponibilidad = []
-            for item in solicitud.items.all():
-                if item.cantidad_aprobada > 0:
-                    resultado = validar_disponibilidad_para_propuesta(
-                        item.producto.id,
-                        item.cantidad_aprobada,
-                        solicitud.institucion_solicitante.id
+            items_aprobados = [item for item in solicitud.items.all() if item.cantidad_aprobada > 0]
+            netos = disponibilidad_neta_por_producto(item.producto_id for item in items_aprobados)
+            for item in items_aprobados:
+                cantidad_disponible = netos.get(item.producto_id, 0)
+                if cantidad_disponible < item.cantidad_aprobada:
+                    errores_disponibilidad.append(
+                        f"Producto {item.producto.clave_cnis}: Se requieren {item.cantidad_aprobada} pero solo hay {cantidad_disponible} disponibles."
                     )
-                    if not resultado['disponible']:
-                        errores_disponibilidad.append(
-                            f"Producto {item.producto.clave_cnis}: Se requieren {item.cantidad_aprobada} pero solo hay {resultado['cantidad_disponible']} disponibles."
-                        )
             
             if errores_disponibilidad:
                 messages.error(request, "No se puede generar la propuesta por falta de disponibilidad:")
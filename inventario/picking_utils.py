@@ -0,0 +1,92 @@
+"""
+Cola de picking: propuestas REVISADA / EN_SURTIMIENTO con sus contadores de avance.
+
+``dashboard_picking`` hacía ``prop.items.count()`` y ``prop.items.filter(...).count()`` por
+cada propuesta de la cola (2 consultas por tarjeta, sin paginar). ``cola_picking`` devuelve
+las propuestas anotadas en una sola consulta agrupada:
+
+- ``total_items`` / ``items_pendientes`` (DISPONIBLE o PARCIAL) / ``items_completados``
+- ``lineas_pendientes``: LoteAsignado sin surtir
+- ``ubicaciones_pendientes``: ubicaciones distintas que faltan por visitar
+
+``estado_cola`` arma la versión JSON de una página de la cola y su ETag, para que las
+tablets consulten cambios con ``If-None-Match`` (respuesta 304 sin cuerpo) en lugar de
+recargar la página completa.
+"""
+
+import hashlib
+import json
+
+from django.core.paginator import Paginator
+from django.db.models import Count, Q
+
+from .busqueda_utils import filtrar
+from .pedidos_models import PropuestaPedido
+
+ESTADOS_COLA = ('REVISADA', 'EN_SURTIMIENTO')
+ESTADOS_ITEM_PENDIENTE = ('DISPONIBLE', 'PARCIAL')
+PROPUESTAS_POR_PAGINA = 24
+
+
+def cola_picking(almacen_id=None, estado=None, busqueda=''):
+    """Queryset de la cola con los contadores anotados (una consulta por página)."""
+    propuestas = PropuestaPedido.objects.filter(estado__in=ESTADOS_COLA)
+    if almacen_id:
+        propuestas = propuestas.filter(solicitud__almacen_destino_id=almacen_id)
+    if estado:
+        propuestas = propuestas.filter(estado=estado)
+    if busqueda:
+        propuestas = filtrar(propuestas, busqueda, campos=(
+            'solicitud__observaciones_solicitud',
+            'solicitud__folio',
+            'solicitud__institucion_solicitante__nombre',
+        ))
+
+    # items x lotes_asignados multiplica filas: todos los conteos son distinct.
+    sin_surtir = Q(items__lotes_asignados__surtido=False)
+    total_items = Count('items', distinct=True)
+    items_pendientes = Count('items', filter=Q(items__estado__in=ESTADOS_ITEM_PENDIENTE), distinct=True)
+    return (
+        propuestas
+        .select_related('solicitud__institucion_solicitante')
+        .annotate(
+            total_items=total_items,
+            items_pendientes=items_pendientes,
+            items_completados=total_items - items_pendientes,
+            lineas_pendientes=Count('items__lotes_asignados', filter=sin_surtir, distinct=True),
+            ubicaciones_pendientes=Count(
+                'items__lotes_asignados__lote_ubicacion__ubicacion', filter=sin_surtir, distinct=True
+            ),
+        )
+        .order_by('-fecha_generacion', 'id')
+    )
+
+
+def pagina_cola(request, propuestas):
+    return Paginator(propuestas, PROPUESTAS_POR_PAGINA).get_page(request.GET.get('page'))
+
+
+def _fila_json(propuesta):
+    return {
+        'id': str(propuesta.id),
+        'folio': propuesta.solicitud.folio,
+        'folio_pedido': propuesta.solicitud.observaciones_solicitud or '',
+        'estado': propuesta.estado,
+        'total_items': propuesta.total_items,
+        'items_pendientes': propuesta.items_pendientes,
+        'items_completados': propuesta.items_completados,
+        'lineas_pendientes': propuesta.lineas_pendientes,
+        'ubicaciones_pendientes': propuesta.ubicaciones_pendientes,
+    }
+
+
+def estado_cola(page_obj):
+    """(datos JSON de la página, ETag) — el ETag cambia si cambia cualquier contador."""
+    datos = {
+        'total': page_obj.paginator.count,
+        'pagina': page_obj.number,
+        'paginas': page_obj.paginator.num_pages,
+        'propuestas': [_fila_json(p) for p in page_obj],
+    }
+    firma = hashlib.sha1(json.dumps(datos, sort_keys=True).encode()).hexdigest()
+    return datos, f'"{firma}"'
@@ -7,14 +7,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse, HttpResponse
-from django.db.models import Q, F
+from django.db.models import Count, F, Max, Q
+from django.contrib.auth import get_user_model
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.template.loader import get_template
 from django.conf import settings
 from datetime import datetime, timedelta
-import re
 from xhtml2pdf import pisa
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
@@ -22,6 +23,8 @@ from io import BytesIO
 import os
 
 from .pedidos_models import PropuestaPedido, ItemPropuesta, LoteAsignado
+from .picking_utils import cola_picking, estado_cola, pagina_cola
+from .ruta_picking_utils import clave_natural, ordenar_lineas
 from .models import Lote, LoteUbicacion, UbicacionAlmacen, Almacen, MovimientoInventario
 from django.urls import reverse
 from .decorators_roles import requiere_rol
@@ -31,23 +34,54 @@ from .propuesta_utils import reservar_cantidad_lote, liberar_cantidad_lote
 from django.db import transaction
 
 
-def _natural_sort_key_codigo(codigo):
+# Renglones del detalle de picking electrónico en el monitor (los más recientes).
+MAX_DETALLE_MONITOR = 500
+
+
+def _lineas_picking(propuesta, user):
     """
-    Genera una clave de ordenamiento natural para códigos de ubicación
-    (ej. J6A.01.02, J6A.01.03, J6A.01.10) para que ordenen correctamente.
+    Líneas pendientes de recoger (LoteAsignado sin surtir) de la propuesta, en una consulta.
+    Usuarios que no son administradores ni supervisores sólo ven las de su almacén.
     """
-    if not codigo:
-        return (0, 0)
-    parts = re.split(r'(\d+)', str(codigo))
-    result = []
-    for part in parts:
-        if not part:
-            continue
-        if part.isdigit():
-            result.append((1, int(part)))
-        else:
-            result.append((0, part))
-    return tuple(result)
+    # Verificar si el usuario es administrador o supervisor
+    es_administrador = user.is_staff or user.is_superuser
+    es_supervisor = user.groups.filter(name='Supervisor').exists()
+    puede_ver_todo = es_administrador or es_supervisor
+    
+    # Obtener almacén del usuario si no es administrador ni supervisor
+    almacen_usuario_id = None
+    if not puede_ver_todo and hasattr(user, 'almacen') and user.almacen:
+        almacen_usuario_id = user.almacen.id
+    
+    # defer('usuario_surtido') por si la columna no existe aún en la BD
+    asignaciones = (
+        LoteAsignado.objects
+        .filter(item_propuesta__propuesta=propuesta, surtido=False)
+        .select_related('lote_ubicacion__lote__producto', 'lote_ubicacion__ubicacion__almacen')
+        .defer('usuario_surtido')
+    )
+    if almacen_usuario_id:
+        asignaciones = asignaciones.filter(lote_ubicacion__ubicacion__almacen_id=almacen_usuario_id)
+    
+    items_picking = []
+    for lote_asignado in asignaciones:
+        lote_ubicacion = lote_asignado.lote_ubicacion
+        lote = lote_ubicacion.lote
+        caducidad = lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else 'N/A'
+        items_picking.append({
+            'item_id': lote_asignado.item_propuesta_id,
+            'lote_asignado_id': lote_asignado.id,
+            'producto': lote.producto.descripcion,
+            'cantidad': lote_asignado.cantidad_asignada,
+            'lote_numero': lote.numero_lote,
+            'almacen': lote_ubicacion.ubicacion.almacen.nombre,
+            'almacen_id': lote_ubicacion.ubicacion.almacen_id,
+            'ubicacion': lote_ubicacion.ubicacion.codigo,
+            'ubicacion_id': lote_ubicacion.ubicacion_id,
+            'clave_cnis': lote.producto.clave_cnis,
+            'caducidad': caducidad,
+        })
+    return items_picking
 
 
 # ============================================================
@@ -61,44 +95,17 @@ def dashboard_picking(request):
     Optimizado para tablet
     """
     
-    # Obtener propuestas en estado REVISADA o EN_SURTIMIENTO
-    propuestas = PropuestaPedido.objects.filter(
-        estado__in=['REVISADA', 'EN_SURTIMIENTO']
-    ).select_related('solicitud').order_by('-fecha_generacion')
-    
-    # Filtros
-    almacen_filter = request.GET.get('almacen')
-    if almacen_filter:
-        propuestas = propuestas.filter(solicitud__almacen_destino_id=almacen_filter)
-    
-    estado_filter = request.GET.get('estado')
-    if estado_filter:
-        propuestas = propuestas.filter(estado=estado_filter)
-    
-    # Búsqueda
-    busqueda = request.GET.get('q', '').strip()
-    if busqueda:
-        propuestas = propuestas.filter(
-            Q(solicitud__observaciones_solicitud__icontains=busqueda) |
-            Q(solicitud__folio__icontains=busqueda) |
-            Q(solicitud__institucion_solicitante__nombre__icontains=busqueda)
-        )
-    
-    # Contar items por propuesta
-    propuestas_con_items = []
-    for prop in propuestas:
-        total_items = prop.items.count()
-        propuestas_con_items.append({
-            'propuesta': prop,
-            'total_items': total_items,
-            'items_pendientes': prop.items.filter(estado__in=['DISPONIBLE', 'PARCIAL']).count()
-        })
+    almacen_filter, estado_filter, busqueda = _filtros_cola(request)
+    page_obj = pagina_cola(request, cola_picking(almacen_filter, estado_filter, busqueda))
+    _, etag = estado_cola(page_obj)
     
     # Obtener almacenes para filtro
     almacenes = Almacen.objects.all()
     
     context = {
-        'propuestas': propuestas_con_items,
+        'propuestas': page_obj,
+        'page_obj': page_obj,
+        'etag_cola': etag,
         'almacenes': almacenes,
         'almacen_filter': almacen_filter,
         'estado_filter': estado_filter,
@@ -108,6 +115,31 @@ def dashboard_picking(request):
     return render(request, 'inventario/picking/dashboard_picking.html', context)
 
 
+def _filtros_cola(request):
+    return (
+        request.GET.get('almacen'),
+        request.GET.get('estado'),
+        request.GET.get('q', '').strip(),
+    )
+
+
+@requiere_rol('Almacenista', 'Administrador', 'Gestor de Inventario')
+@require_http_methods(["GET"])
+def estado_cola_picking(request):
+    """
+    JSON de la cola de picking (mismos filtros y página que el dashboard) con ETag:
+    las tablets consultan con If-None-Match y reciben 304 si nada cambió.
+    """
+    almacen_filter, estado_filter, busqueda = _filtros_cola(request)
+    page_obj = pagina_cola(request, cola_picking(almacen_filter, estado_filter, busqueda))
+    datos, etag = estado_cola(page_obj)
+
+    respuesta = get_conditional_response(request, etag=etag) or JsonResponse(datos)
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+
 # ============================================================
 # MONITOR DE PICKING (electrónico vs manual)
 # ============================================================
@@ -125,64 +157,54 @@ def monitor_picking(request):
     ultimas_24h = ahora - timedelta(hours=24)
     ultimas_2h = ahora - timedelta(hours=2)
 
-    # --- Picking electrónico: detalle de cada ítem recogido (folio pedido = observaciones, insumos, ubicaciones)
-    recogidas_electronicas = (
-        LoteAsignado.objects
-        .filter(surtido=True, usuario_surtido__isnull=False, fecha_surtimiento__gte=ultimas_24h)
-        .select_related(
-            'usuario_surtido',
-            'item_propuesta__propuesta__solicitud',
-            'lote_ubicacion__ubicacion__almacen',
-            'lote_ubicacion__lote__producto',
-        )
-        .order_by('-fecha_surtimiento')
+    # --- Picking electrónico: resumen por usuario agrupado en BD
+    recogidas_electronicas = LoteAsignado.objects.filter(
+        surtido=True, usuario_surtido__isnull=False, fecha_surtimiento__gte=ultimas_24h
     )
-
-    # Lista detallada: folio pedido (observaciones), insumos con ubicaciones
-    detalle_electronicos = []
-    usuarios_electronicos = {}
-    for la in recogidas_electronicas:
-        solicitud = la.item_propuesta.propuesta.solicitud if la.item_propuesta and la.item_propuesta.propuesta else None
-        folio_pedido = (solicitud.observaciones_solicitud or '').strip() if solicitud else ''
-        folio_solicitud = solicitud.folio if solicitud else '—'
-        lu = la.lote_ubicacion
-        producto = lu.lote.producto if lu and lu.lote else None
-        insumo = producto.descripcion if producto else '—'
-        clave_cnis = producto.clave_cnis if producto else '—'
-        ubicacion = lu.ubicacion.codigo if lu and lu.ubicacion else '—'
-        almacen = lu.ubicacion.almacen.nombre if lu and lu.ubicacion and lu.ubicacion.almacen else '—'
-
-        detalle_electronicos.append({
-            'usuario': la.usuario_surtido,
-            'folio_pedido': folio_pedido or '—',
-            'folio_solicitud': folio_solicitud,
-            'insumo': insumo,
-            'clave_cnis': clave_cnis,
-            'ubicacion': ubicacion,
-            'almacen': almacen,
-            'cantidad': la.cantidad_asignada,
-            'fecha_surtimiento': la.fecha_surtimiento,
-        })
-
-        u = la.usuario_surtido
-        if u not in usuarios_electronicos:
-            usuarios_electronicos[u] = {'total_items': 0, 'ultima_actividad': la.fecha_surtimiento}
-        usuarios_electronicos[u]['total_items'] += 1
-        usuarios_electronicos[u]['ultima_actividad'] = max(
-            usuarios_electronicos[u]['ultima_actividad'] or la.fecha_surtimiento,
-            la.fecha_surtimiento
-        )
+    por_usuario = list(
+        recogidas_electronicas.order_by()
+        .values('usuario_surtido_id')
+        .annotate(total_items=Count('id'), ultima_actividad=Max('fecha_surtimiento'))
+    )
+    usuarios = get_user_model().objects.in_bulk([fila['usuario_surtido_id'] for fila in por_usuario])
 
     lista_electronicos = [
         {
-            'usuario': u,
-            'total_items': datos['total_items'],
-            'ultima_actividad': datos['ultima_actividad'],
-            'activo_reciente': (datos['ultima_actividad'] or ahora) >= ultimas_2h,
+            'usuario': usuarios.get(fila['usuario_surtido_id']),
+            'total_items': fila['total_items'],
+            'ultima_actividad': fila['ultima_actividad'],
+            'activo_reciente': (fila['ultima_actividad'] or ahora) >= ultimas_2h,
         }
-        for u, datos in usuarios_electronicos.items()
+        for fila in por_usuario
     ]
     lista_electronicos.sort(key=lambda x: (not x['activo_reciente'], -(x['ultima_actividad'] or ahora).timestamp()))
+    total_electronicos = sum(fila['total_items'] for fila in por_usuario)
+
+    # Lista detallada (las más recientes): folio pedido (observaciones), insumos con ubicaciones
+    detalle_electronicos = [
+        {
+            'usuario': usuarios.get(fila['usuario_surtido_id']),
+            'folio_pedido': (fila['item_propuesta__propuesta__solicitud__observaciones_solicitud'] or '').strip() or '—',
+            'folio_solicitud': fila['item_propuesta__propuesta__solicitud__folio'] or '—',
+            'insumo': fila['lote_ubicacion__lote__producto__descripcion'] or '—',
+            'clave_cnis': fila['lote_ubicacion__lote__producto__clave_cnis'] or '—',
+            'ubicacion': fila['lote_ubicacion__ubicacion__codigo'] or '—',
+            'almacen': fila['lote_ubicacion__ubicacion__almacen__nombre'] or '—',
+            'cantidad': fila['cantidad_asignada'],
+            'fecha_surtimiento': fila['fecha_surtimiento'],
+        }
+        for fila in recogidas_electronicas.order_by('-fecha_surtimiento').values(
+            'usuario_surtido_id',
+            'item_propuesta__propuesta__solicitud__observaciones_solicitud',
+            'item_propuesta__propuesta__solicitud__folio',
+            'lote_ubicacion__lote__producto__descripcion',
+            'lote_ubicacion__lote__producto__clave_cnis',
+            'lote_ubicacion__ubicacion__codigo',
+            'lote_ubicacion__ubicacion__almacen__nombre',
+            'cantidad_asignada',
+            'fecha_surtimiento',
+        )[:MAX_DETALLE_MONITOR]
+    ]
 
     # --- Picking manual: propuestas SURTIDA donde ningún ítem fue recogido por usuario (surtida vía "Surtir propuesta")
     # Propuestas que tienen al menos un LoteAsignado con usuario_surtido no null = tuvieron picking electrónico
@@ -203,6 +225,7 @@ def monitor_picking(request):
     context = {
         'lista_electronicos': lista_electronicos,
         'detalle_electronicos': detalle_electronicos,
+        'total_electronicos': total_electronicos,
         'propuestas_manuales': propuestas_manuales,
         'ultimas_24h': ultimas_24h,
         'ultimas_2h': ultimas_2h,
@@ -228,7 +251,7 @@ def redirect_picking_propuesta_a_logistica(request, propuesta_id):
 def picking_propuesta(request, propuesta_id):
     """
     Vista optimizada de picking para tablet/pantalla
-    Muestra los items ordenados por ubicación
+    Muestra los items en orden de recorrido (ruta_picking_utils) o por ubicación/producto/cantidad
     """
     
     propuesta = get_object_or_404(PropuestaPedido, id=propuesta_id)
@@ -239,58 +262,23 @@ def picking_propuesta(request, propuesta_id):
         return redirect('logistica:detalle_propuesta', propuesta_id=propuesta_id)
     
     # Obtener orden de picking
-    orden_picking = request.GET.get('orden', 'ubicacion')  # ubicacion, producto, cantidad
-    
-    # Obtener items de la propuesta con lotes asignados
-    items_picking = []
+    orden_picking = request.GET.get('orden', 'ruta')  # ruta, ubicacion, producto, cantidad
     
-    # Verificar si el usuario es administrador o supervisor
-    es_administrador = request.user.is_staff or request.user.is_superuser
-    es_supervisor = request.user.groups.filter(name='Supervisor').exists()
-    puede_ver_todo = es_administrador or es_supervisor
-    
-    # Obtener almacén del usuario si no es administrador ni supervisor
-    almacen_usuario_id = None
-    if not puede_ver_todo and hasattr(request.user, 'almacen') and request.user.almacen:
-        almacen_usuario_id = request.user.almacen.id
-    
-    for item in propuesta.items.all():
-        # defer('usuario_surtido') por si la columna no existe aún en la BD
-        for lote_asignado in item.lotes_asignados.filter(surtido=False).defer('usuario_surtido'):
-            lote_ubicacion = lote_asignado.lote_ubicacion
-            lote = lote_ubicacion.lote
-            
-            # Filtrar por almacén del usuario si no es administrador ni supervisor
-            if not puede_ver_todo and almacen_usuario_id:
-                if lote_ubicacion.ubicacion.almacen_id != almacen_usuario_id:
-                    continue  # Saltar este item si no pertenece al almacén del usuario
-            
-            caducidad = lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else 'N/A'
-            items_picking.append({
-                'item_id': item.id,
-                'lote_asignado_id': lote_asignado.id,
-                'producto': lote.producto.descripcion,
-                'cantidad': lote_asignado.cantidad_asignada,
-                'lote_numero': lote.numero_lote,
-                'almacen': lote_ubicacion.ubicacion.almacen.nombre,
-                'almacen_id': lote_ubicacion.ubicacion.almacen_id,
-                'ubicacion': lote_ubicacion.ubicacion.codigo,
-                'ubicacion_id': lote_ubicacion.ubicacion_id,
-                'clave_cnis': lote.producto.clave_cnis,
-                'caducidad': caducidad,
-            })
+    items_picking = _lineas_picking(propuesta, request.user)
     
     # Ordenar según parámetro
     if orden_picking == 'producto':
         items_picking.sort(key=lambda x: x['producto'])
     elif orden_picking == 'cantidad':
         items_picking.sort(key=lambda x: x['cantidad'], reverse=True)
-    else:  # ubicacion (predeterminado): orden natural por código (J6A.01.02, .03, .10) y dentro por producto
+    elif orden_picking == 'ubicacion':  # orden natural por código (J6A.01.02, .03, .10) y dentro por producto
         items_picking.sort(key=lambda x: (
             x['almacen_id'],
-            _natural_sort_key_codigo(x['ubicacion']),
+            clave_natural(x['ubicacion']),
             (x['producto'] or '').lower(),
         ))
+    else:  # ruta (predeterminado): recorrido corto por racks y posiciones
+        items_picking = ordenar_lineas(items_picking)
     
     # Agrupar por ubicación para vista (el dict conserva orden de inserción; los ítems dentro ya están ordenados)
     ubicaciones_agrupadas = {}
@@ -748,51 +736,13 @@ def cambiar_cantidad_picking(request, lote_asignado_id):
 @login_required
 def imprimir_hoja_surtido(request, propuesta_id):
     """
-    Genera un PDF con la hoja de picking ordenada por ubicación.
+    Genera un PDF con la hoja de picking en orden de recorrido.
     Genera el Excel primero y luego lo convierte a PDF usando weasyprint.
     """
     propuesta = get_object_or_404(PropuestaPedido, id=propuesta_id)
     
-    # Verificar si el usuario es administrador o supervisor
-    es_administrador = request.user.is_staff or request.user.is_superuser
-    es_supervisor = request.user.groups.filter(name='Supervisor').exists()
-    puede_ver_todo = es_administrador or es_supervisor
-    
-    # Obtener almacén del usuario si no es administrador ni supervisor
-    almacen_usuario_id = None
-    if not puede_ver_todo and hasattr(request.user, 'almacen') and request.user.almacen:
-        almacen_usuario_id = request.user.almacen.id
-    
-    # Obtener items de la propuesta con lotes asignados
-    items_picking = []
-    
-    for item in propuesta.items.all():
-        for lote_asignado in item.lotes_asignados.filter(surtido=False):
-            lote_ubicacion = lote_asignado.lote_ubicacion
-            lote = lote_ubicacion.lote
-            
-            # Filtrar por almacén del usuario si no es administrador ni supervisor
-            if not puede_ver_todo and almacen_usuario_id:
-                if lote_ubicacion.ubicacion.almacen_id != almacen_usuario_id:
-                    continue  # Saltar este item si no pertenece al almacén del usuario
-            
-            caducidad = lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else 'N/A'
-            items_picking.append({
-                'item_id': item.id,
-                'lote_asignado_id': lote_asignado.id,
-                'producto': lote.producto.descripcion,
-                'cantidad': lote_asignado.cantidad_asignada,
-                'lote_numero': lote.numero_lote,
-                'almacen': lote_ubicacion.ubicacion.almacen.nombre,
-                'almacen_id': lote_ubicacion.ubicacion.almacen_id,
-                'ubicacion': lote_ubicacion.ubicacion.codigo,
-                'ubicacion_id': lote_ubicacion.ubicacion_id,
-                'clave_cnis': lote.producto.clave_cnis,
-                'caducidad': caducidad,
-            })
-    
-    # Ordenar por ubicación
-    items_picking.sort(key=lambda x: (x['almacen_id'], x['ubicacion_id']))
+    # Líneas en orden de recorrido (ruta por racks y posiciones)
+    items_picking = ordenar_lineas(_lineas_picking(propuesta, request.user))
     
     try:
         # Generar Excel
@@ -949,51 +899,13 @@ def exportar_picking_excel_interno(propuesta, items_picking):
 @login_required
 def exportar_picking_excel(request, propuesta_id):
     """
-    Genera un archivo Excel con la hoja de picking ordenada por ubicación.
+    Genera un archivo Excel con la hoja de picking en orden de recorrido.
     Versión 2.0: Sin template, con encabezados en fila 8.
     """
     propuesta = get_object_or_404(PropuestaPedido, id=propuesta_id)
     
-    # Verificar si el usuario es administrador o supervisor
-    es_administrador = request.user.is_staff or request.user.is_superuser
-    es_supervisor = request.user.groups.filter(name='Supervisor').exists()
-    puede_ver_todo = es_administrador or es_supervisor
-    
-    # Obtener almacén del usuario si no es administrador ni supervisor
-    almacen_usuario_id = None
-    if not puede_ver_todo and hasattr(request.user, 'almacen') and request.user.almacen:
-        almacen_usuario_id = request.user.almacen.id
-    
-    # Obtener items de la propuesta con lotes asignados
-    items_picking = []
-    
-    for item in propuesta.items.all():
-        for lote_asignado in item.lotes_asignados.filter(surtido=False):
-            lote_ubicacion = lote_asignado.lote_ubicacion
-            lote = lote_ubicacion.lote
-            
-            # Filtrar por almacén del usuario si no es administrador ni supervisor
-            if not puede_ver_todo and almacen_usuario_id:
-                if lote_ubicacion.ubicacion.almacen_id != almacen_usuario_id:
-                    continue  # Saltar este item si no pertenece al almacén del usuario
-            
-            caducidad = lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else 'N/A'
-            items_picking.append({
-                'item_id': item.id,
-                'lote_asignado_id': lote_asignado.id,
-                'producto': lote.producto.descripcion,
-                'cantidad': lote_asignado.cantidad_asignada,
-                'lote_numero': lote.numero_lote,
-                'almacen': lote_ubicacion.ubicacion.almacen.nombre,
-                'almacen_id': lote_ubicacion.ubicacion.almacen_id,
-                'ubicacion': lote_ubicacion.ubicacion.codigo,
-                'ubicacion_id': lote_ubicacion.ubicacion_id,
-                'clave_cnis': lote.producto.clave_cnis,
-                'caducidad': caducidad,
-            })
-    
-    # Ordenar por ubicación
-    items_picking.sort(key=lambda x: (x['almacen_id'], x['ubicacion_id']))
+    # Líneas en orden de recorrido (ruta por racks y posiciones)
+    items_picking = ordenar_lineas(_lineas_picking(propuesta, request.user))
     
     # Crear workbook - Versión sin template
     wb = Workbook()
@@ -0,0 +1,92 @@
+"""
+Caché del principal de la API móvil (``mobile_api.auth.get_user_from_token``).
+
+El principal (usuario activo con permiso de conteo) se guarda en un LRU en memoria por
+``sub`` del token durante ``MOBILE_API_AUTH_CACHE_TTL`` segundos (default 60): las
+peticiones de conteo no hacen consultas de autenticación mientras la entrada esté vigente.
+
+- La entrada guarda solo los valores de los campos del usuario (una tupla inmutable); cada
+  lectura arma una instancia nueva con ``User.from_db``, así que los hilos del pool de BD
+  nunca comparten el mismo objeto ``User`` ni sus cachés de relaciones.
+- Los cambios del usuario (``post_save``/``post_delete``), de sus grupos (``m2m_changed``)
+  y de los grupos mismos invalidan las entradas de este proceso. Los receptores se
+  conectan en ``InventarioConfig.ready``; en otros workers de gunicorn el TTL acota cuánto
+  puede tardar en verse el cambio.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+AUTH_CACHE_TTL = float(os.environ.get('MOBILE_API_AUTH_CACHE_TTL', '60'))
+AUTH_CACHE_MAX = 1024
+
+
+class _CachePrincipal:
+    """LRU con TTL {user_id: valores de los campos}, compartido por los hilos del pool de BD."""
+
+    def __init__(self, ttl: float, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        """Instancia nueva del usuario en caché, o None si no hay entrada vigente."""
+        with self._lock:
+            entrada = self._datos.get(user_id)
+            if entrada is None:
+                return None
+            expira, valores = entrada
+            if expira < time.monotonic():
+                del self._datos[user_id]
+                return None
+            self._datos.move_to_end(user_id)
+        User = get_user_model()
+        return User.from_db(DEFAULT_DB_ALIAS, [f.attname for f in User._meta.concrete_fields], valores)
+
+    def set(self, user_id: int, user) -> None:
+        if self.ttl <= 0:
+            return
+        valores = tuple(getattr(user, f.attname) for f in user._meta.concrete_fields)
+        with self._lock:
+            self._datos[user_id] = (time.monotonic() + self.ttl, valores)
+            self._datos.move_to_end(user_id)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, user_ids=None) -> None:
+        """Elimina las entradas indicadas; sin argumento vacía la caché."""
+        with self._lock:
+            if user_ids is None:
+                self._datos.clear()
+            else:
+                for user_id in user_ids:
+                    self._datos.pop(user_id, None)
+
+
+principales = _CachePrincipal(AUTH_CACHE_TTL, AUTH_CACHE_MAX)
+
+
+def invalidar_principal_usuario(sender, instance, **kwargs):
+    principales.invalidar([instance.pk])
+
+
+def invalidar_principal_grupos_usuario(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        principales.invalidar([instance.pk])
+    elif pk_set is None:
+        # group.user_set.clear(): no se conocen los usuarios afectados
+        principales.invalidar()
+    else:
+        principales.invalidar(pk_set)
+
+
+def invalidar_principales(sender, **kwargs):
+    principales.invalidar()
@@ -7,9 +7,11 @@ Este módulo contiene las funciones necesarias para:
 3. Generar una propuesta de surtimiento con información de ubicaciones.
 """
 
+import logging
+from collections import defaultdict
 from datetime import date, timedelta
 from django.db import transaction
-from django.db.models import IntegerField, Q, Sum, Value
+from django.db.models import Count, F, IntegerField, Q, Sum, Value
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 
@@ -21,6 +23,9 @@ from .pedidos_models import (
     ProductoNoDisponibleAlmacen
 )
 from .models import Lote, LoteUbicacion, Almacen
+from .reservas_utils import registrar_asignaciones_creadas
+
+logger = logging.getLogger(__name__)
 
 
 class PropuestaGenerator:
@@ -41,27 +46,59 @@ class PropuestaGenerator:
     def generate(self):
         """
         Genera la propuesta de pedido completa.
+
+        Todas las claves de la solicitud se asignan en bloque: los lotes y ubicaciones
+        candidatos se leen en un par de consultas, la regla de asignación se aplica en
+        memoria y el resultado se escribe con bulk_create / bulk_update.
         """
         if self.solicitud.estado != 'VALIDADA':
             raise ValueError("La solicitud debe estar en estado VALIDADA para generar una propuesta.")
 
+        items_solicitud = list(self.solicitud.items.select_related('producto'))
+
         # Crear la propuesta principal
         # total_solicitado incluye todos los items (incluso con cantidad_aprobada=0) para el registro
         self.propuesta = PropuestaPedido.objects.create(
             solicitud=self.solicitud,
             usuario_generacion=self.usuario,
-            total_solicitado=sum(item.cantidad_aprobada for item in self.solicitud.items.all())
+            total_solicitado=sum(item.cantidad_aprobada for item in items_solicitud)
         )
 
         # Solo se generan ítems de propuesta y se reserva inventario para claves con cantidad_aprobada > 0.
         # Si cantidad_aprobada es 0: el ítem queda registrado en la solicitud (se sabe que el usuario lo solicitó),
         # pero no se crea línea en la propuesta ni se reserva cantidad alguna.
-        for item_solicitud in self.solicitud.items.filter(cantidad_aprobada__gt=0):
-            self._generate_item_propuesta(item_solicitud)
+        items_a_surtir = [item for item in items_solicitud if item.cantidad_aprobada > 0]
+
+        fecha_minima = date.today() + timedelta(days=60)
+        lotes_por_producto = self._cargar_lotes_candidatos(
+            [item.producto_id for item in items_a_surtir], fecha_minima
+        )
+
+        items_propuesta = []
+        asignaciones = []
+        for item_solicitud in items_a_surtir:
+            item_propuesta, asignaciones_item = self._asignar_item(
+                item_solicitud,
+                lotes_por_producto.get(item_solicitud.producto_id, []),
+                fecha_minima,
+            )
+            items_propuesta.append(item_propuesta)
+            asignaciones.extend(asignaciones_item)
+
+        self._explicar_items_no_disponibles(items_propuesta, fecha_minima)
+
+        # Escritura en bloque: ítems, asignaciones y reservas desnormalizadas
+        ItemPropuesta.objects.bulk_create(items_propuesta)
+        LoteAsignado.objects.bulk_create(asignaciones)
+        registrar_asignaciones_creadas(asignaciones)
+        ubicaciones_reservadas = {a.lote_ubicacion.pk: a.lote_ubicacion for a in asignaciones}
+        lotes_reservados = {a.lote_ubicacion.lote.pk: a.lote_ubicacion.lote for a in asignaciones}
+        LoteUbicacion.objects.bulk_update(ubicaciones_reservadas.values(), ['cantidad_reservada'])
+        Lote.objects.bulk_update(lotes_reservados.values(), ['cantidad_reservada'])
 
         # Actualizar totales de la propuesta
-        self.propuesta.total_disponible = sum(item.cantidad_disponible for item in self.propuesta.items.all())
-        self.propuesta.total_propuesto = sum(item.cantidad_propuesta for item in self.propuesta.items.all())
+        self.propuesta.total_disponible = sum(item.cantidad_disponible for item in items_propuesta)
+        self.propuesta.total_propuesto = sum(item.cantidad_propuesta for item in items_propuesta)
         self.propuesta.save()
 
         # Enviar notificación por Telegram si hay productos no disponibles en el almacén destino
@@ -128,60 +165,89 @@ class PropuestaGenerator:
             logger = logging.getLogger(__name__)
             logger.error(f"Error al enviar notificación Telegram de productos no disponibles: {str(e)}")
 
-    def _generate_item_propuesta(self, item_solicitud):
+    def _cargar_lotes_candidatos(self, producto_ids, fecha_minima):
         """
-        Genera un item de la propuesta, buscando lotes disponibles con sus ubicaciones.
-        Considera la cantidad reservada en otros lotes.
+        Carga en dos consultas los lotes candidatos de todas las claves y sus ubicaciones.
+
         Regla de asignación por clave (producto): 1) caducidad (primero a vencer),
         2) lote (numero_lote), 3) ubicación (código de ubicación).
 
         Disponibilidad neta: misma regla que editar propuesta / selects AJAX — reserva real =
-        suma de LoteAsignado.cantidad_asignada con surtido=False (no el campo cantidad_reservada).
+        suma de LoteAsignado.cantidad_asignada con surtido=False (no el campo cantidad_reservada),
+        leída del libro LoteUbicacion.reserva_activa.
+
+        Returns:
+            dict: {producto_id: [Lote, ...]} en orden de asignación; cada lote trae
+            ``reserva_real_lote`` y ``ubicaciones_candidatas`` (LoteUbicacion con
+            ``reservado_real``, ordenadas por código de ubicación).
         """
-        cantidad_requerida = item_solicitud.cantidad_aprobada
-        producto = item_solicitud.producto
-        
-        # Crear el item de la propuesta
-        item_propuesta = ItemPropuesta.objects.create(
-            propuesta=self.propuesta,
-            item_solicitud=item_solicitud,
-            producto=producto,
-            cantidad_solicitada=cantidad_requerida
-        )
+        if not producto_ids:
+            return {}
 
-        # Buscar lotes disponibles que no estén caducados
         # Considerar que deben tener al menos 60 días de vida útil
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        fecha_minima = date.today() + timedelta(days=60)
-        # Regla de asignación: 1) caducidad, 2) lote, 3) ubicación por clave (por producto)
-        # Reserva real a nivel lote = suma LoteAsignado (surtido=False), igual que pedidos_views / reportes.
-        lotes_disponibles = list(
+        lotes = list(
             Lote.objects.filter(
-                producto=producto,
+                producto_id__in=producto_ids,
                 fecha_caducidad__gte=fecha_minima,
                 estado=1  # Solo lotes disponibles
             )
             .annotate(
                 reserva_real_lote=Coalesce(
-                    Sum(
-                        'ubicaciones_detalle__asignaciones_propuesta__cantidad_asignada',
-                        filter=Q(
-                            ubicaciones_detalle__asignaciones_propuesta__surtido=False
-                        ),
-                    ),
+                    Sum('ubicaciones_detalle__reserva_activa'),
                     Value(0),
                     output_field=IntegerField(),
                 )
             )
-            .select_related('producto')
             .order_by(
+                'producto_id',
                 'fecha_caducidad',  # 1) Primero los que caducan antes
                 'numero_lote',  # 2) Luego por número de lote
             )
         )
 
+        # 3) Dentro del lote: por ubicación (código de ubicación), todos los almacenes/subalmacenes
+        ubicaciones_por_lote = defaultdict(list)
+        ubicaciones = (
+            LoteUbicacion.objects.filter(
+                lote__producto_id__in=producto_ids,
+                lote__fecha_caducidad__gte=fecha_minima,
+                lote__estado=1,
+                cantidad__gt=0,
+            )
+            .annotate(reservado_real=F('reserva_activa'))
+            .select_related('ubicacion')
+            .order_by('lote_id', 'ubicacion__codigo')
+        )
+        for lote_ubicacion in ubicaciones:
+            ubicaciones_por_lote[lote_ubicacion.lote_id].append(lote_ubicacion)
+
+        lotes_por_producto = defaultdict(list)
+        for lote in lotes:
+            lote.ubicaciones_candidatas = ubicaciones_por_lote.get(lote.id, [])
+            for lote_ubicacion in lote.ubicaciones_candidatas:
+                # Comparte la instancia para acumular cantidad_reservada en un solo objeto
+                lote_ubicacion.lote = lote
+            lotes_por_producto[lote.producto_id].append(lote)
+        return lotes_por_producto
+
+    def _asignar_item(self, item_solicitud, lotes_disponibles, fecha_minima):
+        """
+        Asigna en memoria los lotes/ubicaciones de un item de la solicitud.
+
+        No escribe en BD: incrementa ``cantidad_reservada`` en las instancias de Lote y
+        LoteUbicacion recibidas y devuelve el ItemPropuesta y los LoteAsignado sin guardar.
+        """
+        cantidad_requerida = item_solicitud.cantidad_aprobada
+        producto = item_solicitud.producto
+
+        item_propuesta = ItemPropuesta(
+            propuesta=self.propuesta,
+            item_solicitud=item_solicitud,
+            producto=producto,
+            cantidad_solicitada=cantidad_requerida
+        )
+        asignaciones = []
+
         # Calcular cantidad total disponible (considerando reservas reales)
         cantidad_total_disponible = sum(
             max(0, lote.cantidad_disponible - (getattr(lote, 'reserva_real_lote', 0) or 0))
@@ -216,35 +282,13 @@ class PropuestaGenerator:
             if cantidad_real_disponible_lote <= 0:
                 continue
 
-            # Calcular cuánto necesitamos aún
-            cantidad_faltante = cantidad_requerida - cantidad_asignada_total
-            
-            # No podemos asignar más de lo disponible en el lote
+            # No podemos asignar más de lo disponible en el lote ni más de lo que falta
             cantidad_maxima_a_asignar = min(
                 cantidad_real_disponible_lote,
-                cantidad_faltante
+                cantidad_requerida - cantidad_asignada_total
             )
 
-            if cantidad_maxima_a_asignar <= 0:
-                continue
-
-            # Distribuir la reserva entre las ubicaciones del lote (todos los almacenes/subalmacenes)
-            # 3) Dentro del lote: por ubicación (código de ubicación)
-            ubicaciones_disponibles = list(
-                lote.ubicaciones_detalle.filter(cantidad__gt=0)
-                .annotate(
-                    reservado_real=Coalesce(
-                        Sum(
-                            'asignaciones_propuesta__cantidad_asignada',
-                            filter=Q(asignaciones_propuesta__surtido=False),
-                        ),
-                        Value(0),
-                        output_field=IntegerField(),
-                    )
-                )
-                .select_related('ubicacion')
-                .order_by('ubicacion__codigo')
-            )
+            ubicaciones_disponibles = lote.ubicaciones_candidatas
 
             # Calcular la cantidad total disponible en todas las ubicaciones del lote
             cantidad_total_disponible_ubicaciones = sum(
@@ -253,25 +297,22 @@ class PropuestaGenerator:
             )
             
             # No podemos asignar más de lo disponible en las ubicaciones
-            cantidad_maxima_por_ubicaciones = min(
+            cantidad_pendiente_reservar = min(
                 cantidad_total_disponible_ubicaciones,
                 cantidad_maxima_a_asignar
             )
             
-            if cantidad_maxima_por_ubicaciones <= 0:
+            if cantidad_pendiente_reservar <= 0:
                 logger.warning(f"  - Lote {lote.numero_lote}: No hay suficiente disponible en ubicaciones (lote: {cantidad_real_disponible_lote}, ubicaciones: {cantidad_total_disponible_ubicaciones})")
                 continue
             
-            cantidad_pendiente_reservar = cantidad_maxima_por_ubicaciones
-            ubicaciones_asignadas = []  # Para crear LoteAsignado después
-            cantidad_total_reservada_en_iteracion = 0  # Para validar que no excedamos
+            cantidad_total_reservada_en_iteracion = 0
             
             # Distribuir la reserva entre ubicaciones
             for lote_ubicacion in ubicaciones_disponibles:
                 if cantidad_pendiente_reservar <= 0:
                     break
                 
-                # Calcular cuánto podemos reservar de esta ubicación
                 # Reserva real = suma LoteAsignado (surtido=False), igual que en selects de propuesta
                 res_u = getattr(lote_ubicacion, 'reservado_real', 0) or 0
                 cantidad_disponible_ubicacion = max(0, lote_ubicacion.cantidad - res_u)
@@ -284,82 +325,74 @@ class PropuestaGenerator:
                     cantidad_pendiente_reservar
                 )
                 
-                # Validación adicional: asegurar que no excedamos la cantidad disponible del lote
-                if cantidad_total_reservada_en_iteracion + cantidad_a_reservar_ubicacion > cantidad_real_disponible_lote:
-                    cantidad_a_reservar_ubicacion = max(0, cantidad_real_disponible_lote - cantidad_total_reservada_en_iteracion)
+                # Reservar en la ubicación y a nivel de lote (se persiste con bulk_update)
+                lote_ubicacion.cantidad_reservada += cantidad_a_reservar_ubicacion
+                lote.cantidad_reservada += cantidad_a_reservar_ubicacion
+
+                asignaciones.append(LoteAsignado(
+                    item_propuesta=item_propuesta,
+                    lote_ubicacion=lote_ubicacion,
+                    cantidad_asignada=cantidad_a_reservar_ubicacion
+                ))
                 
-                if cantidad_a_reservar_ubicacion > 0:
-                    # Reservar en la ubicación
-                    lote_ubicacion.cantidad_reservada += cantidad_a_reservar_ubicacion
-                    lote_ubicacion.save(update_fields=['cantidad_reservada'])
-                    
-                    # También actualizar la reserva a nivel de lote
-                    lote.cantidad_reservada += cantidad_a_reservar_ubicacion
-                    lote.save(update_fields=['cantidad_reservada'])
-                    
-                    # Guardar para crear LoteAsignado después
-                    ubicaciones_asignadas.append({
-                        'lote_ubicacion': lote_ubicacion,
-                        'cantidad': cantidad_a_reservar_ubicacion
-                    })
-                    
-                    cantidad_pendiente_reservar -= cantidad_a_reservar_ubicacion
-                    cantidad_total_reservada_en_iteracion += cantidad_a_reservar_ubicacion
-                    cantidad_asignada_total += cantidad_a_reservar_ubicacion
-                    
-                    logger.warning(f"  - Lote {lote.numero_lote} Ubicación {lote_ubicacion.ubicacion.codigo}: Reservando {cantidad_a_reservar_ubicacion} (Disponible ubicación: {cantidad_disponible_ubicacion}, Disponible lote: {cantidad_real_disponible_lote})")
-                else:
-                    break
-            
-            # Validación final: verificar que no hayamos excedido la cantidad disponible del lote
-            if cantidad_total_reservada_en_iteracion > cantidad_real_disponible_lote:
-                logger.error(f"  - ERROR: Se reservó {cantidad_total_reservada_en_iteracion} pero solo había {cantidad_real_disponible_lote} disponible en lote {lote.numero_lote}")
-                # Revertir las reservas si excedimos
-                for asignacion in ubicaciones_asignadas:
-                    lote_ubicacion = asignacion['lote_ubicacion']
-                    cantidad = asignacion['cantidad']
-                    lote_ubicacion.cantidad_reservada = max(0, lote_ubicacion.cantidad_reservada - cantidad)
-                    lote_ubicacion.save(update_fields=['cantidad_reservada'])
-                    lote.cantidad_reservada = max(0, lote.cantidad_reservada - cantidad)
-                lote.save(update_fields=['cantidad_reservada'])
-                ubicaciones_asignadas = []
-                continue
+                cantidad_pendiente_reservar -= cantidad_a_reservar_ubicacion
+                cantidad_total_reservada_en_iteracion += cantidad_a_reservar_ubicacion
+                cantidad_asignada_total += cantidad_a_reservar_ubicacion
+                
+                logger.warning(f"  - Lote {lote.numero_lote} Ubicación {lote_ubicacion.ubicacion.codigo}: Reservando {cantidad_a_reservar_ubicacion} (Disponible ubicación: {cantidad_disponible_ubicacion}, Disponible lote: {cantidad_real_disponible_lote})")
             
-            # Si se pudo reservar todo (o parte), crear los registros LoteAsignado
-            if ubicaciones_asignadas:
-                for asignacion in ubicaciones_asignadas:
-                    LoteAsignado.objects.create(
-                        item_propuesta=item_propuesta,
-                        lote_ubicacion=asignacion['lote_ubicacion'],
-                        cantidad_asignada=asignacion['cantidad']
-                    )
-                logger.warning(f"  - Lote {lote.numero_lote}: Total reservado en esta iteración: {cantidad_total_reservada_en_iteracion} de {cantidad_real_disponible_lote} disponible")
-            else:
-                # Si no se pudo reservar nada, continuar con el siguiente lote
-                logger.warning(f"  - No se pudo reservar ninguna cantidad del lote {lote.numero_lote}")
-                continue
+            logger.warning(f"  - Lote {lote.numero_lote}: Total reservado en esta iteración: {cantidad_total_reservada_en_iteracion} de {cantidad_real_disponible_lote} disponible")
 
         # Actualizar estado y cantidad propuesta
         item_propuesta.cantidad_propuesta = cantidad_asignada_total
         
         if cantidad_asignada_total == 0:
+            # Observaciones se completan en bloque en _explicar_items_no_disponibles
             item_propuesta.estado = 'NO_DISPONIBLE'
-            # El texto anterior culpaba siempre a caducidad; la causa suele ser existencia neta 0
-            # (p. ej. cantidad reservada en propuestas ≥ cantidad en lote/ubicación).
-            n_lotes_activos = Lote.objects.filter(producto=producto, estado=1).count()
-            n_lotes_caducidad_ok = Lote.objects.filter(
-                producto=producto, estado=1, fecha_caducidad__gte=fecha_minima
-            ).count()
-            if n_lotes_activos == 0:
+        elif cantidad_asignada_total < cantidad_requerida:
+            item_propuesta.estado = 'PARCIAL'
+            item_propuesta.observaciones = f"Solo se encontraron {cantidad_asignada_total} de {cantidad_requerida} unidades."
+        else:
+            item_propuesta.estado = 'DISPONIBLE'
+
+        return item_propuesta, asignaciones
+
+    def _explicar_items_no_disponibles(self, items_propuesta, fecha_minima):
+        """
+        Fija las observaciones de los ítems sin asignación con un solo conteo agrupado
+        de lotes activos / lotes con caducidad válida por producto.
+        """
+        sin_asignar = [item for item in items_propuesta if item.estado == 'NO_DISPONIBLE']
+        if not sin_asignar:
+            return
+
+        conteos = {
+            fila['producto_id']: fila
+            for fila in Lote.objects.filter(
+                producto_id__in={item.producto_id for item in sin_asignar},
+                estado=1,
+            )
+            .values('producto_id')
+            .annotate(
+                n_lotes_activos=Count('id'),
+                n_lotes_caducidad_ok=Count('id', filter=Q(fecha_caducidad__gte=fecha_minima)),
+            )
+        }
+
+        # El texto anterior culpaba siempre a caducidad; la causa suele ser existencia neta 0
+        # (p. ej. cantidad reservada en propuestas ≥ cantidad en lote/ubicación).
+        for item_propuesta in sin_asignar:
+            conteo = conteos.get(item_propuesta.producto_id, {})
+            if not conteo.get('n_lotes_activos'):
                 item_propuesta.observaciones = (
                     "No hay lotes en estado disponible para este producto."
                 )
-            elif n_lotes_caducidad_ok == 0:
+            elif not conteo.get('n_lotes_caducidad_ok'):
                 item_propuesta.observaciones = (
                     "No hay lotes que cumplan la regla mínima de caducidad "
                     "(fecha de caducidad al menos 60 días posterior a la fecha actual)."
                 )
-            elif cantidad_total_disponible == 0:
+            elif item_propuesta.cantidad_disponible == 0:
                 item_propuesta.observaciones = (
                     "No hay existencia neta disponible para asignar: el inventario visible "
                     "puede estar totalmente reservado en otras propuestas pendientes de surtir, "
@@ -370,10 +403,3 @@ class PropuestaGenerator:
                     "Hay existencia a nivel lote, pero no se pudo reservar por ubicación "
                     "(revisar distribución en ubicaciones o reservas por ubicación)."
                 )
-        elif cantidad_asignada_total < cantidad_requerida:
-            item_propuesta.estado = 'PARCIAL'
-            item_propuesta.observaciones = f"Solo se encontraron {cantidad_asignada_total} de {cantidad_requerida} unidades."
-        else:
-            item_propuesta.estado = 'DISPONIBLE'
-        
-        item_propuesta.save()
@@ -9,64 +9,56 @@ Este módulo proporciona funciones para:
 """
 
 import re
+from collections import defaultdict
 from uuid import UUID
 
 from django.db import transaction
 from django.db.models import F, Sum
 from django.utils import timezone
 
+from .dashboard_utils import invalidar_dashboard
 from .pedidos_models import PropuestaPedido, ItemPropuesta, LoteAsignado, LogPropuesta, SolicitudPedido
 from .models import Lote, LoteUbicacion, MovimientoInventario
+from .fase5_utils import bloquear_lote_ubicaciones
+from .reservas_utils import recalcular_reserva_activa, totales_reserva_activa_por_lote
 
 
 def _reserva_real_lote_ubicacion(lote_ubicacion):
-    """Reserva real en esta ubicación = suma de LoteAsignado (surtido=False). Igual que reporte de reservas."""
-    return LoteAsignado.objects.filter(
-        lote_ubicacion=lote_ubicacion, surtido=False
-    ).aggregate(total=Sum('cantidad_asignada'))['total'] or 0
+    """
+    Reserva real en esta ubicación = suma de LoteAsignado (surtido=False). Igual que reporte de reservas.
+    Es el libro ``LoteUbicacion.reserva_activa`` (ver reservas_utils) de la instancia, que el
+    llamador acaba de refrescar: no hace consultas.
+    """
+    return lote_ubicacion.reserva_activa or 0
 
 
 def _reserva_real_lote(lote):
     """Reserva real en el lote (todas sus ubicaciones) = suma de LoteAsignado (surtido=False)."""
-    return LoteAsignado.objects.filter(
-        lote_ubicacion__lote=lote, surtido=False
-    ).aggregate(total=Sum('cantidad_asignada'))['total'] or 0
+    return totales_reserva_activa_por_lote([lote.pk]).get(lote.pk, 0)
 
 
 def totales_reserva_activa_por_lote_ids(lote_ids):
     """
     Por cada id de Lote, suma de cantidad_asignada en LoteAsignado con surtido=False.
     Misma regla que reporte de reservas; no usa el campo Lote.cantidad_reservada (puede estar desactualizado).
+    Se resuelve con el libro ``LoteUbicacion.reserva_activa``, sin agregar sobre LoteAsignado.
     """
-    if not lote_ids:
-        return {}
-    return {
-        pk: (total or 0)
-        for pk, total in LoteAsignado.objects.filter(
-            surtido=False, lote_ubicacion__lote_id__in=lote_ids
-        )
-        .values('lote_ubicacion__lote_id')
-        .annotate(total=Sum('cantidad_asignada'))
-        .values_list('lote_ubicacion__lote_id', 'total')
-    }
+    return totales_reserva_activa_por_lote(lote_ids)
 
 
 def totales_reserva_activa_por_lote_ubicacion_ids(lote_ubicacion_ids):
     """
     Por cada id de LoteUbicacion, suma de cantidad_asignada (LoteAsignado, surtido=False).
     La asignación en propuestas es siempre por producto + lote + ubicación (FK lote_ubicacion).
+    Lectura directa del libro ``LoteUbicacion.reserva_activa``.
     """
     if not lote_ubicacion_ids:
         return {}
-    return {
-        pk: (total or 0)
-        for pk, total in LoteAsignado.objects.filter(
-            surtido=False, lote_ubicacion_id__in=lote_ubicacion_ids
-        )
-        .values('lote_ubicacion_id')
-        .annotate(total=Sum('cantidad_asignada'))
-        .values_list('lote_ubicacion_id', 'total')
-    }
+    return dict(
+        LoteUbicacion.objects.filter(
+            id__in=lote_ubicacion_ids, reserva_activa__gt=0
+        ).values_list('id', 'reserva_activa')
+    )
 
 
 def cantidad_existencia_fisica_lote_como_reporte_existencias(lote):
@@ -607,20 +599,53 @@ def obtener_cantidad_disponible_real(lote):
     return lote.cantidad_disponible - lote.cantidad_reservada
 
 
-def validar_disponibilidad_para_propuesta(producto_id, cantidad_requerida, institucion_id=None):
+def disponibilidad_neta_por_producto(producto_ids):
+    """
+    Neto disponible por producto para validar solicitudes, en una sola consulta agrupada
+    sobre LoteUbicacion (fuente de verdad; ``Lote.cantidad_disponible`` puede no estar
+    sincronizado): suma de ``cantidad`` − suma de ``reserva_activa`` de todas las ubicaciones
+    de los lotes disponibles (estado=1) del producto.
+
+    IMPORTANTE: NO filtra por almacén ni por institución.
+
+    Args:
+        producto_ids: iterable de IDs de producto
+
+    Returns:
+        dict: {producto_id: cantidad neta disponible} (0 para productos sin existencia)
+    """
+    producto_ids = set(producto_ids)
+    if not producto_ids:
+        return {}
+    netos = {pk: 0 for pk in producto_ids}
+    for fila in (
+        LoteUbicacion.objects.filter(lote__producto_id__in=producto_ids, lote__estado=1)
+        .order_by()
+        .values('lote__producto_id')
+        .annotate(total_cantidad=Sum('cantidad'), total_reserva=Sum('reserva_activa'))
+    ):
+        netos[fila['lote__producto_id']] = max(
+            0, (fila['total_cantidad'] or 0) - (fila['total_reserva'] or 0)
+        )
+    return netos
+
+
+def validar_disponibilidad_para_propuesta(producto_id, cantidad_requerida, institucion_id=None, detalle=False):
     """
     Valida si hay suficiente cantidad disponible para una nueva propuesta.
-    Suma el total disponible de TODOS los lotes del producto, considerando:
-    - cantidad_disponible total del producto (suma de todos los lotes)
-    - cantidad_reservada total del producto (suma de todas las reservas)
+    Suma el total disponible de TODOS los lotes del producto desde sus ubicaciones:
+    cantidad en LoteUbicacion − reserva activa (libro ``reserva_activa``).
     
     IMPORTANTE: NO filtra por almacén ni por institución. Considera TODOS los lotes
     del producto sin importar en qué almacén estén.
+
+    Para validar varios productos a la vez usar ``disponibilidad_neta_por_producto``.
     
     Args:
         producto_id: ID del producto
         cantidad_requerida: Cantidad que se necesita
         institucion_id: ID de la institución (opcional, NO se usa para filtrar)
+        detalle: si es True, registra en el log el desglose por lote
     
     Returns:
         dict: {
@@ -629,129 +654,51 @@ def validar_disponibilidad_para_propuesta(producto_id, cantidad_requerida, insti
             'lotes': list de lotes disponibles con cantidad real
         }
     """
-    from .models import Lote, Producto, LoteUbicacion
-    from django.db.models import Sum, Q
     import logging
-    
+
     logger = logging.getLogger(__name__)
-    
-    try:
-        producto = Producto.objects.get(id=producto_id)
-        clave_cnis = producto.clave_cnis
-    except Producto.DoesNotExist:
-        logger.error(f"[VALIDAR_DISPONIBILIDAD] Producto ID {producto_id} no existe")
-        return {
-            'disponible': False,
-            'cantidad_disponible': 0,
-            'lotes': []
-        }
-    
-    # Obtener TODOS los lotes disponibles del producto
-    # NO filtramos por almacén, institución, ni nada más
-    # Solo filtramos por producto y estado disponible (estado=1)
-    query = Lote.objects.filter(
-        producto_id=producto_id,
-        estado=1  # Solo lotes disponibles
-    )
-    
-    # Contar lotes antes de agregar más información
-    total_lotes = query.count()
-    
-    # IMPORTANTE: Calcular disponibilidad desde LoteUbicacion (fuente de verdad)
-    # porque cantidad_disponible en Lote puede no estar sincronizado
-    # Sumar cantidad y cantidad_reservada de todas las ubicaciones de todos los lotes del producto
-    # NO filtramos por almacén - consideramos TODAS las ubicaciones de TODOS los almacenes
-    # NO filtramos por institución - consideramos TODAS las instituciones
-    
-    # Primero obtener todos los lotes del producto con estado=1
-    lotes_ids = list(query.values_list('id', flat=True))
-    
-    # Luego obtener todas las ubicaciones de esos lotes
-    # Esto asegura que no haya problemas con joins o filtros implícitos
-    ubicaciones_totales = LoteUbicacion.objects.filter(
-        lote_id__in=lotes_ids
-    ).aggregate(
-        total_cantidad_ubicaciones=Sum('cantidad'),
-        total_reservada_ubicaciones=Sum('cantidad_reservada')
+
+    # Una consulta: totales por lote desde sus ubicaciones
+    por_lote = list(
+        LoteUbicacion.objects.filter(lote__producto_id=producto_id, lote__estado=1)
+        .order_by()
+        .values('lote_id', 'lote__numero_lote', 'lote__fecha_caducidad')
+        .annotate(total_cantidad=Sum('cantidad'), total_reserva=Sum('reserva_activa'))
+        .order_by('lote__fecha_caducidad', 'lote__numero_lote')
     )
-    
-    total_cantidad_ubicaciones = ubicaciones_totales['total_cantidad_ubicaciones'] or 0
-    total_reservada_ubicaciones = ubicaciones_totales['total_reservada_ubicaciones'] or 0
-    
-    # SIEMPRE usar el cálculo desde ubicaciones (más preciso y confiable)
-    # cantidad_total_disponible = suma de todas las cantidades en ubicaciones - suma de todas las reservas
+
+    total_cantidad_ubicaciones = sum(f['total_cantidad'] or 0 for f in por_lote)
+    total_reservada_ubicaciones = sum(f['total_reserva'] or 0 for f in por_lote)
     cantidad_total_disponible = max(0, total_cantidad_ubicaciones - total_reservada_ubicaciones)
-    
-    # Contar ubicaciones para debugging
-    total_ubicaciones = LoteUbicacion.objects.filter(lote_id__in=lotes_ids).count()
-    
-    # También calcular desde lotes para comparación (pero NO usar este valor como principal)
-    totales_lotes = query.aggregate(
-        total_cantidad_disponible=Sum('cantidad_disponible'),
-        total_cantidad_reservada=Sum('cantidad_reservada')
-    )
-    
-    total_disponible_lotes = totales_lotes['total_cantidad_disponible'] or 0
-    total_reservada_lotes = totales_lotes['total_cantidad_reservada'] or 0
-    cantidad_desde_lotes = max(0, total_disponible_lotes - total_reservada_lotes)
-    
-    # SIEMPRE usar el cálculo desde ubicaciones (más preciso y confiable)
-    logger.warning(
-        f"[VALIDAR_DISPONIBILIDAD] Usando cálculo desde ubicaciones (fuente de verdad): "
-        f"Total lotes encontrados: {total_lotes} | "
-        f"Total ubicaciones encontradas: {total_ubicaciones} | "
-        f"Total cantidad ubicaciones={total_cantidad_ubicaciones}, "
-        f"Total reservada ubicaciones={total_reservada_ubicaciones}, "
-        f"Neto disponible={cantidad_total_disponible} | "
-        f"(Comparación desde lotes: disponible={total_disponible_lotes}, reservado={total_reservada_lotes}, neto={cantidad_desde_lotes})"
-    )
-    
-    # Log detallado para debugging
-    logger.warning(
-        f"[VALIDAR_DISPONIBILIDAD] Clave: {clave_cnis} | "
-        f"Solicitado: {cantidad_requerida} | "
-        f"Total cantidad ubicaciones: {total_cantidad_ubicaciones} | "
-        f"Total reservada ubicaciones: {total_reservada_ubicaciones} | "
-        f"Neto disponible (desde ubicaciones): {cantidad_total_disponible} | "
-        f"Total lotes encontrados: {total_lotes} | "
-        f"¿Disponible?: {cantidad_total_disponible >= cantidad_requerida}"
-    )
-    
-    # Si hay lotes, log detallado de cada uno con información de ubicaciones
-    if total_lotes > 0:
-        logger.warning(f"[VALIDAR_DISPONIBILIDAD] Detalle de lotes para {clave_cnis}:")
-        for lote in query[:10]:  # Limitar a los primeros 10 para no saturar el log
-            # Calcular desde ubicaciones del lote (fuente de verdad)
-            ubicaciones_lote = LoteUbicacion.objects.filter(lote=lote).aggregate(
-                total_cant=Sum('cantidad'),
-                total_res=Sum('cantidad_reservada')
-            )
-            cantidad_desde_ubicaciones_lote = (ubicaciones_lote['total_cant'] or 0) - (ubicaciones_lote['total_res'] or 0)
-            cantidad_real_lote = obtener_cantidad_disponible_real(lote)
-            
-            logger.warning(
-                f"  - Lote {lote.numero_lote}: "
-                f"Disponible(lote)={lote.cantidad_disponible}, "
-                f"Reservado(lote)={lote.cantidad_reservada}, "
-                f"Neto(lote)={cantidad_real_lote}, "
-                f"Cantidad(ubicaciones)={ubicaciones_lote['total_cant'] or 0}, "
-                f"Reservada(ubicaciones)={ubicaciones_lote['total_res'] or 0}, "
-                f"Neto(ubicaciones)={cantidad_desde_ubicaciones_lote}, "
-                f"Almacén={lote.almacen.nombre if lote.almacen else 'N/A'}, "
-                f"Estado={lote.estado}"
-            )
-    
-    # Construir lista de lotes para referencia
+
     lotes_disponibles = []
-    for lote in query:
-        cantidad_real = obtener_cantidad_disponible_real(lote)
+    for fila in por_lote:
+        cantidad_real = (fila['total_cantidad'] or 0) - (fila['total_reserva'] or 0)
         if cantidad_real > 0:
             lotes_disponibles.append({
-                'lote_id': lote.id,
-                'numero_lote': lote.numero_lote,
+                'lote_id': fila['lote_id'],
+                'numero_lote': fila['lote__numero_lote'],
                 'cantidad_disponible': cantidad_real,
-                'fecha_caducidad': lote.fecha_caducidad
+                'fecha_caducidad': fila['lote__fecha_caducidad']
             })
+
+    if detalle:
+        logger.info(
+            f"[VALIDAR_DISPONIBILIDAD] Producto ID: {producto_id} | "
+            f"Solicitado: {cantidad_requerida} | "
+            f"Total cantidad ubicaciones: {total_cantidad_ubicaciones} | "
+            f"Total reservada ubicaciones: {total_reservada_ubicaciones} | "
+            f"Neto disponible: {cantidad_total_disponible} | "
+            f"Lotes con ubicaciones: {len(por_lote)} | "
+            f"¿Disponible?: {cantidad_total_disponible >= cantidad_requerida}"
+        )
+        for fila in por_lote:
+            logger.info(
+                f"  - Lote {fila['lote__numero_lote']}: "
+                f"Cantidad(ubicaciones)={fila['total_cantidad'] or 0}, "
+                f"Reservada(ubicaciones)={fila['total_reserva'] or 0}, "
+                f"Caducidad={fila['lote__fecha_caducidad']}"
+            )
     
     return {
         'disponible': cantidad_total_disponible >= cantidad_requerida,
@@ -763,7 +710,8 @@ def validar_disponibilidad_para_propuesta(producto_id, cantidad_requerida, insti
 def completar_surtimiento_propuesta(propuesta_id):
     """
     Completa el surtimiento de una propuesta.
-    Decrementa cantidad_disponible y cantidad_reservada de los lotes.
+    Decrementa cantidad_disponible y cantidad_reservada de los lotes
+    (ubicaciones bloqueadas en orden y escritas con bulk_update).
     
     Args:
         propuesta_id: ID de la propuesta
@@ -781,27 +729,36 @@ def completar_surtimiento_propuesta(propuesta_id):
             }
         
         with transaction.atomic():
-            for item in propuesta.items.all():
-                for lote_asignado in item.lotes_asignados.all():
-                    if lote_asignado.surtido:
-                        lote = lote_asignado.lote_ubicacion.lote
-                        lote_ubicacion = lote_asignado.lote_ubicacion
-                        cantidad = lote_asignado.cantidad_asignada
-                        
-                        # Decrementar cantidad_disponible a nivel de lote
-                        lote.cantidad_disponible = max(0, lote.cantidad_disponible - cantidad)
-                        
-                        # Decrementar cantidad_reservada a nivel de lote
-                        lote.cantidad_reservada = max(0, lote.cantidad_reservada - cantidad)
-                        lote.save(update_fields=['cantidad_disponible', 'cantidad_reservada'])
-                        
-                        # Decrementar cantidad_reservada en la ubicación específica
-                        lote_ubicacion.cantidad_reservada = max(0, lote_ubicacion.cantidad_reservada - cantidad)
-                        lote_ubicacion.save(update_fields=['cantidad_reservada'])
-                        
-                        # También decrementar la cantidad en la ubicación
-                        lote_ubicacion.cantidad = max(0, lote_ubicacion.cantidad - cantidad)
-                        lote_ubicacion.save(update_fields=['cantidad'])
+            lote_ubicacion_ids = set()
+            surtido_por_lu = defaultdict(int)
+            for lu_id, cantidad, surtido in LoteAsignado.objects.filter(
+                item_propuesta__propuesta=propuesta
+            ).order_by().values_list('lote_ubicacion_id', 'cantidad_asignada', 'surtido'):
+                lote_ubicacion_ids.add(lu_id)
+                if surtido:
+                    surtido_por_lu[lu_id] += cantidad
+
+            # Un solo SELECT ... FOR UPDATE ordenado; los descuentos se aplican en memoria
+            # (max(0, x - total) equivale a restar cada asignación con su propio tope en 0).
+            ubicaciones = bloquear_lote_ubicaciones(surtido_por_lu)
+            lotes = {}
+            for lote_ubicacion in ubicaciones:
+                cantidad = surtido_por_lu[lote_ubicacion.pk]
+                lote = lotes.setdefault(lote_ubicacion.lote_id, lote_ubicacion.lote)
+                lote.cantidad_disponible = max(0, lote.cantidad_disponible - cantidad)
+                lote.cantidad_reservada = max(0, lote.cantidad_reservada - cantidad)
+                lote_ubicacion.cantidad_reservada = max(0, lote_ubicacion.cantidad_reservada - cantidad)
+                lote_ubicacion.cantidad = max(0, lote_ubicacion.cantidad - cantidad)
+
+            LoteUbicacion.objects.bulk_update(ubicaciones, ['cantidad', 'cantidad_reservada'], batch_size=500)
+            Lote.objects.bulk_update(
+                lotes.values(), ['cantidad_disponible', 'cantidad_reservada'], batch_size=500
+            )
+            invalidar_dashboard()
+
+            # Las marcas de surtido pueden llegar por queryset.update (sin señales):
+            # se realinea el libro de reservas de las ubicaciones de esta propuesta.
+            recalcular_reserva_activa(lote_ubicacion_ids)
         
         return {
             'exito': True,
@@ -820,14 +777,18 @@ def completar_surtimiento_propuesta(propuesta_id):
         }
 
 
-def validar_disponibilidad_solicitud(solicitud_id):
+def validar_disponibilidad_solicitud(solicitud_id, detalle=False):
     """
     Valida si hay disponibilidad para los items de una solicitud.
     Permite validar incluso si hay disponibilidad parcial, ya que el algoritmo de generación
     de propuestas buscará múltiples lotes para cubrir la cantidad solicitada.
     
+    La disponibilidad de todas las claves se obtiene con una sola consulta agrupada
+    (``disponibilidad_neta_por_producto``).
+
     Args:
         solicitud_id: ID de la solicitud
+        detalle: si es True, registra en el log el desglose por lote de cada clave con error
     
     Returns:
         dict: {
@@ -836,8 +797,6 @@ def validar_disponibilidad_solicitud(solicitud_id):
             'mensaje_resumen': str con resumen del problema
         }
     """
-    from .pedidos_models import SolicitudPedido
-    
     try:
         solicitud = SolicitudPedido.objects.prefetch_related('items__producto').get(id=solicitud_id)
     except SolicitudPedido.DoesNotExist:
@@ -853,14 +812,16 @@ def validar_disponibilidad_solicitud(solicitud_id):
 
     # Solo validar disponibilidad para ítems que se van a surtir (cantidad_aprobada > 0).
     # Si cantidad_aprobada es 0, no se genera propuesta ni se reserva; no debe aparecer en alertas.
-    for item in solicitud.items.all():
-        if item.cantidad_aprobada <= 0:
-            continue
-        resultado = validar_disponibilidad_para_propuesta(
-            item.producto.id,
-            item.cantidad_aprobada,
-            solicitud.institucion_solicitante.id
-        )
+    items_a_validar = [item for item in solicitud.items.all() if item.cantidad_aprobada > 0]
+    netos = disponibilidad_neta_por_producto(item.producto_id for item in items_a_validar)
+    for item in items_a_validar:
+        cantidad_disponible = netos.get(item.producto_id, 0)
+        resultado = {
+            'disponible': cantidad_disponible >= item.cantidad_aprobada,
+            'cantidad_disponible': cantidad_disponible,
+        }
+        if detalle and not resultado['disponible']:
+            validar_disponibilidad_para_propuesta(item.producto_id, item.cantidad_aprobada, detalle=True)
 
         # Si no hay disponibilidad suficiente, pero hay alguna disponibilidad, es parcial
         if not resultado['disponible']:
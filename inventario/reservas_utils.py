@@ -0,0 +1,216 @@
+"""
+Libro de reservas activas por ubicación de lote.
+
+``LoteUbicacion.reserva_activa`` guarda la suma de ``LoteAsignado.cantidad_asignada``
+con ``surtido=False`` de esa ubicación: la "reserva real" que usan propuestas, selects
+AJAX y reportes. Se mantiene en la misma transacción que el cambio del LoteAsignado:
+
+1. ``save()`` / ``delete()`` de LoteAsignado (incluye borrados en CASCADE) mediante las
+   señales registradas en ``InventarioConfig.ready``. El delta se calcula contra la fila
+   leída con ``select_for_update`` (no contra el estado con que se cargó la instancia) y
+   se aplica con F().
+2. Escrituras en bloque (``bulk_create``, ``queryset.update``), que no disparan señales:
+   quien las hace llama a ``aplicar_deltas_reserva`` o ``recalcular_reserva_activa``.
+
+Los campos ``cantidad_reservada`` de Lote/LoteUbicacion siguen existiendo por
+compatibilidad, pero no son fuente de verdad; el comando ``verificar_reservas``
+compara el libro contra LoteAsignado, lo repara y realinea esos campos.
+"""
+
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import LoteUbicacion
+
+# Máximo de ubicaciones por UPDATE ... CASE para no generar sentencias gigantes.
+TAMANO_LOTE_ACTUALIZACION = 500
+
+
+def contribucion_reserva(lote_asignado):
+    """Unidades que un LoteAsignado aporta a la reserva activa de su ubicación."""
+    if lote_asignado.surtido:
+        return 0
+    return int(lote_asignado.cantidad_asignada or 0)
+
+
+def aplicar_deltas_reserva(deltas):
+    """
+    Suma los deltas indicados a ``LoteUbicacion.reserva_activa`` con actualizaciones
+    atómicas (F()), sin leer las filas. Nunca deja la reserva en negativo.
+
+    Args:
+        deltas: dict {lote_ubicacion_id: delta}
+
+    Returns:
+        int: número de ubicaciones actualizadas
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if pk and delta}
+    if not deltas:
+        return 0
+
+    actualizadas = 0
+    ids = sorted(deltas)
+    for inicio in range(0, len(ids), TAMANO_LOTE_ACTUALIZACION):
+        bloque = ids[inicio:inicio + TAMANO_LOTE_ACTUALIZACION]
+        incremento = Case(
+            *[When(id=pk, then=Value(deltas[pk])) for pk in bloque],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        actualizadas += LoteUbicacion.objects.filter(id__in=bloque).update(
+            reserva_activa=Greatest(F('reserva_activa') + incremento, Value(0))
+        )
+    return actualizadas
+
+
+def registrar_asignaciones_creadas(asignaciones):
+    """Refleja en el libro un ``bulk_create`` de LoteAsignado (no dispara señales)."""
+    deltas = {}
+    for asignacion in asignaciones:
+        deltas[asignacion.lote_ubicacion_id] = (
+            deltas.get(asignacion.lote_ubicacion_id, 0) + contribucion_reserva(asignacion)
+        )
+    return aplicar_deltas_reserva(deltas)
+
+
+def calcular_reserva_activa(lote_ubicacion_ids=None):
+    """
+    Reserva activa esperada según LoteAsignado (surtido=False), agrupada por ubicación.
+
+    Args:
+        lote_ubicacion_ids: iterable de ids a calcular; None = todas las ubicaciones.
+
+    Returns:
+        dict: {lote_ubicacion_id: total} (solo ubicaciones con reserva > 0)
+    """
+    from .pedidos_models import LoteAsignado
+
+    qs = LoteAsignado.objects.filter(surtido=False)
+    if lote_ubicacion_ids is not None:
+        qs = qs.filter(lote_ubicacion_id__in=list(lote_ubicacion_ids))
+    return {
+        pk: (total or 0)
+        for pk, total in qs.order_by()
+        .values('lote_ubicacion_id')
+        .annotate(total=Sum('cantidad_asignada'))
+        .values_list('lote_ubicacion_id', 'total')
+        if total
+    }
+
+
+def recalcular_reserva_activa(lote_ubicacion_ids=None, aplicar=True):
+    """
+    Compara ``reserva_activa`` contra LoteAsignado y corrige las diferencias.
+
+    Args:
+        lote_ubicacion_ids: ids a revisar; None = todas las ubicaciones.
+        aplicar: si es False solo reporta (modo dry-run).
+
+    Returns:
+        list: tuplas (lote_ubicacion_id, reserva_registrada, reserva_correcta)
+    """
+    esperado = calcular_reserva_activa(lote_ubicacion_ids)
+
+    qs = LoteUbicacion.objects.all()
+    if lote_ubicacion_ids is not None:
+        qs = qs.filter(id__in=list(lote_ubicacion_ids))
+    else:
+        # Solo filas con reserva registrada o esperada: evita recorrer ubicaciones en cero.
+        qs = qs.filter(Q(reserva_activa__gt=0) | Q(id__in=list(esperado)))
+
+    diferencias = []
+    corregir = []
+    for lote_ubicacion in qs.only('id', 'reserva_activa').iterator(chunk_size=2000):
+        correcta = esperado.get(lote_ubicacion.id, 0)
+        if lote_ubicacion.reserva_activa != correcta:
+            diferencias.append((lote_ubicacion.id, lote_ubicacion.reserva_activa, correcta))
+            lote_ubicacion.reserva_activa = correcta
+            corregir.append(lote_ubicacion)
+
+    if aplicar and corregir:
+        LoteUbicacion.objects.bulk_update(corregir, ['reserva_activa'], batch_size=TAMANO_LOTE_ACTUALIZACION)
+    return diferencias
+
+
+def totales_reserva_activa_por_lote(lote_ids):
+    """{lote_id: reserva activa} sumando el libro de sus ubicaciones (sin tocar LoteAsignado)."""
+    if not lote_ids:
+        return {}
+    return {
+        pk: (total or 0)
+        for pk, total in LoteUbicacion.objects.filter(
+            lote_id__in=lote_ids, reserva_activa__gt=0
+        )
+        .order_by()
+        .values('lote_id')
+        .annotate(total=Sum('reserva_activa'))
+        .values_list('lote_id', 'total')
+    }
+
+
+def subquery_reserva_activa_lote(outer_ref='pk'):
+    """Subconsulta con la reserva activa del lote referenciado, para ``annotate``."""
+    return (
+        LoteUbicacion.objects.filter(lote_id=OuterRef(outer_ref), reserva_activa__gt=0)
+        .order_by()
+        .values('lote_id')
+        .annotate(t=Sum('reserva_activa'))
+        .values('t')[:1]
+    )
+
+
+# ---------------------------------------------------------------------------
+# Señales de LoteAsignado (registradas en apps.InventarioConfig.ready)
+# ---------------------------------------------------------------------------
+
+def _estado_reserva(lote_asignado):
+    return (lote_asignado.lote_ubicacion_id, contribucion_reserva(lote_asignado))
+
+
+def _estado_reserva_bloqueado(sender, instance):
+    """
+    Estado vigente en BD de la asignación, con la fila bloqueada (``select_for_update``)
+    hasta el fin de la transacción; None si ya no existe. Dos ediciones concurrentes del
+    mismo LoteAsignado se serializan y cada una aplica su delta sobre lo que dejó la otra.
+    """
+    fila = (
+        sender.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list('lote_ubicacion_id', 'cantidad_asignada', 'surtido')
+        .first()
+    )
+    if fila is None:
+        return None
+    lote_ubicacion_id, cantidad, surtido = fila
+    return (lote_ubicacion_id, 0 if surtido else int(cantidad or 0))
+
+
+def lote_asignado_pre_save(sender, instance, raw=False, **kwargs):
+    """Base del delta: la fila actual bloqueada (LoteAsignado.save corre en una transacción)."""
+    if raw or instance._state.adding:
+        return
+    instance._reserva_cargada = _estado_reserva_bloqueado(sender, instance)
+
+
+def lote_asignado_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = None if created else getattr(instance, '_reserva_cargada', None)
+    nuevo = _estado_reserva(instance)
+    deltas = {}
+    if anterior:
+        deltas[anterior[0]] = deltas.get(anterior[0], 0) - anterior[1]
+    deltas[nuevo[0]] = deltas.get(nuevo[0], 0) + nuevo[1]
+    aplicar_deltas_reserva(deltas)
+    instance._reserva_cargada = nuevo
+
+
+def lote_asignado_pre_delete(sender, instance, **kwargs):
+    """El Collector de Django borra dentro de una transacción: se bloquea y lee la fila."""
+    instance._reserva_cargada = _estado_reserva_bloqueado(sender, instance)
+
+
+def lote_asignado_post_delete(sender, instance, **kwargs):
+    anterior = getattr(instance, '_reserva_cargada', None)
+    if anterior:
+        aplicar_deltas_reserva({anterior[0]: -anterior[1]})
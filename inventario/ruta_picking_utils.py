@@ -0,0 +1,235 @@
+"""
+Ruta de recorrido para picking (vista de tablet, hoja de surtido en Excel/PDF).
+
+Ordenar las líneas por código de ubicación hace que el surtidor recorra los racks en orden
+alfabético y cada rack completo de frente a fondo, aunque sólo tenga que tomar algo al
+principio del siguiente. Aquí cada ubicación se traduce a una posición física:
+
+- ``rack``: índice del rack dentro del almacén (orden natural del primer segmento del
+  código, p. ej. ``J6A`` en ``J6A.01.02``; o el campo ``rack``).
+- ``posicion``: posición a lo largo del rack (segundo segmento; o el campo ``pasillo``,
+  que es donde ``cargar_ubicaciones`` guarda la POSICION).
+- ``nivel``: altura (tercer segmento; o el campo ``nivel``).
+
+Entre ubicaciones del mismo rack se camina a lo largo del rack; para cambiar de rack se
+sale por el pasillo transversal del frente o del fondo (el más corto) y se cruza
+``ANCHO_ENTRE_RACKS`` por cada rack de distancia. Cambiar de nivel en la misma posición
+cuesta ``COSTO_NIVEL``.
+
+Las ubicaciones distintas son paradas; la ruta sale del frente del primer rack y regresa
+ahí. Se construye por vecino más cercano (o en serpentina rack por rack si hay más de
+``MAX_PARADAS_VECINO`` paradas) y se mejora con 2-opt en una ventana de
+``VENTANA_2OPT`` paradas. Las líneas de varias propuestas pueden recorrerse juntas en
+una ola (``ordenar_ola``).
+
+La distribución de cada almacén (código → posición, largo de cada rack) se lee una vez
+de UbicacionAlmacen y se guarda en caché ``DISTRIBUCION_CACHE_TTL`` segundos.
+
+Benchmark sobre almacenes sintéticos: ``python manage.py benchmark_ruta_picking``.
+"""
+
+import re
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+
+ANCHO_ENTRE_RACKS = 2.0
+COSTO_NIVEL = 0.2
+MAX_PARADAS_VECINO = 600
+VENTANA_2OPT = 60
+MAX_PASADAS_2OPT = 8
+DISTRIBUCION_CACHE_TTL = getattr(settings, 'RUTA_PICKING_CACHE_TTL', 600)
+
+_SEPARADORES = re.compile(r'[.\-_/\s]+')
+_DIGITOS = re.compile(r'\d+')
+
+
+def clave_natural(codigo):
+    """
+    Clave de ordenamiento natural para códigos de ubicación
+    (ej. J6A.01.02, J6A.01.03, J6A.01.10) para que ordenen correctamente.
+    """
+    if not codigo:
+        return (0, 0)
+    result = []
+    for part in re.split(r'(\d+)', str(codigo)):
+        if not part:
+            continue
+        result.append((1, int(part)) if part.isdigit() else (0, part))
+    return tuple(result)
+
+
+def _entero(texto):
+    encontrado = _DIGITOS.search(str(texto or ''))
+    return int(encontrado.group()) if encontrado else 0
+
+
+def descomponer_ubicacion(codigo, rack=None, pasillo=None, nivel=None):
+    """(rack, posicion, nivel) de una ubicación: segmentos del código o, si faltan, sus campos."""
+    segmentos = [s for s in _SEPARADORES.split(str(codigo or '').strip().upper()) if s]
+    nombre_rack = segmentos[0] if segmentos else str(rack or '').strip().upper()
+    posicion = _entero(segmentos[1]) if len(segmentos) > 1 else _entero(pasillo)
+    altura = _entero(segmentos[2]) if len(segmentos) > 2 else _entero(nivel)
+    return nombre_rack, posicion, altura
+
+
+@dataclass(frozen=True)
+class Punto:
+    rack: int
+    posicion: int
+    nivel: int
+
+
+class Distribucion:
+    """Posición física de cada código de ubicación de un almacén y largo de sus racks."""
+
+    def __init__(self, ubicaciones):
+        """``ubicaciones``: iterable de (codigo, rack, pasillo, nivel)."""
+        descompuestas = {
+            codigo: descomponer_ubicacion(codigo, rack, pasillo, nivel)
+            for codigo, rack, pasillo, nivel in ubicaciones
+        }
+        racks = sorted({d[0] for d in descompuestas.values()}, key=clave_natural)
+        self.indice_rack = {nombre: i for i, nombre in enumerate(racks)}
+        self.puntos = {
+            codigo: Punto(self.indice_rack[r], posicion, nivel)
+            for codigo, (r, posicion, nivel) in descompuestas.items()
+        }
+        self.largo = {}
+        for punto in self.puntos.values():
+            self.largo[punto.rack] = max(self.largo.get(punto.rack, 0), punto.posicion)
+
+    def punto(self, codigo):
+        punto = self.puntos.get(codigo)
+        if punto is None:
+            # Ubicación que no estaba al cargar la distribución: se coloca tras el último rack.
+            nombre, posicion, nivel = descomponer_ubicacion(codigo)
+            punto = Punto(self.indice_rack.get(nombre, len(self.indice_rack)), posicion, nivel)
+        return punto
+
+    def distancia(self, a, b):
+        niveles = COSTO_NIVEL * abs(a.nivel - b.nivel)
+        if a.rack == b.rack:
+            return abs(a.posicion - b.posicion) + niveles
+        largo = max(self.largo.get(a.rack, a.posicion), self.largo.get(b.rack, b.posicion))
+        por_frente = a.posicion + b.posicion
+        por_fondo = 2 * largo - a.posicion - b.posicion
+        return ANCHO_ENTRE_RACKS * abs(a.rack - b.rack) + min(por_frente, por_fondo) + niveles
+
+    def longitud(self, puntos, origen=Punto(0, 0, 0)):
+        """Distancia de recorrer ``puntos`` en orden, saliendo y regresando a ``origen``."""
+        total, anterior = 0.0, origen
+        for punto in puntos:
+            total += self.distancia(anterior, punto)
+            anterior = punto
+        return total + self.distancia(anterior, origen)
+
+
+def _serpentina(distribucion, puntos):
+    """Rack por rack; los racks pares de frente a fondo y los nones de regreso."""
+    return sorted(puntos, key=lambda p: (p.rack, p.posicion if p.rack % 2 == 0 else -p.posicion, p.nivel))
+
+
+def _vecino_mas_cercano(distribucion, puntos, origen):
+    pendientes = list(puntos)
+    ruta, actual = [], origen
+    distancia = distribucion.distancia
+    while pendientes:
+        mejor = min(range(len(pendientes)), key=lambda i: distancia(actual, pendientes[i]))
+        actual = pendientes[mejor]
+        pendientes[mejor] = pendientes[-1]
+        pendientes.pop()
+        ruta.append(actual)
+    return ruta
+
+
+def _dos_opt(distribucion, ruta, origen):
+    """Invierte tramos de hasta VENTANA_2OPT paradas mientras acorten el recorrido cerrado."""
+    recorrido = [origen] + ruta + [origen]
+    distancia = distribucion.distancia
+    ultimo = len(recorrido) - 1
+    for _ in range(MAX_PASADAS_2OPT):
+        mejoro = False
+        for i in range(1, ultimo - 1):
+            a, b = recorrido[i - 1], recorrido[i]
+            d_ab = distancia(a, b)
+            for j in range(i + 1, min(i + VENTANA_2OPT, ultimo)):
+                c, d = recorrido[j], recorrido[j + 1]
+                if distancia(a, c) + distancia(b, d) < d_ab + distancia(c, d) - 1e-9:
+                    recorrido[i:j + 1] = recorrido[j:i - 1:-1]
+                    b = recorrido[i]
+                    d_ab = distancia(a, b)
+                    mejoro = True
+        if not mejoro:
+            break
+    return recorrido[1:-1]
+
+
+def planificar_ruta(distribucion, puntos, origen=Punto(0, 0, 0)):
+    """Orden de visita de ``puntos`` (distintos) que acorta el recorrido cerrado desde ``origen``."""
+    puntos = list(puntos)
+    if len(puntos) <= 2:
+        return _serpentina(distribucion, puntos)
+    if len(puntos) <= MAX_PARADAS_VECINO:
+        ruta = _vecino_mas_cercano(distribucion, puntos, origen)
+    else:
+        ruta = _serpentina(distribucion, puntos)
+    return _dos_opt(distribucion, ruta, origen)
+
+
+def distribucion_almacen(almacen_id):
+    def cargar():
+        from .models import UbicacionAlmacen
+
+        return Distribucion(
+            UbicacionAlmacen.objects.filter(almacen_id=almacen_id)
+            .values_list('codigo', 'rack', 'pasillo', 'nivel')
+        )
+
+    return cache.get_or_set(f'ruta_picking:distribucion:{almacen_id}', cargar, DISTRIBUCION_CACHE_TTL)
+
+
+def ordenar_lineas(lineas, distribuciones=None):
+    """
+    Lista nueva con ``lineas`` en orden de recorrido.
+
+    Cada línea es un dict con ``almacen_id`` y ``ubicacion`` (código); se le agrega
+    ``parada`` (número de parada en la ruta, desde 1). Los almacenes se recorren por id;
+    dentro de una parada, las líneas quedan por producto.
+    """
+    distribuciones = distribuciones if distribuciones is not None else {}
+    por_almacen = {}
+    for linea in lineas:
+        por_almacen.setdefault(linea['almacen_id'], {}).setdefault(linea['ubicacion'], []).append(linea)
+
+    ordenadas, parada = [], 0
+    for almacen_id in sorted(por_almacen, key=lambda a: (a is None, a or 0)):
+        paradas = por_almacen[almacen_id]
+        distribucion = distribuciones.get(almacen_id)
+        if distribucion is None:
+            distribucion = distribuciones[almacen_id] = distribucion_almacen(almacen_id)
+        codigo_de = {}
+        for codigo in paradas:
+            codigo_de.setdefault(distribucion.punto(codigo), []).append(codigo)
+        for punto in planificar_ruta(distribucion, codigo_de):
+            for codigo in sorted(codigo_de[punto], key=clave_natural):
+                parada += 1
+                for linea in sorted(paradas[codigo], key=lambda x: (x.get('producto') or '').lower()):
+                    ordenadas.append(dict(linea, parada=parada))
+    return ordenadas
+
+
+def ordenar_ola(lineas_por_propuesta, distribuciones=None):
+    """
+    Una sola ruta para varias propuestas (ola de surtido).
+
+    ``lineas_por_propuesta``: {propuesta: [líneas]}; cada línea resultante lleva
+    ``propuesta`` para separar lo recogido al final del recorrido.
+    """
+    lineas = [
+        dict(linea, propuesta=propuesta)
+        for propuesta, lineas_propuesta in lineas_por_propuesta.items()
+        for linea in lineas_propuesta
+    ]
+    return ordenar_lineas(lineas, distribuciones)
@@ -0,0 +1,195 @@
+"""
+Saldos de cierre diario por lote (snapshots del kardex).
+
+La existencia histórica de un lote a una fecha es ``cantidad_nueva`` del último
+MovimientoInventario vigente hasta el cierre de ese día. En lugar de recorrer todo el
+historial en cada consulta, ``SaldoCierreLote`` guarda ese saldo por (lote, día) para los
+días ya cerrados (hasta ``ControlSaldosCierre.fecha_cierre``); solo la "cola" de
+movimientos posteriores al cierre se consulta directamente.
+
+Los filtros de fecha usan rangos ``[inicio del día, inicio del día siguiente)`` en la
+zona horaria local en vez de ``fecha_movimiento__date``, para que el motor use el índice
+de ``fecha_movimiento`` sin convertir cada fila.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ControlSaldosCierre, MovimientoInventario, SaldoCierreLote
+
+TIPOS_EXCLUIDOS_SALDO = ('AJUSTE_DATOS_LOTE',)
+
+# Días consolidados por pasada: acota la memoria en la primera carga del historial.
+DIAS_POR_BLOQUE = 31
+TAMANO_LOTE_INSERCION = 1000
+
+
+def inicio_dia(fecha):
+    """Datetime aware del inicio de ``fecha`` en la zona horaria local."""
+    return timezone.make_aware(datetime.combine(fecha, time.min))
+
+
+def fin_dia(fecha):
+    """Límite exclusivo del día: inicio del día siguiente."""
+    return inicio_dia(fecha + timedelta(days=1))
+
+
+def movimientos_vigentes():
+    """Movimientos que determinan el saldo físico (no anulados, sin ajustes de datos)."""
+    return MovimientoInventario.objects.filter(anulado=False).exclude(
+        tipo_movimiento__in=TIPOS_EXCLUIDOS_SALDO
+    )
+
+
+def obtener_fecha_cierre():
+    """Último día consolidado en SaldoCierreLote, o None si nunca se ha ejecutado."""
+    return ControlSaldosCierre.objects.filter(pk=1).values_list('fecha_cierre', flat=True).first()
+
+
+def consolidar_saldos(desde, hasta, lote_ids=None):
+    """
+    Recalcula los saldos de cierre de los días ``desde``..``hasta`` (inclusive).
+
+    Borra los snapshots del rango (de los lotes indicados, o de todos) y los vuelve a
+    generar a partir de los movimientos vigentes, así un día que se quedó sin
+    movimientos por anulaciones deja de tener fila.
+
+    Returns:
+        int: snapshots escritos
+    """
+    escritos = 0
+    dia = desde
+    while dia <= hasta:
+        fin_bloque = min(dia + timedelta(days=DIAS_POR_BLOQUE - 1), hasta)
+        movs = movimientos_vigentes().filter(
+            fecha_movimiento__gte=inicio_dia(dia),
+            fecha_movimiento__lt=fin_dia(fin_bloque),
+        )
+        existentes = SaldoCierreLote.objects.filter(fecha__gte=dia, fecha__lte=fin_bloque)
+        if lote_ids is not None:
+            movs = movs.filter(lote_id__in=lote_ids)
+            existentes = existentes.filter(lote_id__in=lote_ids)
+
+        # Ordenados cronológicamente: el último de cada (lote, día) gana.
+        cierres = {}
+        for lote_id, fecha_movimiento, mov_id, cantidad_nueva in (
+            movs.order_by('fecha_movimiento', 'id')
+            .values_list('lote_id', 'fecha_movimiento', 'id', 'cantidad_nueva')
+            .iterator(chunk_size=5000)
+        ):
+            cierres[(lote_id, timezone.localtime(fecha_movimiento).date())] = (cantidad_nueva, mov_id)
+
+        existentes.delete()
+        SaldoCierreLote.objects.bulk_create(
+            [
+                SaldoCierreLote(lote_id=lote_id, fecha=fecha, saldo=saldo, ultimo_movimiento_id=mov_id)
+                for (lote_id, fecha), (saldo, mov_id) in cierres.items()
+            ],
+            batch_size=TAMANO_LOTE_INSERCION,
+        )
+        escritos += len(cierres)
+        dia = fin_bloque + timedelta(days=1)
+    return escritos
+
+
+def actualizar_saldos_cierre(hasta=None, reconstruir=False):
+    """
+    Avanza el cierre hasta ``hasta`` (por defecto ayer) de forma incremental.
+
+    1. Consolida los días posteriores a ``fecha_cierre`` (la primera vez, desde el
+       primer movimiento registrado).
+    2. Reprocesa, desde el día del movimiento, los lotes con movimientos anulados
+       después de la última ejecución que caen en días ya cerrados.
+
+    Returns:
+        dict: {'desde', 'hasta', 'saldos', 'lotes_reprocesados'}
+    """
+    hasta = hasta or (timezone.localdate() - timedelta(days=1))
+    ahora = timezone.now()
+    resumen = {'desde': None, 'hasta': hasta, 'saldos': 0, 'lotes_reprocesados': 0}
+
+    with transaction.atomic():
+        control, _ = ControlSaldosCierre.objects.select_for_update().get_or_create(pk=1)
+        if reconstruir:
+            SaldoCierreLote.objects.all().delete()
+            control.fecha_cierre = None
+            control.ultima_ejecucion = None
+
+        if control.fecha_cierre and control.ultima_ejecucion:
+            anulados = (
+                MovimientoInventario.objects.filter(
+                    anulado=True,
+                    fecha_anulacion__gte=control.ultima_ejecucion,
+                    fecha_movimiento__lt=fin_dia(control.fecha_cierre),
+                )
+                .order_by()
+                .values('lote_id')
+                .annotate(primer_movimiento=Min('fecha_movimiento'))
+                .values_list('lote_id', 'primer_movimiento')
+            )
+            lotes_por_dia = {}
+            for lote_id, primer_movimiento in anulados:
+                lotes_por_dia.setdefault(timezone.localtime(primer_movimiento).date(), []).append(lote_id)
+            for dia, lote_ids in lotes_por_dia.items():
+                resumen['saldos'] += consolidar_saldos(dia, control.fecha_cierre, lote_ids)
+                resumen['lotes_reprocesados'] += len(lote_ids)
+
+        if control.fecha_cierre:
+            desde = control.fecha_cierre + timedelta(days=1)
+        else:
+            primero = movimientos_vigentes().aggregate(m=Min('fecha_movimiento'))['m']
+            desde = timezone.localtime(primero).date() if primero else hasta + timedelta(days=1)
+
+        if desde <= hasta:
+            resumen['desde'] = desde
+            resumen['saldos'] += consolidar_saldos(desde, hasta)
+
+        if control.fecha_cierre is None or hasta > control.fecha_cierre:
+            control.fecha_cierre = hasta
+        control.ultima_ejecucion = ahora
+        control.save()
+    return resumen
+
+
+def existencia_en_fecha(fecha, por_defecto, outer_ref='pk', fecha_cierre=None):
+    """
+    Expresión para ``annotate`` con la existencia física del lote al cierre de ``fecha``.
+
+    Busca primero en la cola de movimientos posteriores al cierre y después en el último
+    snapshot <= fecha; si no hay ninguno devuelve ``por_defecto`` (expresión o Value).
+    Sin snapshots (nunca se ejecutó el cierre) consulta todo el historial.
+    """
+    if fecha_cierre is None:
+        fecha_cierre = obtener_fecha_cierre()
+
+    candidatos = []
+    if fecha_cierre is None or fecha > fecha_cierre:
+        cola = movimientos_vigentes().filter(
+            lote_id=OuterRef(outer_ref),
+            fecha_movimiento__lt=fin_dia(fecha),
+        )
+        if fecha_cierre is not None:
+            cola = cola.filter(fecha_movimiento__gte=fin_dia(fecha_cierre))
+        candidatos.append(
+            Subquery(
+                cola.order_by('-fecha_movimiento', '-id').values('cantidad_nueva')[:1],
+                output_field=IntegerField(),
+            )
+        )
+    if fecha_cierre is not None:
+        candidatos.append(
+            Subquery(
+                SaldoCierreLote.objects.filter(
+                    lote_id=OuterRef(outer_ref),
+                    fecha__lte=min(fecha, fecha_cierre),
+                )
+                .order_by('-fecha')
+                .values('saldo')[:1],
+                output_field=IntegerField(),
+            )
+        )
+    return Coalesce(*candidatos, por_defecto, output_field=IntegerField())
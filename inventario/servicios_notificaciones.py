@@ -6,15 +6,18 @@ Proporciona funcionalidades para:
 - Enviar notificaciones por Telegram
 - Registrar logs de notificaciones
 - Gestionar configuración centralizada
+
+Los envíos se encolan como LogNotificaciones pendientes en la transacción de quien
+llama; el despacho real (SMTP / API de Telegram) ocurre tras el commit, fuera del
+request (ver notificaciones_outbox_utils).
 """
 
-import requests
 import logging
-from django.core.mail import send_mail, EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.conf import settings
 from .models import ConfiguracionNotificaciones, LogNotificaciones
+from .notificaciones_outbox_utils import encolar
 
 logger = logging.getLogger(__name__)
 
@@ -73,55 +76,21 @@ class ServicioNotificaciones:
                 'log_id': None
             }
         
-        # Crear log de notificación
-        log = LogNotificaciones.objects.create(
+        # Encolar: se envía después del commit (ver notificaciones_outbox_utils)
+        log = encolar(
             tipo='email',
             evento=evento,
             asunto=asunto,
             mensaje=mensaje,
             destinatarios=', '.join(destinatarios),
-            estado='pendiente',
             usuario_relacionado=usuario
         )
         
-        try:
-            # Enviar email
-            send_mail(
-                subject=asunto,
-                message=mensaje,
-                from_email=config.email_remitente,
-                recipient_list=destinatarios,
-                fail_silently=False,
-                html_message=mensaje  # Permitir HTML
-            )
-            
-            # Actualizar log
-            log.estado = 'enviada'
-            log.fecha_entrega = timezone.now()
-            log.respuesta = 'Email enviado exitosamente'
-            log.save()
-            
-            logger.info(f"Email enviado: {asunto} a {', '.join(destinatarios)}")
-            
-            return {
-                'exitoso': True,
-                'mensaje': 'Email enviado exitosamente',
-                'log_id': log.id
-            }
-        
-        except Exception as e:
-            # Registrar error
-            log.estado = 'error'
-            log.respuesta = str(e)
-            log.save()
-            
-            logger.error(f"Error al enviar email: {str(e)}")
-            
-            return {
-                'exitoso': False,
-                'mensaje': f'Error al enviar email: {str(e)}',
-                'log_id': log.id
-            }
+        return {
+            'exitoso': True,
+            'mensaje': 'Email encolado para envío',
+            'log_id': log.id
+        }
     
     # ========================================================================
     # NOTIFICACIONES POR TELEGRAM
@@ -157,72 +126,21 @@ class ServicioNotificaciones:
                 'log_id': None
             }
         
-        # Crear log de notificación
-        log = LogNotificaciones.objects.create(
+        # Encolar: se envía después del commit (ver notificaciones_outbox_utils)
+        log = encolar(
             tipo='telegram',
             evento=evento,
             asunto=f'Notificación Telegram: {evento}',
             mensaje=mensaje,
             destinatarios=config.telegram_chat_id,
-            estado='pendiente',
             usuario_relacionado=usuario
         )
         
-        try:
-            # Construir URL de Telegram
-            url = f"https://api.telegram.org/bot{config.telegram_token}/sendMessage"
-            
-            # Preparar datos
-            datos = {
-                'chat_id': config.telegram_chat_id,
-                'text': mensaje,
-                'parse_mode': 'Markdown'  # Usar Markdown en lugar de HTML
-            }
-            
-            # Enviar mensaje
-            respuesta = requests.post(url, json=datos, timeout=10)
-            
-            if respuesta.status_code == 200:
-                # Actualizar log
-                log.estado = 'enviada'
-                log.fecha_entrega = timezone.now()
-                log.respuesta = 'Mensaje enviado a Telegram exitosamente'
-                log.save()
-                
-                logger.info(f"Mensaje Telegram enviado: {evento}")
-                
-                return {
-                    'exitoso': True,
-                    'mensaje': 'Mensaje enviado a Telegram exitosamente',
-                    'log_id': log.id
-                }
-            else:
-                # Error en respuesta
-                log.estado = 'error'
-                log.respuesta = f"Error {respuesta.status_code}: {respuesta.text}"
-                log.save()
-                
-                logger.error(f"Error Telegram {respuesta.status_code}: {respuesta.text}")
-                
-                return {
-                    'exitoso': False,
-                    'mensaje': f'Error al enviar a Telegram: {respuesta.text}',
-                    'log_id': log.id
-                }
-        
-        except Exception as e:
-            # Registrar error
-            log.estado = 'error'
-            log.respuesta = str(e)
-            log.save()
-            
-            logger.error(f"Error al enviar Telegram: {str(e)}")
-            
-            return {
-                'exitoso': False,
-                'mensaje': f'Error al enviar a Telegram: {str(e)}',
-                'log_id': log.id
-            }
+        return {
+            'exitoso': True,
+            'mensaje': 'Mensaje de Telegram encolado para envío',
+            'log_id': log.id
+        }
     
     # ========================================================================
     # NOTIFICACIONES COMBINADAS
@@ -1,5 +1,4 @@
 from django import template
-from django.db.models import Sum
 
 register = template.Library()
 
@@ -22,19 +21,13 @@ def disponible_real(lote_ubicacion):
     Cantidad realmente disponible en una ubicación de lote:
     cantidad física - reserva activa real (suma de LoteAsignado con surtido=False).
 
-    Se evita usar `cantidad_reservada` persistida porque puede estar desfasada.
+    Se evita usar `cantidad_reservada` persistida porque puede estar desfasada; la reserva
+    activa se lee del libro `reserva_activa` (sin consulta extra).
     """
     if lote_ubicacion is None:
         return 0
     try:
-        from inventario.pedidos_models import LoteAsignado
-
-        reservada_activa = (
-            LoteAsignado.objects.filter(lote_ubicacion=lote_ubicacion, surtido=False)
-            .aggregate(total=Sum('cantidad_asignada'))
-            .get('total')
-            or 0
-        )
+        reservada_activa = lote_ubicacion.reserva_activa or 0
         return max(0, int(lote_ubicacion.cantidad or 0) - int(reservada_activa))
     except (TypeError, AttributeError):
         return 0
\ No newline at end of file
@@ -1,9 +1,11 @@
 """
 Template tags para renderizar menús dinámicos basados en MenuItemRol
-Soporta jerarquía de menús con submenús
+Soporta jerarquía de menús con submenús.
+El árbol visible se resuelve una vez por request (ver inventario.menu_roles_utils).
 """
 
 from django import template
+from inventario.menu_roles_utils import acceso_menu_usuario
 from inventario.models import MenuItemRol
 
 register = template.Library()
@@ -15,28 +17,10 @@ def obtener_items_menu_principales(user):
     Obtiene los items del menú principal (sin padre) que el usuario puede ver
     basado en sus roles. Soporta jerarquía de menús.
     """
-    
-    if not user.is_authenticated:
+    acceso = acceso_menu_usuario(user)
+    if acceso is None:
         return []
-    
-    # Si es superusuario, mostrar todo
-    if user.is_superuser:
-        return MenuItemRol.objects.filter(
-            activo=True, 
-            menu_padre__isnull=True
-        ).order_by('orden')
-    
-    # Obtener grupos del usuario
-    user_groups = user.groups.all()
-    
-    # Obtener items que el usuario puede ver (solo items sin padre)
-    items = MenuItemRol.objects.filter(
-        activo=True,
-        menu_padre__isnull=True,
-        roles_permitidos__in=user_groups
-    ).distinct().order_by('orden')
-    
-    return items
+    return acceso.raices
 
 
 @register.simple_tag
@@ -44,28 +28,10 @@ def obtener_submenus(menu_padre, user):
     """
     Obtiene los submenús de un menú padre que el usuario puede ver
     """
-    
-    if not user.is_authenticated:
+    acceso = acceso_menu_usuario(user)
+    if acceso is None:
         return []
-    
-    # Si es superusuario, mostrar todo
-    if user.is_superuser:
-        return MenuItemRol.objects.filter(
-            activo=True,
-            menu_padre=menu_padre
-        ).order_by('orden')
-    
-    # Obtener grupos del usuario
-    user_groups = user.groups.all()
-    
-    # Obtener submenús que el usuario puede ver
-    submenus = MenuItemRol.objects.filter(
-        activo=True,
-        menu_padre=menu_padre,
-        roles_permitidos__in=user_groups
-    ).distinct().order_by('orden')
-    
-    return submenus
+    return acceso.submenus(menu_padre)
 
 
 @register.filter
@@ -73,26 +39,8 @@ def tiene_submenus(menu_item, user):
     """
     Verifica si un menú tiene submenús que el usuario puede ver
     """
-    
-    if not user.is_authenticated:
-        return False
-    
-    # Si es superusuario
-    if user.is_superuser:
-        return MenuItemRol.objects.filter(
-            activo=True,
-            menu_padre=menu_item
-        ).exists()
-    
-    # Obtener grupos del usuario
-    user_groups = user.groups.all()
-    
-    # Verificar si hay submenús
-    return MenuItemRol.objects.filter(
-        activo=True,
-        menu_padre=menu_item,
-        roles_permitidos__in=user_groups
-    ).distinct().exists()
+    acceso = acceso_menu_usuario(user)
+    return bool(acceso and acceso.submenus(menu_item))
 
 
 @register.filter
@@ -100,26 +48,10 @@ def contar_submenus(menu_item, user):
     """
     Cuenta cuántos submenús tiene un menú que el usuario puede ver
     """
-    
-    if not user.is_authenticated:
+    acceso = acceso_menu_usuario(user)
+    if acceso is None:
         return 0
-    
-    # Si es superusuario
-    if user.is_superuser:
-        return MenuItemRol.objects.filter(
-            activo=True,
-            menu_padre=menu_item
-        ).count()
-    
-    # Obtener grupos del usuario
-    user_groups = user.groups.all()
-    
-    # Contar submenús
-    return MenuItemRol.objects.filter(
-        activo=True,
-        menu_padre=menu_item,
-        roles_permitidos__in=user_groups
-    ).distinct().count()
+    return len(acceso.submenus(menu_item))
 
 
 @register.filter
@@ -129,12 +61,12 @@ def puede_acceder_url(usuario, url_name):
     """
     if usuario.is_superuser:
         return True
-    
-    menu_item = MenuItemRol.objects.filter(url_name=url_name, activo=True).first()
+
+    acceso = acceso_menu_usuario(usuario)
+    menu_item = acceso.menu_de_url(url_name) if acceso else None
     if not menu_item:
         return False
-    user_groups = usuario.groups.all()
-    return menu_item.roles_permitidos.filter(id__in=user_groups).exists()
+    return acceso.puede_ver(menu_item)
 
 
 @register.simple_tag
@@ -1,8 +1,16 @@
+import json
+import re
 from datetime import date, timedelta
 from decimal import Decimal
+from io import StringIO
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
 from .models import (
     Almacen,
@@ -10,16 +18,22 @@ from .models import (
     Institucion,
     Lote,
     LoteUbicacion,
+    MenuItemRol,
+    MovimientoInventario,
     Producto,
     TipoInstitucion,
+    TrabajoSegundoPlano,
     UbicacionAlmacen,
 )
 from .pedidos_models import ItemSolicitud, LoteAsignado, SolicitudPedido
+from .fase5_utils import generar_movimientos_suministro
+from .kardex_utils import saldo_inicial_lote
 from .propuesta_generator import PropuestaGenerator
 from .propuesta_utils import (
     cantidad_existencia_fisica_lote_como_reporte_existencias,
     completar_surtimiento_propuesta,
     totales_reserva_activa_por_lote_ids,
+    validar_disponibilidad_solicitud,
 )
 
 
@@ -144,3 +158,1444 @@ class FlujoPedidosSurtimientoTest(TestCase):
 
         reservas = totales_reserva_activa_por_lote_ids([self.lote.id])
         self.assertEqual(reservas.get(self.lote.id, 0), 0)
+
+    def test_generar_movimientos_suministro_en_bloque(self):
+        ubicacion_b = UbicacionAlmacen.objects.create(almacen=self.almacen, codigo="B-01")
+        LoteUbicacion.objects.create(
+            lote=self.lote, ubicacion=ubicacion_b, cantidad=50, usuario_asignacion=self.usuario
+        )
+        Lote.objects.filter(pk=self.lote.pk).update(cantidad_disponible=150)
+        solicitud = self._crear_solicitud_validada(cantidad_aprobada=120)
+        propuesta = PropuestaGenerator(solicitud.id, self.usuario).generate()
+        asignaciones = LoteAsignado.objects.filter(item_propuesta__propuesta=propuesta).count()
+        self.assertEqual(asignaciones, 2)
+
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = generar_movimientos_suministro(propuesta.id, self.usuario)
+
+        self.assertTrue(resultado["exito"], resultado["mensaje"])
+        self.assertEqual(resultado["movimientos_creados"], 2)
+        # Número fijo de sentencias: no crece con las líneas de la propuesta.
+        self.assertLessEqual(len(consultas), 10)
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote.cantidad_disponible, 30)
+        self.assertEqual(
+            sum(LoteUbicacion.objects.filter(lote=self.lote).values_list("cantidad", flat=True)), 30
+        )
+        # Cada movimiento parte del saldo que dejó el anterior dentro del mismo lote.
+        saldos = sorted(
+            MovimientoInventario.objects.filter(lote=self.lote, tipo_movimiento="SALIDA")
+            .values_list("cantidad_anterior", "cantidad_nueva"),
+            reverse=True,
+        )
+        self.assertEqual(saldos[0][0], 150)
+        self.assertEqual(saldos[0][1], saldos[1][0])
+        self.assertEqual(saldos[1][1], 30)
+
+    def test_generacion_propuesta_respeta_caducidad_lote_y_ubicacion(self):
+        # Lote que caduca antes, repartido en dos ubicaciones: debe consumirse primero,
+        # recorriendo las ubicaciones por código, antes de tocar QA-LOTE-001.
+        ubicacion_b = UbicacionAlmacen.objects.create(almacen=self.almacen, codigo="B-01")
+        lote_pronto = Lote.objects.create(
+            numero_lote="QA-LOTE-000",
+            producto=self.producto,
+            institucion=self.institucion,
+            almacen=self.almacen,
+            ubicacion=ubicacion_b,
+            cantidad_inicial=30,
+            cantidad_disponible=30,
+            precio_unitario=Decimal("10.00"),
+            valor_total=Decimal("300.00"),
+            fecha_caducidad=date.today() + timedelta(days=90),
+            fecha_recepcion=date.today(),
+            estado=1,
+            creado_por=self.usuario,
+        )
+        lu_b = LoteUbicacion.objects.create(lote=lote_pronto, ubicacion=ubicacion_b, cantidad=20)
+        lu_a = LoteUbicacion.objects.create(lote=lote_pronto, ubicacion=self.ubicacion, cantidad=10)
+        solicitud = self._crear_solicitud_validada(cantidad_aprobada=40)
+
+        propuesta = PropuestaGenerator(solicitud.id, self.usuario).generate()
+
+        asignado = {
+            a.lote_ubicacion_id: a.cantidad_asignada
+            for a in LoteAsignado.objects.filter(item_propuesta__propuesta=propuesta)
+        }
+        self.assertEqual(asignado, {lu_a.id: 10, lu_b.id: 20, self.lote_ubicacion.id: 10})
+        self.assertEqual(propuesta.total_disponible, 130)
+        self.assertEqual(propuesta.items.get().estado, "DISPONIBLE")
+
+        lote_pronto.refresh_from_db()
+        self.lote.refresh_from_db()
+        self.assertEqual(lote_pronto.cantidad_reservada, 30)
+        self.assertEqual(self.lote.cantidad_reservada, 10)
+
+    def test_libro_reserva_activa_sigue_asignaciones(self):
+        solicitud = self._crear_solicitud_validada(cantidad_aprobada=40)
+        propuesta = PropuestaGenerator(solicitud.id, self.usuario).generate()
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 40)
+
+        asignacion = LoteAsignado.objects.get(item_propuesta__propuesta=propuesta)
+        asignacion.cantidad_asignada = 25
+        asignacion.save(update_fields=["cantidad_asignada"])
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 25)
+
+        asignacion.surtido = True
+        asignacion.save(update_fields=["surtido"])
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 0)
+
+        asignacion.surtido = False
+        asignacion.save(update_fields=["surtido"])
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 25)
+
+        # Dos copias cargadas antes de editar (como dos peticiones concurrentes): el delta
+        # se calcula contra la fila bloqueada, no contra el estado con que se cargó cada una.
+        copia_a = LoteAsignado.objects.get(pk=asignacion.pk)
+        copia_b = LoteAsignado.objects.get(pk=asignacion.pk)
+        copia_a.cantidad_asignada = 30
+        copia_a.save(update_fields=["cantidad_asignada"])
+        copia_b.cantidad_asignada = 35
+        copia_b.save(update_fields=["cantidad_asignada"])
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 35)
+
+        copia_a.delete()
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 0)
+        propuesta.delete()
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 0)
+
+        # Desfase provocado a mano: el comando de verificación lo detecta y lo repara.
+        LoteUbicacion.objects.filter(pk=self.lote_ubicacion.pk).update(reserva_activa=7)
+        salida = StringIO()
+        call_command("verificar_reservas", "--reparar", stdout=salida)
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.reserva_activa, 0)
+        self.assertIn("Ubicaciones con libro desfasado: 1", salida.getvalue())
+
+    def test_validar_disponibilidad_solicitud_descuenta_reservas(self):
+        PropuestaGenerator(self._crear_solicitud_validada(cantidad_aprobada=40).id, self.usuario).generate()
+        solicitud = self._crear_solicitud_validada(cantidad_aprobada=80)
+
+        resultado = validar_disponibilidad_solicitud(solicitud.id)
+
+        self.assertTrue(resultado["disponible"])
+        self.assertEqual(len(resultado["items_con_error"]), 1)
+        error = resultado["items_con_error"][0]
+        self.assertEqual(error["cantidad_disponible"], 60)
+        self.assertEqual(error["diferencia"], 20)
+        self.assertTrue(error["parcial"])
+
+    def test_cola_picking_anotada_paginada_y_etag(self):
+        for _ in range(3):
+            propuesta = PropuestaGenerator(self._crear_solicitud_validada(cantidad_aprobada=10).id, self.usuario).generate()
+            propuesta.estado = "REVISADA"
+            propuesta.save(update_fields=["estado"])
+        admin = get_user_model().objects.create_superuser("qa_picking", "qa@example.com", "x")
+        self.client.force_login(admin)
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse("picking:dashboard"))
+        self.assertEqual(respuesta.status_code, 200)
+        page_obj = respuesta.context["page_obj"]
+        self.assertEqual(page_obj.paginator.count, 3)
+        fila = page_obj[0]
+        self.assertEqual((fila.total_items, fila.lineas_pendientes, fila.ubicaciones_pendientes), (1, 1, 1))
+        self.assertFalse([q for q in consultas.captured_queries if "inventario_itempropuesta" in q["sql"]
+                          and "GROUP BY" not in q["sql"]])
+
+        url = reverse("picking:estado_cola")
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.json()["propuestas"][0]["lineas_pendientes"], 1)
+        etag = respuesta["ETag"]
+        self.assertEqual(self.client.get(url)["ETag"], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        LoteAsignado.objects.filter(item_propuesta__propuesta=propuesta).update(
+            surtido=True, usuario_surtido=admin, fecha_surtimiento=timezone.now()
+        )
+        monitor = self.client.get(reverse("picking:monitor"))
+        self.assertEqual(monitor.context["total_electronicos"], 1)
+        self.assertEqual(monitor.context["lista_electronicos"][0]["usuario"], admin)
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta["ETag"], etag)
+
+    def test_saldos_cierre_coinciden_con_historial(self):
+        hoy = timezone.localdate()
+
+        def movimiento(dias_atras, tipo, cantidad, anterior, nueva):
+            mov = MovimientoInventario.objects.create(
+                lote=self.lote,
+                tipo_movimiento=tipo,
+                cantidad=cantidad,
+                cantidad_anterior=anterior,
+                cantidad_nueva=nueva,
+                motivo="QA",
+                usuario=self.usuario,
+            )
+            fecha = timezone.now() - timedelta(days=dias_atras)
+            MovimientoInventario.objects.filter(pk=mov.pk).update(fecha_movimiento=fecha)
+            return mov
+
+        movimiento(5, "ENTRADA", 100, 0, 100)
+        salida = movimiento(3, "SALIDA", 30, 100, 70)
+        movimiento(1, "SALIDA", 10, 70, 60)
+        movimiento(0, "SALIDA", 5, 60, 55)
+
+        esperado = {d: saldo_inicial_lote(self.lote, hoy - timedelta(days=d)) for d in range(7)}
+        call_command("actualizar_saldos_cierre", stdout=StringIO())
+        self.assertEqual(
+            {d: saldo_inicial_lote(self.lote, hoy - timedelta(days=d)) for d in range(7)},
+            esperado,
+        )
+        self.assertEqual(saldo_inicial_lote(self.lote, hoy - timedelta(days=2)), 70)
+        self.assertEqual(saldo_inicial_lote(self.lote, hoy + timedelta(days=1)), 55)
+
+        # La anulación de un movimiento de un día ya cerrado reprocesa el lote.
+        MovimientoInventario.objects.filter(pk=salida.pk).update(
+            anulado=True, fecha_anulacion=timezone.now()
+        )
+        call_command("actualizar_saldos_cierre", stdout=StringIO())
+        self.assertEqual(saldo_inicial_lote(self.lote, hoy - timedelta(days=2)), 100)
+
+
+    def test_reporte_usuarios_lee_consolidado_diario(self):
+        from .models import ActividadUsuarioDia
+
+        def movimiento(dias_atras):
+            mov = MovimientoInventario.objects.create(
+                lote=self.lote, tipo_movimiento="ENTRADA", cantidad=1,
+                cantidad_anterior=0, cantidad_nueva=1, motivo="QA", usuario=self.usuario,
+            )
+            MovimientoInventario.objects.filter(pk=mov.pk).update(
+                fecha_movimiento=timezone.now() - timedelta(days=dias_atras)
+            )
+
+        for dias_atras in (10, 10, 4, 0):
+            movimiento(dias_atras)
+        self.client.force_login(self.usuario)
+        url = reverse("reporte_usuarios_actividades")
+        etiquetas = self.client.get(url).context["etiquetas"]
+        columna = etiquetas.index("Movimientos inventario")
+
+        def movimientos(**filtros):
+            respuesta = self.client.get(url, filtros)
+            fila = next(f for f in respuesta.context["filas"] if f["usuario"] == self.usuario)
+            return fila["counts_list"][columna]
+
+        en_vivo = movimientos()
+        call_command("actualizar_actividad_usuarios", stdout=StringIO())
+        self.assertTrue(ActividadUsuarioDia.objects.filter(usuario=self.usuario, total=2).exists())
+        self.assertEqual(movimientos(), en_vivo)
+        self.assertEqual(en_vivo, 4)
+        hace = lambda d: (timezone.localdate() - timedelta(days=d)).isoformat()
+        self.assertEqual(movimientos(desde=hace(5)), 2)
+        self.assertEqual(movimientos(desde=hace(12), hasta=hace(5)), 2)
+
+        # Con el cierre al día, el reporte completo no vuelve a agrupar MovimientoInventario.
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(url)
+        self.assertFalse([
+            q for q in consultas.captured_queries
+            if "inventario_movimientoinventario" in q["sql"] and "GROUP BY" in q["sql"] and ">=" not in q["sql"]
+        ])
+
+        # Una fuente que falla solo omite esa actividad, en el reporte y en el consolidado.
+        from unittest import mock
+
+        from . import actividad_usuarios_utils
+
+        rota = ("MovimientoInventario", "usuario", ("campo_inexistente",), "Rota")
+        with mock.patch.object(actividad_usuarios_utils, "ACTIVIDADES", [rota] + actividad_usuarios_utils.ACTIVIDADES):
+            with self.assertLogs("inventario.actividad_usuarios_utils", "ERROR"):
+                self.assertEqual(movimientos(), 4)
+            with self.assertLogs("inventario.actividad_usuarios_utils", "ERROR"):
+                call_command("actualizar_actividad_usuarios", "--reconstruir", stdout=StringIO())
+        self.assertTrue(ActividadUsuarioDia.objects.filter(usuario=self.usuario, total=2).exists())
+        self.assertEqual(movimientos(), 4)
+
+    def test_reporte_ubicaciones_vacias_y_ocupacion_por_rack(self):
+        from .ocupacion_utils import OCUPACION_RESERVADA, resumen_ocupacion, ubicaciones_con_ocupacion
+
+        UbicacionAlmacen.objects.filter(pk=self.ubicacion.pk).update(rack="A")
+        for codigo in ("A-02", "A-03", "B-01"):
+            UbicacionAlmacen.objects.create(almacen=self.almacen, codigo=codigo, rack=codigo[0])
+        LoteUbicacion.objects.filter(pk=self.lote_ubicacion.pk).update(reserva_activa=30)
+
+        self.client.force_login(self.usuario)
+        url = reverse("reporte_ubicaciones_vacias")
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url, {"almacen": self.almacen.id, "codigo": "a-0"})
+        self.assertEqual(respuesta.context["total_registros"], 2)
+        self.assertEqual([u.codigo for u in respuesta.context["page_obj"]], ["A-02", "A-03"])
+        self.assertLess(len(consultas), 15)
+
+        self.assertEqual(
+            list(ubicaciones_con_ocupacion(ocupacion=OCUPACION_RESERVADA).values_list("codigo", flat=True)),
+            ["A-01"],
+        )
+        rack_a, rack_b = resumen_ocupacion(almacen_id=self.almacen.id)
+        self.assertEqual(
+            (rack_a["rack"], rack_a["posiciones"], rack_a["vacias"], rack_a["reservadas"], rack_a["unidades"]),
+            ("A", 3, 2, 1, 100),
+        )
+        self.assertEqual(rack_a["porcentaje_ocupado"], 33.3)
+        self.assertEqual((rack_b["rack"], rack_b["vacias"], rack_b["porcentaje_ocupado"]), ("B", 1, 0))
+
+        excel = self.client.get(reverse("exportar_ubicaciones_vacias_excel"), {"formato": "csv"})
+        self.assertEqual(b"".join(excel.streaming_content).decode("utf-8-sig").count("\n"), 5)
+
+    def test_reportes_caducados_y_disponibilidad_paginan_en_sql(self):
+        hoy = timezone.now().date()
+        for i, dias in enumerate((-10, 5, 20, 45, 80, 80)):
+            Lote.objects.create(
+                numero_lote=f"CAD-{i}", producto=self.producto, institucion=self.institucion,
+                almacen=self.almacen, cantidad_inicial=10, cantidad_disponible=10,
+                precio_unitario=Decimal("2.00"), valor_total=Decimal("20.00"),
+                fecha_caducidad=hoy + timedelta(days=dias), fecha_recepcion=hoy, estado=1,
+            )
+        LoteUbicacion.objects.filter(pk=self.lote_ubicacion.pk).update(reserva_activa=30)
+        self.client.force_login(self.usuario)
+
+        respuesta = self.client.get(reverse("reporte_caducados"), {"rango": "60"})
+        contexto = respuesta.context
+        self.assertEqual(
+            (contexto["conteo_caducado"], contexto["conteo_30"], contexto["conteo_60"], contexto["conteo_90"]),
+            (1, 2, 3, 5),
+        )
+        self.assertEqual((contexto["total_registros"], contexto["total_cantidad"]), (3, 30))
+        self.assertEqual(contexto["total_valor"], 60.0)
+        self.assertEqual([item["dias"] for item in contexto["page_obj"]], [5, 20, 45])
+
+        url = reverse("reportes:reporte_disponibilidad_lotes")
+        with CaptureQueriesContext(connection) as consultas:
+            contexto = self.client.get(url).context
+        self.assertEqual(contexto["total_lotes"], 7)
+        self.assertEqual(
+            (contexto["total_disponible"], contexto["total_reservado"], contexto["total_neto"]), (160, 30, 130)
+        )
+        self.assertEqual(len(contexto["datos_reporte"]), 7)
+        with CaptureQueriesContext(connection) as consultas_mas:
+            self.client.get(url, {"page": 2})
+        self.assertLessEqual(len(consultas_mas), len(consultas))
+        self.assertFalse([q for q in consultas.captured_queries if "ubicaciones_detalle" in q["sql"]])
+
+    def test_dashboard_movimientos_feed_union_en_bd(self):
+        from .models import OrdenSuministro
+
+        self.usuario.first_name, self.usuario.last_name = "Ana", "QA"
+        self.usuario.save()
+        for tipo, cantidad in (("ENTRADA", 5), ("SALIDA", 2)):
+            MovimientoInventario.objects.create(
+                lote=self.lote, tipo_movimiento=tipo, cantidad=cantidad,
+                cantidad_anterior=100, cantidad_nueva=100, motivo="QA " * 60, usuario=self.usuario,
+            )
+        OrdenSuministro.objects.create(numero_orden="OS-QA-1", partida_presupuestal="2531", fecha_orden=date.today())
+        self.client.force_login(self.usuario)
+
+        url = reverse("dashboard_movimientos")
+        with CaptureQueriesContext(connection) as consultas:
+            contexto = self.client.get(url).context
+        estadisticas = contexto["estadisticas"]
+        self.assertEqual(estadisticas["total_movimientos"], 4)
+        self.assertEqual(
+            estadisticas["por_tipo"],
+            {"Movimiento de Inventario": 2, "Asignación de Ubicación": 1, "Orden de Suministro": 1},
+        )
+        self.assertEqual(estadisticas["por_usuario"], {"Ana QA": 3, "-": 1})
+        self.assertEqual(estadisticas["por_institucion"], {"Institucion QA": 3})
+
+        filas = list(contexto["page_obj"])
+        self.assertEqual(filas[0]["id"], "orden_%s" % OrdenSuministro.objects.get().pk)
+        self.assertIsNone(filas[0]["cantidad"])
+        salida = next(f for f in filas if f["subtipo"] == "Salida")
+        self.assertEqual((salida["cantidad"], salida["folio"], len(salida["motivo"])), (2, "-", 100))
+        asignacion = next(f for f in filas if f["tipo"] == "Asignación de Ubicación")
+        self.assertEqual((asignacion["motivo"], asignacion["folio"]), ("Ubicación: A-01", "QA-LOTE-001"))
+
+        # Más filas no agregan consultas: página, total y conteos van en SQL.
+        for _ in range(30):
+            MovimientoInventario.objects.create(
+                lote=self.lote, tipo_movimiento="ENTRADA", cantidad=1,
+                cantidad_anterior=100, cantidad_nueva=101, motivo="QA", usuario=self.usuario,
+            )
+        with CaptureQueriesContext(connection) as consultas_mas:
+            contexto = self.client.get(url, {"page": 2}).context
+        self.assertLessEqual(len(consultas_mas), len(consultas))
+        self.assertEqual(len(contexto["page_obj"]), 9)
+
+        # Contrato de la API: tipos/total solo con movimientos; el feed va en actividades
+        datos = self.client.get(reverse("api_estadisticas_movimientos")).json()
+        self.assertEqual(datos, {
+            "tipos": {"ENTRADA": 31, "SALIDA": 1},
+            "total": 32,
+            "actividades": {
+                "Movimiento de Inventario": 32, "Asignación de Ubicación": 1, "Orden de Suministro": 1,
+            },
+            "total_actividades": 34,
+        })
+
+    def test_reporte_lote_pedidos_agrega_en_dos_consultas(self):
+        solicitud = self._crear_solicitud_validada(cantidad_aprobada=40)
+        propuesta = PropuestaGenerator(solicitud.id, self.usuario).generate()
+        self.client.force_login(self.usuario)
+
+        url = reverse("reportes:reporte_lote_pedidos")
+        with CaptureQueriesContext(connection) as consultas:
+            contexto = self.client.get(url).context
+        self.assertEqual(contexto["total_lotes"], 1)
+        lote = contexto["page_obj"][0]
+        self.assertEqual(
+            (lote["cantidad_disponible"], lote["cantidad_reservada"], lote["cantidad_neta"], lote["total_pedidos"]),
+            (100, 40, 60, 1),
+        )
+        pedido = lote["pedidos"][0]
+        self.assertEqual(
+            (pedido["propuesta_id"], pedido["solicitud_folio"], pedido["institucion_solicitante"]),
+            (propuesta.id, "PED-QA-0001", "Institucion QA"),
+        )
+        self.assertEqual(
+            (pedido["cantidad_total_asignada"], pedido["cantidad_total_surtida"], pedido["cantidad_pendiente_surtir"]),
+            (40, 0, 40),
+        )
+        # Rollup lote × propuesta y metadatos de lotes: sin consultas por asignación.
+        consultas_reporte = [q for q in consultas.captured_queries if "inventario_loteasignado" in q["sql"]]
+        self.assertEqual(len(consultas_reporte), 1)
+
+        respuesta = self.client.get(reverse("reportes:exportar_lote_pedidos_excel"), {"lote": "QA-LOTE"})
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_sincronizar_conteos_en_lote_es_idempotente(self):
+        from unittest import mock
+
+        from .conteo_mobile_services import ConteoSincronizado, sincronizar_conteos
+        from .models import SincronizacionConteoMovil
+
+        conteos = [
+            ConteoSincronizado("tablet-1", self.lote_ubicacion.id, 90),
+            ConteoSincronizado("tablet-2", self.lote_ubicacion.id, 95, observaciones="Recontado"),
+            ConteoSincronizado("tablet-1", self.lote_ubicacion.id, 90),
+            ConteoSincronizado("tablet-3", 999999, 10),
+        ]
+        resultados = sincronizar_conteos(self.usuario, conteos)
+
+        self.assertEqual([r["estado"] for r in resultados], ["aplicado", "aplicado", "duplicado", "error"])
+        self.assertEqual((resultados[0]["cantidad_anterior"], resultados[0]["diferencia"]), (100, -10))
+        self.assertEqual((resultados[1]["cantidad_anterior"], resultados[1]["cantidad_nueva"]), (90, 95))
+        self.lote_ubicacion.refresh_from_db()
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.cantidad, 95)
+        self.assertEqual(self.lote.cantidad_disponible, 95)
+        self.assertEqual(self.lote_ubicacion.registro_conteo.tercer_conteo, 95)
+        self.assertEqual(MovimientoInventario.objects.filter(lote=self.lote).count(), 2)
+
+        # Reenvío del mismo lote tras un corte de red: no se vuelve a aplicar.
+        reenvio = sincronizar_conteos(self.usuario, conteos[:2])
+        self.assertEqual([r["estado"] for r in reenvio], ["duplicado", "duplicado"])
+        self.assertEqual(reenvio[0]["movimiento_id"], resultados[0]["movimiento_id"])
+        self.assertEqual(MovimientoInventario.objects.filter(lote=self.lote).count(), 2)
+
+        # La clave es por usuario: otro dispositivo/usuario con la misma clave no recibe este resultado.
+        otro = get_user_model().objects.create_user(username="qa_otro", password="x")
+        ajeno = sincronizar_conteos(otro, [ConteoSincronizado("tablet-1", self.lote_ubicacion.id, 80)])
+        self.assertEqual((ajeno[0]["estado"], ajeno[0]["cantidad_anterior"]), ("aplicado", 95))
+        self.assertEqual(SincronizacionConteoMovil.objects.filter(clave_idempotencia="tablet-1").count(), 2)
+
+        # Una sincronización concurrente que reclama la misma clave entre la consulta de previas y el
+        # reclamo: esta responde 'duplicado' con el resultado de la otra y no aplica nada.
+        reclamar = SincronizacionConteoMovil.objects.bulk_create
+
+        def competir(objs, **kwargs):
+            SincronizacionConteoMovil.objects.create(
+                clave_idempotencia="tablet-9", usuario=self.usuario, resultado={"cantidad_nueva": 70}
+            )
+            return reclamar(objs, **kwargs)
+
+        with mock.patch.object(SincronizacionConteoMovil.objects, "bulk_create", side_effect=competir):
+            carrera = sincronizar_conteos(
+                self.usuario,
+                [ConteoSincronizado("tablet-9", self.lote_ubicacion.id, 60), ConteoSincronizado("tablet-5", 999999, 1)],
+            )
+        self.assertEqual([r["estado"] for r in carrera], ["duplicado", "error"])
+        self.assertEqual(carrera[0]["cantidad_nueva"], 70)
+        self.lote_ubicacion.refresh_from_db()
+        self.assertEqual(self.lote_ubicacion.cantidad, 80)
+        # La clave reclamada de un conteo con error se libera para poder reintentarlo.
+        self.assertFalse(SincronizacionConteoMovil.objects.filter(clave_idempotencia="tablet-5").exists())
+
+
+class PlanesConsultaTest(TestCase):
+    """
+    Regresión de planes de ejecución: las consultas de asignación y reportes sobre las
+    tablas grandes deben resolverse por índice. Se ejecuta cada consulta real, se obtiene
+    su plan y falla si aparece un recorrido secuencial sobre Lote, LoteUbicacion o
+    MovimientoInventario.
+
+    En PostgreSQL se fija ``enable_seqscan = off`` dentro de la transacción de la prueba
+    (con pocas filas el planificador preferiría un Seq Scan aunque exista el índice) y se
+    recorre ``EXPLAIN (FORMAT JSON)``: si aun así queda un Seq Scan, no hay índice que la
+    consulta pueda usar. En SQLite se revisa ``EXPLAIN QUERY PLAN`` como chequeo
+    secundario.
+    """
+
+    INDICES = {
+        Lote: ('lote_prod_cad_disponible', 'lote_prod_estado_cad', 'lote_almacen_estado'),
+        LoteUbicacion: ('loteubic_lote_con_exist', 'loteubic_ubic_con_exist'),
+        MovimientoInventario: ('mov_lote_fecha_vigente', 'mov_fecha_vigente', 'mov_tipo_fecha', 'mov_fecha_anulacion'),
+    }
+
+    TABLAS_GRANDES = ()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.TABLAS_GRANDES = (
+            Lote._meta.db_table,
+            LoteUbicacion._meta.db_table,
+            MovimientoInventario._meta.db_table,
+        )
+        cls.usuario = get_user_model().objects.create_user(username="qa_planes", password="x")
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Planes QA")
+        cls.institucion = Institucion.objects.create(
+            clue="QA002", denominacion="Institucion planes", tipo_institucion=tipo
+        )
+        cls.almacen = Almacen.objects.create(
+            institucion=cls.institucion, nombre="Almacen planes", codigo="ALM-QA-02"
+        )
+        ubicaciones = UbicacionAlmacen.objects.bulk_create(
+            [UbicacionAlmacen(almacen=cls.almacen, codigo=f"P-{i:02d}") for i in range(10)]
+        )
+        categoria = CategoriaProducto.objects.create(nombre="Planes QA")
+        cls.productos = Producto.objects.bulk_create(
+            [
+                Producto(
+                    clave_cnis=f"010.000.{i:04d}",
+                    descripcion=f"Producto planes {i}",
+                    categoria=categoria,
+                    unidad_medida="PIEZA",
+                )
+                for i in range(20)
+            ]
+        )
+        hoy = date.today()
+        lotes = Lote.objects.bulk_create(
+            [
+                Lote(
+                    numero_lote=f"PL-{p.id}-{n}",
+                    producto=p,
+                    institucion=cls.institucion,
+                    almacen=cls.almacen,
+                    cantidad_inicial=50,
+                    cantidad_disponible=50,
+                    precio_unitario=Decimal("1.00"),
+                    valor_total=Decimal("50.00"),
+                    fecha_caducidad=hoy + timedelta(days=100 + n * 30),
+                    fecha_recepcion=hoy - timedelta(days=30),
+                    estado=1 if n % 4 else 6,
+                )
+                for p in cls.productos
+                for n in range(10)
+            ]
+        )
+        LoteUbicacion.objects.bulk_create(
+            [
+                LoteUbicacion(lote=lote, ubicacion=ubicaciones[i % 10], cantidad=50 if i % 3 else 0)
+                for i, lote in enumerate(lotes)
+            ]
+        )
+        MovimientoInventario.objects.bulk_create(
+            [
+                MovimientoInventario(
+                    lote=lote,
+                    tipo_movimiento="SALIDA" if m else "ENTRADA",
+                    cantidad=1,
+                    cantidad_anterior=50,
+                    cantidad_nueva=49,
+                    motivo="QA",
+                    usuario=cls.usuario,
+                )
+                for lote in lotes
+                for m in range(5)
+            ]
+        )
+        cls.lote = lotes[1]
+
+    def _recorridos_secuenciales(self, funcion):
+        """Ejecuta ``funcion`` y devuelve [(tabla, sql)] de cada recorrido secuencial."""
+        es_postgres = connection.vendor == "postgresql"
+        if not es_postgres and connection.vendor != "sqlite":
+            self.skipTest(f"Sin verificación de planes para {connection.vendor}")
+        with CaptureQueriesContext(connection) as capturadas:
+            funcion()
+        hallazgos = []
+        with connection.cursor() as cursor:
+            if es_postgres:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            for consulta in capturadas.captured_queries:
+                sql = consulta["sql"]
+                if not sql.lstrip().upper().startswith("SELECT"):
+                    continue
+                if es_postgres:
+                    cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    escaneadas = self._seq_scans(plan[0]["Plan"])
+                else:
+                    # SQLite muestra el alias de las subconsultas (U0, T3...), no la tabla.
+                    alias = dict((a, t) for t, a in re.findall(r'"(\w+)" ([UT]\d+)\b', sql))
+                    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                    lineas = [fila[-1] for fila in cursor.fetchall()]
+                    escaneadas = [
+                        alias.get(l.split()[1], l.split()[1]) for l in lineas
+                        if l.startswith("SCAN ") and " USING " not in l
+                    ]
+                hallazgos.extend((tabla, sql) for tabla in escaneadas if tabla in self.TABLAS_GRANDES)
+        return hallazgos
+
+    @classmethod
+    def _seq_scans(cls, nodo):
+        """Tablas con nodo ``Seq Scan`` en un plan de ``EXPLAIN (FORMAT JSON)``."""
+        tablas = [nodo["Relation Name"]] if nodo.get("Node Type") == "Seq Scan" else []
+        for hijo in nodo.get("Plans", ()):
+            tablas.extend(cls._seq_scans(hijo))
+        return tablas
+
+    def test_indices_tablas_grandes(self):
+        with connection.cursor() as cursor:
+            for modelo, nombres in self.INDICES.items():
+                existentes = connection.introspection.get_constraints(cursor, modelo._meta.db_table)
+                for nombre in nombres:
+                    self.assertIn(nombre, existentes, f"Falta el índice {nombre} en {modelo._meta.db_table}")
+
+    def test_planes_asignacion_y_disponibilidad(self):
+        from .propuesta_utils import disponibilidad_neta_por_producto
+
+        producto_ids = [p.id for p in self.productos[:3]]
+        solicitud = SolicitudPedido.objects.create(
+            institucion_solicitante=self.institucion,
+            almacen_destino=self.almacen,
+            usuario_solicitante=self.usuario,
+            fecha_entrega_programada=date.today() + timedelta(days=1),
+            estado="VALIDADA",
+        )
+        ItemSolicitud.objects.bulk_create(
+            [
+                ItemSolicitud(
+                    solicitud=solicitud, producto_id=pk, cantidad_solicitada=60, cantidad_aprobada=60
+                )
+                for pk in producto_ids
+            ]
+        )
+        generador = PropuestaGenerator(solicitud.id, self.usuario)
+        self.assertEqual(self._recorridos_secuenciales(generador.generate), [])
+        self.assertEqual(
+            self._recorridos_secuenciales(lambda: disponibilidad_neta_por_producto(producto_ids)), []
+        )
+
+    def test_planes_kardex_e_historial(self):
+        from .comparativo_inventario_utils import annotar_existencias_comparativo
+        from .kardex_utils import construir_kardex_lote
+
+        hoy = timezone.localdate()
+        self.assertEqual(
+            self._recorridos_secuenciales(
+                lambda: construir_kardex_lote(self.lote, hoy - timedelta(days=30), hoy)
+            ),
+            [],
+        )
+        self.assertEqual(
+            self._recorridos_secuenciales(
+                lambda: list(
+                    annotar_existencias_comparativo(
+                        Lote.objects.filter(producto=self.productos[0]), hoy - timedelta(days=7), hoy
+                    )
+                )
+            ),
+            [],
+        )
+
+
+class MenuRolesResolverTest(TestCase):
+    """El árbol de menú por rol se resuelve una vez por usuario/request y se invalida al editar menús."""
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+
+        from .menu_roles_utils import invalidar_catalogo_menu
+
+        invalidar_catalogo_menu()
+        self.grupo = Group.objects.create(name="Almacenero")
+        otro = Group.objects.create(name="Supervisión")
+        self.padre = MenuItemRol.objects.create(menu_item="inventario", nombre_mostrado="Inventario", url_name="x", orden=1)
+        self.hijo = MenuItemRol.objects.create(
+            menu_item="lotes", nombre_mostrado="Lotes", url_name="lista_lotes", menu_padre=self.padre, orden=1
+        )
+        self.restringido = MenuItemRol.objects.create(
+            menu_item="roles", nombre_mostrado="Roles", url_name="admin_roles", menu_padre=self.padre, orden=2
+        )
+        self.padre.roles_permitidos.add(self.grupo)
+        self.hijo.roles_permitidos.add(self.grupo)
+        self.restringido.roles_permitidos.add(otro)
+        self.usuario = get_user_model().objects.create_user(username="qa_menu", password="x")
+        self.usuario.groups.add(self.grupo)
+
+    def test_arbol_visible_con_una_consulta_de_roles(self):
+        from .menu_roles_utils import acceso_menu_usuario, obtener_catalogo_menu
+        from .templatetags.menu_tags import (
+            obtener_items_menu_principales,
+            obtener_submenus,
+            puede_acceder_url,
+            tiene_submenus,
+        )
+
+        obtener_catalogo_menu()
+        with self.assertNumQueries(1):
+            acceso = acceso_menu_usuario(self.usuario)
+            raices = obtener_items_menu_principales(self.usuario)
+            self.assertEqual(raices, [self.padre])
+            self.assertTrue(tiene_submenus(self.padre, self.usuario))
+            self.assertEqual(obtener_submenus(self.padre, self.usuario), [self.hijo])
+            self.assertTrue(puede_acceder_url(self.usuario, "lista_lotes"))
+            self.assertFalse(puede_acceder_url(self.usuario, "admin_roles"))
+            self.assertEqual(acceso.roles, ["Almacenero"])
+
+        # Cambiar los roles de un menú invalida el catálogo del proceso.
+        self.restringido.roles_permitidos.add(self.grupo)
+        del self.usuario._acceso_menu
+        self.assertEqual(obtener_submenus(self.padre, self.usuario), [self.hijo, self.restringido])
+
+
+class LogSistemaDiferidoTest(TestCase):
+    def test_deduplica_y_respalda_en_archivo(self):
+        import tempfile
+        from pathlib import Path
+        from unittest import mock
+
+        from . import logs_utils
+        from .models import LogSistema
+
+        for _ in range(3):
+            LogSistema.crear_log("ERROR", "SISTEMA", "Error no manejado en /qa/", "BD caída")
+        self.assertEqual(LogSistema.objects.count(), 1)
+        logs_utils.sink.flush()
+        resumen = LogSistema.objects.get(detalles__repeticiones=2)
+        self.assertIn("repetido 2 veces", resumen.mensaje)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            respaldo = Path(tmp) / "respaldo.jsonl"
+            with mock.patch.object(logs_utils, "ARCHIVO_RESPALDO", respaldo), mock.patch.object(
+                LogSistema.objects, "bulk_create", side_effect=RuntimeError("sin BD")
+            ):
+                LogSistema.crear_log("ERROR", "SISTEMA", "Otro error", "timeout")
+            self.assertEqual(LogSistema.objects.count(), 2)
+            self.assertEqual(logs_utils.reimportar_respaldo(respaldo), 1)
+            self.assertTrue(LogSistema.objects.filter(titulo="Otro error").exists())
+
+    def test_deduplica_solo_errores_del_mismo_usuario_y_url(self):
+        from . import logs_utils
+        from .models import LogSistema
+
+        usuario = get_user_model().objects.create_user(username="qa_logs", password="x")
+        for _ in range(2):
+            LogSistema.crear_log("WARNING", "SISTEMA", "Aviso QA", "repetido")
+        LogSistema.crear_log("ERROR", "SISTEMA", "Error QA", "falla", url="/qa/a/")
+        LogSistema.crear_log("ERROR", "SISTEMA", "Error QA", "falla", url="/qa/b/")
+        LogSistema.crear_log("ERROR", "SISTEMA", "Error QA", "falla", usuario=usuario, url="/qa/a/")
+        LogSistema.crear_log("ERROR", "SISTEMA", "Error QA", "falla", url="/qa/a/")
+        self.assertEqual(LogSistema.objects.filter(titulo="Aviso QA").count(), 2)
+        self.assertEqual(LogSistema.objects.filter(titulo="Error QA").count(), 3)
+
+        # Modo síncrono: el siguiente log cierra las ventanas vencidas y guarda su resumen.
+        for visto in logs_utils.sink._vistos.values():
+            visto["expira"] = 0
+        LogSistema.crear_log("INFO", "SISTEMA", "Info QA", "cualquiera")
+        resumen = LogSistema.objects.get(titulo="Error QA", detalles__repeticiones=1)
+        self.assertEqual(resumen.url, "/qa/a/")
+        self.assertIsNone(resumen.usuario_id)
+        self.assertEqual(logs_utils.sink._vistos, {})
+
+
+class NotificacionesOutboxTest(TestCase):
+    def test_encola_en_transaccion_y_despacha_con_reintento(self):
+        from unittest import mock
+
+        from django.db import transaction
+
+        from . import notificaciones_outbox_utils as outbox
+        from .models import ConfiguracionNotificaciones, LogNotificaciones
+        from .servicios_notificaciones import ServicioNotificaciones
+
+        ConfiguracionNotificaciones.objects.create(
+            email_habilitado=False, telegram_habilitado=True, telegram_token="t", telegram_chat_id="-100"
+        )
+        servicio = ServicioNotificaciones()
+
+        # Si la transacción del llamador se revierte, la notificación no existe.
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            servicio.enviar_telegram("descartada", evento="qa")
+            raise RuntimeError
+        self.assertFalse(LogNotificaciones.objects.exists())
+
+        for texto in ("uno", "dos"):
+            self.assertTrue(servicio.enviar_telegram(texto, evento="qa")["exitoso"])
+        self.assertEqual(LogNotificaciones.objects.filter(estado="pendiente").count(), 2)
+
+        caida = mock.Mock(status_code=502, text="Bad Gateway")
+        ok = mock.Mock(status_code=200)
+        sesion = mock.Mock()
+        sesion.post.side_effect = [caida, ok]
+        with mock.patch.object(outbox, "sesion_http", return_value=sesion), mock.patch.object(
+            outbox, "limitador_telegram", outbox.LimitadorPorChat(0)
+        ):
+            self.assertEqual(outbox.despachar_pendientes()["reintentos"], 2)
+            # Ambos mensajes del chat viajaron en una sola llamada.
+            self.assertEqual(sesion.post.call_count, 1)
+            self.assertEqual(outbox.despachar_pendientes()["enviadas"], 0)
+
+            LogNotificaciones.objects.update(proximo_intento=timezone.now())
+            self.assertEqual(outbox.despachar_pendientes()["enviadas"], 2)
+        self.assertEqual(
+            list(LogNotificaciones.objects.order_by().values_list("estado", "intentos").distinct()), [("enviada", 2)]
+        )
+
+
+class CargaMasivaLotesTest(TestCase):
+    def test_carga_por_bloques_con_consultas_acotadas(self):
+        import os
+        import tempfile
+
+        from openpyxl import Workbook
+
+        from .views_carga_masiva import procesar_carga_masiva
+
+        usuario = get_user_model().objects.create_user(username="qa_carga", password="x")
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Carga QA")
+        institucion = Institucion.objects.create(clue="QA003", denominacion="Institucion carga", tipo_institucion=tipo)
+        almacen = Almacen.objects.create(institucion=institucion, nombre="Almacen carga", codigo="ALM-QA-03")
+        categoria = CategoriaProducto.objects.create(nombre="Carga QA")
+        producto = Producto.objects.create(clave_cnis="010.000.9000", descripcion="Existente", categoria=categoria)
+        existente = Lote.objects.create(
+            numero_lote="EX-1", producto=producto, institucion=institucion, almacen=almacen,
+            cantidad_inicial=5, cantidad_disponible=5, precio_unitario=Decimal("2.00"),
+            valor_total=Decimal("10.00"), fecha_recepcion=date.today(),
+        )
+        LoteUbicacion.objects.create(
+            lote=existente, ubicacion=UbicacionAlmacen.objects.create(almacen=almacen, codigo="A-01"), cantidad=5
+        )
+
+        libro = Workbook()
+        hoja = libro.active
+        hoja.append(["almcen", "CLAVE", "DESCRIPCION", "LOTE", "CADUCIDAD", "UBICACIÓN", "INVENTARIO"])
+        hoja.append([almacen.id, "010.000.9000", "Existente", "EX-1", "2030-01-31", "A-01", 7])
+        hoja.append([almacen.id, "010.000.9000", "Existente", "EX-1", None, "A-02", 3])
+        for i in range(40):
+            hoja.append([almacen.id, f"020.000.{i:04d}", f"Nuevo {i}", f"N-{i}", None, f"B-{i % 4}", 10])
+        hoja.append([almacen.id, "S/CLAVE", "", "X", None, "A-01", 1])
+        hoja.append([999999, "010.000.9000", "", "EX-2", None, "A-01", 1])
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+            ruta = tmp.name
+        libro.save(ruta)
+
+        try:
+            with CaptureQueriesContext(connection) as consultas:
+                stats = procesar_carga_masiva(ruta, institucion.id, usuario)
+        finally:
+            os.remove(ruta)
+
+        # Resolución por bloque, no por fila (antes ~5 consultas por renglón).
+        self.assertLess(len(consultas), 30)
+        self.assertEqual(stats["total_registros"], 44)
+        self.assertEqual(stats["procesados"], 42)
+        self.assertEqual(stats["omitidos"], 1)
+        self.assertEqual(stats["errores"], 1)
+        self.assertEqual(stats["productos_creados"], 40)
+        self.assertEqual(stats["ubicaciones_creadas"], 5)
+        self.assertEqual(stats["lotes_creados"], 40)
+        existente.refresh_from_db()
+        self.assertEqual(existente.fecha_caducidad, date(2030, 1, 31))
+        self.assertEqual(existente.cantidad_disponible, 10)
+        self.assertEqual(Lote.objects.get(numero_lote="N-3").ubicaciones_detalle.get().cantidad, 10)
+
+    def test_comando_no_sobrescribe_cantidades_de_lotes_existentes(self):
+        import os
+        import tempfile
+
+        from openpyxl import Workbook
+
+        usuario = get_user_model().objects.create_user(username="qa_carga_cmd", password="x")
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Carga comando QA")
+        institucion = Institucion.objects.create(clue="QA007", denominacion="Institucion comando", tipo_institucion=tipo)
+        almacen = Almacen.objects.create(institucion=institucion, nombre="Almacen comando", codigo="ALM-QA-07")
+        categoria = CategoriaProducto.objects.create(nombre="Carga comando QA")
+        producto = Producto.objects.create(clave_cnis="010.000.9100", descripcion="Existente", categoria=categoria)
+        existente = Lote.objects.create(
+            numero_lote="EX-C", producto=producto, institucion=institucion, almacen=almacen,
+            cantidad_inicial=5, cantidad_disponible=5, precio_unitario=Decimal("2.00"),
+            valor_total=Decimal("10.00"), fecha_recepcion=date.today(),
+        )
+
+        libro = Workbook()
+        hoja = libro.active
+        hoja.append(["almcen", "CLAVE", "DESCRIPCION", "LOTE", "CADUCIDAD", "UBICACIÓN", "INVENTARIO"])
+        hoja.append([almacen.id, "010.000.9100", "Existente", "EX-C", "2031-06-30", "C-01", 80])
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+            ruta = tmp.name
+        libro.save(ruta)
+        try:
+            call_command(
+                "cargar_lotes_masivo", ruta, "--institucion-id", str(institucion.id),
+                "--usuario-id", str(usuario.id), stdout=StringIO(),
+            )
+        finally:
+            os.remove(ruta)
+
+        existente.refresh_from_db()
+        self.assertEqual(existente.fecha_caducidad, date(2031, 6, 30))
+        self.assertEqual(existente.cantidad_inicial, 5)
+        self.assertEqual(existente.valor_total, Decimal("10.00"))
+
+
+class TrabajosSegundoPlanoTest(TestCase):
+    def test_exportacion_como_trabajo_y_descarga(self):
+        import tempfile
+
+        from .trabajos_utils import ejecutar_trabajo
+
+        usuario = get_user_model().objects.create_user(username="qa_trabajos", password="x")
+        otro = get_user_model().objects.create_user(username="qa_trabajos_2", password="x")
+        trabajo = TrabajoSegundoPlano.objects.create(
+            tipo="vista",
+            usuario=usuario,
+            parametros={
+                "vista": "inventario.views_reporte_inventario_detallado.exportar_inventario_detallado_excel",
+                "metodo": "GET",
+                "GET": {},
+                "POST": {},
+            },
+        )
+
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            ejecutar_trabajo(trabajo.pk)
+            trabajo.refresh_from_db()
+            self.assertEqual(trabajo.estado, "completado", trabajo.mensaje_error)
+            self.assertTrue(trabajo.nombre_resultado.endswith(".xlsx"))
+
+            self.client.force_login(usuario)
+            estado = self.client.get(reverse("trabajo_estado", args=[trabajo.pk])).json()
+            self.assertTrue(estado["terminado"])
+            self.assertEqual(estado["url_resultado"], reverse("trabajo_descargar", args=[trabajo.pk]))
+            descarga = self.client.get(estado["url_resultado"])
+            self.assertEqual(descarga.status_code, 200)
+            self.assertTrue(b"".join(descarga.streaming_content).startswith(b"PK"))
+            self.assertContains(self.client.get(reverse("trabajo_detalle", args=[trabajo.pk])), "Descargar archivo")
+
+            self.client.force_login(otro)
+            self.assertEqual(self.client.get(reverse("trabajo_descargar", args=[trabajo.pk])).status_code, 404)
+
+
+    def _excel(self, filas):
+        from io import BytesIO
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from openpyxl import Workbook
+
+        libro = Workbook()
+        for fila in filas:
+            libro.active.append(fila)
+        contenido = BytesIO()
+        libro.save(contenido)
+        return SimpleUploadedFile("carga.xlsx", contenido.getvalue())
+
+    def test_cargas_con_archivo_como_trabajo(self):
+        import tempfile
+
+        usuario = get_user_model().objects.create_superuser(username="qa_trabajos_cargas", password="x")
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Cargas QA")
+        institucion = Institucion.objects.create(clue="QA009", denominacion="Institucion cargas", tipo_institucion=tipo)
+        almacen = Almacen.objects.create(institucion=institucion, nombre="Almacen origen", codigo="ALM-QA-09")
+        destino = Almacen.objects.create(institucion=institucion, nombre="Almacen destino", codigo="ALM-QA-10")
+        ubicacion = UbicacionAlmacen.objects.create(almacen=almacen, codigo="U-01")
+        categoria = CategoriaProducto.objects.create(nombre="Cargas QA")
+        producto = Producto.objects.create(clave_cnis="010.000.9200", descripcion="Conteo", categoria=categoria)
+        lote = Lote.objects.create(
+            numero_lote="CT-1", producto=producto, institucion=institucion, almacen=almacen,
+            cantidad_inicial=5, cantidad_disponible=5, precio_unitario=Decimal("1.00"),
+            valor_total=Decimal("5.00"), fecha_recepcion=date.today(),
+        )
+        LoteUbicacion.objects.create(lote=lote, ubicacion=ubicacion, cantidad=5)
+        self.client.force_login(usuario)
+
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            respuesta = self.client.post(reverse("carga_masiva_ubicaciones_almacen"), {
+                "archivo_excel": self._excel([["ubicación", "zona"], ["U-01", "Almacen destino"], ["U-99", "Almacen destino"]]),
+            })
+            trabajo = TrabajoSegundoPlano.objects.get(tipo="carga_masiva_ubicaciones_almacen")
+            self.assertRedirects(respuesta, reverse("trabajo_detalle", args=[trabajo.pk]), fetch_redirect_response=False)
+            self.assertEqual(trabajo.estado, "completado", trabajo.mensaje_error)
+            self.assertEqual(trabajo.resultado["actualizados"], 1)
+            ubicacion.refresh_from_db()
+            self.assertEqual(ubicacion.almacen_id, destino.id)
+            estado = self.client.get(reverse("trabajo_estado", args=[trabajo.pk])).json()
+            self.assertContains(self.client.get(estado["url_resultado"]), "U-99")
+
+            respuesta = self.client.post(reverse("logistica:carga_masiva_conteos"), {
+                "archivo": self._excel([["CLAVE", "LOTE", "UBICACIÓN", "INVENTARIO"], ["010.000.9200", "CT-1", "U-01", 8], ["010.000.9200", "CT-X", "U-01", 1]]),
+            })
+            trabajo = TrabajoSegundoPlano.objects.get(tipo="carga_masiva_conteos")
+            self.assertRedirects(respuesta, reverse("trabajo_detalle", args=[trabajo.pk]), fetch_redirect_response=False)
+            self.assertEqual(trabajo.estado, "completado", trabajo.mensaje_error)
+            self.assertEqual(trabajo.resultado["creados"], 1)
+            self.assertEqual(len(trabajo.resultado["errores"]), 1)
+            self.assertEqual(lote.ubicaciones_detalle.get().cantidad, 8)
+            estado = self.client.get(reverse("trabajo_estado", args=[trabajo.pk])).json()
+            self.assertContains(self.client.get(estado["url_resultado"]), "CT-X")
+
+            with self.assertLogs("inventario.trabajos_utils", "ERROR"):
+                self.client.post(reverse("carga_masiva_ubicaciones_almacen"), {
+                    "archivo_excel": self._excel([["codigo", "almacen"], ["U-01", "Almacen origen"]]),
+                })
+            trabajo = TrabajoSegundoPlano.objects.filter(tipo="carga_masiva_ubicaciones_almacen").latest("pk")
+            self.assertEqual(trabajo.estado, "error")
+            self.assertIn("ubicación", trabajo.mensaje_error)
+
+class ExportacionStreamingTest(TestCase):
+    def test_disponibilidad_excel_y_csv(self):
+        from io import BytesIO
+
+        from openpyxl import load_workbook
+
+        usuario = get_user_model().objects.create_user(username="qa_export", password="x")
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Export QA")
+        institucion = Institucion.objects.create(clue="QA004", denominacion="Institucion export", tipo_institucion=tipo)
+        almacen = Almacen.objects.create(institucion=institucion, nombre="Almacen export", codigo="ALM-QA-04")
+        categoria = CategoriaProducto.objects.create(nombre="Export QA")
+        for i in range(3):
+            producto = Producto.objects.create(clave_cnis=f"030.000.{i:04d}", descripcion=f"Prod {i}", categoria=categoria)
+            Lote.objects.create(
+                numero_lote=f"EXP-{i}", producto=producto, institucion=institucion, almacen=almacen,
+                cantidad_inicial=10, cantidad_disponible=10, precio_unitario=Decimal("1.50"),
+                valor_total=Decimal("15.00"), fecha_recepcion=date.today(), estado=1,
+            )
+        self.client.force_login(usuario)
+        url = reverse("reportes:exportar_disponibilidad_excel")
+
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        hoja = load_workbook(BytesIO(b"".join(respuesta.streaming_content))).active
+        filas = list(hoja.iter_rows(values_only=True))
+        self.assertEqual(len(filas), 5)
+        self.assertEqual(filas[1][:3], ("030.000.0000", "Prod 0", "EXP-0"))
+        self.assertEqual(filas[-1][0], "TOTAL")
+        self.assertEqual(filas[-1][4], 30)
+        self.assertEqual(hoja["A2"].fill.start_color.rgb, "00C6EFCE")
+
+        respuesta = self.client.get(url, {"formato": "csv"})
+        self.assertTrue(respuesta["Content-Disposition"].endswith('.csv"'))
+        lineas = b"".join(respuesta.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lineas), 5)
+        self.assertTrue(lineas[3].startswith("030.000.0002,Prod 2,EXP-2,"))
+
+
+class BusquedaTest(TestCase):
+    def test_sin_acentos_por_palabras_y_prefijo_primero(self):
+        from inventario.busqueda_utils import buscar, filtrar
+
+        categoria = CategoriaProducto.objects.create(nombre="Busqueda QA")
+        acido = Producto.objects.create(clave_cnis="040.000.0001", descripcion="ACIDO FOLICO TABLETA 5 MG", categoria=categoria)
+        otro = Producto.objects.create(clave_cnis="010.000.0400", descripcion="JERINGA DESECHABLE", categoria=categoria)
+
+        self.assertEqual(list(buscar("producto", "Ácido  tableta")), [acido])
+        self.assertEqual(list(buscar("producto", "tableta fólico")), [acido])
+        self.assertEqual(list(buscar("producto", "040")), [acido, otro])
+        self.assertEqual(list(buscar("producto", "  ")), [])
+        self.assertEqual(
+            list(filtrar(Producto.objects.order_by("clave_cnis"), "jeringa", campos=("descripcion",))), [otro]
+        )
+
+
+class DashboardMetricasTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_resumen_en_cache_e_invalidacion(self):
+        usuario = get_user_model().objects.create_user(username="qa_dashboard", password="x")
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Dashboard QA")
+        # Las invalidaciones solo corren al "confirmar": sin esto quedaría un callback pendiente
+        with self.captureOnCommitCallbacks(execute=True):
+            institucion = Institucion.objects.create(clue="QA005", denominacion="Institucion dashboard", tipo_institucion=tipo)
+            categoria = CategoriaProducto.objects.create(nombre="Dashboard QA")
+            producto = Producto.objects.create(clave_cnis="050.000.0001", descripcion="Prod dashboard", categoria=categoria)
+
+        def crear_lote(numero, cantidad):
+            with self.captureOnCommitCallbacks(execute=True):
+                Lote.objects.create(
+                    numero_lote=numero, producto=producto, institucion=institucion,
+                    cantidad_inicial=cantidad, cantidad_disponible=cantidad, precio_unitario=Decimal("2.00"),
+                    fecha_recepcion=date.today(), fecha_caducidad=date.today() + timedelta(days=10), estado=1,
+                )
+
+        crear_lote("DASH-1", 5)
+        self.client.force_login(usuario)
+        respuesta = self.client.get(reverse("dashboard"))
+        self.assertEqual(respuesta.context["total_lotes"], 1)
+        self.assertEqual(respuesta.context["alertas_30_dias"], 1)
+        self.assertEqual(respuesta.context["productos_bajo_stock"], 1)
+        self.assertEqual(respuesta.context["instituciones_top"][0]["denominacion"], "Institucion dashboard")
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse("dashboard"))
+        self.assertFalse([q for q in consultas.captured_queries if 'COUNT(' in q["sql"]])
+
+        crear_lote("DASH-2", 50)
+        respuesta = self.client.get(reverse("dashboard"))
+        self.assertEqual(respuesta.context["total_lotes"], 2)
+        self.assertEqual(respuesta.context["valor_total_inventario"], Decimal("110.00"))
+
+        datos = self.client.get(reverse("api_estadisticas_dashboard")).json()
+        self.assertEqual(len(datos["estadisticas_mensuales"]), 6)
+        self.assertEqual(datos["estadisticas_mensuales"][-1], {"mes": date.today().strftime("%Y-%m"), "lotes": 2, "valor": 110.0})
+        self.assertEqual([(c["nombre"], c["total_lotes"]) for c in datos["categorias"]], [("Dashboard QA", 2)])
+        self.assertEqual(Decimal(datos["categorias"][0]["valor_total"]), Decimal("110"))
+
+    def test_invalidacion_con_version_en_bd(self):
+        from django.db import transaction
+        from django.db.models import F
+
+        from inventario.dashboard_utils import invalidar_dashboard, resumen_dashboard, version_dashboard
+        from inventario.models import ControlDashboard
+
+        tipo = TipoInstitucion.objects.create(tipo="OTRO", descripcion="Dashboard version")
+        with self.captureOnCommitCallbacks(execute=True):
+            institucion = Institucion.objects.create(clue="QA006", denominacion="Institucion version", tipo_institucion=tipo)
+            categoria = CategoriaProducto.objects.create(nombre="Dashboard version")
+            producto = Producto.objects.create(clave_cnis="050.000.0002", descripcion="Prod version", categoria=categoria)
+            lote = Lote.objects.create(
+                numero_lote="VER-1", producto=producto, institucion=institucion, cantidad_inicial=5,
+                cantidad_disponible=5, precio_unitario=Decimal("1.00"), fecha_recepcion=date.today(), estado=1,
+            )
+        version = version_dashboard()
+        self.assertEqual(resumen_dashboard()["total_lotes"], 1)
+
+        # Escritura masiva sin señales: la entrada en caché sigue vigente...
+        Lote.objects.filter(pk=lote.pk).update(estado=6)
+        self.assertEqual(resumen_dashboard()["total_lotes"], 1)
+        # ...hasta que otro proceso incrementa la versión en la BD.
+        ControlDashboard.objects.filter(pk=1).update(version=F("version") + 1)
+        self.assertEqual(resumen_dashboard()["total_lotes"], 0)
+
+        # Varias invalidaciones en una transacción: un solo incremento al confirmar.
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                Lote.objects.filter(pk=lote.pk).update(estado=1)
+                invalidar_dashboard()
+                invalidar_dashboard()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(version_dashboard(), version + 2)
+        self.assertEqual(resumen_dashboard()["total_lotes"], 1)
+
+
+class RutaPickingTest(TestCase):
+    def test_ruta_mas_corta_que_orden_por_codigo(self):
+        from inventario.ruta_picking_utils import Distribucion, clave_natural, ordenar_lineas
+
+        codigos = [f"{rack}.{posicion:02d}.{nivel:02d}" for rack in ("A1", "A2", "A3")
+                   for posicion in range(1, 21) for nivel in (1, 2)]
+        distribucion = Distribucion((codigo, None, None, None) for codigo in codigos)
+        # Frente y fondo de tres racks: por código cada rack se recorre desde el frente.
+        ubicaciones = ("A1.02.01", "A1.19.01", "A2.02.01", "A2.19.02", "A2.19.01", "A3.02.01", "A3.19.01")
+        lineas = [{"almacen_id": 1, "ubicacion": c, "producto": c} for c in ubicaciones]
+
+        ordenadas = ordenar_lineas(lineas, {1: distribucion})
+
+        def longitud(filas):
+            return distribucion.longitud([distribucion.punto(f["ubicacion"]) for f in filas])
+
+        por_codigo = sorted(lineas, key=lambda f: clave_natural(f["ubicacion"]))
+        self.assertLess(longitud(ordenadas), longitud(por_codigo))
+        self.assertEqual([f["ubicacion"] for f in ordenadas][0], "A1.02.01")
+        self.assertEqual([f["parada"] for f in ordenadas], list(range(1, 8)))
+        self.assertEqual(sorted(f["ubicacion"] for f in ordenadas), sorted(f["ubicacion"] for f in lineas))
+
+
+class PoolLibreOfficeTest(TestCase):
+    """Pool de conversión con instancias falsas (sin LibreOffice) y un ``uno`` falso."""
+
+    def _pool(self, tamano=1, max_trabajos=100, espera=2):
+        from .libreoffice_pool_utils import PoolLibreOffice
+
+        creadas = []
+
+        class InstanciaFalsa:
+            def __init__(self):
+                self.puerto = len(creadas)
+                self.trabajos = 0
+                self.viva = True
+                self.detenida = False
+                self.error = None
+                self.bloqueo = None
+                creadas.append(self)
+
+            def sana(self):
+                return self.viva
+
+            def convertir(self, datos, filtro):
+                if self.bloqueo:
+                    self.bloqueo.wait(5)
+                if self.error:
+                    raise self.error
+                self.trabajos += 1
+                return b"%PDF " + datos
+
+            def detener(self):
+                self.detenida = True
+
+        pool = PoolLibreOffice(tamano=tamano, max_trabajos=max_trabajos, espera=espera, fabrica=InstanciaFalsa)
+        return pool, creadas
+
+    def test_reutiliza_recicla_y_reemplaza(self):
+        from .libreoffice_pool_utils import ErrorConversionPDF
+
+        pool, creadas = self._pool(max_trabajos=2)
+        self.assertEqual(pool.convertir(b"a"), b"%PDF a")
+        self.assertEqual(pool.convertir(b"b"), b"%PDF b")
+        # Tras MAX_TRABAJOS se recicla: la siguiente conversión arranca otra instancia.
+        self.assertTrue(creadas[0].detenida)
+        pool.convertir(b"c")
+        self.assertEqual(len(creadas), 2)
+
+        # Instancia que no pasa el chequeo de salud al tomarla: se descarta y se reemplaza.
+        creadas[1].viva = False
+        pool.convertir(b"d")
+        self.assertTrue(creadas[1].detenida)
+        self.assertEqual(len(creadas), 3)
+
+        # Error en la conversión: se propaga y la instancia se descarta.
+        creadas[2].error = ErrorConversionPDF("falla")
+        with self.assertRaises(ErrorConversionPDF):
+            pool.convertir(b"e")
+        self.assertTrue(creadas[2].detenida)
+        self.assertEqual(pool.estado()["creadas"], 0)
+        pool.convertir(b"f")
+        self.assertEqual((len(creadas), pool.estado()["creadas"], pool.estado()["libres"]), (4, 1, 1))
+
+    def test_espera_despierta_al_descartar_y_agota_tiempo(self):
+        import threading
+        import time
+
+        from .libreoffice_pool_utils import ErrorConversionPDF
+
+        pool, creadas = self._pool(tamano=1, espera=3)
+        pool.convertir(b"x")
+        ocupada = creadas[0]
+        ocupada.bloqueo = threading.Event()
+        ocupada.error = ErrorConversionPDF("colgada")
+        primero = threading.Thread(target=lambda: self.assertRaises(ErrorConversionPDF, pool.convertir, b"1"))
+        primero.start()
+        while pool.estado()["libres"]:
+            time.sleep(0.01)
+
+        resultado = {}
+
+        def segundo():
+            inicio = time.monotonic()
+            resultado["pdf"] = pool.convertir(b"2")
+            resultado["segundos"] = time.monotonic() - inicio
+
+        hilo = threading.Thread(target=segundo)
+        hilo.start()
+        time.sleep(0.1)
+        ocupada.bloqueo.set()  # la primera falla: su descarte libera cupo y despierta al segundo
+        primero.join()
+        hilo.join()
+        self.assertEqual(resultado["pdf"], b"%PDF 2")
+        self.assertLess(resultado["segundos"], 2)
+        self.assertEqual(len(creadas), 2)
+
+        # Sin instancias libres ni cupo, la espera se agota.
+        pool.espera = 0.1
+        creadas[1].bloqueo = threading.Event()
+        ocupante = threading.Thread(target=pool.convertir, args=(b"3",))
+        ocupante.start()
+        while pool.estado()["libres"]:
+            time.sleep(0.01)
+        with self.assertRaisesMessage(ErrorConversionPDF, "No hay instancias"):
+            pool.convertir(b"4")
+        creadas[1].bloqueo.set()
+        ocupante.join()
+
+    def test_instancia_convierte_por_streams_y_mata_si_se_cuelga(self):
+        import threading
+        from io import BytesIO
+        from types import SimpleNamespace
+        from unittest import mock
+
+        from . import libreoffice_pool_utils as lpu
+
+        class Salida:
+            def __init__(self):
+                self.buffer = BytesIO()
+
+        class Proceso:
+            def __init__(self):
+                self.muerto = threading.Event()
+
+            def kill(self):
+                self.muerto.set()
+
+            def poll(self):
+                return -9 if self.muerto.is_set() else None
+
+        class Documento:
+            def storeToURL(self, url, propiedades):
+                opciones = {p["Name"]: p["Value"] for p in propiedades}
+                self.filtro = opciones["FilterName"]
+                opciones["OutputStream"].buffer.write(b"%PDF-1.7")
+
+            def close(self, forzar):
+                self.cerrado = True
+
+        documento = Documento()
+        entrada = SimpleNamespace(initialize=lambda args: setattr(entrada, "datos", args[0]))
+        contexto = SimpleNamespace(ServiceManager=SimpleNamespace(createInstanceWithContext=lambda *a: entrada))
+
+        def instancia(cargar):
+            inst = object.__new__(lpu.InstanciaSoffice)
+            inst.proceso, inst.contexto, inst.trabajos, inst.timeout = Proceso(), contexto, 0, 0.2
+            inst.escritorio = SimpleNamespace(loadComponentFromURL=lambda *a: cargar(inst))
+            return inst
+
+        def colgada(inst):
+            inst.proceso.muerto.wait(5)
+            raise RuntimeError("DisposedException")
+
+        with mock.patch.object(lpu, "uno", SimpleNamespace(ByteSequence=bytes)), \
+                mock.patch.object(lpu, "_SalidaEnMemoria", Salida, create=True), \
+                mock.patch.object(lpu, "PropertyValue", lambda **kw: kw, create=True):
+            buena = instancia(lambda inst: documento)
+            self.assertEqual(buena.convertir(b"xlsx"), b"%PDF-1.7")
+            self.assertEqual((entrada.datos, documento.filtro, buena.trabajos), (b"xlsx", lpu.FILTRO_PDF_CALC, 1))
+            self.assertTrue(documento.cerrado)
+
+            mala = instancia(colgada)
+            with self.assertRaisesMessage(lpu.ErrorConversionPDF, "excedió"):
+                mala.convertir(b"xlsx")
+            self.assertTrue(mala.proceso.muerto.is_set())
+
+
+class ApiMovilTest(TestCase):
+    def setUp(self):
+        from inventario.principal_movil_utils import principales
+
+        principales.invalidar()
+
+    def test_principal_en_cache_sin_consultas_e_invalidacion(self):
+        from django.contrib.auth.models import Group
+        from mobile_api.auth import create_access_token, get_user_from_token
+
+        grupo, _ = Group.objects.get_or_create(name="Conteo")
+        usuario = get_user_model().objects.create_user(username="qa_movil", password="x", first_name="Ana")
+        usuario.groups.add(grupo)
+        token = create_access_token(usuario.id, usuario.username)
+
+        self.assertEqual(get_user_from_token(token).pk, usuario.pk)
+        with self.assertNumQueries(0):
+            uno = get_user_from_token(token)
+            otro = get_user_from_token(token)
+        # Cada petición recibe su propia instancia: los hilos no comparten el objeto en caché
+        self.assertIsNot(uno, otro)
+        uno.first_name = "Modificado"
+        self.assertEqual(get_user_from_token(token).first_name, "Ana")
+        self.assertFalse(otro._state.adding)
+
+        # Cambios de grupos del usuario (receptores conectados en InventarioConfig.ready)
+        usuario.groups.remove(grupo)
+        with self.assertRaises(PermissionError):
+            get_user_from_token(token)
+        grupo.user_set.add(usuario)
+        self.assertEqual(get_user_from_token(token).pk, usuario.pk)
+
+        # Renombrar el grupo vacía la caché
+        grupo.name = "Conteo (histórico)"
+        grupo.save()
+        with self.assertRaises(PermissionError):
+            get_user_from_token(token)
+        grupo.name = "Conteo"
+        grupo.save()
+        get_user_from_token(token)
+
+        # Desactivar el usuario
+        usuario.is_active = False
+        usuario.save(update_fields=["is_active"])
+        with self.assertRaises(PermissionError):
+            get_user_from_token(token)
+
+    def test_run_db_en_pool_con_cierre_de_conexiones(self):
+        import asyncio
+        import threading
+        from unittest import mock
+
+        from mobile_api import db
+
+        self.addCleanup(db.shutdown)
+        eventos = []
+
+        def trabajo(a, b=0):
+            eventos.append(("trabajo", threading.current_thread().name))
+            return a + b
+
+        def cerrar():
+            eventos.append(("cerrar", threading.current_thread().name))
+
+        with mock.patch.object(db, "close_old_connections", side_effect=cerrar):
+            self.assertEqual(asyncio.run(db.run_db(trabajo, 2, b=3)), 5)
+        self.assertEqual([e[0] for e in eventos], ["cerrar", "trabajo", "cerrar"])
+        self.assertTrue(all(hilo.startswith("mobile-api-db") for _, hilo in eventos))
+
+        def falla():
+            raise ValueError("sin stock")
+
+        with mock.patch.object(db, "close_old_connections") as cerrar_conexiones:
+            with self.assertRaisesMessage(ValueError, "sin stock"):
+                asyncio.run(db.run_db(falla))
+        self.assertEqual(cerrar_conexiones.call_count, 2)
+
+    def test_pool_de_bd_se_cierra_al_apagar(self):
+        import asyncio
+        import runpy
+        from pathlib import Path
+        from unittest import mock
+
+        from django.conf import settings
+
+        from mobile_api import db
+        from mobile_api.main import app
+
+        self.addCleanup(db.shutdown)
+
+        async def ciclo_de_vida():
+            async with app.router.lifespan_context(app):
+                await db.run_db(lambda: None)
+                return db._executor
+
+        with mock.patch.object(db, "close_old_connections"):
+            executor = asyncio.run(ciclo_de_vida())
+        self.assertIsNotNone(executor)
+        self.assertTrue(executor._shutdown)
+        self.assertIsNone(db._executor)
+
+        # Montada con a2wsgi (sin lifespan): el hook worker_exit de gunicorn
+        hooks = runpy.run_path(str(Path(settings.BASE_DIR) / "gunicorn.conf.py"))
+        with mock.patch.object(db, "close_old_connections"):
+            asyncio.run(db.run_db(lambda: None))
+        executor = db._executor
+        hooks["worker_exit"](None, None)
+        self.assertTrue(executor._shutdown)
+        self.assertIsNone(db._executor)
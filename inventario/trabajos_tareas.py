@@ -0,0 +1,72 @@
+"""
+Tareas que ejecuta ``procesar_trabajos`` (ver trabajos_utils).
+
+Cada tarea adapta un flujo existente: toma el archivo y las opciones que guardó la
+vista, llama a la función de negocio de siempre y devuelve sus estadísticas, que la
+página de resultado lee de ``trabajo.resultado``.
+"""
+
+from django.urls import reverse
+
+from .trabajos_utils import tarea
+
+
+def _url_con_trabajo(nombre_url):
+    return lambda trabajo: f"{reverse(nombre_url)}?trabajo={trabajo.pk}"
+
+
+@tarea('carga_masiva_lotes', url_resultado=_url_con_trabajo('carga_masiva_resultado'))
+def carga_masiva_lotes(ctx):
+    from .views_carga_masiva import procesar_carga_masiva
+
+    p = ctx.parametros
+    with ctx.ruta_entrada() as ruta:
+        return procesar_carga_masiva(
+            ruta,
+            p['institucion_id'],
+            ctx.usuario,
+            dry_run=p.get('dry_run', False),
+            actualizar_cantidad=p.get('actualizar_cantidad', True),
+            progreso=lambda procesadas, total: ctx.progreso(procesadas, total, 'Registros procesados'),
+        )
+
+
+@tarea('carga_masiva_ordenes_suministro', url_resultado=_url_con_trabajo('carga_masiva_ordenes_resultado'))
+def carga_masiva_ordenes_suministro(ctx):
+    from .views_carga_masiva import procesar_carga_masiva_ordenes
+
+    p = ctx.parametros
+    ctx.progreso(0, 0, 'Procesando órdenes de suministro')
+    with ctx.ruta_entrada() as ruta:
+        return procesar_carga_masiva_ordenes(
+            ruta,
+            partida_default=p.get('partida_default', 'N/A'),
+            dry_run=p.get('dry_run', False),
+        )
+
+
+@tarea('carga_masiva_ubicaciones_almacen', url_resultado=_url_con_trabajo('carga_masiva_ubicaciones_almacen'))
+def carga_masiva_ubicaciones_almacen(ctx):
+    from .views_carga_masiva import procesar_carga_ubicaciones_almacen
+
+    ctx.progreso(0, 0, 'Actualizando almacén de las ubicaciones')
+    with ctx.ruta_entrada() as ruta:
+        return procesar_carga_ubicaciones_almacen(ruta)
+
+
+@tarea('carga_masiva_conteos', url_resultado=_url_con_trabajo('logistica:carga_masiva_conteos'))
+def carga_masiva_conteos(ctx):
+    from .views_carga_masiva_conteos import procesar_carga_masiva_conteos
+
+    ctx.progreso(0, 0, 'Registrando conteos')
+    with ctx.ruta_entrada() as ruta:
+        return procesar_carga_masiva_conteos(ruta, ctx.usuario)
+
+
+@tarea('carga_masiva_solicitud', url_resultado=_url_con_trabajo('carga_masiva_solicitud'))
+def carga_masiva_solicitud(ctx):
+    from .views import procesar_carga_masiva_solicitud
+
+    ctx.progreso(0, 0, 'Procesando solicitud')
+    with ctx.ruta_entrada() as ruta:
+        return procesar_carga_masiva_solicitud(ruta, ctx.usuario)
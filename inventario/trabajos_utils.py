@@ -0,0 +1,403 @@
+"""
+Trabajos en segundo plano respaldados en BD (TrabajoSegundoPlano).
+
+Cargas y exportaciones de Excel grandes no deben depender del timeout de
+gunicorn/nginx. Flujo: la vista encola el trabajo y redirige a ``trabajo_detalle``,
+que consulta ``trabajo_estado`` hasta que termina y ofrece ``trabajo_descargar``.
+``manage.py procesar_trabajos --workers N`` toma los pendientes (``SKIP LOCKED``) y los
+ejecuta en un pool de procesos.
+
+Dos formas de pasar un flujo existente a la cola sin tocar su lógica:
+
+- ``@tarea('nombre')``: función ``f(ctx)`` registrada en ``trabajos_tareas`` que llama a la
+  función de negocio (p. ej. ``procesar_carga_masiva``) con ``ctx.ruta_entrada()``,
+  ``ctx.parametros`` y ``ctx.progreso``; lo que devuelve queda en ``trabajo.resultado``.
+- ``@en_segundo_plano('descripción')`` sobre una vista de exportación: la petición se
+  encola (método, GET y POST) y el worker vuelve a llamar a la misma vista; el cuerpo
+  de la respuesta es el archivo descargable. El control de acceso del middleware ya se
+  aplicó al encolar. No aplica a vistas que reciben archivos (request.FILES).
+
+Con ``TRABAJOS_EN_SEGUNDO_PLANO = False`` todo se ejecuta dentro del request, como antes.
+Un trabajo cuyo proceso deja de dar señales (``latido``) por ``TRABAJOS_ABANDONO_SEGUNDOS``
+vuelve a la cola hasta ``TRABAJOS_MAX_INTENTOS`` veces.
+
+Despliegue: el servicio ``worker`` de docker-compose (``entrypoint.sh worker``, con
+``restart: always``); sin él, entrypoint.sh lo lanza en el contenedor web dentro de un
+bucle que lo reinicia.
+"""
+
+import logging
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import wraps
+from importlib import import_module
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.http import HttpRequest, QueryDict
+from django.shortcuts import redirect
+from django.utils import timezone
+
+from .models import TrabajoSegundoPlano
+
+logger = logging.getLogger(__name__)
+
+EN_SEGUNDO_PLANO = getattr(settings, 'TRABAJOS_EN_SEGUNDO_PLANO', True)
+ABANDONO_SEGUNDOS = getattr(settings, 'TRABAJOS_ABANDONO_SEGUNDOS', 600)
+MAX_INTENTOS = getattr(settings, 'TRABAJOS_MAX_INTENTOS', 2)
+DIAS_RETENCION = getattr(settings, 'TRABAJOS_DIAS_RETENCION', 7)
+INTERVALO_LATIDO = 2.0
+
+MODULOS_TAREAS = ('inventario.trabajos_tareas',)
+
+
+# ---------------------------------------------------------------------------
+# Registro de tareas
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Tarea:
+    funcion: object
+    url_resultado: object = None
+
+
+TAREAS = {}
+_tareas_cargadas = False
+
+
+def tarea(nombre, url_resultado=None):
+    """
+    Registra ``funcion(ctx)`` como tipo de trabajo.
+
+    ``url_resultado(trabajo)`` (opcional) da la página que muestra ``trabajo.resultado``
+    al terminar; sin ella la página del trabajo ofrece la descarga del archivo.
+    """
+    def decorador(funcion):
+        TAREAS[nombre] = Tarea(funcion, url_resultado)
+        return funcion
+    return decorador
+
+
+def obtener_tarea(nombre):
+    global _tareas_cargadas
+    if not _tareas_cargadas:
+        for modulo in MODULOS_TAREAS:
+            import_module(modulo)
+        _tareas_cargadas = True
+    return TAREAS.get(nombre)
+
+
+# ---------------------------------------------------------------------------
+# Encolado
+# ---------------------------------------------------------------------------
+
+def encolar_trabajo(tipo, usuario, parametros=None, archivo=None, descripcion=''):
+    """
+    Crea el trabajo pendiente (guardando ``archivo`` como entrada, si se indica).
+
+    Sin segundo plano lo ejecuta en el momento; en ambos casos la vista redirige a
+    ``trabajo_detalle``.
+    """
+    trabajo = TrabajoSegundoPlano(
+        tipo=tipo,
+        usuario=usuario,
+        parametros=parametros or {},
+        descripcion=descripcion[:255],
+    )
+    if archivo is not None:
+        trabajo.archivo_entrada.save(os.path.basename(archivo.name), archivo, save=False)
+    trabajo.save()
+    if not EN_SEGUNDO_PLANO:
+        ejecutar_trabajo(trabajo.pk)
+        trabajo.refresh_from_db()
+    return trabajo
+
+
+def en_segundo_plano(descripcion):
+    """Decorador para vistas de exportación: encola la petición y la ejecuta en el worker."""
+    def decorador(vista):
+        ruta = f'{vista.__module__}.{vista.__name__}'
+
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if (not EN_SEGUNDO_PLANO or not request.user.is_authenticated
+                    or getattr(request, 'trabajo_segundo_plano', None) is not None):
+                return vista(request, *args, **kwargs)
+            trabajo = encolar_trabajo(
+                'vista',
+                request.user,
+                parametros={
+                    'vista': ruta,
+                    'metodo': request.method,
+                    'GET': dict(request.GET.lists()),
+                    'POST': {k: v for k, v in request.POST.lists() if k != 'csrfmiddlewaretoken'},
+                    'args': list(args),
+                    'kwargs': kwargs,
+                },
+                descripcion=descripcion,
+            )
+            return redirect('trabajo_detalle', pk=trabajo.pk)
+
+        return envoltura
+    return decorador
+
+
+# ---------------------------------------------------------------------------
+# Ejecución
+# ---------------------------------------------------------------------------
+
+class ContextoTrabajo:
+    """Lo que recibe una tarea: parámetros, archivo de entrada, progreso y resultado."""
+
+    def __init__(self, trabajo, en_hilo=True):
+        self.trabajo = trabajo
+        self.parametros = trabajo.parametros or {}
+        self._progreso = None
+        self._escrito = None
+        self._detener = threading.Event()
+        self._hilo = None
+        if en_hilo:
+            # La tarea puede correr en una transacción larga (p. ej. la carga masiva): el
+            # progreso y el latido se escriben desde otro hilo, con su propia conexión,
+            # para que la página de estado los vea antes del commit.
+            self._hilo = threading.Thread(target=self._reportar, name=f'trabajo-{trabajo.pk}', daemon=True)
+            self._hilo.start()
+
+    @property
+    def usuario(self):
+        return self.trabajo.usuario
+
+    @contextmanager
+    def ruta_entrada(self):
+        """Ruta local del archivo de entrada (copia temporal si el storage no es de disco)."""
+        archivo = self.trabajo.archivo_entrada
+        try:
+            ruta = archivo.path
+        except NotImplementedError:
+            ruta = None
+        if ruta is not None:
+            yield ruta
+            return
+        sufijo = os.path.splitext(archivo.name)[1]
+        with tempfile.NamedTemporaryFile(suffix=sufijo) as tmp, archivo.open('rb') as origen:
+            shutil.copyfileobj(origen, tmp)
+            tmp.flush()
+            yield tmp.name
+
+    def progreso(self, actual, total=None, mensaje=None):
+        self._progreso = (actual, total, mensaje)
+
+    def guardar_resultado(self, contenido, nombre, tipo_contenido='application/octet-stream'):
+        """Guarda el archivo descargable (bytes o archivo abierto en modo binario)."""
+        if isinstance(contenido, bytes):
+            contenido = ContentFile(contenido)
+        elif not isinstance(contenido, File):
+            contenido = File(contenido)
+        self.trabajo.archivo_resultado.save(nombre, contenido, save=False)
+        self.trabajo.nombre_resultado = nombre[:255]
+        self.trabajo.tipo_contenido = tipo_contenido[:100]
+
+    def _escribir_progreso(self):
+        campos = {'latido': timezone.now()}
+        progreso = self._progreso
+        if progreso is not None and progreso != self._escrito:
+            actual, total, mensaje = progreso
+            campos['progreso_actual'] = actual
+            if total is not None:
+                campos['progreso_total'] = total
+            if mensaje is not None:
+                campos['progreso_mensaje'] = mensaje[:255]
+            self._escrito = progreso
+        TrabajoSegundoPlano.objects.filter(pk=self.trabajo.pk).update(**campos)
+
+    def _reportar(self):
+        try:
+            while not self._detener.wait(INTERVALO_LATIDO):
+                try:
+                    self._escribir_progreso()
+                except Exception as exc:
+                    logger.warning('No se pudo registrar el avance del trabajo %s: %s', self.trabajo.pk, exc)
+        finally:
+            connection.close()
+
+    def detener(self):
+        if self._hilo is not None:
+            self._detener.set()
+            self._hilo.join()
+        if self._progreso is not None:
+            actual, total, mensaje = self._progreso
+            self.trabajo.progreso_actual = actual
+            if total is not None:
+                self.trabajo.progreso_total = total
+            if mensaje is not None:
+                self.trabajo.progreso_mensaje = mensaje[:255]
+
+
+def ejecutar_trabajo(trabajo_id, trabajador=''):
+    """Ejecuta un trabajo ya reclamado (o, sin segundo plano, recién creado)."""
+    close_old_connections()
+    try:
+        trabajo = TrabajoSegundoPlano.objects.select_related('usuario').get(pk=trabajo_id)
+        if trabajo.fecha_inicio is None:
+            trabajo.estado = 'en_proceso'
+            trabajo.fecha_inicio = timezone.now()
+            trabajo.intentos += 1
+            trabajo.save(update_fields=['estado', 'fecha_inicio', 'intentos'])
+
+        definicion = obtener_tarea(trabajo.tipo)
+        contexto = ContextoTrabajo(trabajo, en_hilo=EN_SEGUNDO_PLANO)
+        try:
+            if definicion is None:
+                raise LookupError(f'Tipo de trabajo no registrado: {trabajo.tipo}')
+            resultado = definicion.funcion(contexto)
+        except Exception as exc:
+            contexto.detener()
+            logger.exception('Trabajo %s (%s) terminó con error', trabajo.pk, trabajo.tipo)
+            trabajo.estado = 'error'
+            trabajo.mensaje_error = str(exc) or exc.__class__.__name__
+        else:
+            contexto.detener()
+            trabajo.estado = 'completado'
+            trabajo.resultado = resultado
+        trabajo.fecha_fin = timezone.now()
+        trabajo.save(update_fields=[
+            'estado', 'resultado', 'mensaje_error', 'fecha_fin', 'archivo_resultado', 'nombre_resultado',
+            'tipo_contenido', 'progreso_actual', 'progreso_total', 'progreso_mensaje',
+        ])
+    finally:
+        close_old_connections()
+
+
+def nombre_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'[:100]
+
+
+def reclamar_trabajo(trabajador):
+    """Marca en proceso el pendiente más antiguo y devuelve su id (None si no hay)."""
+    ahora = timezone.now()
+    with transaction.atomic():
+        trabajo_id = (
+            TrabajoSegundoPlano.objects.select_for_update(skip_locked=True)
+            .filter(estado='pendiente')
+            .order_by('fecha_creacion', 'id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if trabajo_id is None:
+            return None
+        TrabajoSegundoPlano.objects.filter(pk=trabajo_id).update(
+            estado='en_proceso',
+            trabajador=trabajador,
+            fecha_inicio=ahora,
+            latido=ahora,
+            intentos=F('intentos') + 1,
+        )
+    return trabajo_id
+
+
+def recuperar_abandonados():
+    """Devuelve a la cola (o marca con error) los trabajos cuyo proceso dejó de responder."""
+    limite = timezone.now() - timedelta(seconds=ABANDONO_SEGUNDOS)
+    abandonados = TrabajoSegundoPlano.objects.filter(estado='en_proceso', latido__lt=limite)
+    reencolados = abandonados.filter(intentos__lt=MAX_INTENTOS).update(
+        estado='pendiente', fecha_inicio=None, trabajador='',
+    )
+    fallidos = abandonados.update(
+        estado='error',
+        fecha_fin=timezone.now(),
+        mensaje_error='El proceso que ejecutaba el trabajo dejó de responder.',
+    )
+    return reencolados, fallidos
+
+
+def reencolar(trabajo_ids):
+    """Trabajos cuyo proceso del pool murió (BrokenProcessPool): se reintentan si aún pueden."""
+    qs = TrabajoSegundoPlano.objects.filter(pk__in=trabajo_ids, estado='en_proceso')
+    qs.filter(intentos__lt=MAX_INTENTOS).update(estado='pendiente', fecha_inicio=None, trabajador='')
+    qs.update(estado='error', fecha_fin=timezone.now(), mensaje_error='El proceso del trabajo terminó inesperadamente.')
+
+
+def purgar_trabajos_antiguos(dias=DIAS_RETENCION):
+    """Borra trabajos terminados (y sus archivos) con más de ``dias`` días."""
+    limite = timezone.now() - timedelta(days=dias)
+    viejos = TrabajoSegundoPlano.objects.filter(estado__in=('completado', 'error'), fecha_fin__lt=limite)
+    borrados = 0
+    for trabajo in viejos.iterator(chunk_size=200):
+        for archivo in (trabajo.archivo_entrada, trabajo.archivo_resultado):
+            if archivo:
+                archivo.delete(save=False)
+        trabajo.delete()
+        borrados += 1
+    return borrados
+
+
+# ---------------------------------------------------------------------------
+# Tarea genérica: volver a ejecutar una vista de exportación
+# ---------------------------------------------------------------------------
+
+def _nombre_archivo(respuesta, por_defecto):
+    disposicion = respuesta.get('Content-Disposition', '')
+    encontrado = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', disposicion)
+    return encontrado.group(1) if encontrado else por_defecto
+
+
+def _peticion_sintetica(parametros, usuario):
+    from django.contrib.messages.storage.session import SessionStorage
+    from django.contrib.sessions.backends.base import SessionBase
+
+    request = HttpRequest()
+    request.method = parametros.get('metodo', 'GET')
+    for destino, origen in (('GET', parametros.get('GET', {})), ('POST', parametros.get('POST', {}))):
+        datos = QueryDict(mutable=True)
+        for clave, valores in origen.items():
+            datos.setlist(clave, valores)
+        datos._mutable = False
+        setattr(request, destino, datos)
+    hosts = [h for h in settings.ALLOWED_HOSTS if h and not h.startswith('.') and h != '*']
+    request.META.update({
+        'SERVER_NAME': hosts[0] if hosts else 'localhost',
+        'SERVER_PORT': '80',
+        'REMOTE_ADDR': '127.0.0.1',
+        'REQUEST_METHOD': request.method,
+    })
+    request.user = usuario
+    request.session = SessionBase()
+    request._messages = SessionStorage(request)
+    return request
+
+
+@tarea('vista')
+def _ejecutar_vista(ctx):
+    parametros = ctx.parametros
+    modulo, nombre = parametros['vista'].rsplit('.', 1)
+    vista = getattr(import_module(modulo), nombre)
+
+    request = _peticion_sintetica(parametros, ctx.usuario)
+    request.trabajo_segundo_plano = ctx.trabajo
+    respuesta = vista(request, *parametros.get('args', []), **parametros.get('kwargs', {}))
+
+    if respuesta.status_code != 200:
+        avisos = '; '.join(str(m) for m in request._messages)
+        raise RuntimeError(avisos or f'La exportación respondió con estado {respuesta.status_code}.')
+
+    nombre_archivo = _nombre_archivo(respuesta, f'{nombre}.bin')
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as destino:
+        if respuesta.streaming:
+            for bloque in respuesta.streaming_content:
+                destino.write(bloque)
+        else:
+            destino.write(respuesta.content)
+        tamano = destino.tell()
+        destino.seek(0)
+        ctx.guardar_resultado(destino, nombre_archivo, respuesta.get('Content-Type', 'application/octet-stream'))
+    return {'bytes': tamano}
@@ -11,6 +11,7 @@ from django.urls import reverse
 from django.views.decorators.http import require_GET
 
 from .llegada_views import EPA_ENCARGADA_AREA_ENTRADAS, EPA_ENCARGADA_OFICINA_INSUMOS
+from .busqueda_utils import buscar
 from .transferencia_forms import TransferenciaEntradaForm, ItemTransferenciaEntradaFormSet
 from .transferencia_models import TransferenciaEntrada
 from .transferencia_services import asignar_transferencia_a_staging
@@ -205,15 +206,10 @@ class ImprimirEPATransferenciaView(LoginRequiredMixin, View):
 @require_GET
 def api_buscar_clave_producto(request):
     """Autocomplete de claves CNIS para captura de ítems."""
-    from .models import Producto
-
     term = (request.GET.get('q') or '').strip()
     if len(term) < 2:
         return JsonResponse([], safe=False)
-    productos = (
-        Producto.objects.filter(Q(clave_cnis__icontains=term) | Q(descripcion__icontains=term))
-        .order_by('clave_cnis')[:20]
-    )
+    productos = buscar('producto', term)
     data = [
         {
             'clave_cnis': p.clave_cnis,
@@ -9,6 +9,7 @@ from .views_carga_masiva import (
     carga_masiva_lotes, carga_masiva_resultado, carga_masiva_ubicaciones_almacen,
     carga_masiva_ordenes_suministro, carga_masiva_ordenes_resultado
 )
+from .views_trabajos import trabajo_detalle, trabajo_estado, trabajo_descargar
 from .views_reporte_ubicaciones_vacias import reporte_ubicaciones_vacias, exportar_ubicaciones_vacias_excel, exportar_ubicaciones_vacias_pdf
 from .views_ubicaciones_almacen import lista_ubicaciones_almacen, crear_ubicacion_almacen, editar_ubicacion_almacen
 from .views_reporte_inventario_detallado import (
@@ -74,6 +75,11 @@ urlpatterns = [
     path('carga-masiva/ordenes-suministro/', carga_masiva_ordenes_suministro, name='carga_masiva_ordenes_suministro'),
     path('carga-masiva/ordenes-suministro/resultado/', carga_masiva_ordenes_resultado, name='carga_masiva_ordenes_resultado'),
 
+    # Trabajos en segundo plano (cargas y exportaciones largas)
+    path('trabajos/<int:pk>/', trabajo_detalle, name='trabajo_detalle'),
+    path('trabajos/<int:pk>/estado/', trabajo_estado, name='trabajo_estado'),
+    path('trabajos/<int:pk>/descargar/', trabajo_descargar, name='trabajo_descargar'),
+
     # Movimientos
     path('movimientos/', views.lista_movimientos, name='lista_movimientos'),
     path('movimientos/crear/', views.crear_movimiento, name='crear_movimiento'),
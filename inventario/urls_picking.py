@@ -10,6 +10,7 @@ app_name = 'picking'
 urlpatterns = [
     # Dashboard
     path('', picking_views.dashboard_picking, name='dashboard'),
+    path('cola/estado/', picking_views.estado_cola_picking, name='estado_cola'),
     # Monitor electrónico vs manual
     path('monitor/', picking_views.monitor_picking, name='monitor'),
 
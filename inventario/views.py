@@ -22,6 +22,9 @@ from django.db.models import Case, When, Value, BooleanField
 
 # Control de acceso por roles
 from .access_control import requiere_rol
+from .busqueda_utils import filtrar
+from .dashboard_utils import estadisticas_dashboard, resumen_dashboard
+from .trabajos_utils import encolar_trabajo
 
 
 from .forms import CargaLotesForm
@@ -61,42 +64,10 @@ from django.core.exceptions import FieldDoesNotExist
 @login_required
 def dashboard(request):
     """Vista principal del panel de control"""
-    total_instituciones = Institucion.objects.filter(activo=True).count()
-    total_productos = Producto.objects.filter(activo=True).count()
-    total_lotes = Lote.objects.filter(estado=1).count()
-
-    valor_total_inventario = Lote.objects.filter(estado=1).aggregate(
-        total=Sum('valor_total')
-    )['total'] or 0
-
-    hoy = date.today()
-    alertas_30_dias = Lote.objects.filter(
-        estado=1, fecha_caducidad__lte=hoy + timedelta(days=30), fecha_caducidad__gt=hoy
-    ).count()
-    productos_caducados = Lote.objects.filter(fecha_caducidad__lt=hoy).count()
-    productos_bajo_stock = Lote.objects.filter(
-        estado=1, cantidad_disponible__lt=10
-    ).count()
-
-    ultimos_movimientos = MovimientoInventario.objects.select_related(
+    context = dict(resumen_dashboard())
+    context['ultimos_movimientos'] = MovimientoInventario.objects.select_related(
         'lote__producto', 'lote__institucion', 'usuario'
     ).order_by('-fecha_movimiento')[:10]
-
-    instituciones_top = Institucion.objects.annotate(
-        total_lotes=Count('lote'), valor_inventario=Sum('lote__valor_total')
-    ).filter(activo=True).order_by('-valor_inventario')[:5]
-
-    context = {
-        'total_instituciones': total_instituciones,
-        'total_productos': total_productos,
-        'total_lotes': total_lotes,
-        'valor_total_inventario': valor_total_inventario,
-        'alertas_30_dias': alertas_30_dias,
-        'productos_caducados': productos_caducados,
-        'productos_bajo_stock': productos_bajo_stock,
-        'ultimos_movimientos': ultimos_movimientos,
-        'instituciones_top': instituciones_top,
-    }
     return render(request, 'inventario/dashboard.html', context)
 
 
@@ -104,36 +75,7 @@ def dashboard(request):
 @require_http_methods(["GET"])
 def api_estadisticas_dashboard(request):
     """API JSON para gráficas del dashboard"""
-    hoy = date.today()
-    estadisticas_mensuales = []
-    for i in range(6):
-        fecha = hoy.replace(day=1) - timedelta(days=30 * i)
-        mes_siguiente = (fecha.replace(month=fecha.month + 1)
-                         if fecha.month < 12 else fecha.replace(year=fecha.year + 1, month=1))
-
-        lotes_mes = Lote.objects.filter(
-            fecha_recepcion__gte=fecha, fecha_recepcion__lt=mes_siguiente
-        ).count()
-
-        valor_mes = Lote.objects.filter(
-            fecha_recepcion__gte=fecha, fecha_recepcion__lt=mes_siguiente
-        ).aggregate(total=Sum('valor_total'))['total'] or 0
-
-        estadisticas_mensuales.append({
-            'mes': fecha.strftime('%Y-%m'),
-            'lotes': lotes_mes,
-            'valor': float(valor_mes)
-        })
-
-    categorias = CategoriaProducto.objects.annotate(
-        total_lotes=Count('producto__lote'),
-        valor_total=Sum('producto__lote__valor_total')
-    ).values('nombre', 'total_lotes', 'valor_total')
-
-    return JsonResponse({
-        'estadisticas_mensuales': list(reversed(estadisticas_mensuales)),
-        'categorias': list(categorias)
-    })
+    return JsonResponse(estadisticas_dashboard())
 
 
 # ==========================================
@@ -325,7 +267,7 @@ def lista_productos(request):
     es_cpm = request.GET.get('es_cpm')
 
     if search:
-        productos = productos.filter(Q(clave_cnis__icontains=search) | Q(descripcion__icontains=search))
+        productos = filtrar(productos, search)
     if categoria_id:
         productos = productos.filter(categoria_id=categoria_id)
     if es_cpm:
@@ -512,11 +454,7 @@ def lista_lotes(request):
     # 🔹 Filtro de búsqueda libre (lote, CNIS o producto)
     search = request.GET.get('search', '').strip()
     if search:
-        lotes = lotes.filter(
-            Q(numero_lote__icontains=search) |
-            Q(producto__clave_cnis__icontains=search) |
-            Q(producto__descripcion__icontains=search)
-        )
+        lotes = filtrar(lotes, search)
 
     # 🔹 Resumen
     resumen = {
@@ -932,11 +870,7 @@ def reporte_lotes_excel(request):
     caducidad = request.GET.get('caducidad')
 
     if search:
-        lotes = lotes.filter(
-            Q(numero_lote__icontains=search) |
-            Q(producto__clave_cnis__icontains=search) |
-            Q(producto__descripcion__icontains=search)
-        )
+        lotes = filtrar(lotes, search)
     if institucion:
         lotes = lotes.filter(institucion_id=institucion)
     if estado:
@@ -1184,10 +1118,7 @@ def alertas_caducidad(request):
 
     # Filtrar por búsqueda
     if search:
-        lotes = lotes.filter(
-            Q(producto__descripcion__icontains=search) |
-            Q(producto__clave_cnis__icontains=search)
-        )
+        lotes = filtrar(lotes, search, campos=('producto__descripcion', 'producto__clave_cnis'))
 
     # Filtrar por prioridad
     if prioridad_selected == 'critica':
@@ -1297,154 +1228,167 @@ from datetime import datetime
 
 from .models import SolicitudInventario, Producto, EstadoInsumo, Institucion
 
-@login_required
-def carga_masiva_solicitud(request):
-    import pandas as pd
-    from datetime import datetime
+def procesar_carga_masiva_solicitud(archivo_path, usuario):
+    """
+    Crea o actualiza productos y lotes por institución (CLUES) desde el Excel de
+    solicitud. Devuelve los registros procesados y los avisos por fila.
+    """
     from decimal import Decimal
     from django.db import transaction
-    from django.contrib import messages
-    from django.shortcuts import redirect, render
     from .models import Producto, CategoriaProducto, Lote, Institucion
 
     fecha_actual = datetime.now().date()
     errores = []
     registros_creados = 0
 
-    if request.method == 'POST' and request.FILES.get('archivo_excel'):
-        archivo_excel = request.FILES['archivo_excel']
+    # Leer archivo Excel
+    try:
+        df = pd.read_excel(archivo_path)
+        df.columns = [col.strip().upper() for col in df.columns]
+    except Exception as e:
+        raise Exception(f"❌ Error al leer el archivo Excel: {str(e)}")
+
+    # Columnas requeridas
+    columnas_esperadas = [
+        'CLAVE/CNIS', 'DESCRIPCIÓN', 'UNIDAD DE MEDIDA',
+        'LOTE', 'INVENTARIO DISPONIBLE', 'FECHA DE CADUCIDAD', 'CLUES'
+    ]
+    for col in columnas_esperadas:
+        if col not in df.columns:
+            raise Exception(f"❌ Falta la columna obligatoria: '{col}'")
+
+    # Categoría por defecto
+    categoria_default = CategoriaProducto.objects.filter(id=1).first()
+    if not categoria_default:
+        raise Exception(
+            "❌ No existe la categoría por defecto (id=1). "
+            "Crea una llamada 'Asignar Categoría'."
+        )
 
-        # Leer archivo Excel
+    # Procesar filas del Excel
+    for index, row in df.iterrows():
         try:
-            df = pd.read_excel(archivo_excel)
-            df.columns = [col.strip().upper() for col in df.columns]
-        except Exception as e:
-            messages.error(request, f"❌ Error al leer el archivo Excel: {str(e)}")
-            return redirect('carga_masiva_solicitud')
-
-        # Columnas requeridas
-        columnas_esperadas = [
-            'CLAVE/CNIS', 'DESCRIPCIÓN', 'UNIDAD DE MEDIDA',
-            'LOTE', 'INVENTARIO DISPONIBLE', 'FECHA DE CADUCIDAD', 'CLUES'
-        ]
-        for col in columnas_esperadas:
-            if col not in df.columns:
-                messages.error(request, f"❌ Falta la columna obligatoria: '{col}'")
-                return redirect('carga_masiva_solicitud')
-
-        # Categoría por defecto
-        categoria_default = CategoriaProducto.objects.filter(id=1).first()
-        if not categoria_default:
-            messages.error(
-                request,
-                "❌ No existe la categoría por defecto (id=1). "
-                "Crea una llamada 'Asignar Categoría'."
-            )
-            return redirect('carga_masiva_solicitud')
-
-        usuario = request.user
+            clave_cnis = str(row.get('CLAVE/CNIS', '')).strip()
+            descripcion = str(row.get('DESCRIPCIÓN', '')).strip()
+            unidad_medida = str(row.get('UNIDAD DE MEDIDA', '')).strip()
+            lote_numero = str(row.get('LOTE', '')).strip()
+            cantidad = row.get('INVENTARIO DISPONIBLE', 0) or 0
+            fecha_caducidad = row.get('FECHA DE CADUCIDAD')
+            if fecha_caducidad:
+                try:
+                    # Si viene como texto, verificamos si es “S/C” o similar
+                    if isinstance(fecha_caducidad, str):
+                        texto = fecha_caducidad.strip().upper()
+                        if texto in ["S/C", "SC", "SIN CADUCIDAD", "NA", "N/A"]:
+                            fecha_caducidad = None
+                        else:
+                            fecha_caducidad = datetime.fromisoformat(fecha_caducidad).date()
+                    elif hasattr(fecha_caducidad, 'date'):
+                        fecha_caducidad = fecha_caducidad.date()
+                except Exception:
+                    errores.append(f"Fila {index + 2}: Fecha de caducidad no válida, se marcó como S/C.")
+                    fecha_caducidad = None
+            else:
+                # Si viene vacío, también lo tratamos como sin caducidad
+                fecha_caducidad = None
+            ib_clue = str(row.get('CLUES', '')).strip()
 
-        # Procesar filas del Excel
-        for index, row in df.iterrows():
-            try:
-                clave_cnis = str(row.get('CLAVE/CNIS', '')).strip()
-                descripcion = str(row.get('DESCRIPCIÓN', '')).strip()
-                unidad_medida = str(row.get('UNIDAD DE MEDIDA', '')).strip()
-                lote_numero = str(row.get('LOTE', '')).strip()
-                cantidad = row.get('INVENTARIO DISPONIBLE', 0) or 0
-                fecha_caducidad = row.get('FECHA DE CADUCIDAD')
-                if fecha_caducidad:
-                    try:
-                        # Si viene como texto, verificamos si es “S/C” o similar
-                        if isinstance(fecha_caducidad, str):
-                            texto = fecha_caducidad.strip().upper()
-                            if texto in ["S/C", "SC", "SIN CADUCIDAD", "NA", "N/A"]:
-                                fecha_caducidad = None
-                            else:
-                                fecha_caducidad = datetime.fromisoformat(fecha_caducidad).date()
-                        elif hasattr(fecha_caducidad, 'date'):
-                            fecha_caducidad = fecha_caducidad.date()
-                    except Exception:
-                        errores.append(f"Fila {index + 2}: Fecha de caducidad no válida, se marcó como S/C.")
-                        fecha_caducidad = None
-                else:
-                    # Si viene vacío, también lo tratamos como sin caducidad
+            # Validar fecha de caducidad
+            if fecha_caducidad:
+                try:
+                    if isinstance(fecha_caducidad, str):
+                        fecha_caducidad = datetime.fromisoformat(fecha_caducidad).date()
+                    elif hasattr(fecha_caducidad, 'date'):
+                        fecha_caducidad = fecha_caducidad.date()
+                except Exception:
+                    errores.append(f"Fila {index + 2}: Fecha de caducidad no válida.")
                     fecha_caducidad = None
-                ib_clue = str(row.get('CLUES', '')).strip()
 
-                # Validar fecha de caducidad
-                if fecha_caducidad:
-                    try:
-                        if isinstance(fecha_caducidad, str):
-                            fecha_caducidad = datetime.fromisoformat(fecha_caducidad).date()
-                        elif hasattr(fecha_caducidad, 'date'):
-                            fecha_caducidad = fecha_caducidad.date()
-                    except Exception:
-                        errores.append(f"Fila {index + 2}: Fecha de caducidad no válida.")
-                        fecha_caducidad = None
-
-                # Validar datos mínimos
-                if not clave_cnis or not descripcion:
-                    errores.append(f"Fila {index + 2}: Falta CLAVE/CNIS o descripción.")
-                    continue
-                if not ib_clue:
-                    errores.append(f"Fila {index + 2}: Falta IB CLUE para asociar institución.")
-                    continue
+            # Validar datos mínimos
+            if not clave_cnis or not descripcion:
+                errores.append(f"Fila {index + 2}: Falta CLAVE/CNIS o descripción.")
+                continue
+            if not ib_clue:
+                errores.append(f"Fila {index + 2}: Falta IB CLUE para asociar institución.")
+                continue
 
-                # Buscar la institución correspondiente al IB CLUE
-                #institucion = Institucion.objects.filter(ib_clue=ib_clue).first()
-                institucion = Institucion.objects.filter(
-                    Q(ib_clue=ib_clue) | Q(clue=ib_clue)
-                ).first()
+            # Buscar la institución correspondiente al IB CLUE
+            #institucion = Institucion.objects.filter(ib_clue=ib_clue).first()
+            institucion = Institucion.objects.filter(
+                Q(ib_clue=ib_clue) | Q(clue=ib_clue)
+            ).first()
 
-                if not institucion:
-                    errores.append(f"Fila {index + 2}: No se encontró institución con IB CLUE '{ib_clue}'.")
-                    continue
+            if not institucion:
+                errores.append(f"Fila {index + 2}: No se encontró institución con IB CLUE '{ib_clue}'.")
+                continue
 
-                with transaction.atomic():
-                    # Crear o actualizar producto
-                    producto, _ = Producto.objects.update_or_create(
-                        clave_cnis=clave_cnis,
+            with transaction.atomic():
+                # Crear o actualizar producto
+                producto, _ = Producto.objects.update_or_create(
+                    clave_cnis=clave_cnis,
+                    defaults={
+                        'descripcion': descripcion,
+                        'unidad_medida': unidad_medida,
+                        'categoria': categoria_default,
+                        'activo': True,
+                    }
+                )
+
+                # Crear o actualizar lote
+                if lote_numero:
+                    lote, created = Lote.objects.update_or_create(
+                        producto=producto,
+                        institucion=institucion,
+                        numero_lote=lote_numero,
                         defaults={
-                            'descripcion': descripcion,
-                            'unidad_medida': unidad_medida,
-                            'categoria': categoria_default,
-                            'activo': True,
+                            'cantidad_inicial': cantidad,
+                            'cantidad_disponible': cantidad,
+                            'precio_unitario': Decimal('0.01'),
+                            'valor_total': Decimal(cantidad) * Decimal('0.01'),
+                            'fecha_caducidad': fecha_caducidad,
+                            'fecha_fabricacion': fecha_actual,
+                            'fecha_recepcion': fecha_actual,
+                            'creado_por': usuario,
                         }
                     )
+                    registros_creados += 1
+                else:
+                    errores.append(f"Fila {index + 2}: No se proporcionó número de lote.")
+                    continue
 
-                    # Crear o actualizar lote
-                    if lote_numero:
-                        lote, created = Lote.objects.update_or_create(
-                            producto=producto,
-                            institucion=institucion,
-                            numero_lote=lote_numero,
-                            defaults={
-                                'cantidad_inicial': cantidad,
-                                'cantidad_disponible': cantidad,
-                                'precio_unitario': Decimal('0.01'),
-                                'valor_total': Decimal(cantidad) * Decimal('0.01'),
-                                'fecha_caducidad': fecha_caducidad,
-                                'fecha_fabricacion': fecha_actual,
-                                'fecha_recepcion': fecha_actual,
-                                'creado_por': usuario,
-                            }
-                        )
-                        registros_creados += 1
-                    else:
-                        errores.append(f"Fila {index + 2}: No se proporcionó número de lote.")
-                        continue
+        except Exception as e:
+            errores.append(f"Fila {index + 2}: Error inesperado ({str(e)})")
 
-            except Exception as e:
-                errores.append(f"Fila {index + 2}: Error inesperado ({str(e)})")
+    return {'registros_creados': registros_creados, 'errores': errores}
 
-        # Mensajes finales
-        if errores:
-            for err in errores:
-                messages.warning(request, err)
 
-        messages.success(request, f"✅ Carga completada. Registros procesados: {registros_creados}")
-        return redirect('carga_masiva_solicitud')
+@login_required
+def carga_masiva_solicitud(request):
+    """
+    El Excel se procesa como TrabajoSegundoPlano (tarea ``carga_masiva_solicitud``);
+    al terminar, el trabajo enlaza a esta vista con ``?trabajo=<id>``.
+    """
+    from .views_carga_masiva import _stats_de_trabajo
+
+    fecha_actual = datetime.now().date()
+    errores = []
+
+    if request.method == 'POST' and request.FILES.get('archivo_excel'):
+        archivo_excel = request.FILES['archivo_excel']
+        trabajo = encolar_trabajo(
+            'carga_masiva_solicitud',
+            request.user,
+            archivo=archivo_excel,
+            descripcion=f'Carga masiva de solicitud: {archivo_excel.name}',
+        )
+        return redirect('trabajo_detalle', pk=trabajo.pk)
+
+    resultado = _stats_de_trabajo(request)
+    if resultado:
+        # Mensajes finales
+        for err in resultado['errores']:
+            messages.warning(request, err)
+        messages.success(request, f"✅ Carga completada. Registros procesados: {resultado['registros_creados']}")
 
     # GET
     contexto = {
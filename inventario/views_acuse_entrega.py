@@ -4,6 +4,7 @@ Módulo: Logística - Gestión de Propuestas de Surtimiento
 """
 
 from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_http_methods
@@ -11,6 +12,7 @@ from django.core.paginator import Paginator
 from django.db.models import Q, Sum, F, Case, When, IntegerField
 from django.utils import timezone
 from datetime import datetime
+import logging
 import textwrap
 import os
 
@@ -25,8 +27,11 @@ from .pedidos_models import PropuestaPedido, ItemPropuesta, SolicitudPedido
 from .models import Institucion, Almacen
 from .acuse_excel import generar_acuse_excel
 from .acuse_excel_to_pdf import convertir_acuse_excel_a_pdf
+from .libreoffice_pool_utils import ErrorConversionPDF, convertir_a_pdf, pool_disponible
 from .decorators_roles import es_administrador
 
+logger = logging.getLogger(__name__)
+
 
 def wrap_text(text, max_chars=25, max_lines=3):
     """
@@ -195,6 +200,22 @@ TIPO: TRANSFERENCIA (SURTIMIENTO)'''
     return header_table
 
 
+def _acuse_pdf(propuesta, almacen_id):
+    """
+    PDF del acuse. Con el servicio de LibreOffice (``ACUSE_PDF_LIBREOFFICE`` y pool disponible)
+    se imprime la plantilla tal cual, en carta horizontal; sin él, o si la conversión falla,
+    se redibuja con reportlab (convertir_acuse_excel_a_pdf).
+    """
+    if getattr(settings, 'ACUSE_PDF_LIBREOFFICE', True) and pool_disponible():
+        excel_buffer = generar_acuse_excel(propuesta, almacen_id=almacen_id)
+        try:
+            return BytesIO(convertir_a_pdf(excel_buffer.getvalue()))
+        except ErrorConversionPDF:
+            logger.warning('Acuse %s: falló la conversión con LibreOffice; se usa reportlab', propuesta.id, exc_info=True)
+    excel_buffer = generar_acuse_excel(propuesta, almacen_id=almacen_id, for_pdf=True)
+    return convertir_acuse_excel_a_pdf(excel_buffer)
+
+
 @login_required
 def generar_acuse_entrega_pdf(request, propuesta_id):
     """
@@ -221,11 +242,8 @@ def generar_acuse_entrega_pdf(request, propuesta_id):
         almacen_id = request.user.almacen.id
 
     try:
-        # Generar Excel (con filtro de almacén si aplica)
-        excel_buffer = generar_acuse_excel(propuesta, almacen_id=almacen_id, for_pdf=True)
-        
-        # Convertir Excel a PDF
-        pdf_buffer = convertir_acuse_excel_a_pdf(excel_buffer)
+        # Generar Excel (con filtro de almacén si aplica) y convertirlo a PDF
+        pdf_buffer = _acuse_pdf(propuesta, almacen_id)
         
         # Retornar PDF
         folio = propuesta.solicitud.folio
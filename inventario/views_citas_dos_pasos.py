@@ -8,11 +8,11 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
-from django.db.models import Q
 from datetime import datetime
 import json
 
-from .models import CitaProveedor, Proveedor, Almacen, Producto
+from .models import CitaProveedor, Proveedor, Almacen
+from .busqueda_utils import buscar
 from .forms import CitaProveedorPaso1Form, CitaProveedorDetalleForm, CargaMasivaCitasForm
 from .servicio_folio import ServicioFolio
 from .servicios_notificaciones import ServicioNotificaciones
@@ -221,10 +221,8 @@ def buscar_productos_cita(request):
         if len(busqueda) < 2:
             return JsonResponse({'results': []})
         
-        # Buscar productos por clave CNIS o descripción
-        productos = Producto.objects.filter(
-            Q(clave_cnis__icontains=busqueda) | Q(descripcion__icontains=busqueda)
-        ).values('id', 'clave_cnis', 'descripcion').order_by('clave_cnis')[:20]
+        # Buscar productos por clave CNIS o descripción (sin acentos, ordenado por relevancia)
+        productos = buscar('producto', busqueda).values('id', 'clave_cnis', 'descripcion')
         
         # Formatear para Select2
         results = []
@@ -1,20 +1,17 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Count, Sum
+from django.core.paginator import Paginator
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import datetime
 from django.http import JsonResponse
-import json
 
+from .feed_movimientos_utils import SIN_DATO, TIPO_MOVIMIENTO, FeedMovimientos
 from .models import (
-    MovimientoInventario, 
-    LoteUbicacion, 
-    OrdenSuministro, 
-    CitaProveedor,
     Institucion,
     Almacen,
     User
 )
+from .saldos_cierre_utils import fin_dia, inicio_dia
 
 
 @login_required
@@ -31,148 +28,37 @@ def dashboard_movimientos(request):
     except:
         fecha_filtro = fecha_hoy
     
-    # Rango de fecha (desde las 00:00 hasta las 23:59)
-    inicio_dia = timezone.make_aware(datetime.combine(fecha_filtro, datetime.min.time()))
-    fin_dia = timezone.make_aware(datetime.combine(fecha_filtro, datetime.max.time()))
-    
     # Obtener filtros
     tipo_movimiento = request.GET.get('tipo_movimiento', '')
     usuario_id = request.GET.get('usuario', '')
     institucion_id = request.GET.get('institucion', '')
     almacen_id = request.GET.get('almacen', '')
     
-    # Inicializar lista de movimientos consolidados
-    movimientos_consolidados = []
-    
-    # 1. Movimientos de Inventario
-    movimientos_inv = MovimientoInventario.objects.filter(
-        fecha_movimiento__gte=inicio_dia,
-        fecha_movimiento__lte=fin_dia,
-        anulado=False
-    ).select_related('lote', 'lote__producto', 'lote__institucion', 'usuario')
-    
-    if usuario_id:
-        movimientos_inv = movimientos_inv.filter(usuario_id=usuario_id)
-    if institucion_id:
-        movimientos_inv = movimientos_inv.filter(lote__institucion_id=institucion_id)
-    
-    for mov in movimientos_inv:
-        movimientos_consolidados.append({
-            'tipo': 'Movimiento de Inventario',
-            'subtipo': mov.get_tipo_movimiento_display(),
-            'fecha': mov.fecha_movimiento,
-            'producto': mov.lote.producto.clave_cnis if mov.lote.producto else '-',
-            'descripcion_producto': mov.lote.producto.descripcion[:50] if mov.lote.producto else '-',
-            'lote': mov.lote.numero_lote,
-            'cantidad': mov.cantidad,
-            'institucion': mov.lote.institucion.denominacion if mov.lote.institucion else '-',
-            'usuario': mov.usuario.get_full_name() or mov.usuario.username,
-            'motivo': mov.motivo[:100],
-            'folio': mov.folio or '-',
-            'id': f'mov_{mov.id}'
-        })
-    
-    # 2. Asignación de Ubicaciones
-    asignaciones = LoteUbicacion.objects.filter(
-        fecha_asignacion__gte=inicio_dia,
-        fecha_asignacion__lte=fin_dia
-    ).select_related('lote', 'lote__producto', 'lote__institucion', 'ubicacion', 'usuario_asignacion')
-    
-    if usuario_id:
-        asignaciones = asignaciones.filter(usuario_asignacion_id=usuario_id)
-    if institucion_id:
-        asignaciones = asignaciones.filter(lote__institucion_id=institucion_id)
-    
-    for asig in asignaciones:
-        movimientos_consolidados.append({
-            'tipo': 'Asignación de Ubicación',
-            'subtipo': 'Asignación',
-            'fecha': asig.fecha_asignacion,
-            'producto': asig.lote.producto.clave_cnis if asig.lote.producto else '-',
-            'descripcion_producto': asig.lote.producto.descripcion[:50] if asig.lote.producto else '-',
-            'lote': asig.lote.numero_lote,
-            'cantidad': asig.cantidad,
-            'institucion': asig.lote.institucion.denominacion if asig.lote.institucion else '-',
-            'usuario': asig.usuario_asignacion.get_full_name() or asig.usuario_asignacion.username if asig.usuario_asignacion else '-',
-            'motivo': f"Ubicación: {asig.ubicacion.codigo}",
-            'folio': asig.lote.numero_lote,
-            'id': f'asig_{asig.id}'
-        })
-    
-    # 3. Órdenes de Suministro
-    ordenes = OrdenSuministro.objects.filter(
-        fecha_creacion__gte=inicio_dia,
-        fecha_creacion__lte=fin_dia
-    ).select_related('proveedor')
-    
-    for orden in ordenes:
-        movimientos_consolidados.append({
-            'tipo': 'Orden de Suministro',
-            'subtipo': 'Creación',
-            'fecha': orden.fecha_creacion,
-            'producto': '-',
-            'descripcion_producto': f"Proveedor: {orden.proveedor.razon_social if orden.proveedor else '-'}",
-            'lote': '-',
-            'cantidad': '-',
-            'institucion': '-',
-            'usuario': '-',
-            'motivo': f"Orden: {orden.numero_orden}",
-            'folio': orden.numero_orden,
-            'id': f'orden_{orden.id}'
-        })
-    
-    # 4. Citas con Proveedores
-    citas = CitaProveedor.objects.filter(
-        fecha_creacion__gte=inicio_dia,
-        fecha_creacion__lte=fin_dia
-    ).select_related('proveedor', 'almacen', 'usuario_creacion')
-    
-    for cita in citas:
-        movimientos_consolidados.append({
-            'tipo': 'Cita con Proveedor',
-            'subtipo': cita.get_estado_display(),
-            'fecha': cita.fecha_creacion,
-            'producto': '-',
-            'descripcion_producto': f"Proveedor: {cita.proveedor.razon_social if cita.proveedor else '-'}",
-            'lote': '-',
-            'cantidad': '-',
-            'institucion': '-',
-            'usuario': cita.usuario_creacion.get_full_name() or cita.usuario_creacion.username if cita.usuario_creacion else '-',
-            'motivo': f"Almacén: {cita.almacen.nombre}",
-            'folio': f"Cita {cita.id}",
-            'id': f'cita_{cita.id}'
-        })
-    
-    # Ordenar por fecha descendente
-    movimientos_consolidados.sort(key=lambda x: x['fecha'], reverse=True)
+    # Feed consolidado (UNION ALL de movimientos, asignaciones, órdenes y citas del día):
+    # el orden, la página y los conteos se resuelven en la BD
+    feed = FeedMovimientos(
+        inicio_dia(fecha_filtro), fin_dia(fecha_filtro),
+        usuario_id=usuario_id, institucion_id=institucion_id,
+    )
     
     # Paginación
-    from django.core.paginator import Paginator
-    paginator = Paginator(movimientos_consolidados, 25)
+    paginator = Paginator(feed, 25)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
     # Calcular estadísticas
     estadisticas = {
-        'total_movimientos': len(movimientos_consolidados),
+        'total_movimientos': paginator.count,
         'por_tipo': {},
         'por_usuario': {},
         'por_institucion': {}
     }
     
-    for mov in movimientos_consolidados:
-        # Por tipo
-        tipo = mov['tipo']
-        estadisticas['por_tipo'][tipo] = estadisticas['por_tipo'].get(tipo, 0) + 1
-        
-        # Por usuario
-        usuario = mov['usuario']
-        estadisticas['por_usuario'][usuario] = estadisticas['por_usuario'].get(usuario, 0) + 1
-        
-        # Por institución
-        institucion = mov['institucion']
-        if institucion != '-':
-            estadisticas['por_institucion'][institucion] = estadisticas['por_institucion'].get(institucion, 0) + 1
+    for tipo, usuario, institucion, n in feed.conteos('tipo', 'usuario', 'institucion'):
+        estadisticas['por_tipo'][tipo] = estadisticas['por_tipo'].get(tipo, 0) + n
+        estadisticas['por_usuario'][usuario] = estadisticas['por_usuario'].get(usuario, 0) + n
+        if institucion != SIN_DATO:
+            estadisticas['por_institucion'][institucion] = estadisticas['por_institucion'].get(institucion, 0) + n
     
     # Obtener opciones de filtro
     usuarios = User.objects.filter(is_active=True).order_by('first_name')
@@ -198,48 +84,28 @@ def dashboard_movimientos(request):
 def api_estadisticas_movimientos(request):
     """API para obtener estadísticas en formato JSON"""
     
-    fecha_str = request.GET.get('fecha', timezone.now().date().isoformat())
+    # Mismo día local que el dashboard (no la fecha UTC)
+    fecha_str = request.GET.get('fecha', timezone.localdate().isoformat())
     try:
         fecha_filtro = datetime.strptime(fecha_str, '%Y-%m-%d').date()
     except:
-        fecha_filtro = timezone.now().date()
-    
-    inicio_dia = timezone.make_aware(datetime.combine(fecha_filtro, datetime.min.time()))
-    fin_dia = timezone.make_aware(datetime.combine(fecha_filtro, datetime.max.time()))
-    
-    # Estadísticas por tipo de movimiento
-    movimientos = MovimientoInventario.objects.filter(
-        fecha_movimiento__gte=inicio_dia,
-        fecha_movimiento__lte=fin_dia,
-        anulado=False
-    ).values('tipo_movimiento').annotate(count=Count('id'))
-    
-    tipos_data = {item['tipo_movimiento']: item['count'] for item in movimientos}
-    
-    # Contar otros tipos
-    asignaciones_count = LoteUbicacion.objects.filter(
-        fecha_asignacion__gte=inicio_dia,
-        fecha_asignacion__lte=fin_dia
-    ).count()
-    
-    ordenes_count = OrdenSuministro.objects.filter(
-        fecha_creacion__gte=inicio_dia,
-        fecha_creacion__lte=fin_dia
-    ).count()
-    
-    citas_count = CitaProveedor.objects.filter(
-        fecha_creacion__gte=inicio_dia,
-        fecha_creacion__lte=fin_dia
-    ).count()
-    
-    if asignaciones_count > 0:
-        tipos_data['Asignación de Ubicación'] = asignaciones_count
-    if ordenes_count > 0:
-        tipos_data['Orden de Suministro'] = ordenes_count
-    if citas_count > 0:
-        tipos_data['Cita con Proveedor'] = citas_count
+        fecha_filtro = timezone.localdate()
+    
+    # Conteos agrupados sobre el mismo feed. ``tipos``/``total`` cubren solo los
+    # movimientos de inventario (por tipo_movimiento); ``actividades``/``total_actividades``
+    # cuentan todo el feed del día por tipo de actividad (movimientos, asignaciones,
+    # órdenes y citas), como las estadísticas del dashboard.
+    feed = FeedMovimientos(inicio_dia(fecha_filtro), fin_dia(fecha_filtro))
+    tipos_data = {}
+    actividades = {}
+    for tipo, tipo_mov, n in feed.conteos('tipo', 'tipo_movimiento'):
+        if tipo == TIPO_MOVIMIENTO:
+            tipos_data[tipo_mov] = tipos_data.get(tipo_mov, 0) + n
+        actividades[tipo] = actividades.get(tipo, 0) + n
     
     return JsonResponse({
         'tipos': tipos_data,
-        'total': sum(tipos_data.values())
+        'total': sum(tipos_data.values()),
+        'actividades': actividades,
+        'total_actividades': sum(actividades.values()),
     })
@@ -20,6 +20,8 @@ import pandas as pd
 from uuid import uuid4
 
 from .models import Lote, MovimientoInventario, Producto, LoteUbicacion, Almacen, Institucion, UbicacionAlmacen
+from .busqueda_utils import filtrar
+from .exportacion_utils import TAMANO_LOTE_ITERATOR, EstiloExportacion, en_lotes, respuesta_exportacion
 from .propuesta_utils import (
     enriquecer_movimientos_folio_observaciones_surtimiento,
     cantidad_existencia_fisica_lote_como_reporte_existencias,
@@ -225,13 +227,13 @@ def lista_lotes(request):
     
     # Búsquedas separadas
     if busqueda_lote:
-        lotes = lotes.filter(numero_lote__icontains=busqueda_lote)
+        lotes = filtrar(lotes, busqueda_lote, campos=('numero_lote',))
     
     if busqueda_cnis:
-        lotes = lotes.filter(producto__clave_cnis__icontains=busqueda_cnis)
+        lotes = filtrar(lotes, busqueda_cnis, campos=('producto__clave_cnis',))
     
     if busqueda_producto:
-        lotes = lotes.filter(producto__descripcion__icontains=busqueda_producto)
+        lotes = filtrar(lotes, busqueda_producto, campos=('producto__descripcion',))
 
     if filtro_partida:
         lotes = lotes.filter(partida__icontains=filtro_partida)
@@ -821,16 +823,7 @@ def pedidos_asociados_lote(request, lote_id):
         lotes_qs = lotes_qs.filter(institucion=institucion)
     lote = get_object_or_404(lotes_qs, id=lote_id)
 
-    lotes_asignados_query = (
-        LoteAsignado.objects.filter(lote_ubicacion__lote_id=lote_id, surtido=False)
-        .select_related(
-            'lote_ubicacion__lote__producto',
-            'lote_ubicacion__lote__institucion',
-            'item_propuesta__propuesta__solicitud',
-            'item_propuesta__propuesta',
-            'item_propuesta__producto',
-        )
-    )
+    lotes_asignados_query = LoteAsignado.objects.filter(lote_ubicacion__lote_id=lote_id, surtido=False)
     datos = _agrupar_lotes_pedidos(lotes_asignados_query)
     if datos:
         lote_info = datos[0]
@@ -1260,18 +1253,12 @@ def lista_movimientos(request):
 
 @login_required
 def exportar_movimientos_excel(request):
-    """Exporta a Excel los movimientos con los mismos filtros GET que la lista (sin límite de página)."""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment
-    from openpyxl.utils import get_column_letter
-
+    """
+    Exporta a Excel los movimientos con los mismos filtros GET que la lista (sin límite de página).
+    ``formato=csv`` exporta en CSV. Se recorre con iterator() y el folio del pedido se
+    resuelve por bloques (ver exportacion_utils).
+    """
     movimientos = _movimientos_filtrados_desde_request(request)
-    movs = list(movimientos)
-    enriquecer_movimientos_folio_observaciones_surtimiento(movs)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Movimientos'
 
     headers = [
         'Fecha y hora',
@@ -1293,62 +1280,56 @@ def exportar_movimientos_excel(request):
         'Usuario',
         'Anulado',
     ]
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    for m in movs:
-        lote = m.lote
-        prod = lote.producto if lote else None
-        inst = lote.institucion if lote else None
-        inst_clue = getattr(inst, 'clue', '') or ''
-        inst_nom = getattr(inst, 'denominacion', '') or ''
-        remision = m.remision or (getattr(lote, 'remision', None) or '') or ''
-        inst_dest = m.institucion_destino
-        if m.mostrar_bloque_destino_pedido_lista and inst_dest:
-            dest_clue = (getattr(inst_dest, 'clue', None) or '')
-            dest_ib_clue = (getattr(inst_dest, 'ib_clue', None) or '')
-            dest_nom = (getattr(inst_dest, 'denominacion', None) or '')
-        else:
-            dest_clue = '-'
-            dest_ib_clue = '-'
-            dest_nom = '-'
-        folio_pedido = m.folio_pedido_lista_movimientos
-        ws.append(
-            [
-                m.fecha_movimiento.strftime('%d/%m/%Y %H:%M') if m.fecha_movimiento else '',
-                m.get_tipo_movimiento_display(),
-                (prod.clave_cnis or '') if prod else '',
-                lote.numero_lote if lote else '',
-                (prod.descripcion or '') if prod else '',
-                inst_clue,
-                inst_nom,
-                m.cantidad_anterior,
-                m.cantidad_nueva,
-                m.cantidad,
-                str(remision) if remision else '',
-                folio_pedido,
-                dest_clue,
-                dest_ib_clue,
-                dest_nom,
-                (m.motivo or '')[:5000],
-                m.usuario.username if m.usuario_id else '',
-                'Sí' if m.anulado else 'No',
-            ]
-        )
 
-    widths = [18, 16, 14, 14, 36, 12, 28, 12, 12, 14, 14, 24, 14, 14, 32, 40, 16, 8]
-    for i, w in enumerate(widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w
+    def filas():
+        for bloque in en_lotes(movimientos.iterator(chunk_size=TAMANO_LOTE_ITERATOR)):
+            enriquecer_movimientos_folio_observaciones_surtimiento(bloque)
+            for m in bloque:
+                lote = m.lote
+                prod = lote.producto if lote else None
+                inst = lote.institucion if lote else None
+                inst_clue = getattr(inst, 'clue', '') or ''
+                inst_nom = getattr(inst, 'denominacion', '') or ''
+                remision = m.remision or (getattr(lote, 'remision', None) or '') or ''
+                inst_dest = m.institucion_destino
+                if m.mostrar_bloque_destino_pedido_lista and inst_dest:
+                    dest_clue = (getattr(inst_dest, 'clue', None) or '')
+                    dest_ib_clue = (getattr(inst_dest, 'ib_clue', None) or '')
+                    dest_nom = (getattr(inst_dest, 'denominacion', None) or '')
+                else:
+                    dest_clue = '-'
+                    dest_ib_clue = '-'
+                    dest_nom = '-'
+                yield [
+                    m.fecha_movimiento.strftime('%d/%m/%Y %H:%M') if m.fecha_movimiento else '',
+                    m.get_tipo_movimiento_display(),
+                    (prod.clave_cnis or '') if prod else '',
+                    lote.numero_lote if lote else '',
+                    (prod.descripcion or '') if prod else '',
+                    inst_clue,
+                    inst_nom,
+                    m.cantidad_anterior,
+                    m.cantidad_nueva,
+                    m.cantidad,
+                    str(remision) if remision else '',
+                    m.folio_pedido_lista_movimientos,
+                    dest_clue,
+                    dest_ib_clue,
+                    dest_nom,
+                    (m.motivo or '')[:5000],
+                    m.usuario.username if m.usuario_id else '',
+                    'Sí' if m.anulado else 'No',
+                ]
 
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return respuesta_exportacion(
+        request,
+        filas(),
+        headers,
+        'movimientos',
+        titulo_hoja='Movimientos',
+        anchos=[18, 16, 14, 14, 36, 12, 28, 12, 12, 14, 14, 24, 14, 14, 32, 40, 16, 8],
+        estilo=EstiloExportacion(fondo_encabezado=None, color_encabezado=None),
     )
-    fname = f"movimientos_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{fname}"'
-    wb.save(response)
-    return response
 
 
 # ============================================================
@@ -1495,13 +1476,13 @@ def exportar_lotes_personalizado(request):
                     lotes = lotes.filter(fecha_caducidad__gte=hoy, fecha_caducidad__lte=hoy + timedelta(days=90))
             
             if busqueda_lote:
-                lotes = lotes.filter(numero_lote__icontains=busqueda_lote)
+                lotes = filtrar(lotes, busqueda_lote, campos=('numero_lote',))
             
             if busqueda_cnis:
-                lotes = lotes.filter(producto__clave_cnis__icontains=busqueda_cnis)
+                lotes = filtrar(lotes, busqueda_cnis, campos=('producto__clave_cnis',))
             
             if busqueda_producto:
-                lotes = lotes.filter(producto__descripcion__icontains=busqueda_producto)
+                lotes = filtrar(lotes, busqueda_producto, campos=('producto__descripcion',))
 
             if filtro_partida:
                 lotes = lotes.filter(partida__icontains=filtro_partida)
@@ -7,18 +7,19 @@ con el mismo layout de columnas que el reporte de entradas (34 columnas + DÍAS
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from django.db.models import Q
+from django.core.paginator import Paginator
+from django.db.models import (
+    Case, CharField, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import datetime, timedelta, date
 
 # No listar lotes con caducidad el 01/10/2025 o anterior (petición de negocio).
 FECHA_MIN_CADUCIDAD_REPORTE = date(2025, 10, 2)  # solo aparecen fechas >= 2 oct 2025
 from decimal import Decimal
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
 
+from .exportacion_utils import TAMANO_LOTE_ITERATOR, EstiloExportacion, respuesta_exportacion
 from .models import Lote, Institucion, Almacen, UbicacionAlmacen
 
 # Mismo layout que reporte de entradas (34 columnas) + columna de estado caducidad
@@ -176,24 +177,62 @@ def _construir_fila_caducado(lote):
     return row
 
 
-@login_required
-def reporte_caducados(request):
+def _filtros_caducados(request):
+    return {
+        'filtro_clave': request.GET.get('clave', '').strip(),
+        'filtro_lote': request.GET.get('lote', '').strip(),
+        'filtro_institucion': request.GET.get('institucion', ''),
+        'filtro_almacen': request.GET.get('almacen', ''),
+        'filtro_ubicacion': request.GET.get('ubicacion', ''),
+        'filtro_rango': request.GET.get('rango', '').strip(),
+    }
+
+
+def _lotes_caducados(filtros, hoy):
     """
-    Reporte de lotes caducados y próximos a caducar (≤ 90 días).
-    Mismo layout de columnas que el reporte de entradas + DÍAS PARA CADUCAR.
+    Lotes caducados o que caducan en ≤ 90 días con los filtros del reporte (sin el de rango),
+    anotados con ``rango_caducidad`` (caducado / 30 / 60 / 90).
     """
-    hoy = timezone.now().date()
-    limite_90 = hoy + timedelta(days=90)
-
     # Caducados ya procesados por cron/Airflow quedan con cantidad_disponible=0; deben seguir
     # visibles. Próximos a caducar: solo con existencia > 0.
     lotes = Lote.objects.filter(
         fecha_caducidad__isnull=False,
         fecha_caducidad__gte=FECHA_MIN_CADUCIDAD_REPORTE,
-        fecha_caducidad__lte=limite_90,
+        fecha_caducidad__lte=hoy + timedelta(days=90),
     ).filter(
         Q(fecha_caducidad__lt=hoy) | Q(cantidad_disponible__gt=0),
-    ).select_related(
+    )
+    if filtros['filtro_clave']:
+        lotes = lotes.filter(producto__clave_cnis__icontains=filtros['filtro_clave'])
+    if filtros['filtro_lote']:
+        lotes = lotes.filter(numero_lote__icontains=filtros['filtro_lote'])
+    if filtros['filtro_institucion']:
+        lotes = lotes.filter(institucion_id=filtros['filtro_institucion'])
+    if filtros['filtro_almacen']:
+        lotes = lotes.filter(almacen__nombre=filtros['filtro_almacen'])
+    if filtros['filtro_ubicacion']:
+        lotes = lotes.filter(ubicacion_id=filtros['filtro_ubicacion'])
+    # Cubetas por fecha (no por diferencia de días) para que el motor compare contra el índice.
+    return lotes.annotate(rango_caducidad=Case(
+        When(fecha_caducidad__lt=hoy, then=Value('caducado')),
+        When(fecha_caducidad__lte=hoy + timedelta(days=30), then=Value('30')),
+        When(fecha_caducidad__lte=hoy + timedelta(days=60), then=Value('60')),
+        default=Value('90'),
+        output_field=CharField(),
+    ))
+
+
+def _q_rango(rango):
+    """Filtro de rango acumulado: ``30`` = 0–30 días, ``60`` = 0–60, ``90`` = 0–90."""
+    if rango == 'caducado':
+        return Q(rango_caducidad='caducado')
+    if rango in ('30', '60', '90'):
+        return Q(rango_caducidad__in=[r for r in ('30', '60', '90') if int(r) <= int(rango)])
+    return Q()
+
+
+def _select_related_fila(lotes):
+    return lotes.select_related(
         'producto',
         'institucion',
         'almacen',
@@ -201,108 +240,69 @@ def reporte_caducados(request):
         'orden_suministro',
         'orden_suministro__proveedor',
         'orden_suministro__fuente_financiamiento',
-    ).order_by('fecha_caducidad', 'numero_lote')
-
-    # Filtros
-    filtro_clave = request.GET.get('clave', '').strip()
-    filtro_lote = request.GET.get('lote', '').strip()
-    filtro_institucion = request.GET.get('institucion', '')
-    filtro_almacen = request.GET.get('almacen', '')
-    filtro_ubicacion = request.GET.get('ubicacion', '')
-    filtro_rango = request.GET.get('rango', '').strip()
-
-    if filtro_clave:
-        lotes = lotes.filter(producto__clave_cnis__icontains=filtro_clave)
-    if filtro_lote:
-        lotes = lotes.filter(numero_lote__icontains=filtro_lote)
-    if filtro_institucion:
-        lotes = lotes.filter(institucion_id=filtro_institucion)
-    if filtro_almacen:
-        lotes = lotes.filter(almacen__nombre=filtro_almacen)
-    if filtro_ubicacion:
-        lotes = lotes.filter(ubicacion_id=filtro_ubicacion)
-
-    # Construir lista de filas
-    lista_filas = []
-    total_cantidad = 0
-    total_valor = 0
-
-    for lote in lotes:
-        dias = _dias_para_caducar(lote)
-        # Filtro por rango: caducado, ≤30, ≤60, ≤90
-        if filtro_rango == 'caducado':
-            if dias is None or dias >= 0:
-                continue
-        elif filtro_rango == '30':
-            if dias is None or dias < 0 or dias > 30:
-                continue
-        elif filtro_rango == '60':
-            if dias is None or dias < 0 or dias > 60:
-                continue
-        elif filtro_rango == '90':
-            if dias is None or dias < 0 or dias > 90:
-                continue
-
-        row = _construir_fila_caducado(lote)
-        lista_filas.append({'row': row, 'id': lote.id, 'dias': dias})
-        total_cantidad += row[6] or 0
-        total_valor += float(row[20] or 0)
+    ).order_by('fecha_caducidad', 'numero_lote', 'pk')
+
+
+@login_required
+def reporte_caducados(request):
+    """
+    Reporte de lotes caducados y próximos a caducar (≤ 90 días).
+    Mismo layout de columnas que el reporte de entradas + DÍAS PARA CADUCAR.
+
+    Cubetas de rango, conteos de las tarjetas y totales salen de un solo aggregate; solo
+    se construyen las filas de la página (LIMIT/OFFSET).
+    """
+    hoy = timezone.now().date()
+    filtros = _filtros_caducados(request)
+    lotes = _lotes_caducados(filtros, hoy)
+    en_rango = _q_rango(filtros['filtro_rango'])
+
+    importe = Coalesce(
+        'importe_total',
+        ExpressionWrapper(
+            F('cantidad_disponible') * Coalesce('precio_unitario', Value(Decimal('0'))),
+            output_field=DecimalField(max_digits=20, decimal_places=2),
+        ),
+        output_field=DecimalField(max_digits=20, decimal_places=2),
+    )
+    resumen = lotes.aggregate(
+        total_registros=Count('pk', filter=en_rango),
+        total_cantidad=Sum('cantidad_disponible', filter=en_rango),
+        total_valor=Sum(importe, filter=en_rango),
+        conteo_caducado=Count('pk', filter=_q_rango('caducado')),
+        conteo_30=Count('pk', filter=_q_rango('30')),
+        conteo_60=Count('pk', filter=_q_rango('60')),
+        conteo_90=Count('pk', filter=_q_rango('90')),
+    )
 
     # Paginación
-    from django.core.paginator import Paginator
-    paginator = Paginator(lista_filas, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = Paginator(_select_related_fila(lotes.filter(en_rango)), 25)
+    paginator.count = resumen['total_registros']  # ya contado en el aggregate; evita otro COUNT
+    page_obj = paginator.get_page(request.GET.get('page'))
+    page_obj.object_list = [
+        {'row': _construir_fila_caducado(lote), 'id': lote.id, 'dias': _dias_para_caducar(lote)}
+        for lote in page_obj.object_list
+    ]
 
     instituciones = Institucion.objects.all().order_by('denominacion')
     almacenes = Almacen.objects.all().order_by('nombre')
     ubicaciones = UbicacionAlmacen.objects.filter(activo=True).select_related('almacen').order_by('almacen__nombre', 'codigo')
 
-    # Conteos por rango para tarjetas
-    lotes_sin_filtro_rango = Lote.objects.filter(
-        fecha_caducidad__isnull=False,
-        fecha_caducidad__gte=FECHA_MIN_CADUCIDAD_REPORTE,
-        fecha_caducidad__lte=limite_90,
-    ).filter(
-        Q(fecha_caducidad__lt=hoy) | Q(cantidad_disponible__gt=0),
-    )
-    if filtro_clave:
-        lotes_sin_filtro_rango = lotes_sin_filtro_rango.filter(producto__clave_cnis__icontains=filtro_clave)
-    if filtro_lote:
-        lotes_sin_filtro_rango = lotes_sin_filtro_rango.filter(numero_lote__icontains=filtro_lote)
-    if filtro_institucion:
-        lotes_sin_filtro_rango = lotes_sin_filtro_rango.filter(institucion_id=filtro_institucion)
-    if filtro_almacen:
-        lotes_sin_filtro_rango = lotes_sin_filtro_rango.filter(almacen__nombre=filtro_almacen)
-    if filtro_ubicacion:
-        lotes_sin_filtro_rango = lotes_sin_filtro_rango.filter(ubicacion_id=filtro_ubicacion)
-
-    conteo_caducado = lotes_sin_filtro_rango.filter(fecha_caducidad__lt=hoy).count()
-    conteo_30 = lotes_sin_filtro_rango.filter(fecha_caducidad__gte=hoy, fecha_caducidad__lte=hoy + timedelta(days=30)).count()
-    conteo_60_total = lotes_sin_filtro_rango.filter(fecha_caducidad__gte=hoy, fecha_caducidad__lte=hoy + timedelta(days=60)).count()
-    conteo_90_extra = lotes_sin_filtro_rango.filter(fecha_caducidad__gte=hoy, fecha_caducidad__lte=hoy + timedelta(days=90)).exclude(fecha_caducidad__lte=hoy + timedelta(days=60)).count()
-    conteo_90_total = conteo_60_total + conteo_90_extra  # total próximos 0-90 días
-
     context = {
         'page_obj': page_obj,
         'headers': CADUCADOS_LAYOUT_HEADERS,
-        'total_registros': len(lista_filas),
-        'total_cantidad': total_cantidad,
-        'total_valor': total_valor,
+        'total_registros': resumen['total_registros'],
+        'total_cantidad': resumen['total_cantidad'] or 0,
+        'total_valor': float(resumen['total_valor'] or 0),
         'instituciones': instituciones,
         'almacenes': almacenes,
         'ubicaciones': ubicaciones,
-        'filtro_clave': filtro_clave,
-        'filtro_lote': filtro_lote,
-        'filtro_institucion': filtro_institucion,
-        'filtro_almacen': filtro_almacen,
-        'filtro_ubicacion': filtro_ubicacion,
-        'filtro_rango': filtro_rango,
+        **filtros,
         'rango_choices': RANGO_CADUCIDAD,
-        'conteo_caducado': conteo_caducado,
-        'conteo_30': conteo_30,
-        'conteo_60': conteo_60_total,
-        'conteo_90': conteo_90_total,
+        'conteo_caducado': resumen['conteo_caducado'],
+        'conteo_30': resumen['conteo_30'],
+        'conteo_60': resumen['conteo_60'],
+        'conteo_90': resumen['conteo_90'],
     }
     return render(request, 'inventario/reporte_caducados.html', context)
 
@@ -311,100 +311,40 @@ def reporte_caducados(request):
 def exportar_caducados_excel(request):
     """Exporta el reporte de caducados a Excel con el mismo layout que entradas + DÍAS PARA CADUCAR."""
     hoy = timezone.now().date()
-    limite_90 = hoy + timedelta(days=90)
-
-    lotes = Lote.objects.filter(
-        fecha_caducidad__isnull=False,
-        fecha_caducidad__gte=FECHA_MIN_CADUCIDAD_REPORTE,
-        fecha_caducidad__lte=limite_90,
-    ).filter(
-        Q(fecha_caducidad__lt=hoy) | Q(cantidad_disponible__gt=0),
-    ).select_related(
-        'producto',
-        'institucion',
-        'almacen',
-        'ubicacion',
-        'orden_suministro',
-        'orden_suministro__proveedor',
-        'orden_suministro__fuente_financiamiento',
-    ).order_by('fecha_caducidad', 'numero_lote')
-
-    filtro_clave = request.GET.get('clave', '').strip()
-    filtro_lote = request.GET.get('lote', '').strip()
-    filtro_institucion = request.GET.get('institucion', '')
-    filtro_almacen = request.GET.get('almacen', '')
-    filtro_ubicacion = request.GET.get('ubicacion', '')
-    filtro_rango = request.GET.get('rango', '').strip()
-
-    if filtro_clave:
-        lotes = lotes.filter(producto__clave_cnis__icontains=filtro_clave)
-    if filtro_lote:
-        lotes = lotes.filter(numero_lote__icontains=filtro_lote)
-    if filtro_institucion:
-        lotes = lotes.filter(institucion_id=filtro_institucion)
-    if filtro_almacen:
-        lotes = lotes.filter(almacen__nombre=filtro_almacen)
-    if filtro_ubicacion:
-        lotes = lotes.filter(ubicacion_id=filtro_ubicacion)
-
-    listado = []
-    total_cantidad = 0
-    total_importe = 0
-    for lote in lotes:
-        dias = _dias_para_caducar(lote)
-        if filtro_rango == 'caducado' and (dias is None or dias >= 0):
-            continue
-        if filtro_rango == '30' and (dias is None or dias < 0 or dias > 30):
-            continue
-        if filtro_rango == '60' and (dias is None or dias < 0 or dias > 60):
-            continue
-        if filtro_rango == '90' and (dias is None or dias < 0 or dias > 90):
-            continue
-        fila = _construir_fila_caducado(lote)
-        listado.append(fila)
-        total_cantidad += fila[6] or 0
-        total_importe += float(fila[20] or 0)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Caducados y próximos"
-    header_fill = PatternFill(start_color="B71C1C", end_color="B71C1C", fill_type="solid")
-    header_font = Font(bold=True, color="FFEBEE", size=10)
-    total_fill = PatternFill(start_color="FFCDD2", end_color="FFCDD2", fill_type="solid")
-    total_font = Font(bold=True, size=10)
-    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    for col, header in enumerate(CADUCADOS_LAYOUT_HEADERS, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = border
-
-    for row_num, fila in enumerate(listado, 2):
-        for col_num, val in enumerate(fila, 1):
-            cell = ws.cell(row=row_num, column=col_num, value=val)
-            cell.border = border
-            if col_num in (7, 17, 18, 19, 20, 21):
-                cell.alignment = Alignment(horizontal='right')
-
-    total_row = len(listado) + 2
-    ws.cell(row=total_row, column=1).value = "TOTALES"
-    ws.cell(row=total_row, column=1).font = total_font
-    ws.cell(row=total_row, column=1).fill = total_fill
-    ws.cell(row=total_row, column=7).value = total_cantidad
-    ws.cell(row=total_row, column=7).font = total_font
-    ws.cell(row=total_row, column=7).fill = total_fill
-    ws.cell(row=total_row, column=21).value = total_importe
-    ws.cell(row=total_row, column=21).font = total_font
-    ws.cell(row=total_row, column=21).fill = total_fill
-    for col in range(1, len(CADUCADOS_LAYOUT_HEADERS) + 1):
-        ws.cell(row=total_row, column=col).border = border
-
-    for col in range(1, len(CADUCADOS_LAYOUT_HEADERS) + 1):
-        ws.column_dimensions[get_column_letter(col)].width = 14
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="reporte_caducados.xlsx"'
-    wb.save(response)
-    return response
+    filtros = _filtros_caducados(request)
+    lotes = _select_related_fila(_lotes_caducados(filtros, hoy).filter(_q_rango(filtros['filtro_rango'])))
+
+    totales = {'cantidad': 0, 'importe': 0}
+
+    def filas():
+        for lote in lotes.iterator(chunk_size=TAMANO_LOTE_ITERATOR):
+            fila = _construir_fila_caducado(lote)
+            totales['cantidad'] += fila[6] or 0
+            totales['importe'] += float(fila[20] or 0)
+            yield fila
+
+    def fila_totales():
+        fila = [None] * len(CADUCADOS_LAYOUT_HEADERS)
+        fila[0] = 'TOTALES'
+        fila[6] = totales['cantidad']
+        fila[20] = totales['importe']
+        return fila
+
+    return respuesta_exportacion(
+        request,
+        filas(),
+        CADUCADOS_LAYOUT_HEADERS,
+        'reporte_caducados',
+        titulo_hoja='Caducados y próximos',
+        anchos=[14] * len(CADUCADOS_LAYOUT_HEADERS),
+        estilo=EstiloExportacion(
+            fondo_encabezado='B71C1C',
+            color_encabezado='FFEBEE',
+            tamano_fuente=10,
+            bordes=True,
+            columnas_derecha=(7, 17, 18, 19, 20, 21),
+            fondo_totales='FFCDD2',
+        ),
+        totales=fila_totales,
+        con_fecha=False,
+    )
@@ -4,25 +4,22 @@ Permite tomar decisiones sobre el inventario considerando las reservas en propue
 
 Misma base que lote-pedidos y reporte de existencias:
 - Existencia: Lote.cantidad_disponible (alineado con reportes/existencias).
-- Reserva: suma de LoteAsignado con surtido=False (totales_reserva_activa_por_lote_ids),
+- Reserva: suma de LoteAsignado con surtido=False (libro LoteUbicacion.reserva_activa, en SQL),
   no el campo Lote.cantidad_reservada (puede estar desactualizado).
 """
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import Case, Count, F, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.core.paginator import Paginator
 from datetime import date
 import logging
 
 from .models import Lote, Institucion
-from .propuesta_utils import (
-    cantidad_existencia_fisica_lote_como_reporte_existencias,
-    totales_reserva_activa_por_lote_ids,
-)
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+from .propuesta_utils import cantidad_existencia_fisica_lote_como_reporte_existencias
+from .reservas_utils import subquery_reserva_activa_lote
+from .exportacion_utils import TAMANO_LOTE_ITERATOR, EstiloExportacion, respuesta_exportacion
 
 logger = logging.getLogger(__name__)
 
@@ -60,37 +57,37 @@ def reporte_disponibilidad_lotes(request):
     if filtro_estado:
         lotes = lotes.filter(estado=int(filtro_estado))
 
-    lotes = lotes.order_by('producto__clave_cnis', 'fecha_caducidad')
-    lotes_list = list(lotes.prefetch_related('ubicaciones_detalle'))
-    lote_ids = [lo.id for lo in lotes_list]
-    reservas_map = totales_reserva_activa_por_lote_ids(lote_ids)
-
-    total_disponible = 0
-    total_reservado = 0
-    total_neto = 0
-    for lote in lotes_list:
-        disp = cantidad_existencia_fisica_lote_como_reporte_existencias(lote)
-        res = reservas_map.get(lote.id, 0)
-        total_disponible += disp
-        total_reservado += res
-        total_neto += max(0, disp - res)
-
-    paginator = Paginator(lotes_list, 20)
-    page = request.GET.get('page')
+    # Reserva y neto anotados en SQL: los totales salen de un solo aggregate y la página
+    # se lee con LIMIT/OFFSET (antes se materializaban todos los lotes para sumar).
+    lotes = lotes.annotate(
+        reserva_activa_total=Coalesce(Subquery(subquery_reserva_activa_lote()), 0),
+    ).annotate(
+        neto=Case(
+            When(cantidad_disponible__gt=F('reserva_activa_total'),
+                 then=F('cantidad_disponible') - F('reserva_activa_total')),
+            default=Value(0),
+        ),
+    )
+    totales = lotes.aggregate(
+        total_lotes=Count('pk'),
+        total_disponible=Coalesce(Sum('cantidad_disponible'), 0),
+        total_reservado=Coalesce(Sum('reserva_activa_total'), 0),
+        total_neto=Coalesce(Sum('neto'), 0),
+    )
+    total_disponible = totales['total_disponible']
+    total_reservado = totales['total_reservado']
+    total_neto = totales['total_neto']
 
-    try:
-        lotes_pagina = paginator.page(page)
-    except PageNotAnInteger:
-        lotes_pagina = paginator.page(1)
-    except EmptyPage:
-        lotes_pagina = paginator.page(paginator.num_pages)
+    paginator = Paginator(lotes.order_by('producto__clave_cnis', 'fecha_caducidad', 'pk'), 20)
+    paginator.count = totales['total_lotes']  # ya contado en el aggregate; evita otro COUNT
+    lotes_pagina = paginator.get_page(request.GET.get('page'))
 
     datos_reporte = []
 
     for lote in lotes_pagina:
         cantidad_disponible = cantidad_existencia_fisica_lote_como_reporte_existencias(lote)
-        cantidad_reservada = reservas_map.get(lote.id, 0)
-        cantidad_neta = max(0, cantidad_disponible - cantidad_reservada)
+        cantidad_reservada = int(lote.reserva_activa_total or 0)
+        cantidad_neta = int(lote.neto or 0)
         porcentaje_reserva = (
             (cantidad_reservada / cantidad_disponible * 100) if cantidad_disponible > 0 else 0
         )
@@ -161,7 +158,7 @@ def reporte_disponibilidad_lotes(request):
 @login_required
 def exportar_disponibilidad_excel(request):
     """
-    Exporta el reporte de disponibilidad vs reservas a Excel.
+    Exporta el reporte de disponibilidad vs reservas a Excel (``formato=csv``: CSV).
     """
     
     # Obtener parámetros de filtro (GET o POST)
@@ -197,28 +194,22 @@ def exportar_disponibilidad_excel(request):
     else:
         logger.info(f"[EXPORTAR_DISPONIBILIDAD] Filtros: clave={filtro_clave}, lote={filtro_lote}, institucion={filtro_institucion}")
     
-    lotes = lotes.order_by('producto__clave_cnis', 'fecha_caducidad')
-    lotes_list = list(lotes.prefetch_related('ubicaciones_detalle'))
-    lote_ids = [lo.id for lo in lotes_list]
-    reservas_map = totales_reserva_activa_por_lote_ids(lote_ids)
-
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Disponibilidad"
-    
-    # Definir estilos
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+    # Existencia = Lote.cantidad_disponible (como cantidad_existencia_fisica_lote_como_reporte_existencias);
+    # la reserva se suma en SQL con el libro de LoteUbicacion, sin cargar los lotes como objetos.
+    lotes = lotes.order_by('producto__clave_cnis', 'fecha_caducidad').annotate(
+        reserva_activa_total=Coalesce(Subquery(subquery_reserva_activa_lote()), 0),
+    ).values_list(
+        'producto__clave_cnis',
+        'producto__descripcion',
+        'numero_lote',
+        'institucion__denominacion',
+        'cantidad_disponible',
+        'reserva_activa_total',
+        'fecha_caducidad',
+        'precio_unitario',
+        'valor_total',
     )
-    
+
     headers = [
         'Clave CNIS',
         'Descripción',
@@ -233,107 +224,59 @@ def exportar_disponibilidad_excel(request):
         'Precio Unitario',
         'Valor Total',
     ]
-    
-    ws.append(headers)
-    
-    # Aplicar estilos a encabezados
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-        cell.border = border
-    
-    # Ajustar ancho de columnas
-    ws.column_dimensions['A'].width = 15
-    ws.column_dimensions['B'].width = 35
-    ws.column_dimensions['C'].width = 15
-    ws.column_dimensions['D'].width = 20
-    ws.column_dimensions['E'].width = 18
-    ws.column_dimensions['F'].width = 18
-    ws.column_dimensions['G'].width = 15
-    ws.column_dimensions['H'].width = 12
-    ws.column_dimensions['I'].width = 15
-    ws.column_dimensions['J'].width = 15
-    ws.column_dimensions['K'].width = 15
-    ws.column_dimensions['L'].width = 15
-    
-    # Llenar datos (todos los lotes, no solo la página actual)
-    total_disponible = 0
-    total_reservado = 0
-    total_neto = 0
-    
-    for lote in lotes_list:
-        cantidad_disponible = cantidad_existencia_fisica_lote_como_reporte_existencias(lote)
-        cantidad_reservada = reservas_map.get(lote.id, 0)
-        cantidad_neta = max(0, cantidad_disponible - cantidad_reservada)
-        porcentaje_reserva = (
-            (cantidad_reservada / cantidad_disponible * 100) if cantidad_disponible > 0 else 0
-        )
+    totales = {'disponible': 0, 'reservado': 0, 'neto': 0}
+    hoy = date.today()
 
-        dias_caducidad = None
-        if lote.fecha_caducidad:
-            dias_caducidad = (lote.fecha_caducidad - date.today()).days
+    def filas():
+        for (clave, descripcion, numero_lote, institucion, disponible, reservada,
+             fecha_caducidad, precio_unitario, valor_total) in lotes.iterator(chunk_size=TAMANO_LOTE_ITERATOR):
+            cantidad_disponible = int(disponible or 0)
+            cantidad_reservada = int(reservada or 0)
+            cantidad_neta = max(0, cantidad_disponible - cantidad_reservada)
+            porcentaje_reserva = (
+                (cantidad_reservada / cantidad_disponible * 100) if cantidad_disponible > 0 else 0
+            )
+            totales['disponible'] += cantidad_disponible
+            totales['reservado'] += cantidad_reservada
+            totales['neto'] += cantidad_neta
+            yield [
+                clave,
+                (descripcion or '')[:60],
+                numero_lote,
+                institucion or 'N/A',
+                cantidad_disponible,
+                cantidad_reservada,
+                cantidad_neta,
+                f"{porcentaje_reserva:.2f}%",
+                fecha_caducidad.strftime('%d/%m/%Y') if fecha_caducidad else 'N/A',
+                (fecha_caducidad - hoy).days if fecha_caducidad else 'N/A',
+                f"${precio_unitario:.2f}",
+                f"${valor_total:.2f}",
+            ]
 
-        row = [
-            lote.producto.clave_cnis,
-            lote.producto.descripcion[:60],
-            lote.numero_lote,
-            lote.institucion.denominacion if lote.institucion else 'N/A',
-            cantidad_disponible,
-            cantidad_reservada,
-            cantidad_neta,
-            f"{porcentaje_reserva:.2f}%",
-            lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else 'N/A',
-            dias_caducidad if dias_caducidad is not None else 'N/A',
-            f"${lote.precio_unitario:.2f}",
-            f"${lote.valor_total:.2f}",
-        ]
-        
-        ws.append(row)
-        
-        # Aplicar bordes y alineación
-        for cell in ws[ws.max_row]:
-            cell.border = border
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Colorear según nivel de reserva
-        if cantidad_neta <= 0:
-            color = "FFC7CE"  # Rojo claro
-        elif porcentaje_reserva >= 80:
-            color = "FFC7CE"  # Rojo claro
-        elif porcentaje_reserva >= 50:
-            color = "FFEB9C"  # Amarillo claro
-        else:
-            color = "C6EFCE"  # Verde claro
-        
-        for cell in ws[ws.max_row]:
-            cell.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-        
-        total_disponible += cantidad_disponible
-        total_reservado += cantidad_reservada
-        total_neto += cantidad_neta
-    
-    # Agregar fila de totales
-    ws.append([])
-    total_row = ws.max_row
-    ws[f'A{total_row}'] = 'TOTAL'
-    ws[f'E{total_row}'] = total_disponible
-    ws[f'F{total_row}'] = total_reservado
-    ws[f'G{total_row}'] = total_neto
-    
-    # Aplicar estilos a fila de totales
-    for col in ['A', 'E', 'F', 'G']:
-        cell = ws[f'{col}{total_row}']
-        cell.font = Font(bold=True, size=11)
-        cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        cell.border = border
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Crear respuesta HTTP
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    def nivel_reserva(fila):
+        # Colorear según nivel de reserva (neta agotada o >= 80% rojo, >= 50% amarillo)
+        disponible, reservada, neta = fila[4], fila[5], fila[6]
+        porcentaje = reservada / disponible * 100 if disponible > 0 else 0
+        if neta <= 0 or porcentaje >= 80:
+            return 'alto'
+        if porcentaje >= 50:
+            return 'medio'
+        return 'bajo'
+
+    return respuesta_exportacion(
+        request,
+        filas(),
+        headers,
+        'reporte_disponibilidad_lotes',
+        titulo_hoja='Disponibilidad',
+        anchos=[15, 35, 15, 20, 18, 18, 15, 12, 15, 15, 15, 15],
+        estilo=EstiloExportacion(
+            bordes=True,
+            fondo_totales='D3D3D3',
+            resaltados={'alto': 'FFC7CE', 'medio': 'FFEB9C', 'bajo': 'C6EFCE'},
+            resaltar=nivel_reserva,
+        ),
+        totales=lambda: ['TOTAL', None, None, None, totales['disponible'], totales['reservado'], totales['neto']],
+        con_fecha=False,
     )
-    response['Content-Disposition'] = 'attachment; filename="reporte_disponibilidad_lotes.xlsx"'
-    
-    wb.save(response)
-    return response
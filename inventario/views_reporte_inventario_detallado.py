@@ -13,7 +13,6 @@ INVENTARIO DISPONIBLE (columna): existencia del lote (misma base que reporte de
 
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
 from django.db.models import (
     Q,
     Sum,
@@ -25,21 +24,19 @@ from django.db.models import (
     Case,
     When,
     F,
-    OuterRef,
     Subquery,
 )
 from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib import messages
 from datetime import date, datetime
-from io import BytesIO
 
 from .models import Lote, Producto, Institucion, OrdenSuministro, Proveedor, MovimientoInventario
-from .pedidos_models import LoteAsignado
 from .propuesta_utils import totales_reserva_activa_por_lote_ids
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from .reservas_utils import subquery_reserva_activa_lote
+from .trabajos_utils import en_segundo_plano
+from .exportacion_utils import TAMANO_LOTE_ITERATOR, EstiloExportacion, respuesta_exportacion
+from openpyxl import load_workbook
 
 
 def _texto_orden_suministro_lote(lote):
@@ -69,16 +66,11 @@ def _texto_proveedor_lote(lote):
 def _annotate_inventario_disponible_real(queryset):
     """
     Por cada Lote: inventario neto = existencia en lote (cantidad_disponible, alineado a existencias SAICA)
-    − reserva activa en propuestas (suma LoteAsignado con surtido=False por lote).
+    − reserva activa en propuestas (suma LoteAsignado con surtido=False por lote, leída del
+    libro LoteUbicacion.reserva_activa).
     Expone _inventario_disponible_neto para ordenar y para _fila_lote_a_dict.
     """
-    la_total = (
-        LoteAsignado.objects.filter(lote_ubicacion__lote_id=OuterRef('pk'), surtido=False)
-        .order_by()
-        .values('lote_ubicacion__lote_id')
-        .annotate(t=Sum('cantidad_asignada'))
-        .values('t')[:1]
-    )
+    la_total = subquery_reserva_activa_lote()
     return (
         queryset.annotate(
             _sum_res=Coalesce(Subquery(la_total, output_field=IntegerField()), Value(0)),
@@ -582,53 +574,25 @@ def exportar_existencias_excel(request):
     columnas = list(EXISTENCIAS_COLUMNAS_LABELS.keys())
     headers = [EXISTENCIAS_COLUMNAS_LABELS[c] for c in columnas]
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Existencias"
-
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-
-    for col_num, header in enumerate(headers, 1):
-        col_letter = get_column_letter(col_num)
-        cell = ws[f"{col_letter}1"]
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-        cell.border = border
-
-    for row_num, lote in enumerate(lotes, 2):
-        fila = _fila_lote_existencias_a_dict(lote)
-        row_data = [fila.get(c, '') for c in columnas]
-
-        for col_num, value in enumerate(row_data, 1):
-            col_letter = get_column_letter(col_num)
-            cell = ws[f"{col_letter}{row_num}"]
-            cell.value = value
-            cell.border = border
-            if columnas[col_num - 1] in ('existencia', 'precio', 'importe'):
-                cell.alignment = Alignment(horizontal="right", vertical="center")
-            else:
-                cell.alignment = Alignment(horizontal="left", vertical="center")
-
-    for col_num in range(1, len(columnas) + 1):
-        col_letter = get_column_letter(col_num)
-        ws.column_dimensions[col_letter].width = 18
-
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    numericas = ('existencia', 'precio', 'importe')
+
+    def filas():
+        for lote in lotes.iterator(chunk_size=TAMANO_LOTE_ITERATOR):
+            fila = _fila_lote_existencias_a_dict(lote)
+            yield [fila.get(c, '') for c in columnas]
+
+    return respuesta_exportacion(
+        request,
+        filas(),
+        headers,
+        'reporte_existencias',
+        titulo_hoja='Existencias',
+        anchos=[18] * len(columnas),
+        estilo=EstiloExportacion(
+            bordes=True,
+            columnas_derecha=tuple(i for i, c in enumerate(columnas, 1) if c in numericas),
+        ),
     )
-    response['Content-Disposition'] = f'attachment; filename="reporte_existencias_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
-    wb.save(response)
-    return response
 
 
 # =========================
@@ -773,45 +737,30 @@ def reporte_existencias_por_claves(request):
 def exportar_existencias_por_claves_excel(request):
     """Exporta el reporte de existencias por claves a Excel."""
     datos = _obtener_existencias_agrupadas_por_clave(request)
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Existencias por Claves"
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    for col_num, header in enumerate(EXISTENCIAS_CLAVES_HEADERS, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-        cell.border = border
     key_order = ['clave_cnis', 'producto', 'unidad_medida', 'almacen', 'existencia', 'precio', 'importe', 'cant_reservada', 'entidad_federativa', 'clues', 'fuente_financiamiento', 'partida_presupuestal', 'lugar_entrega', 'entradas', 'salidas']
-    for row_num, row in enumerate(datos, 2):
-        for col_num, key in enumerate(key_order, 1):
-            cell = ws.cell(row=row_num, column=col_num)
-            cell.value = row.get(key, '')
-            cell.border = border
-            if key in ('existencia', 'precio', 'importe', 'cant_reservada', 'entradas', 'salidas'):
-                cell.alignment = Alignment(horizontal="right", vertical="center")
-            else:
-                cell.alignment = Alignment(horizontal="left", vertical="center")
-    for col_num in range(1, len(EXISTENCIAS_CLAVES_HEADERS) + 1):
-        ws.column_dimensions[get_column_letter(col_num)].width = 18
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="reporte_existencias_por_claves_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
-    wb.save(response)
-    return response
+    numericas = ('existencia', 'precio', 'importe', 'cant_reservada', 'entradas', 'salidas')
+    return respuesta_exportacion(
+        request,
+        ([row.get(key, '') for key in key_order] for row in datos),
+        EXISTENCIAS_CLAVES_HEADERS,
+        'reporte_existencias_por_claves',
+        titulo_hoja='Existencias por Claves',
+        anchos=[18] * len(EXISTENCIAS_CLAVES_HEADERS),
+        estilo=EstiloExportacion(
+            bordes=True,
+            columnas_derecha=tuple(i for i, key in enumerate(key_order, 1) if key in numericas),
+        ),
+    )
 
 
 @login_required
+@en_segundo_plano('Exportación de inventario detallado a Excel')
 def exportar_inventario_detallado_excel(request):
     """
     Exporta el reporte de inventario detallado a Excel.
     GET: exporta con todas las columnas (incluye DESCRIPCIÓN).
     POST: exporta solo las columnas seleccionadas (columnas, orden_columnas y filtros en POST).
-    Usa hoja write_only + iterator() para velocidad; sin estilos ni anchos de columna en el XLSX.
+    Hoja write_only + iterator() (ver exportacion_utils); ``formato=csv`` exporta en CSV.
     """
     from_post = request.method == 'POST'
     lotes = _annotate_inventario_disponible_real(_obtener_lotes_filtrados(request, from_post=from_post))
@@ -831,26 +780,13 @@ def exportar_inventario_detallado_excel(request):
 
     headers = [COLUMNAS_EXCEL_LABELS.get(c, c.upper()) for c in columnas]
 
-    wb = Workbook(write_only=True)
-    ws = wb.create_sheet(title="Inventario Detallado")
-    ws.append(headers)
-
-    for lote in lotes.iterator(chunk_size=500):
-        fila = _fila_lote_a_dict(lote)
-        ws.append([fila.get(c, '') for c in columnas])
+    def filas():
+        for lote in lotes.iterator(chunk_size=TAMANO_LOTE_ITERATOR):
+            fila = _fila_lote_a_dict(lote)
+            yield [fila.get(c, '') for c in columnas]
 
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    response = HttpResponse(
-        buffer.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    )
-    response['Content-Disposition'] = (
-        f'attachment; filename="reporte_inventario_detallado_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
-    )
-    return response
+    return respuesta_exportacion(request, filas(), headers, 'reporte_inventario_detallado',
+                                 titulo_hoja='Inventario Detallado')
 
 
 # --- Carga masiva desde Excel (mismo layout que el reporte) ---
@@ -9,110 +9,158 @@ Relaciones:
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
-from django.db.models import Q
+from django.db.models import Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from datetime import date, datetime
 import logging
 
+from .models import Lote
 from .pedidos_models import LoteAsignado, PropuestaPedido
-from .propuesta_utils import (
-    cantidad_existencia_fisica_lote_como_reporte_existencias,
-    totales_reserva_activa_por_lote_ids,
-)
+from .reservas_utils import subquery_reserva_activa_lote
 from openpyxl import Workbook
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 logger = logging.getLogger(__name__)
 
 
-def _agrupar_lotes_pedidos(lotes_asignados_query):
-    """
-    Agrupa asignaciones por lote y por propuesta/pedido.
+FILTROS_LOTE_PEDIDOS = ('clave', 'lote', 'folio', 'fecha_desde', 'fecha_hasta', 'estado')
 
-    Reserva del lote: suma de LoteAsignado con surtido=False (misma regla que
-    editar propuesta / reportes de reservas), vía totales_reserva_activa_por_lote_ids.
-    No usa el campo Lote.cantidad_reservada. Existencia física: Lote.cantidad_disponible
-    (mismo criterio que el reporte de existencias, no la suma directa de ubicaciones).
-    """
-    lote_ids = list(
-        lotes_asignados_query.values_list('lote_ubicacion__lote_id', flat=True).distinct()
-    )
-    reservas_por_lote = totales_reserva_activa_por_lote_ids(lote_ids)
-    lotes_dict = {}
 
-    for lote_asignado in lotes_asignados_query:
-        try:
-            lote = lote_asignado.lote_ubicacion.lote
-            item_prop = lote_asignado.item_propuesta
-            propuesta = item_prop.propuesta
-            solicitud = propuesta.solicitud
-
-            lote_key = lote.id
+def _asignaciones_filtradas(filtros):
+    """
+    LoteAsignado pendientes de surtir (surtido=False) con los filtros del reporte
+    (``filtros``: dict con las claves de FILTROS_LOTE_PEDIDOS). Compartido por la vista y el Excel.
+    """
+    lotes_asignados_query = LoteAsignado.objects.filter(surtido=False)  # Excluir asignaciones ya surtidas
 
-            if lote_key not in lotes_dict:
-                reserva_desde_pedidos = reservas_por_lote.get(lote.id, 0)
-                disp = cantidad_existencia_fisica_lote_como_reporte_existencias(lote)
-                cantidad_neta = max(0, disp - reserva_desde_pedidos)
-                lotes_dict[lote_key] = {
-                    'lote_id': lote.id,
-                    'clave': lote.producto.clave_cnis,
-                    'descripcion': lote.producto.descripcion,
-                    'numero_lote': lote.numero_lote,
-                    'institucion': lote.institucion.denominacion if lote.institucion else 'N/A',
-                    'cantidad_disponible': disp,
-                    'cantidad_reservada': reserva_desde_pedidos,
-                    'cantidad_neta': cantidad_neta,
-                    'sobre_reserva': reserva_desde_pedidos > disp,
-                    'deficit_unidades': max(0, reserva_desde_pedidos - disp),
-                    'fecha_caducidad': lote.fecha_caducidad,
-                    'precio_unitario': lote.precio_unitario,
-                    'valor_total': lote.valor_total,
-                    'pedidos': {},
-                }
+    if filtros['clave']:
+        lotes_asignados_query = lotes_asignados_query.filter(
+            Q(lote_ubicacion__lote__producto__clave_cnis__icontains=filtros['clave']) |
+            Q(lote_ubicacion__lote__producto__descripcion__icontains=filtros['clave'])
+        )
 
-            pedido_key = propuesta.id
+    if filtros['lote']:
+        lotes_asignados_query = lotes_asignados_query.filter(
+            lote_ubicacion__lote__numero_lote__icontains=filtros['lote']
+        )
 
-            if pedido_key not in lotes_dict[lote_key]['pedidos']:
-                lotes_dict[lote_key]['pedidos'][pedido_key] = {
-                    'propuesta_id': propuesta.id,
-                    'solicitud_folio': solicitud.observaciones_solicitud or solicitud.folio,
-                    'institucion_solicitante': solicitud.institucion_solicitante.denominacion,
-                    'estado_propuesta': propuesta.get_estado_display(),
-                    'fecha_generacion': propuesta.fecha_generacion,
-                    'cantidad_total_asignada': 0,
-                    'cantidad_total_surtida': 0,
-                    'cantidad_pendiente_surtir': 0,
-                }
+    if filtros['folio']:
+        lotes_asignados_query = lotes_asignados_query.filter(
+            Q(item_propuesta__propuesta__solicitud__observaciones_solicitud__icontains=filtros['folio']) |
+            Q(item_propuesta__propuesta__solicitud__folio__icontains=filtros['folio'])
+        )
 
-            lotes_dict[lote_key]['pedidos'][pedido_key]['cantidad_total_asignada'] += (
-                lote_asignado.cantidad_asignada
+    if filtros['fecha_desde']:
+        try:
+            fecha_desde = datetime.strptime(filtros['fecha_desde'], '%Y-%m-%d').date()
+            lotes_asignados_query = lotes_asignados_query.filter(
+                item_propuesta__propuesta__fecha_generacion__date__gte=fecha_desde
             )
-            if lote_asignado.surtido:
-                lotes_dict[lote_key]['pedidos'][pedido_key]['cantidad_total_surtida'] += (
-                    lote_asignado.cantidad_asignada
-                )
+        except ValueError:
+            pass
 
-            lotes_dict[lote_key]['pedidos'][pedido_key]['cantidad_pendiente_surtir'] = max(
-                0,
-                lotes_dict[lote_key]['pedidos'][pedido_key]['cantidad_total_asignada']
-                - lotes_dict[lote_key]['pedidos'][pedido_key]['cantidad_total_surtida'],
+    if filtros['fecha_hasta']:
+        try:
+            fecha_hasta = datetime.strptime(filtros['fecha_hasta'], '%Y-%m-%d').date()
+            lotes_asignados_query = lotes_asignados_query.filter(
+                item_propuesta__propuesta__fecha_generacion__date__lte=fecha_hasta
             )
+        except ValueError:
+            pass
 
-        except Exception as e:
-            logger.error(f"Error procesando lote asignado: {str(e)}")
+    if filtros['estado']:
+        lotes_asignados_query = lotes_asignados_query.filter(
+            item_propuesta__propuesta__estado=filtros['estado']
+        )
 
-    datos_lotes = []
-    for lote_key, lote_data in lotes_dict.items():
-        lote_data['pedidos'] = list(lote_data['pedidos'].values())
-        lote_data['total_pedidos'] = len(lote_data['pedidos'])
-        lote_data['total_cantidad_asignada'] = sum(
-            p['cantidad_total_asignada'] for p in lote_data['pedidos']
+    return lotes_asignados_query
+
+
+def _agrupar_lotes_pedidos(lotes_asignados_query):
+    """
+    Agrupa asignaciones por lote y por propuesta/pedido en dos consultas:
+
+    - Rollup lote × propuesta: ``values(lote, propuesta + datos del pedido)`` con
+      ``Sum(cantidad_asignada)`` total y ``Sum(..., filter=surtido)``; el pendiente se deriva.
+    - Metadatos de los lotes involucrados (producto, institución) con su reserva activa.
+
+    Reserva del lote: suma de LoteAsignado con surtido=False (misma regla que
+    editar propuesta / reportes de reservas), leída del libro ``LoteUbicacion.reserva_activa``.
+    No usa el campo Lote.cantidad_reservada. Existencia física: Lote.cantidad_disponible
+    (mismo criterio que el reporte de existencias, no la suma directa de ubicaciones).
+    """
+    estados = dict(PropuestaPedido.ESTADO_CHOICES)
+    rollup = (
+        lotes_asignados_query.order_by()
+        .values(
+            'lote_ubicacion__lote_id',
+            'item_propuesta__propuesta_id',
+            'item_propuesta__propuesta__estado',
+            'item_propuesta__propuesta__fecha_generacion',
+            'item_propuesta__propuesta__solicitud__folio',
+            'item_propuesta__propuesta__solicitud__observaciones_solicitud',
+            'item_propuesta__propuesta__solicitud__institucion_solicitante__denominacion',
         )
-        lote_data['total_cantidad_surtida'] = sum(
-            p['cantidad_total_surtida'] for p in lote_data['pedidos']
+        .annotate(
+            asignada=Sum('cantidad_asignada'),
+            surtida=Coalesce(Sum('cantidad_asignada', filter=Q(surtido=True)), 0),
         )
-        datos_lotes.append(lote_data)
+        .order_by('lote_ubicacion__lote_id', 'item_propuesta__propuesta__fecha_generacion', 'item_propuesta__propuesta_id')
+    )
 
-    datos_lotes.sort(key=lambda x: x['numero_lote'])
+    pedidos_por_lote = {}
+    for fila in rollup:
+        pedidos_por_lote.setdefault(fila['lote_ubicacion__lote_id'], []).append({
+            'propuesta_id': fila['item_propuesta__propuesta_id'],
+            'solicitud_folio': (
+                fila['item_propuesta__propuesta__solicitud__observaciones_solicitud']
+                or fila['item_propuesta__propuesta__solicitud__folio']
+            ),
+            'institucion_solicitante': fila['item_propuesta__propuesta__solicitud__institucion_solicitante__denominacion'],
+            'estado_propuesta': estados.get(fila['item_propuesta__propuesta__estado'], fila['item_propuesta__propuesta__estado']),
+            'fecha_generacion': fila['item_propuesta__propuesta__fecha_generacion'],
+            'cantidad_total_asignada': fila['asignada'],
+            'cantidad_total_surtida': fila['surtida'],
+            'cantidad_pendiente_surtir': max(0, fila['asignada'] - fila['surtida']),
+        })
+    if not pedidos_por_lote:
+        return []
+
+    lotes = (
+        Lote.objects.filter(pk__in=pedidos_por_lote)
+        .annotate(reserva_activa_total=Coalesce(Subquery(subquery_reserva_activa_lote()), 0))
+        .values(
+            'id', 'producto__clave_cnis', 'producto__descripcion', 'numero_lote',
+            'institucion__denominacion', 'cantidad_disponible', 'reserva_activa_total',
+            'fecha_caducidad', 'precio_unitario', 'valor_total',
+        )
+        .order_by('numero_lote', 'id')
+    )
+
+    datos_lotes = []
+    for lote in lotes:
+        disp = int(lote['cantidad_disponible'] or 0)
+        reserva_desde_pedidos = lote['reserva_activa_total']
+        pedidos = pedidos_por_lote[lote['id']]
+        datos_lotes.append({
+            'lote_id': lote['id'],
+            'clave': lote['producto__clave_cnis'],
+            'descripcion': lote['producto__descripcion'],
+            'numero_lote': lote['numero_lote'],
+            'institucion': lote['institucion__denominacion'] or 'N/A',
+            'cantidad_disponible': disp,
+            'cantidad_reservada': reserva_desde_pedidos,
+            'cantidad_neta': max(0, disp - reserva_desde_pedidos),
+            'sobre_reserva': reserva_desde_pedidos > disp,
+            'deficit_unidades': max(0, reserva_desde_pedidos - disp),
+            'fecha_caducidad': lote['fecha_caducidad'],
+            'precio_unitario': lote['precio_unitario'],
+            'valor_total': lote['valor_total'],
+            'pedidos': pedidos,
+            'total_pedidos': len(pedidos),
+            'total_cantidad_asignada': sum(p['cantidad_total_asignada'] for p in pedidos),
+            'total_cantidad_surtida': sum(p['cantidad_total_surtida'] for p in pedidos),
+        })
     return datos_lotes
 
 
@@ -129,64 +177,8 @@ def reporte_lote_pedidos(request):
     """
     
     # Obtener parámetros de filtro
-    filtro_clave = request.GET.get('clave', '').strip()
-    filtro_lote = request.GET.get('lote', '').strip()
-    filtro_folio = request.GET.get('folio', '').strip()
-    filtro_fecha_desde = request.GET.get('fecha_desde', '').strip()
-    filtro_fecha_hasta = request.GET.get('fecha_hasta', '').strip()
-    filtro_estado = request.GET.get('estado', '').strip()
-    
-    # Obtener todos los lotes asignados en pedidos (excluir los que ya fueron surtidos)
-    lotes_asignados_query = LoteAsignado.objects.select_related(
-        'lote_ubicacion__lote__producto',
-        'lote_ubicacion__lote__institucion',
-        'item_propuesta__propuesta__solicitud',
-        'item_propuesta__propuesta',
-        'item_propuesta__producto'
-    ).filter(surtido=False)  # Excluir asignaciones ya surtidas
-    
-    # Aplicar filtros
-    if filtro_clave:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            Q(lote_ubicacion__lote__producto__clave_cnis__icontains=filtro_clave) |
-            Q(lote_ubicacion__lote__producto__descripcion__icontains=filtro_clave)
-        )
-    
-    if filtro_lote:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            lote_ubicacion__lote__numero_lote__icontains=filtro_lote
-        )
-    
-    if filtro_folio:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            Q(item_propuesta__propuesta__solicitud__observaciones_solicitud__icontains=filtro_folio) |
-            Q(item_propuesta__propuesta__solicitud__folio__icontains=filtro_folio)
-        )
-    
-    if filtro_fecha_desde:
-        try:
-            fecha_desde = datetime.strptime(filtro_fecha_desde, '%Y-%m-%d').date()
-            lotes_asignados_query = lotes_asignados_query.filter(
-                item_propuesta__propuesta__fecha_generacion__date__gte=fecha_desde
-            )
-        except ValueError:
-            pass
-    
-    if filtro_fecha_hasta:
-        try:
-            fecha_hasta = datetime.strptime(filtro_fecha_hasta, '%Y-%m-%d').date()
-            lotes_asignados_query = lotes_asignados_query.filter(
-                item_propuesta__propuesta__fecha_generacion__date__lte=fecha_hasta
-            )
-        except ValueError:
-            pass
-    
-    if filtro_estado:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            item_propuesta__propuesta__estado=filtro_estado
-        )
-
-    datos_lotes = _agrupar_lotes_pedidos(lotes_asignados_query)
+    filtros = {nombre: request.GET.get(nombre, '').strip() for nombre in FILTROS_LOTE_PEDIDOS}
+    datos_lotes = _agrupar_lotes_pedidos(_asignaciones_filtradas(filtros))
 
     # Paginación
     paginator = Paginator(datos_lotes, 20)  # 20 lotes por página
@@ -205,12 +197,12 @@ def reporte_lote_pedidos(request):
     # Contexto
     context = {
         'page_title': 'Reporte de Lotes y Pedidos Asociados',
-        'filtro_clave': filtro_clave,
-        'filtro_lote': filtro_lote,
-        'filtro_folio': filtro_folio,
-        'filtro_fecha_desde': filtro_fecha_desde,
-        'filtro_fecha_hasta': filtro_fecha_hasta,
-        'filtro_estado': filtro_estado,
+        'filtro_clave': filtros['clave'],
+        'filtro_lote': filtros['lote'],
+        'filtro_folio': filtros['folio'],
+        'filtro_fecha_desde': filtros['fecha_desde'],
+        'filtro_fecha_hasta': filtros['fecha_hasta'],
+        'filtro_estado': filtros['estado'],
         'estados_propuesta': estados_propuesta,
         'page_obj': lotes_pagina,
         'paginator': paginator,
@@ -227,66 +219,12 @@ def exportar_lote_pedidos_excel(request):
     Usa la misma lógica de filtrado que la vista principal.
     """
     
-    # Obtener parámetros de filtro (GET o POST)
-    filtro_clave = request.POST.get('clave', request.GET.get('clave', '')).strip()
-    filtro_lote = request.POST.get('lote', request.GET.get('lote', '')).strip()
-    filtro_folio = request.POST.get('folio', request.GET.get('folio', '')).strip()
-    filtro_fecha_desde = request.POST.get('fecha_desde', request.GET.get('fecha_desde', '')).strip()
-    filtro_fecha_hasta = request.POST.get('fecha_hasta', request.GET.get('fecha_hasta', '')).strip()
-    filtro_estado = request.POST.get('estado', request.GET.get('estado', '')).strip()
-    
-    # Obtener todos los lotes asignados en pedidos (misma lógica que la vista)
-    # Excluir los que ya fueron surtidos
-    lotes_asignados_query = LoteAsignado.objects.select_related(
-        'lote_ubicacion__lote__producto',
-        'lote_ubicacion__lote__institucion',
-        'item_propuesta__propuesta__solicitud',
-        'item_propuesta__propuesta',
-        'item_propuesta__producto'
-    ).filter(surtido=False)  # Excluir asignaciones ya surtidas
-    
-    # Aplicar filtros (misma lógica que la vista)
-    if filtro_clave:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            Q(lote_ubicacion__lote__producto__clave_cnis__icontains=filtro_clave) |
-            Q(lote_ubicacion__lote__producto__descripcion__icontains=filtro_clave)
-        )
-    
-    if filtro_lote:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            lote_ubicacion__lote__numero_lote__icontains=filtro_lote
-        )
-    
-    if filtro_folio:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            Q(item_propuesta__propuesta__solicitud__observaciones_solicitud__icontains=filtro_folio) |
-            Q(item_propuesta__propuesta__solicitud__folio__icontains=filtro_folio)
-        )
-    
-    if filtro_fecha_desde:
-        try:
-            fecha_desde = datetime.strptime(filtro_fecha_desde, '%Y-%m-%d').date()
-            lotes_asignados_query = lotes_asignados_query.filter(
-                item_propuesta__propuesta__fecha_generacion__date__gte=fecha_desde
-            )
-        except ValueError:
-            pass
-    
-    if filtro_fecha_hasta:
-        try:
-            fecha_hasta = datetime.strptime(filtro_fecha_hasta, '%Y-%m-%d').date()
-            lotes_asignados_query = lotes_asignados_query.filter(
-                item_propuesta__propuesta__fecha_generacion__date__lte=fecha_hasta
-            )
-        except ValueError:
-            pass
-    
-    if filtro_estado:
-        lotes_asignados_query = lotes_asignados_query.filter(
-            item_propuesta__propuesta__estado=filtro_estado
-        )
-
-    datos_lotes = _agrupar_lotes_pedidos(lotes_asignados_query)
+    # Obtener parámetros de filtro (GET o POST); misma consulta y agrupación que la vista
+    filtros = {
+        nombre: request.POST.get(nombre, request.GET.get(nombre, '')).strip()
+        for nombre in FILTROS_LOTE_PEDIDOS
+    }
+    datos_lotes = _agrupar_lotes_pedidos(_asignaciones_filtradas(filtros))
 
     # Crear workbook
     wb = Workbook()
@@ -1,18 +1,16 @@
 """
 Reporte de Ubicaciones Vacías en Almacenes
 
-Muestra todas las ubicaciones que no tienen lotes asignados.
-Permite filtrar por almacén e institución.
+Muestra todas las ubicaciones que no tienen lotes asignados y la ocupación por rack.
+Permite filtrar por almacén e institución; filtros y paginación van en SQL (ocupacion_utils).
 Exporta a Excel y PDF.
 """
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
 from django.http import HttpResponse
-from django.db.models import Q, Count
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
@@ -20,237 +18,117 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib import colors
 from io import BytesIO
 
-from .models import UbicacionAlmacen, LoteUbicacion, Almacen, Institucion
+from .exportacion_utils import EstiloExportacion, respuesta_exportacion
+from .models import UbicacionAlmacen, Almacen, Institucion
+from .ocupacion_utils import resumen_ocupacion, ubicaciones_vacias as ubicaciones_vacias_qs
+
+
+def _filtros(request):
+    """Filtros del request: (valores para el template, kwargs para ocupacion_utils)."""
+    valores = {
+        'filtro_codigo': request.GET.get('codigo', '').strip(),
+        'filtro_almacen': request.GET.get('almacen', ''),
+        'filtro_institucion': request.GET.get('institucion', ''),
+        'filtro_estado': request.GET.get('estado', ''),
+    }
+    filtros = {
+        'codigo': valores['filtro_codigo'],
+        'almacen_id': int(valores['filtro_almacen']) if valores['filtro_almacen'].isdigit() else None,
+        'institucion_id': int(valores['filtro_institucion']) if valores['filtro_institucion'].isdigit() else None,
+        'estado': valores['filtro_estado'],
+    }
+    return valores, filtros
+
+
+def _filas_vacias(ubicaciones):
+    """Filas para Excel/PDF leídas con values_list (sin instanciar modelos)."""
+    estados = dict(UbicacionAlmacen.ESTADOS_UBICACION)
+    for codigo, descripcion, nivel, pasillo, rack, seccion, almacen, institucion, estado, activo in (
+        ubicaciones.values_list(
+            'codigo', 'descripcion', 'nivel', 'pasillo', 'rack', 'seccion',
+            'almacen__nombre', 'almacen__institucion__denominacion', 'estado', 'activo',
+        ).iterator(chunk_size=2000)
+    ):
+        yield [
+            codigo,
+            descripcion or '-',
+            nivel or '-',
+            pasillo or '-',
+            rack or '-',
+            seccion or '-',
+            almacen or '-',
+            institucion or '-',
+            estados.get(estado, estado),
+            'Sí' if activo else 'No',
+        ]
 
 
 @login_required
 def reporte_ubicaciones_vacias(request):
     """
     Reporte de ubicaciones vacías (sin lotes asignados).
-    Muestra ubicaciones que no tienen ningún lote registrado.
+    Muestra ubicaciones que no tienen ningún lote registrado, y la ocupación por rack
+    de las ubicaciones filtradas (ver ocupacion_utils).
     """
-    
-    # Obtener todas las ubicaciones
-    todas_ubicaciones = UbicacionAlmacen.objects.select_related(
-        'almacen',
-        'almacen__institucion'
-    ).all()
-    
-    # Ubicaciones vacías (sin lotes asignados)
-    ubicaciones_vacias = []
-    
-    for ubicacion in todas_ubicaciones:
-        # Verificar si tiene lotes asignados
-        tiene_lotes = LoteUbicacion.objects.filter(ubicacion=ubicacion).exists()
-        
-        if not tiene_lotes:
-            ubicaciones_vacias.append({
-                'id': ubicacion.id,
-                'codigo': ubicacion.codigo,
-                'descripcion': ubicacion.descripcion or '-',
-                'nivel': ubicacion.nivel or '-',
-                'pasillo': ubicacion.pasillo or '-',
-                'rack': ubicacion.rack or '-',
-                'seccion': ubicacion.seccion or '-',
-                'almacen': ubicacion.almacen.nombre if ubicacion.almacen else '-',
-                'almacen_id': ubicacion.almacen.id if ubicacion.almacen else None,
-                'institucion': ubicacion.almacen.institucion.denominacion if ubicacion.almacen and ubicacion.almacen.institucion else '-',
-                'institucion_id': ubicacion.almacen.institucion.id if ubicacion.almacen and ubicacion.almacen.institucion else None,
-                'estado': ubicacion.get_estado_display() if hasattr(ubicacion, 'get_estado_display') else ubicacion.estado,
-                'activo': 'Sí' if ubicacion.activo else 'No',
-            })
-    
-    # Filtros
-    filtro_codigo = request.GET.get('codigo', '').strip()
-    filtro_almacen = request.GET.get('almacen', '')
-    filtro_institucion = request.GET.get('institucion', '')
-    filtro_estado = request.GET.get('estado', '')
-    
-    # Aplicar filtros
-    if filtro_codigo:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if filtro_codigo.lower() in u['codigo'].lower()]
-    
-    if filtro_almacen:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['almacen_id'] == int(filtro_almacen)]
-    
-    if filtro_institucion:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['institucion_id'] == int(filtro_institucion)]
-    
-    if filtro_estado:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['estado'] == filtro_estado]
-    
-    # Paginación
-    from django.core.paginator import Paginator
+    valores, filtros = _filtros(request)
+
+    # Anti-join y filtros en SQL; el paginador hace COUNT + LIMIT/OFFSET.
+    ubicaciones_vacias = ubicaciones_vacias_qs(**filtros)
     paginator = Paginator(ubicaciones_vacias, 25)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-    
+
     # Obtener opciones de filtro
     instituciones = Institucion.objects.all().order_by('denominacion')
     almacenes = Almacen.objects.all().order_by('nombre')
-    
-    # Estados disponibles
-    estados = [
-        ('disponible', 'Disponible'),
-        ('ocupada', 'Ocupada'),
-        ('bloqueada', 'Bloqueada'),
-        ('cuarentena', 'Cuarentena'),
-        ('caducados', 'Caducados'),
-        ('devoluciones', 'Devoluciones'),
-    ]
-    
+
     context = {
         'page_obj': page_obj,
-        'total_registros': len(ubicaciones_vacias),
+        'total_registros': paginator.count,
+        'resumen_ocupacion': resumen_ocupacion(**filtros),
         'instituciones': instituciones,
         'almacenes': almacenes,
-        'estados': estados,
-        'filtro_codigo': filtro_codigo,
-        'filtro_almacen': filtro_almacen,
-        'filtro_institucion': filtro_institucion,
-        'filtro_estado': filtro_estado,
+        'estados': UbicacionAlmacen.ESTADOS_UBICACION,
+        **valores,
     }
-    
+
     return render(request, 'inventario/reporte_ubicaciones_vacias.html', context)
 
 
 @login_required
 def exportar_ubicaciones_vacias_excel(request):
     """
-    Exporta el reporte de ubicaciones vacías a Excel.
+    Exporta el reporte de ubicaciones vacías a Excel (o CSV con ``?formato=csv``).
     """
-    
-    # Obtener todas las ubicaciones
-    todas_ubicaciones = UbicacionAlmacen.objects.select_related(
-        'almacen',
-        'almacen__institucion'
-    ).all()
-    
-    # Ubicaciones vacías
-    ubicaciones_vacias = []
-    
-    for ubicacion in todas_ubicaciones:
-        tiene_lotes = LoteUbicacion.objects.filter(ubicacion=ubicacion).exists()
-        
-        if not tiene_lotes:
-            ubicaciones_vacias.append({
-                'codigo': ubicacion.codigo,
-                'descripcion': ubicacion.descripcion or '-',
-                'nivel': ubicacion.nivel or '-',
-                'pasillo': ubicacion.pasillo or '-',
-                'rack': ubicacion.rack or '-',
-                'seccion': ubicacion.seccion or '-',
-                'almacen': ubicacion.almacen.nombre if ubicacion.almacen else '-',
-                'institucion': ubicacion.almacen.institucion.denominacion if ubicacion.almacen and ubicacion.almacen.institucion else '-',
-                'estado': ubicacion.get_estado_display() if hasattr(ubicacion, 'get_estado_display') else ubicacion.estado,
-                'activo': 'Sí' if ubicacion.activo else 'No',
-            })
-    
-    # Aplicar filtros
-    filtro_codigo = request.GET.get('codigo', '').strip()
-    filtro_almacen = request.GET.get('almacen', '')
-    filtro_institucion = request.GET.get('institucion', '')
-    filtro_estado = request.GET.get('estado', '')
-    
-    if filtro_codigo:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if filtro_codigo.lower() in u['codigo'].lower()]
-    
-    if filtro_almacen:
-        almacen_obj = Almacen.objects.get(id=int(filtro_almacen))
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['almacen'] == almacen_obj.nombre]
-    
-    if filtro_institucion:
-        institucion_obj = Institucion.objects.get(id=int(filtro_institucion))
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['institucion'] == institucion_obj.denominacion]
-    
-    if filtro_estado:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['estado'] == filtro_estado]
-    
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Ubicaciones Vacías"
-    
-    # Estilos
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    total_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-    total_font = Font(bold=True, size=11)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Encabezados
-    headers = [
-        'CÓDIGO UBICACIÓN',
-        'DESCRIPCIÓN',
-        'NIVEL',
-        'PASILLO',
-        'RACK',
-        'SECCIÓN',
-        'ALMACÉN',
-        'INSTITUCIÓN',
-        'ESTADO',
-        'ACTIVO'
-    ]
-    
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = border
-    
-    # Datos
-    for row, ubicacion in enumerate(ubicaciones_vacias, 2):
-        ws.cell(row=row, column=1).value = ubicacion['codigo']
-        ws.cell(row=row, column=2).value = ubicacion['descripcion']
-        ws.cell(row=row, column=3).value = ubicacion['nivel']
-        ws.cell(row=row, column=4).value = ubicacion['pasillo']
-        ws.cell(row=row, column=5).value = ubicacion['rack']
-        ws.cell(row=row, column=6).value = ubicacion['seccion']
-        ws.cell(row=row, column=7).value = ubicacion['almacen']
-        ws.cell(row=row, column=8).value = ubicacion['institucion']
-        ws.cell(row=row, column=9).value = ubicacion['estado']
-        ws.cell(row=row, column=10).value = ubicacion['activo']
-        
-        for col in range(1, 11):
-            ws.cell(row=row, column=col).border = border
-            ws.cell(row=row, column=col).alignment = Alignment(horizontal='left', vertical='center')
-    
-    # Fila de totales
-    total_row = len(ubicaciones_vacias) + 2
-    ws.cell(row=total_row, column=1).value = "TOTAL"
-    ws.cell(row=total_row, column=1).font = total_font
-    ws.cell(row=total_row, column=1).fill = total_fill
-    ws.cell(row=total_row, column=2).value = len(ubicaciones_vacias)
-    ws.cell(row=total_row, column=2).font = total_font
-    ws.cell(row=total_row, column=2).fill = total_fill
-    
-    # Ajustar ancho de columnas
-    ws.column_dimensions['A'].width = 18
-    ws.column_dimensions['B'].width = 25
-    ws.column_dimensions['C'].width = 12
-    ws.column_dimensions['D'].width = 12
-    ws.column_dimensions['E'].width = 12
-    ws.column_dimensions['F'].width = 12
-    ws.column_dimensions['G'].width = 18
-    ws.column_dimensions['H'].width = 20
-    ws.column_dimensions['I'].width = 15
-    ws.column_dimensions['J'].width = 10
-    
-    # Crear respuesta HTTP
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    _, filtros = _filtros(request)
+    total = {'n': 0}
+
+    def filas():
+        for fila in _filas_vacias(ubicaciones_vacias_qs(**filtros)):
+            total['n'] += 1
+            yield fila
+
+    return respuesta_exportacion(
+        request,
+        filas(),
+        [
+            'CÓDIGO UBICACIÓN',
+            'DESCRIPCIÓN',
+            'NIVEL',
+            'PASILLO',
+            'RACK',
+            'SECCIÓN',
+            'ALMACÉN',
+            'INSTITUCIÓN',
+            'ESTADO',
+            'ACTIVO'
+        ],
+        'ubicaciones_vacias',
+        titulo_hoja='Ubicaciones Vacías',
+        anchos=[18, 25, 12, 12, 12, 12, 18, 20, 15, 10],
+        estilo=EstiloExportacion(fondo_encabezado='4472C4', bordes=True, fondo_totales='E2EFDA'),
+        totales=lambda: ['TOTAL', total['n']],
     )
-    response['Content-Disposition'] = f'attachment; filename="ubicaciones_vacias_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
-    
-    wb.save(response)
-    return response
 
 
 @login_required
@@ -258,53 +136,9 @@ def exportar_ubicaciones_vacias_pdf(request):
     """
     Exporta el reporte de ubicaciones vacías a PDF.
     """
-    
-    # Obtener todas las ubicaciones
-    todas_ubicaciones = UbicacionAlmacen.objects.select_related(
-        'almacen',
-        'almacen__institucion'
-    ).all()
-    
-    # Ubicaciones vacías
-    ubicaciones_vacias = []
-    
-    for ubicacion in todas_ubicaciones:
-        tiene_lotes = LoteUbicacion.objects.filter(ubicacion=ubicacion).exists()
-        
-        if not tiene_lotes:
-            ubicaciones_vacias.append({
-                'codigo': ubicacion.codigo,
-                'descripcion': ubicacion.descripcion or '-',
-                'nivel': ubicacion.nivel or '-',
-                'pasillo': ubicacion.pasillo or '-',
-                'rack': ubicacion.rack or '-',
-                'seccion': ubicacion.seccion or '-',
-                'almacen': ubicacion.almacen.nombre if ubicacion.almacen else '-',
-                'institucion': ubicacion.almacen.institucion.denominacion if ubicacion.almacen and ubicacion.almacen.institucion else '-',
-                'estado': ubicacion.get_estado_display() if hasattr(ubicacion, 'get_estado_display') else ubicacion.estado,
-                'activo': 'Sí' if ubicacion.activo else 'No',
-            })
-    
-    # Aplicar filtros
-    filtro_codigo = request.GET.get('codigo', '').strip()
-    filtro_almacen = request.GET.get('almacen', '')
-    filtro_institucion = request.GET.get('institucion', '')
-    filtro_estado = request.GET.get('estado', '')
-    
-    if filtro_codigo:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if filtro_codigo.lower() in u['codigo'].lower()]
-    
-    if filtro_almacen:
-        almacen_obj = Almacen.objects.get(id=int(filtro_almacen))
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['almacen'] == almacen_obj.nombre]
-    
-    if filtro_institucion:
-        institucion_obj = Institucion.objects.get(id=int(filtro_institucion))
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['institucion'] == institucion_obj.denominacion]
-    
-    if filtro_estado:
-        ubicaciones_vacias = [u for u in ubicaciones_vacias if u['estado'] == filtro_estado]
-    
+    _, filtros = _filtros(request)
+    ubicaciones_vacias = list(_filas_vacias(ubicaciones_vacias_qs(**filtros)))
+
     # Crear PDF
     buffer = BytesIO()
     doc = SimpleDocTemplate(
@@ -360,19 +194,7 @@ def exportar_ubicaciones_vacias_pdf(request):
     ]
     data = [headers]
     
-    for ubicacion in ubicaciones_vacias:
-        data.append([
-            ubicacion['codigo'],
-            ubicacion['descripcion'],
-            ubicacion['nivel'],
-            ubicacion['pasillo'],
-            ubicacion['rack'],
-            ubicacion['seccion'],
-            ubicacion['almacen'],
-            ubicacion['institucion'],
-            ubicacion['estado'],
-            ubicacion['activo'],
-        ])
+    data.extend(ubicaciones_vacias)
     
     table = Table(data, colWidths=[1.2*inch, 1.5*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch, 1.2*inch, 1.5*inch, 1*inch, 0.7*inch])
     
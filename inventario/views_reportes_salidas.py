@@ -7,7 +7,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse
 from django.db.models import Sum, Count, Q, F, DecimalField
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
@@ -15,16 +15,18 @@ from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from datetime import timedelta, datetime
 import json
 import logging
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
 
 from .models import (
     MovimientoInventario, Lote, Institucion, Almacen, Producto, LoteUbicacion
 )
 from .pedidos_models import PropuestaPedido, ItemPropuesta, LoteAsignado, SolicitudPedido
 from .decorators_roles import requiere_rol
-from .propuesta_utils import liberar_cantidad_lote
+from .exportacion_utils import TAMANO_LOTE_ITERATOR, EstiloExportacion, respuesta_exportacion
+from .propuesta_utils import (
+    liberar_cantidad_lote,
+    totales_reserva_activa_por_lote_ids,
+    totales_reserva_activa_por_lote_ubicacion_ids,
+)
 from django.db import transaction
 
 logger = logging.getLogger(__name__)
@@ -827,23 +829,6 @@ def exportar_salidas_surtidas_excel(request):
     for i, d in enumerate(datos_reporte, 1):
         d['partida'] = i
     
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Salidas Surtidas"
-    
-    # Estilos
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Encabezados
     headers = [
         'PARTIDA', 'CLAVE (CNIS)', 'DESCRIPCION', 'UNIDAD DE MEDIDA', 'LOTE',
         'CADUCIDAD', 'CANTIDAD SOLICITADA', 'CANT. PREVIA AL SURTIMIENTO', 'CANTIDAD SURTIDA', 'OBSERVACIONES',
@@ -851,58 +836,22 @@ def exportar_salidas_surtidas_excel(request):
         'FECHA ENTREGA PROGRAMADA', 'STATUS', 'REMISION DE INGRESO',
         'ORDEN DE REPOSICION', 'USUARIO'
     ]
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = center_alignment
-        cell.border = border
-    
-    # Datos
-    for row_num, dato in enumerate(datos_reporte, 2):
-        ws.cell(row=row_num, column=1, value=dato['partida'])
-        ws.cell(row=row_num, column=2, value=dato['clave_cnis'])
-        ws.cell(row=row_num, column=3, value=dato['descripcion'])
-        ws.cell(row=row_num, column=4, value=dato['unidad_medida'])
-        ws.cell(row=row_num, column=5, value=dato['lote'])
-        ws.cell(row=row_num, column=6, value=dato['caducidad'])
-        ws.cell(row=row_num, column=7, value=dato['cantidad_solicitada'])
-        ws.cell(row=row_num, column=8, value=dato.get('cantidad_previa'))
-        ws.cell(row=row_num, column=9, value=dato['cantidad_surtida'])
-        ws.cell(row=row_num, column=10, value=dato['observaciones'])
-        ws.cell(row=row_num, column=11, value=dato['recurso'])
-        ws.cell(row=row_num, column=12, value=dato['destino'])
-        ws.cell(row=row_num, column=13, value=dato['ubicacion'])
-        ws.cell(row=row_num, column=14, value=dato['fecha_captura'])
-        ws.cell(row=row_num, column=15, value=dato['folio'])
-        ws.cell(row=row_num, column=16, value=dato['fecha_entrega_programada'])
-        ws.cell(row=row_num, column=17, value=dato['status'])
-        ws.cell(row=row_num, column=18, value=dato['remision_ingreso'])
-        ws.cell(row=row_num, column=19, value=dato['orden_reposicion'])
-        ws.cell(row=row_num, column=20, value=dato['usuario'])
-        
-        # Aplicar bordes
-        for col_num in range(1, 21):
-            ws.cell(row=row_num, column=col_num).border = border
-    
-    # Ajustar ancho de columnas
-    column_widths = [10, 15, 50, 15, 15, 12, 18, 22, 18, 30, 30, 25, 15, 18, 20, 22, 15, 20, 20, 25]
-    for col_num, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col_num)].width = width
-    
-    # Congelar primera fila
-    ws.freeze_panes = 'A2'
-    
-    # Preparar respuesta
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    campos = [
+        'partida', 'clave_cnis', 'descripcion', 'unidad_medida', 'lote',
+        'caducidad', 'cantidad_solicitada', 'cantidad_previa', 'cantidad_surtida', 'observaciones',
+        'recurso', 'destino', 'ubicacion', 'fecha_captura', 'folio',
+        'fecha_entrega_programada', 'status', 'remision_ingreso',
+        'orden_reposicion', 'usuario',
+    ]
+    return respuesta_exportacion(
+        request,
+        ([dato.get(campo) for campo in campos] for dato in datos_reporte),
+        headers,
+        'reporte_salidas_surtidas',
+        titulo_hoja='Salidas Surtidas',
+        anchos=[10, 15, 50, 15, 15, 12, 18, 22, 18, 30, 30, 25, 15, 18, 20, 22, 15, 20, 20, 25],
+        estilo=EstiloExportacion(fondo_encabezado='366092', bordes=True),
     )
-    filename = f"reporte_salidas_surtidas_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
 
 
 # ============================================================
@@ -912,21 +861,17 @@ def exportar_salidas_surtidas_excel(request):
 def _mapas_totales_reservas_activas():
     """
     Totales por lote y por LoteUbicacion (surtido=False) en solo 2 consultas SQL.
-    Mismo criterio que _reserva_real_lote / _reserva_real_lote_ubicacion en propuesta_utils.
+    Mismo criterio que _reserva_real_lote / _reserva_real_lote_ubicacion en propuesta_utils:
+    se leen del libro LoteUbicacion.reserva_activa.
     """
-    qs = LoteAsignado.objects.filter(surtido=False)
+    qs = LoteUbicacion.objects.filter(reserva_activa__gt=0)
     por_lote = {
         pk: (total or 0)
-        for pk, total in qs.values('lote_ubicacion__lote_id').annotate(
-            total=Sum('cantidad_asignada')
-        ).values_list('lote_ubicacion__lote_id', 'total')
-    }
-    por_lu = {
-        pk: (total or 0)
-        for pk, total in qs.values('lote_ubicacion_id').annotate(
-            total=Sum('cantidad_asignada')
-        ).values_list('lote_ubicacion_id', 'total')
+        for pk, total in qs.order_by().values('lote_id').annotate(
+            total=Sum('reserva_activa')
+        ).values_list('lote_id', 'total')
     }
+    por_lu = dict(qs.values_list('id', 'reserva_activa'))
     return por_lote, por_lu
 
 
@@ -935,27 +880,10 @@ def _totales_reservas_para_ids(lote_ids, lu_ids):
     Mismos totales globales por lote / LoteUbicacion, pero solo para los IDs indicados.
     Dos consultas acotadas (ideal para la página HTML con ~50 filas).
     """
-    totales_lote = {}
-    if lote_ids:
-        totales_lote = {
-            pk: (total or 0)
-            for pk, total in LoteAsignado.objects.filter(
-                surtido=False, lote_ubicacion__lote_id__in=lote_ids
-            ).values('lote_ubicacion__lote_id').annotate(
-                total=Sum('cantidad_asignada')
-            ).values_list('lote_ubicacion__lote_id', 'total')
-        }
-    totales_lu = {}
-    if lu_ids:
-        totales_lu = {
-            pk: (total or 0)
-            for pk, total in LoteAsignado.objects.filter(
-                surtido=False, lote_ubicacion_id__in=lu_ids
-            ).values('lote_ubicacion_id').annotate(
-                total=Sum('cantidad_asignada')
-            ).values_list('lote_ubicacion_id', 'total')
-        }
-    return totales_lote, totales_lu
+    return (
+        totales_reserva_activa_por_lote_ids(lote_ids),
+        totales_reserva_activa_por_lote_ubicacion_ids(lu_ids),
+    )
 
 
 # Ventana por defecto y máxima para reporte de reservas (reduce carga en BD/CPU).
@@ -1343,52 +1271,41 @@ def exportar_reservas_excel(request):
         'UBICACIÓN', 'FECHA RESERVA', 'FOLIO', 'FECHA ENTREGA PROGRAMADA', 'ESTADO PROPUESTA'
     ]
 
-    # write_only + append: evita miles de objetos Cell/Style (lo que disparaba CPU y memoria).
-    wb = Workbook(write_only=True)
-    ws = wb.create_sheet(title='Reservas', index=0)
-    ws.append(headers)
-
-    partida_counter = 1
-    for reserva in reservas.iterator(chunk_size=500):
-        propuesta = reserva.item_propuesta.propuesta
-        solicitud = propuesta.solicitud
-        producto = reserva.item_propuesta.producto
-        lote_ubicacion = reserva.lote_ubicacion
-        lote = lote_ubicacion.lote
-        ubicacion = lote_ubicacion.ubicacion
-
-        destino = ''
-        if solicitud.almacen_destino and solicitud.almacen_destino.institucion:
-            inst = solicitud.almacen_destino.institucion
-            destino = inst.nombre or inst.denominacion or ''
-
-        ws.append([
-            partida_counter,
-            producto.clave_cnis,
-            producto.descripcion,
-            producto.unidad_medida or '',
-            lote.numero_lote,
-            lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else '',
-            reserva.cantidad_asignada,
-            totales_lote.get(lote.id, 0),
-            totales_lu.get(lote_ubicacion.id, 0),
-            reserva.item_propuesta.cantidad_solicitada,
-            solicitud.observaciones_solicitud or '',
-            solicitud.institucion_solicitante.nombre if solicitud.institucion_solicitante else '',
-            destino,
-            ubicacion.codigo if ubicacion else '',
-            reserva.fecha_asignacion.strftime('%d/%m/%Y %H:%M') if reserva.fecha_asignacion else '',
-            solicitud.observaciones_solicitud or solicitud.folio,
-            solicitud.fecha_entrega_programada.strftime('%d/%m/%Y') if solicitud.fecha_entrega_programada else '',
-            propuesta.get_estado_display(),
-        ])
-        partida_counter += 1
-
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    filename = f"reporte_reservas_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-    wb.save(response)
-    return response
+    def filas():
+        partida_counter = 1
+        for reserva in reservas.iterator(chunk_size=TAMANO_LOTE_ITERATOR):
+            propuesta = reserva.item_propuesta.propuesta
+            solicitud = propuesta.solicitud
+            producto = reserva.item_propuesta.producto
+            lote_ubicacion = reserva.lote_ubicacion
+            lote = lote_ubicacion.lote
+            ubicacion = lote_ubicacion.ubicacion
+
+            destino = ''
+            if solicitud.almacen_destino and solicitud.almacen_destino.institucion:
+                inst = solicitud.almacen_destino.institucion
+                destino = inst.nombre or inst.denominacion or ''
+
+            yield [
+                partida_counter,
+                producto.clave_cnis,
+                producto.descripcion,
+                producto.unidad_medida or '',
+                lote.numero_lote,
+                lote.fecha_caducidad.strftime('%d/%m/%Y') if lote.fecha_caducidad else '',
+                reserva.cantidad_asignada,
+                totales_lote.get(lote.id, 0),
+                totales_lu.get(lote_ubicacion.id, 0),
+                reserva.item_propuesta.cantidad_solicitada,
+                solicitud.observaciones_solicitud or '',
+                solicitud.institucion_solicitante.nombre if solicitud.institucion_solicitante else '',
+                destino,
+                ubicacion.codigo if ubicacion else '',
+                reserva.fecha_asignacion.strftime('%d/%m/%Y %H:%M') if reserva.fecha_asignacion else '',
+                solicitud.observaciones_solicitud or solicitud.folio,
+                solicitud.fecha_entrega_programada.strftime('%d/%m/%Y') if solicitud.fecha_entrega_programada else '',
+                propuesta.get_estado_display(),
+            ]
+            partida_counter += 1
+
+    return respuesta_exportacion(request, filas(), headers, 'reporte_reservas', titulo_hoja='Reservas')
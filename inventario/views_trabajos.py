@@ -0,0 +1,81 @@
+"""
+Páginas de los trabajos en segundo plano: estado, avance y descarga del resultado.
+"""
+
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.views.decorators.http import require_http_methods
+
+from .models import TrabajoSegundoPlano
+from .trabajos_utils import obtener_tarea
+
+
+def _trabajo_del_usuario(request, pk):
+    trabajos = TrabajoSegundoPlano.objects.all()
+    if not request.user.is_superuser:
+        trabajos = trabajos.filter(usuario=request.user)
+    return get_object_or_404(trabajos, pk=pk)
+
+
+def _url_resultado(trabajo):
+    if trabajo.estado != 'completado':
+        return None
+    definicion = obtener_tarea(trabajo.tipo)
+    if definicion is not None and definicion.url_resultado is not None:
+        return definicion.url_resultado(trabajo)
+    if trabajo.archivo_resultado:
+        return reverse('trabajo_descargar', args=[trabajo.pk])
+    return None
+
+
+def _estado(trabajo):
+    return {
+        'id': trabajo.pk,
+        'estado': trabajo.estado,
+        'estado_display': trabajo.get_estado_display(),
+        'terminado': trabajo.terminado,
+        'progreso_actual': trabajo.progreso_actual,
+        'progreso_total': trabajo.progreso_total,
+        'progreso_mensaje': trabajo.progreso_mensaje,
+        'porcentaje': trabajo.porcentaje,
+        'mensaje_error': trabajo.mensaje_error,
+        'url_resultado': _url_resultado(trabajo),
+        'descarga': bool(trabajo.archivo_resultado),
+    }
+
+
+@login_required
+@require_http_methods(["GET"])
+def trabajo_detalle(request, pk):
+    """Página de espera: consulta el estado hasta que el trabajo termina."""
+    trabajo = _trabajo_del_usuario(request, pk)
+    context = {
+        'trabajo': trabajo,
+        'estado': _estado(trabajo),
+        'titulo': trabajo.descripcion or 'Trabajo en segundo plano',
+    }
+    return render(request, 'inventario/trabajos/detalle.html', context)
+
+
+@login_required
+@require_http_methods(["GET"])
+def trabajo_estado(request, pk):
+    """Estado y avance del trabajo en JSON."""
+    return JsonResponse(_estado(_trabajo_del_usuario(request, pk)))
+
+
+@login_required
+@require_http_methods(["GET"])
+def trabajo_descargar(request, pk):
+    """Descarga el archivo generado por el trabajo."""
+    trabajo = _trabajo_del_usuario(request, pk)
+    if trabajo.estado != 'completado' or not trabajo.archivo_resultado:
+        raise Http404('El trabajo no tiene archivo de resultado')
+    return FileResponse(
+        trabajo.archivo_resultado.open('rb'),
+        as_attachment=True,
+        filename=trabajo.nombre_resultado or None,
+        content_type=trabajo.tipo_contenido or None,
+    )
@@ -26,3 +26,15 @@ class DisableMigrations(dict):
 
 
 MIGRATION_MODULES = DisableMigrations()
+
+# Los índices con INCLUDE (solo PostgreSQL) se crean sin columnas extra en SQLite.
+SILENCED_SYSTEM_CHECKS = ["models.W040"]
+
+# LogSistema se guarda al momento (sin hilo de fondo) para que las pruebas lo vean.
+LOG_SISTEMA_ASINCRONO = False
+
+# Las notificaciones quedan en la bandeja de salida; las pruebas despachan a mano.
+NOTIFICACIONES_DESPACHO_EN_PROCESO = False
+
+# Los trabajos en segundo plano se ejecutan dentro del request (sin procesar_trabajos).
+TRABAJOS_EN_SEGUNDO_PLANO = False
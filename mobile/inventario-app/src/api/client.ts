@@ -65,6 +65,30 @@ export type LoteUbicacionRow = {
   conteo_completado: boolean;
 };
 
+export type ConteoSyncItem = {
+  clave_idempotencia: string;
+  lote_ubicacion_id: number;
+  cantidad_fisica: number;
+  fecha_caducidad?: string;
+  observaciones?: string;
+};
+export type ConteoSyncResultado = {
+  clave_idempotencia: string;
+  estado: 'aplicado' | 'duplicado' | 'error';
+  detalle?: string;
+  lote_ubicacion_id?: number;
+  movimiento_id?: number | null;
+  cantidad_anterior?: number;
+  cantidad_nueva?: number;
+  diferencia?: number;
+};
+export type ConteoSyncResponse = {
+  aplicados: number;
+  duplicados: number;
+  errores: number;
+  resultados: ConteoSyncResultado[];
+};
+
 export const api = {
   login: (username: string, password: string) =>
     request<LoginResponse>('/auth/login', {
@@ -94,6 +118,13 @@ export const api = {
       body: payload,
     }),
 
+  sincronizarConteos: (token: string, conteos: ConteoSyncItem[]) =>
+    request<ConteoSyncResponse>('/conteos/sync', {
+      method: 'POST',
+      token,
+      body: { conteos },
+    }),
+
   verificar: (token: string, loteUbicacionId: number) =>
     request(`/conteos/lotes/${loteUbicacionId}/verificar`, {
       method: 'POST',
@@ -1,5 +1,14 @@
-"""Autenticación JWT con usuarios Django."""
+"""
+Autenticación JWT con usuarios Django.
 
+El principal se resuelve con la caché de ``inventario.principal_movil_utils``: mientras la
+entrada esté vigente las peticiones de conteo no hacen consultas de autenticación.
+
+El token lleva el claim ``conteo`` (permiso validado al iniciar sesión). Con
+``MOBILE_API_CONFIAR_CLAIM_CONTEO=true`` un fallo de caché no vuelve a consultar los grupos.
+"""
+
+import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -14,11 +23,13 @@ from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
 
 from inventario.conteo_mobile_services import usuario_puede_conteo_movil
+from inventario.principal_movil_utils import principales
 
 User = get_user_model()
 
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_HOURS = 12
+CONFIAR_CLAIM_CONTEO = os.environ.get('MOBILE_API_CONFIAR_CLAIM_CONTEO', 'false').lower() in ('true', '1')
 
 
 class TokenResponse(BaseModel):
@@ -36,7 +47,7 @@ class LoginRequest(BaseModel):
 
 def create_access_token(user_id: int, username: str) -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-    payload = {'sub': str(user_id), 'username': username, 'exp': expire}
+    payload = {'sub': str(user_id), 'username': username, 'conteo': True, 'exp': expire}
     return jwt.encode(payload, settings.SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -55,7 +66,14 @@ def get_user_from_token(token: str) -> User:
         user_id = int(payload.get('sub', 0))
     except (JWTError, ValueError, TypeError) as exc:
         raise PermissionError('Token inválido o expirado') from exc
+    user = principales.get(user_id)
+    if user is not None:
+        return user
     user = User.objects.filter(pk=user_id, is_active=True).first()
-    if not user or not usuario_puede_conteo_movil(user):
+    if not user:
+        raise PermissionError('Usuario sin permiso de conteo móvil')
+    confiar_claim = CONFIAR_CLAIM_CONTEO and payload.get('conteo') is True
+    if not confiar_claim and not usuario_puede_conteo_movil(user):
         raise PermissionError('Usuario sin permiso de conteo móvil')
+    principales.set(user_id, user)
     return user
@@ -0,0 +1,96 @@
+"""
+Acceso al ORM de Django desde las rutas async de la API móvil.
+
+Las rutas son ``async def`` y mandan el trabajo de BD a un ThreadPoolExecutor propio y
+acotado, en vez del threadpool genérico de Starlette (40 hilos, cada uno con su conexión
+abierta y sin ciclo request_started/request_finished que la cierre):
+
+- ``MOBILE_API_DB_WORKERS`` (default 4): hilos de BD por proceso = conexiones máximas a
+  PostgreSQL por proceso. Con gunicorn ``--workers 5`` el tope es 5 × este valor; dimensionar
+  contra ``max_connections`` del servidor.
+- ``MOBILE_API_CONN_MAX_AGE`` (default 300 s): cada hilo reutiliza su conexión entre
+  peticiones; ``close_old_connections`` antes y después de cada llamada descarta las
+  caducadas o con error, igual que hace Django en cada request web.
+
+El event loop nunca toca la BD: una consulta lenta solo ocupa un hilo del pool.
+
+``shutdown`` cierra el pool al apagar la aplicación: desde el lifespan de FastAPI con
+uvicorn, y desde el hook ``worker_exit`` de ``gunicorn.conf.py`` cuando va montada con
+a2wsgi (que no emite eventos lifespan).
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connections
+
+DB_WORKERS = max(int(os.environ.get('MOBILE_API_DB_WORKERS', '4')), 1)
+CONN_MAX_AGE = int(os.environ.get('MOBILE_API_CONN_MAX_AGE', '300'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _inicializar_hilo():
+    """Conexiones persistentes solo en los hilos del pool (no cambia la config de la web)."""
+    for conn in connections.all(initialized_only=False):
+        conn.settings_dict = {
+            **conn.settings_dict,
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+
+
+def get_executor() -> ThreadPoolExecutor:
+    # Creación perezosa: montada vía a2wsgi no hay evento lifespan de arranque.
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=DB_WORKERS,
+                    thread_name_prefix='mobile-api-db',
+                    initializer=_inicializar_hilo,
+                )
+    return _executor
+
+
+def _ejecutar(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args, **kwargs):
+    """Ejecuta ``func(*args, **kwargs)`` (código ORM síncrono) en el pool de BD."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(_ejecutar, func, args, kwargs)
+    )
+
+
+def shutdown():
+    """Cierra la conexión de cada hilo del pool y detiene el executor."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is None:
+        return
+    # La barrera obliga a que cada tarea corra en un hilo distinto.
+    barrera = threading.Barrier(DB_WORKERS)
+
+    def _cerrar():
+        try:
+            barrera.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+        connections.close_all()
+
+    for _ in range(DB_WORKERS):
+        executor.submit(_cerrar)
+    executor.shutdown(wait=True)
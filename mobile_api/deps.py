@@ -4,11 +4,12 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from mobile_api.auth import get_user_from_token
+from mobile_api.db import run_db
 
 security = HTTPBearer(auto_error=False)
 
 
-def get_current_user(
+async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
 ):
     if not credentials or not credentials.credentials:
@@ -17,6 +18,6 @@ def get_current_user(
             detail='Token requerido',
         )
     try:
-        return get_user_from_token(credentials.credentials)
+        return await run_db(get_user_from_token, credentials.credentials)
     except PermissionError as exc:
         raise HTTPException(status_code=401, detail=str(exc)) from exc
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -5,13 +7,22 @@ from mobile_api.django_setup import setup_django
 
 setup_django()
 
+from mobile_api import db
 from mobile_api.routers import auth_router, conteos_router
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    db.shutdown()
+
+
 app = FastAPI(
     title='Inventario Hospitalario — API móvil conteo',
     version='1.0.0',
     docs_url='/docs',
     openapi_url='/openapi.json',
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -27,5 +38,5 @@ app.include_router(conteos_router.router)
 
 
 @app.get('/health')
-def health():
+async def health():
     return {'status': 'ok', 'service': 'mobile_api'}
@@ -1,13 +1,14 @@
 from fastapi import APIRouter, HTTPException
 
 from mobile_api.auth import LoginRequest, TokenResponse, authenticate_user, create_access_token
+from mobile_api.db import run_db
 
 router = APIRouter(prefix='/auth', tags=['auth'])
 
 
 @router.post('/login', response_model=TokenResponse)
-def login(body: LoginRequest):
-    user = authenticate_user(body.username, body.password)
+async def login(body: LoginRequest):
+    user = await run_db(authenticate_user, body.username, body.password)
     if not user:
         raise HTTPException(
             status_code=401,
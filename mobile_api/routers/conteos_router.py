@@ -2,20 +2,37 @@ from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 
+from django.db import IntegrityError
+
 from inventario.conteo_mobile_services import (
+    ConteoSincronizado,
     crear_lote_en_ubicacion,
     listar_lotes_ubicacion,
     registrar_conteo_ubicacion,
+    sincronizar_conteos,
 )
-from inventario.models import Almacen, UbicacionAlmacen
+from inventario.busqueda_utils import filtrar
+from inventario.models import Almacen, LoteUbicacion, UbicacionAlmacen
+from mobile_api.db import run_db
 from mobile_api.deps import get_current_user
-from mobile_api.schemas import ConteoRequest, CrearLoteRequest
+from mobile_api.schemas import ConteoRequest, ConteoSyncRequest, CrearLoteRequest
 
 router = APIRouter(prefix='/conteos', tags=['conteos'])
 
 
-@router.get('/almacenes')
-def almacenes(user=Depends(get_current_user)):
+def _resultado_conteo(resultado):
+    return {
+        'lote_ubicacion_id': resultado.lote_ubicacion_id,
+        'movimiento_id': resultado.movimiento_id,
+        'cantidad_anterior': resultado.cantidad_anterior,
+        'cantidad_nueva': resultado.cantidad_nueva,
+        'diferencia': resultado.diferencia,
+        'tipo_movimiento': resultado.tipo_movimiento,
+        'completado': resultado.completado,
+    }
+
+
+def _listar_almacenes():
     qs = Almacen.objects.filter(activo=True).select_related('institucion').order_by('nombre')
     return [
         {
@@ -28,15 +45,10 @@ def almacenes(user=Depends(get_current_user)):
     ]
 
 
-@router.get('/ubicaciones')
-def ubicaciones(
-    almacen_id: int = Query(...),
-    q: Optional[str] = Query(None),
-    user=Depends(get_current_user),
-):
+def _listar_ubicaciones(almacen_id: int, q: Optional[str]):
     qs = UbicacionAlmacen.objects.filter(almacen_id=almacen_id, activo=True).order_by('codigo')
     if q:
-        qs = qs.filter(codigo__icontains=q.strip())
+        qs = filtrar(qs, q, campos=('codigo',))
     return [
         {
             'id': u.id,
@@ -48,17 +60,51 @@ def ubicaciones(
     ]
 
 
-@router.get('/ubicaciones/{ubicacion_id}/lotes')
-def lotes_en_ubicacion(ubicacion_id: int, user=Depends(get_current_user)):
+def _lotes_en_ubicacion(ubicacion_id: int):
     if not UbicacionAlmacen.objects.filter(pk=ubicacion_id, activo=True).exists():
-        raise HTTPException(status_code=404, detail='Ubicación no encontrada')
+        return None
     return listar_lotes_ubicacion(ubicacion_id)
 
 
+def _verificar_coincide(lote_ubicacion_id: int, user):
+    cantidad = LoteUbicacion.objects.filter(pk=lote_ubicacion_id).values_list('cantidad', flat=True).first()
+    if cantidad is None:
+        return None
+    return registrar_conteo_ubicacion(
+        lote_ubicacion_id,
+        user,
+        cantidad,
+        observaciones='Coincide con sistema',
+    )
+
+
+@router.get('/almacenes')
+async def almacenes(user=Depends(get_current_user)):
+    return await run_db(_listar_almacenes)
+
+
+@router.get('/ubicaciones')
+async def ubicaciones(
+    almacen_id: int = Query(...),
+    q: Optional[str] = Query(None),
+    user=Depends(get_current_user),
+):
+    return await run_db(_listar_ubicaciones, almacen_id, q)
+
+
+@router.get('/ubicaciones/{ubicacion_id}/lotes')
+async def lotes_en_ubicacion(ubicacion_id: int, user=Depends(get_current_user)):
+    lotes = await run_db(_lotes_en_ubicacion, ubicacion_id)
+    if lotes is None:
+        raise HTTPException(status_code=404, detail='Ubicación no encontrada')
+    return lotes
+
+
 @router.post('/lotes/{lote_ubicacion_id}/conteo')
-def registrar_conteo(lote_ubicacion_id: int, body: ConteoRequest, user=Depends(get_current_user)):
+async def registrar_conteo(lote_ubicacion_id: int, body: ConteoRequest, user=Depends(get_current_user)):
     try:
-        resultado = registrar_conteo_ubicacion(
+        resultado = await run_db(
+            registrar_conteo_ubicacion,
             lote_ubicacion_id,
             user,
             body.cantidad_fisica,
@@ -67,49 +113,55 @@ def registrar_conteo(lote_ubicacion_id: int, body: ConteoRequest, user=Depends(g
         )
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return _resultado_conteo(resultado)
+
+
+@router.post('/sync')
+async def sincronizar(body: ConteoSyncRequest, user=Depends(get_current_user)):
+    """Conteos capturados sin conexión: se aplican en una transacción, con resultado por conteo."""
+    conteos = [
+        ConteoSincronizado(
+            clave_idempotencia=item.clave_idempotencia,
+            lote_ubicacion_id=item.lote_ubicacion_id,
+            cantidad_fisica=item.cantidad_fisica,
+            fecha_caducidad=item.fecha_caducidad,
+            observaciones=item.observaciones,
+        )
+        for item in body.conteos
+    ]
+    try:
+        resultados = await run_db(sincronizar_conteos, user, conteos)
+    except IntegrityError as exc:
+        raise HTTPException(
+            status_code=409,
+            detail='Otra sincronización con las mismas claves está en curso; reintente.',
+        ) from exc
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     return {
-        'lote_ubicacion_id': resultado.lote_ubicacion_id,
-        'movimiento_id': resultado.movimiento_id,
-        'cantidad_anterior': resultado.cantidad_anterior,
-        'cantidad_nueva': resultado.cantidad_nueva,
-        'diferencia': resultado.diferencia,
-        'tipo_movimiento': resultado.tipo_movimiento,
-        'completado': resultado.completado,
+        'aplicados': sum(1 for r in resultados if r['estado'] == 'aplicado'),
+        'duplicados': sum(1 for r in resultados if r['estado'] == 'duplicado'),
+        'errores': sum(1 for r in resultados if r['estado'] == 'error'),
+        'resultados': resultados,
     }
 
 
 @router.post('/lotes/{lote_ubicacion_id}/verificar')
-def verificar_coincide(lote_ubicacion_id: int, user=Depends(get_current_user)):
-    from inventario.models import LoteUbicacion
-
+async def verificar_coincide(lote_ubicacion_id: int, user=Depends(get_current_user)):
     try:
-        lu = LoteUbicacion.objects.get(pk=lote_ubicacion_id)
-    except LoteUbicacion.DoesNotExist as exc:
-        raise HTTPException(status_code=404, detail='Lote en ubicación no encontrado') from exc
-    try:
-        resultado = registrar_conteo_ubicacion(
-            lote_ubicacion_id,
-            user,
-            lu.cantidad,
-            observaciones='Coincide con sistema',
-        )
+        resultado = await run_db(_verificar_coincide, lote_ubicacion_id, user)
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return {
-        'lote_ubicacion_id': resultado.lote_ubicacion_id,
-        'movimiento_id': resultado.movimiento_id,
-        'cantidad_anterior': resultado.cantidad_anterior,
-        'cantidad_nueva': resultado.cantidad_nueva,
-        'diferencia': resultado.diferencia,
-        'tipo_movimiento': resultado.tipo_movimiento,
-        'completado': resultado.completado,
-    }
+    if resultado is None:
+        raise HTTPException(status_code=404, detail='Lote en ubicación no encontrado')
+    return _resultado_conteo(resultado)
 
 
 @router.post('/ubicaciones/{ubicacion_id}/lotes')
-def alta_lote(ubicacion_id: int, body: CrearLoteRequest, user=Depends(get_current_user)):
+async def alta_lote(ubicacion_id: int, body: CrearLoteRequest, user=Depends(get_current_user)):
     try:
-        return crear_lote_en_ubicacion(
+        return await run_db(
+            crear_lote_en_ubicacion,
             ubicacion_id,
             user,
             body.clave_cnis,
@@ -1,5 +1,5 @@
 from datetime import date
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -17,3 +17,15 @@ class CrearLoteRequest(BaseModel):
     fecha_caducidad: date
     precio_unitario: Optional[float] = None
     observaciones: str = ''
+
+
+class ConteoSyncItem(BaseModel):
+    clave_idempotencia: str = Field(..., min_length=1, max_length=64)
+    lote_ubicacion_id: int
+    cantidad_fisica: int = Field(..., ge=0)
+    fecha_caducidad: Optional[date] = None
+    observaciones: str = ''
+
+
+class ConteoSyncRequest(BaseModel):
+    conteos: List[ConteoSyncItem] = Field(..., min_length=1, max_length=500)